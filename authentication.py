@@ -27,6 +27,7 @@ class Authentication(MetaObject):
         """
 
         __metaclass__ = ABCMeta
+        __slots__ = []
 
         @abstractproperty
         def is_signed(self):
@@ -68,6 +69,7 @@ class NoAuthentication(Authentication):
     gossiping purposes.
     """
     class Implementation(Authentication.Implementation):
+        __slots__ = []
 
         @property
         def is_signed(self):
@@ -102,6 +104,7 @@ class MemberAuthentication(Authentication):
     give you this permission in the form of a signed message.
     """
     class Implementation(Authentication.Implementation):
+        __slots__ = ["_member", "_signature"]
 
         def __init__(self, meta, member, signature=""):
             """
@@ -221,6 +224,7 @@ class DoubleMemberAuthentication(Authentication):
     forwarded to other nodes in the community.
     """
     class Implementation(Authentication.Implementation):
+        __slots__ = ["_members", "_signatures"]
 
         def __init__(self, meta, members, signatures=[]):
             """
@@ -317,7 +321,9 @@ class DoubleMemberAuthentication(Authentication):
             return "".join(self._signatures)
 
         def has_valid_signature_for(self, placeholder, payload):
-            payloads = self._meta.split_payload_func(payload)
+            # the split_payload_func may use any str method, hence PAYLOAD, which may be a read-only
+            # buffer, is materialized here
+            payloads = self._meta.split_payload_func(str(payload))
             for signature, member, payload in zip(self._signatures, self._members, payloads):
                 if self._is_sig_empty(signature, member):
                     if not placeholder.allow_empty_signature:
@@ -0,0 +1,217 @@
+"""
+Record incoming datagrams and replay them to measure the performance of Dispersy on real traffic.
+
+A capture file starts with CAPTURE_MAGIC, followed by one record for every datagram.  A record is a
+CAPTURE_RECORD header, i.e. the time the datagram was received, the IPv4 address and port it was
+received from, and the length of the datagram, followed by the datagram itself.  Datagrams that
+were received together have the same time.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from itertools import groupby
+from socket import inet_aton, inet_ntoa
+from struct import Struct
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.task import deferLater
+from twisted.python.threadable import isInIOThread
+
+from .candidate import Candidate
+from .endpoint import StandaloneEndpoint, TUNNEL_PREFIX, TUNNEL_PREFIX_LENGHT
+
+
+CAPTURE_MAGIC = "DISPCAP\x01"
+CAPTURE_RECORD = Struct(">d4sHH")
+
+logger = logging.getLogger(__name__)
+
+
+class CaptureWriter(object):
+
+    """
+    Writes datagrams to a capture file.
+    """
+
+    def __init__(self, file_path):
+        super(CaptureWriter, self).__init__()
+        self._file = open(file_path, "wb")
+        self._file.write(CAPTURE_MAGIC)
+        self._packet_count = 0
+        self._byte_count = 0
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    @property
+    def packet_count(self):
+        return self._packet_count
+
+    @property
+    def byte_count(self):
+        return self._byte_count
+
+    def write(self, timestamp, packets):
+        """
+        Writes PACKETS, a list with (sock_addr, data) tuples that were received at TIMESTAMP.
+        """
+        assert isinstance(timestamp, float), type(timestamp)
+        assert isinstance(packets, (list, tuple)), type(packets)
+        write = self._file.write
+        for (ip, port), data in packets:
+            write(CAPTURE_RECORD.pack(timestamp, inet_aton(ip), port, len(data)))
+            write(data)
+            self._byte_count += len(data)
+        self._packet_count += len(packets)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_capture(file_path):
+    """
+    Yields a (timestamp, sock_addr, data) tuple for every datagram in the capture file FILE_PATH.
+
+    Raises ValueError when FILE_PATH is not a capture file.  A record that is cut off, i.e. when
+    the capturing process did not close the file, is ignored.
+    """
+    with open(file_path, "rb") as stream:
+        if stream.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("%s is not a capture file" % file_path)
+
+        while True:
+            header = stream.read(CAPTURE_RECORD.size)
+            if not header:
+                break
+            if len(header) < CAPTURE_RECORD.size:
+                logger.warning("ignoring the incomplete record at the end of %s", file_path)
+                break
+
+            timestamp, ip, port, length = CAPTURE_RECORD.unpack(header)
+            data = stream.read(length)
+            if len(data) < length:
+                logger.warning("ignoring the incomplete record at the end of %s", file_path)
+                break
+
+            yield timestamp, (inet_ntoa(ip), port), data
+
+
+class CaptureEndpoint(StandaloneEndpoint):
+
+    """
+    A StandaloneEndpoint that writes every datagram it passes to Dispersy to a capture file.
+
+    Datagrams handled by a listen_to handler are not captured.
+    """
+
+    def __init__(self, capture_file_path, port, ip="0.0.0.0"):
+        super(CaptureEndpoint, self).__init__(port, ip)
+        self._writer = CaptureWriter(capture_file_path)
+
+    @property
+    def writer(self):
+        return self._writer
+
+    def dispersythread_data_came_in(self, packets, timestamp, cache=True):
+        if not self._writer.closed:
+            self._writer.write(timestamp, packets)
+        super(CaptureEndpoint, self).dispersythread_data_came_in(packets, timestamp, cache)
+
+    def close(self, timeout=10.0):
+        result = super(CaptureEndpoint, self).close(timeout)
+        self._writer.close()
+        return result
+
+
+def prepare_replay_directory(working_directory, database_filename):
+    """
+    Returns a new temporary working directory containing a copy of the database DATABASE_FILENAME
+    of WORKING_DIRECTORY.
+
+    A replay stores the messages that it processes, hence a second replay on the same database
+    gives different results.  Running every replay on a fresh copy makes it deterministic.  The
+    caller must remove the returned directory.
+    """
+    assert isinstance(working_directory, unicode), type(working_directory)
+    assert isinstance(database_filename, unicode), type(database_filename)
+    directory = tempfile.mkdtemp(prefix=u"dispersy-replay-")
+    if database_filename != u":memory:":
+        source = os.path.join(working_directory, u"sqlite")
+        destination = os.path.join(directory, u"sqlite")
+        os.mkdir(destination)
+        # include the write-ahead log, it may contain committed transactions
+        for suffix in (u"", u"-wal", u"-journal"):
+            path = os.path.join(source, database_filename + suffix)
+            if os.path.exists(path):
+                shutil.copy2(path, os.path.join(destination, database_filename + suffix))
+    return directory
+
+
+@inlineCallbacks
+def replay(dispersy, file_path, speed=None, cache=True):
+    """
+    Feeds the datagrams in the capture file FILE_PATH to DISPERSY.on_incoming_packets.
+
+    Datagrams that were received together are given to Dispersy together.  When SPEED is None they
+    are given as fast as possible, allowing one reactor iteration in between, otherwise they are
+    given at their original times divided by SPEED, i.e. 1.0 is the original speed and 10.0 is ten
+    times as fast.  Messages that are waiting in a batch are processed when the capture ends.
+
+    The instrumentation of DISPERSY is enabled and reset when the replay starts.  The processed messages are
+    stored in the database of DISPERSY, use prepare_replay_directory to replay on a copy.
+
+    Returns a Deferred that fires with a dictionary containing the number of packets and bytes, the
+    duration in seconds, the packets and bytes per second, the number of messages that were
+    processed successfully and that were dropped, and the reactor_lag and stages of
+    Instrumentation.get_dict.
+    """
+    assert isInIOThread(), "Must be called from the callback thread"
+    assert dispersy.running, "Dispersy must be running"
+    assert speed is None or speed > 0.0, speed
+    assert isinstance(cache, bool), type(cache)
+
+    msg_statistics = dispersy.statistics.msg_statistics
+    success_count, drop_count = msg_statistics.success_count, msg_statistics.drop_count
+    dispersy.enable_instrumentation(True)
+    dispersy.instrumentation.reset()
+    packet_count = byte_count = 0
+    begin = time()
+    first_timestamp = None
+
+    for timestamp, records in groupby(read_capture(file_path), key=lambda record: record[0]):
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        delay = 0.0 if speed is None else begin + (timestamp - first_timestamp) / speed - time()
+        yield deferLater(reactor, max(0.0, delay), lambda: None)
+
+        packets = []
+        for _, sock_addr, data in records:
+            if data.startswith(TUNNEL_PREFIX):
+                packets.append((Candidate(sock_addr, True), data[TUNNEL_PREFIX_LENGHT:]))
+            else:
+                packets.append((Candidate(sock_addr, False), data))
+            byte_count += len(data)
+        packet_count += len(packets)
+        dispersy.on_incoming_packets(packets, cache, time(), u"replay")
+
+    for community in dispersy.get_communities():
+        community.flush_batch_cache(sync_only=False)
+
+    duration = time() - begin
+    report = {u"packets": packet_count,
+              u"bytes": byte_count,
+              u"duration": duration,
+              u"packets_per_second": packet_count / duration if duration else 0.0,
+              u"bytes_per_second": byte_count / duration if duration else 0.0,
+              u"success": msg_statistics.success_count - success_count,
+              u"drop": msg_statistics.drop_count - drop_count}
+    report.update(dispersy.instrumentation.get_dict())
+    returnValue(report)
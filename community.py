@@ -25,11 +25,12 @@ from .bloomfilter import BloomFilter
 from .candidate import Candidate, WalkCandidate
 from .conversion import BinaryConversion, DefaultConversion, Conversion
 from .destination import CommunityDestination, CandidateDestination
+from .dispersydatabase import get_sync_modulo, get_sync_modulo_clause, is_sync_bucket_modulo
 from .distribution import (SyncDistribution, GlobalTimePruning, LastSyncDistribution, DirectDistribution,
                            FullSyncDistribution)
 from .exception import ConversionNotFoundException, MetaNotFoundException
 from .member import DummyMember, Member
-from .message import (BatchConfiguration, Message, Packet, DropMessage, DelayMessageByProof,
+from .message import (BatchConfiguration, BatchWindow, Message, Packet, DropMessage, DelayMessageByProof,
                       DelayMessageByMissingMessage, DropPacket, DelayPacket, DelayMessage)
 from .payload import (AuthorizePayload, RevokePayload, UndoPayload, DestroyCommunityPayload, DynamicSettingsPayload,
                       IdentityPayload, MissingIdentityPayload, IntroductionRequestPayload, IntroductionResponsePayload,
@@ -37,6 +38,7 @@ from .payload import (AuthorizePayload, RevokePayload, UndoPayload, DestroyCommu
                       MissingProofPayload, SignatureRequestPayload, SignatureResponsePayload)
 from .requestcache import RequestCache, SignatureRequestCache, IntroductionRequestCache
 from .resolution import PublicResolution, LinearResolution, DynamicResolution
+from .sanitycheck import SanityCheck
 from .statistics import CommunityStatistics
 from .taskmanager import TaskManager
 from .timeline import Timeline
@@ -67,6 +69,153 @@ class SyncCache(object):
         self.candidate = None
 
 
+class ResponseBudget(object):
+
+    """
+    Keeps track of the number of bytes sent to every candidate during the current window.
+    """
+
+    def __init__(self, window=1.0):
+        assert isinstance(window, float), type(window)
+        assert 0.0 < window, window
+        self.window = window
+        # sock_addr: (window_start, bytes_sent)
+        self._sent = {}
+
+    def claim(self, candidate, packets, limit, now=None):
+        """
+        Returns the packets from PACKETS that may be sent to CANDIDATE.
+
+        Packets are taken in order until LIMIT bytes have been sent to CANDIDATE during the current
+        window, the packet that exceeds LIMIT is still included.
+        """
+        assert isinstance(candidate, Candidate), type(candidate)
+        assert isinstance(limit, (int, long)), type(limit)
+        if now is None:
+            now = time()
+
+        if len(self._sent) > 1000:
+            self._sent = dict((sock_addr, value) for sock_addr, value in self._sent.iteritems()
+                              if now < value[0] + self.window)
+
+        window_start, sent = self._sent.get(candidate.sock_addr, (now, 0))
+        if window_start + self.window <= now:
+            window_start, sent = now, 0
+
+        claimed = []
+        for packet in packets:
+            if sent >= limit:
+                break
+            claimed.append(packet)
+            sent += len(packet)
+
+        self._sent[candidate.sock_addr] = (window_start, sent)
+        return claimed
+
+
+class MissingSequenceCache(object):
+
+    """
+    Caches the packets that were recently sent in response to dispersy-missing-sequence messages.
+
+    Every entry contains the packets of one member and meta message, ordered by sequence number,
+    from LOW up to and including the last sequence number that was cached.  Packets with higher
+    sequence numbers are read from the database and added to the entry on demand.  Since sequence
+    numbers are stored in order, an entry remains valid when new packets arrive.
+
+    An entry holds at most ENTRY_BYTES bytes, packets beyond this are read from the database every
+    time.  When all entries together hold more than TOTAL_BYTES bytes the least recently used
+    entries are removed.
+    """
+
+    def __init__(self, size=64, lifetime=5.0, entry_bytes=64 * 1024, total_bytes=1024 * 1024):
+        assert isinstance(size, int), type(size)
+        assert isinstance(lifetime, float), type(lifetime)
+        assert isinstance(entry_bytes, int), type(entry_bytes)
+        assert isinstance(total_bytes, int), type(total_bytes)
+        assert 0 < entry_bytes <= total_bytes, (entry_bytes, total_bytes)
+        self.size = size
+        self.lifetime = lifetime
+        self.entry_bytes = entry_bytes
+        self.total_bytes = total_bytes
+        # (member_id, message_id): [expires, low, high, [(sequence, packet)], bytes]
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def bytes(self):
+        """
+        The number of packet bytes that are cached.
+        """
+        return self._bytes
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def discard(self, member_id, message_id):
+        """
+        Removes the packets of MEMBER_ID and MESSAGE_ID, must be called when these are deleted.
+        """
+        entry = self._entries.pop((member_id, message_id), None)
+        if entry:
+            self._bytes -= entry[4]
+
+    def discard_meta(self, message_id):
+        """
+        Removes the packets of MESSAGE_ID for all members, must be called when these are deleted.
+        """
+        for key in [key for key in self._entries if key[1] == message_id]:
+            self._bytes -= self._entries.pop(key)[4]
+
+    def iter_packets(self, database, member_id, message_id, low, high, now=None):
+        """
+        Yields (sequence, packet) tuples for the packets of MEMBER_ID and MESSAGE_ID with sequence
+        numbers between LOW and HIGH, ordered by sequence number.
+
+        The database is only queried for the sequence numbers that are not cached, and every packet
+        that is read from the database is also yielded.  Closing the generator early leaves the
+        entry covering the packets that were read.
+        """
+        if now is None:
+            now = time()
+
+        key = (member_id, message_id)
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] <= now or low < entry[1] or entry[2] + 1 < low:
+            if entry:
+                self._bytes -= entry[4]
+            entry = [now + self.lifetime, low, low - 1, [], 0]
+        self._entries[key] = entry
+        if len(self._entries) > self.size:
+            self._bytes -= self._entries.popitem(last=False)[1][4]
+
+        rows = entry[3]
+        for sequence, packet in rows:
+            if sequence > high:
+                return
+            if sequence >= low:
+                yield sequence, packet
+
+        if entry[2] < high:
+            caching = True
+            for sequence, packet in database.execute(u"SELECT sequence, packet FROM sync "
+                                                     u"WHERE meta_message = ? AND member = ? AND sequence BETWEEN ? AND ? "
+                                                     u"ORDER BY sequence",
+                                                     (message_id, member_id, entry[2] + 1, high)):
+                packet = str(packet)
+                # once a packet is not cached the entry must not cover any higher sequence number
+                caching = caching and entry[4] + len(packet) <= self.entry_bytes and self._entries.get(key) is entry
+                if caching:
+                    rows.append((sequence, packet))
+                    entry[2] = sequence
+                    entry[4] += len(packet)
+                    self._bytes += len(packet)
+                    while self._bytes > self.total_bytes:
+                        self._bytes -= self._entries.popitem(last=False)[1][4]
+                yield sequence, packet
+
+
 class DispersyInternalMessage(object):
     pass
 
@@ -274,6 +423,8 @@ class Community(TaskManager):
 
         # batch caching incoming packets
         self._batch_cache = {}
+        # BatchWindow instances for meta messages that use adaptive batching
+        self._batch_windows = {}
 
         # delayed list for incoming packet/messages which are delayed
         self._delayed_key = defaultdict(list)
@@ -296,6 +447,14 @@ class Community(TaskManager):
         self._request_cache = None
         self._timeline = None
         self._random = None
+
+        # bytes sent to every candidate in response to missing-identity, -message, and -proof
+        self._missing_response_budget = ResponseBudget()
+        # recently sent packets in response to missing-sequence
+        self._missing_sequence_cache = MissingSequenceCache()
+
+        # SanityCheck that runs in the background
+        self._sanity_check = None
         self._walked_candidates = None
         self._stumbled_candidates = None
         self._introduced_candidates = None
@@ -352,12 +511,14 @@ class Community(TaskManager):
                 del self.meta_message_cache[name]
 
         # batched insert
+        meta_message_rows = self._dispersy.get_meta_message_rows(self._database_id)
         update_list = []
-        for database_id, name, priority, direction in self._dispersy.database.execute(u"SELECT id, name, priority, direction FROM meta_message WHERE community = ?", (self._database_id,)):
+        for name, (database_id, priority, direction) in meta_message_rows.items():
             meta_message_info = self.meta_message_cache.get(name)
             if meta_message_info:
                 if priority != meta_message_info["priority"] or direction != meta_message_info["direction"]:
-                    update_list.append((priority, direction, database_id))
+                    update_list.append((meta_message_info["priority"], meta_message_info["direction"], database_id))
+                    meta_message_rows[name] = (database_id, meta_message_info["priority"], meta_message_info["direction"])
 
                 self._meta_messages[name]._database_id = database_id
                 del self.meta_message_cache[name]
@@ -374,7 +535,10 @@ class Community(TaskManager):
                 insert_list)
 
             for database_id, name in self._dispersy.database.execute(u"SELECT id, name FROM meta_message WHERE community = ?", (self._database_id,)):
-                self._meta_messages[name]._database_id = database_id  # cleanup pre-fetched values
+                data = self.meta_message_cache.get(name)
+                if data:
+                    meta_message_rows[name] = (database_id, data["priority"], data["direction"])
+                    self._meta_messages[name]._database_id = database_id  # cleanup pre-fetched values
         self.meta_message_cache = None
 
         # define all available conversions
@@ -445,10 +609,7 @@ class Community(TaskManager):
         self.dispersy_check_database()
         from sys import argv
         if "--sanity-check" in argv:
-            try:
-                self.dispersy.sanity_check(self)
-            except ValueError:
-                self._logger.exception("sanity check fail for %s", self)
+            self.start_sanity_check()
 
         # start walker, if needed
         if self.dispersy_enable_candidate_walker:
@@ -912,10 +1073,12 @@ class Community(TaskManager):
             capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
             self._nrsyncpackets = list(self._dispersy.database.execute(u"SELECT count(*) FROM sync WHERE meta_message IN (%s) AND undone = 0 LIMIT 1" % (syncable_messages)))[0][0]
-            modulo = int(ceil(self._nrsyncpackets / float(capacity)))
+            # a divisor of SYNC_BUCKETS allows both sides to select the packets using the bucket index
+            modulo = get_sync_modulo(int(ceil(self._nrsyncpackets / float(capacity))))
             if modulo > 1:
                 offset = randint(0, modulo - 1)
-                packets = list(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync.packet FROM sync WHERE meta_message IN (%s) AND sync.undone = 0 AND (sync.global_time + ?) %% ? = 0" % syncable_messages, (offset, modulo)))
+                modulo_clause, modulo_arguments = get_sync_modulo_clause(offset, modulo)
+                packets = list(str(packet) for packet, in self._dispersy.database.execute(u"SELECT sync.packet FROM sync WHERE meta_message IN (%s) AND sync.undone = 0 AND %s" % (syncable_messages, modulo_clause), modulo_arguments))
             else:
                 offset = 0
                 modulo = 1
@@ -940,6 +1103,15 @@ class Community(TaskManager):
         """
         return 5 * 1024
 
+    @property
+    def dispersy_missing_response_limit(self):
+        """
+        The maximum number of bytes to send back to one candidate per second in response to
+        dispersy-missing-identity, dispersy-missing-message, and dispersy-missing-proof messages.
+        @rtype: int
+        """
+        return 50 * 1024
+
     @property
     def dispersy_missing_sequence_response_limit(self):
         """
@@ -1065,6 +1237,7 @@ class Community(TaskManager):
         self.purge_batch_cache()
 
         self.cancel_all_pending_tasks()
+        self._dispersy.walk_scheduler.unschedule(self)
 
         self._request_cache.clear()
 
@@ -1094,6 +1267,8 @@ class Community(TaskManager):
                          self._dispersy.database.execute(
                             u"DELETE FROM sync WHERE meta_message = ? AND global_time <= ?",
                             (meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold))
+                         if isinstance(meta.distribution, FullSyncDistribution) and meta.distribution.enable_sequence_number:
+                             self._missing_sequence_cache.discard_meta(meta.database_id)
 
     def dispersy_check_database(self):
         """
@@ -1144,6 +1319,14 @@ class Community(TaskManager):
         self._logger.warning("unable to find conversion to encode %s in %s", message, self._conversions)
         raise ConversionNotFoundException(message=message)
 
+    @property
+    def conversions(self):
+        """
+        The conversions of this community, in the order in which they were added.
+        @rtype: [Conversion]
+        """
+        return self._conversions
+
     def add_conversion(self, conversion):
         """
         Add a Conversion to the Community.
@@ -1162,12 +1345,11 @@ class Community(TaskManager):
             # pretending that we're already in the future to make candidates eligible for walking sooner, add some randomness to load balance
             return [candidate for candidate in self._candidates.itervalues() if candidate.is_eligible_for_walk(now + uniform(20, 27.5))]
 
-        def switch_to_normal_walking():
+        def switch_to_normal_walking(delay):
             """
-            Start walking towards eligible candidates regularly, stopping the fast walker if it's still running.
+            Start walking towards eligible candidates regularly, replacing the fast walker if it's still running.
             """
-            self.cancel_pending_task("take fast steps")
-            self.register_task("take step", LoopingCall(self.take_step)).start(TAKE_STEP_INTERVAL, now=True)
+            self._dispersy.walk_scheduler.schedule(self, self.take_step, TAKE_STEP_INTERVAL, delay)
 
         def take_fast_steps():
             """
@@ -1180,7 +1362,8 @@ class Community(TaskManager):
             if len(active_canidates) > FAST_WALKER_CANDIDATE_TARGET:
                 self._logger.debug("there are %d active candidates available, "
                                    "quitting fast walker", len(active_canidates))
-                switch_to_normal_walking()
+                # the first normal step is taken when the next fast step would have been
+                switch_to_normal_walking(FAST_WALKER_STEP_INTERVAL)
             else:
                 self._logger.debug("%d candidates active, target is %d walking a bit more... (step %d of %d)",
                                    len(active_canidates),
@@ -1196,15 +1379,14 @@ class Community(TaskManager):
 
                 self._fast_steps_taken += 1
                 if self._fast_steps_taken >= FAST_WALKER_STEPS:
-                    switch_to_normal_walking()
+                    switch_to_normal_walking(FAST_WALKER_STEP_INTERVAL)
 
+        # the first step is taken immediately
         if self.dispersy_enable_fast_candidate_walker:
             self._fast_steps_taken = 0
-            self.register_task("take fast steps",
-                               LoopingCall(take_fast_steps)
-            ).start(FAST_WALKER_STEP_INTERVAL, now=True)
+            self._dispersy.walk_scheduler.schedule(self, take_fast_steps, FAST_WALKER_STEP_INTERVAL, 0.0)
         else:
-            switch_to_normal_walking()
+            switch_to_normal_walking(0.0)
 
     def take_step(self):
         now = time()
@@ -2010,16 +2192,31 @@ class Community(TaskManager):
                 batch = [(self.get_candidate(candidate.sock_addr) or candidate, packet, conversion, source)
                          for candidate, packet in cur_packets]
                 if meta.batch.enabled and cache:
+                    if meta.batch.adaptive:
+                        batch_window = self._get_batch_window(meta)
+                        batch_window.arrived(len(batch), timestamp)
+                        window, max_size = batch_window.window, batch_window.max_size
+                    else:
+                        window, max_size = meta.batch.max_window, 0
+
                     if meta in self._batch_cache:
                         _, current_batch = self._batch_cache[meta]
                         current_batch.extend(batch)
                         self._logger.debug("adding %d %s messages to existing cache", len(batch), meta.name)
-                    else:
-                        self.register_task(meta, reactor.callLater(meta.batch.max_window, self._process_message_batch, meta))
+                        if max_size and len(current_batch) >= max_size:
+                            self._process_message_batch(meta)
+                    elif window > 0.0 and not (max_size and len(batch) >= max_size):
+                        self.register_task(meta, reactor.callLater(window, self._process_message_batch, meta))
                         self._batch_cache[meta] = (timestamp, batch)
-                        self._logger.debug("new cache with %d %s messages (batch window: %d)",
-                                           len(batch), meta.name, meta.batch.max_window)
+                        self._logger.debug("new cache with %d %s messages (batch window: %f)",
+                                           len(batch), meta.name, window)
+                    else:
+                        if timestamp:
+                            self._dispersy.instrumentation.add(u"receive", time() - timestamp)
+                        self._on_batch_cache(meta, batch)
                 else:
+                    if timestamp:
+                        self._dispersy.instrumentation.add(u"receive", time() - timestamp)
                     self._on_batch_cache(meta, batch)
 
                 self._statistics.increase_total_received_count(len(cur_packets))
@@ -2032,20 +2229,76 @@ class Community(TaskManager):
                 self._statistics.increase_msg_count(
                     u"drop", u"convert_packets_into_batch:unknown conversion", len(cur_packets))
 
+    @property
+    def sanity_check(self):
+        """
+        The SanityCheck that was started using start_sanity_check, or None.
+        """
+        return self._sanity_check
+
+    def start_sanity_check(self, chunk_size=100, interval=0.1, **kargs):
+        """
+        Check the database content of this community in the background.
+
+        Every INTERVAL seconds at most CHUNK_SIZE rows are checked.  The current position is stored
+        in the database after every chunk, a check that was interrupted resumes where it stopped.
+        Findings are logged and, together with the progress, available through
+        CommunityStatistics.sanity_check.  KARGS select the tests, see SanityCheck.
+        """
+        assert isinstance(chunk_size, int), type(chunk_size)
+        assert isinstance(interval, float), type(interval)
+        self.cancel_pending_task("sanity check")
+        self._sanity_check = SanityCheck(self._dispersy, self, **kargs)
+        self._sanity_check.chunk_size = chunk_size
+        if self._sanity_check.load():
+            self._logger.info("resuming the sanity check of %s at %s", self.cid.encode("HEX"), self._sanity_check.current_step)
+        self.register_task("sanity check", LoopingCall(self._sanity_check_step)).start(interval, now=False)
+        return self._sanity_check
+
+    def _sanity_check_step(self):
+        sanity_check = self._sanity_check
+        if not sanity_check.step():
+            self.cancel_pending_task("sanity check")
+            self._logger.info("sanity check of %s finished with %d findings (%d rows)",
+                              self.cid.encode("HEX"), len(sanity_check.findings), sanity_check.rows_checked)
+        sanity_check.save()
+
+    @property
+    def missing_sequence_cache(self):
+        """
+        The MissingSequenceCache containing recently sent dispersy-missing-sequence responses.
+        """
+        return self._missing_sequence_cache
+
+    @property
+    def batch_windows(self):
+        """
+        The BatchWindow instances of the meta messages that use adaptive batching.
+        """
+        return self._batch_windows
+
+    def _get_batch_window(self, meta):
+        batch_window = self._batch_windows.get(meta)
+        if batch_window is None:
+            batch_window = self._batch_windows[meta] = BatchWindow(meta.batch)
+        return batch_window
+
     def _process_message_batch(self, meta):
         """
         Start processing a batch of messages.
 
-        This method is called meta.batch.max_window seconds after the first message in this batch arrived or when
-        flushing all the batches.  All messages in this batch have been 'cached' together in self._batch_cache[meta].
+        This method is called meta.batch.max_window seconds after the first message in this batch arrived, when an
+        adaptive batch reached its maximum size, or when flushing all the batches.  All messages in this batch have been 'cached' together in self._batch_cache[meta].
         Hopefully the delay caused the batch to collect as many messages as possible.
 
         """
         assert isinstance(meta, Message)
         assert meta in self._batch_cache
 
-        _, batch = self._batch_cache.pop(meta)
+        timestamp, batch = self._batch_cache.pop(meta)
         self.cancel_pending_task(meta)
+        if timestamp:
+            self._dispersy.instrumentation.add(u"receive", time() - timestamp)
         self._logger.debug("processing %sx %s batched messages", len(batch), meta.name)
 
         return self._on_batch_cache(meta, batch)
@@ -2063,6 +2316,8 @@ class Community(TaskManager):
 
          3. All remaining messages are passed to on_message_batch.
         """
+        begin = time()
+
         # convert binary packets into Message.Implementation instances
         messages = []
 
@@ -2085,6 +2340,9 @@ class Community(TaskManager):
             except DelayPacket as delay:
                 self._dispersy._delay(delay, packet, candidate)
 
+        instrumentation = self._dispersy.instrumentation
+        instrumentation.add(u"decode", time() - begin)
+
         assert all(isinstance(message, Message.Implementation) for message in messages), "convert_batch_into_messages must return only Message.Implementation instances"
         assert all(message.meta == meta for message in messages), "All Message.Implementation instances must be in the same batch"
 
@@ -2092,6 +2350,11 @@ class Community(TaskManager):
         if messages:
             self.on_messages(messages)
 
+        duration = time() - begin
+        instrumentation.add(u"batch", duration)
+        if meta.batch.adaptive:
+            self._get_batch_window(meta).processed(len(batch), duration)
+
     def purge_batch_cache(self):
         """
         Remove all batches currently scheduled.
@@ -2101,17 +2364,20 @@ class Community(TaskManager):
             self.cancel_pending_task(meta)
         self._batch_cache.clear()
 
-    def flush_batch_cache(self):
+    def flush_batch_cache(self, sync_only=True):
         """
-        Process all pending batches with a sync distribution.
+        Process all pending batches with a sync distribution, or all pending batches when SYNC_ONLY
+        is False.
         """
         flush_list = [(meta, tup) for meta, tup in
-                      self._batch_cache.iteritems() if isinstance(meta.distribution, SyncDistribution)]
+                      self._batch_cache.iteritems() if not sync_only or isinstance(meta.distribution, SyncDistribution)]
 
         for meta, (_, batch) in flush_list:
-            self._logger.debug("flush cached %dx %s messages (dc: %s)",
-                               len(batch), meta.name, self._pending_tasks[meta])
-            self._process_message_batch(meta)
+            # processing one batch may already have processed another
+            if meta in self._batch_cache:
+                self._logger.debug("flush cached %dx %s messages (dc: %s)",
+                                   len(batch), meta.name, self._pending_tasks[meta])
+                self._process_message_batch(meta)
 
     def on_messages(self, messages):
         """
@@ -2164,6 +2430,7 @@ class Community(TaskManager):
         # handle/remove DropMessage and DelayMessage instances
         messages = [message for message in messages if _filter_fail(message)]
         if not messages:
+            self._dispersy.instrumentation.add(u"check", time() - debug_begin)
             return 0
 
         # check all remaining messages on the community side.  may yield Message.Implementation,
@@ -2186,6 +2453,7 @@ class Community(TaskManager):
 
         # handle/remove DropMessage and DelayMessage instances
         possibly_messages = [message for message in possibly_messages if _filter_fail(message)]
+        self._dispersy.instrumentation.add(u"check", time() - debug_begin)
         if not possibly_messages:
             return 0
 
@@ -2549,23 +2817,61 @@ class Community(TaskManager):
                 messages_with_sync.append((message, time_low, time_high, offset, modulo))
 
         if messages_with_sync:
-            for message, generator in self._get_packets_for_bloomfilters(messages_with_sync, include_inactive=False):
-                payload = message.payload
+            readers = self._dispersy.database_readers
+            if readers.available:
+                # the read-only connections only see committed packets
+                self._dispersy.commit_for_database_readers()
+            for message, sql, sql_arguments in self._get_sql_for_bloomfilters(messages_with_sync, include_inactive=False):
                 # we limit the response by byte_limit bytes
                 byte_limit = self.dispersy_sync_response_limit
 
+                if readers.available:
+                    # the packets are selected by a worker thread and streamed back to the reactor
+                    if not readers.submit(self._select_sync_response, message, sql, sql_arguments, byte_limit):
+                        self._logger.debug("too many concurrent sync requests, ignoring sync from %s", message.candidate)
+                    continue
+
+                generator = ((str(packet),) for packet, in self._dispersy._database.execute(sql, sql_arguments))
                 packets = []
-                for packet, in payload.bloom_filter.not_filter(generator):
+                for packet, in message.payload.bloom_filter.not_filter(generator):
                     packets.append(packet)
                     byte_limit -= len(packet)
                     if byte_limit <= 0:
                         self._logger.debug("bandwidth throttle")
                         break
 
-                if packets:
-                    self._logger.debug("syncing %d packets (%d bytes) to %s",
-                                       len(packets), sum(len(packet) for packet in packets), message.candidate)
-                    self._dispersy._send_packets([message.candidate], packets, self, "-caused by sync-")
+                self._send_sync_response(message.candidate, packets)
+
+    def _select_sync_response(self, cursor, message, sql, sql_arguments, byte_limit, chunk_size=16):
+        """
+        Select the packets for MESSAGE, a dispersy-introduction-request with a bloom filter, using
+        CURSOR, the cursor of a read-only connection.
+
+        Called in a worker thread, see ReadOnlyConnectionPool.  Every CHUNK_SIZE packets are passed
+        to the reactor thread, allowing the first packets to be sent while the remaining packets are
+        still being selected.  At most BYTE_LIMIT bytes are selected.
+        """
+        packets = []
+        generator = ((str(packet),) for packet, in cursor.execute(sql, sql_arguments))
+        for packet, in message.payload.bloom_filter.not_filter(generator):
+            packets.append(packet)
+            byte_limit -= len(packet)
+            if byte_limit <= 0:
+                self._logger.debug("bandwidth throttle")
+                break
+
+            if len(packets) >= chunk_size:
+                reactor.callFromThread(self._send_sync_response, message.candidate, packets)
+                packets = []
+
+        if packets:
+            reactor.callFromThread(self._send_sync_response, message.candidate, packets)
+
+    def _send_sync_response(self, candidate, packets):
+        if packets and self._dispersy.running and self._dispersy._communities.get(self._cid) is self:
+            self._logger.debug("syncing %d packets (%d bytes) to %s",
+                               len(packets), sum(len(packet) for packet in packets), candidate)
+            self._dispersy._send_packets([candidate], packets, self, "-caused by sync-")
 
     def check_introduction_response(self, messages):
         identifiers_seen = {}
@@ -2645,13 +2951,11 @@ class Community(TaskManager):
                 cache.response_candidate = introduced
 
                 # update statistics
-                if self._dispersy._statistics.received_introductions is not None:
-                    self._dispersy._statistics.received_introductions[candidate.sock_addr][introduced.sock_addr] += 1
+                self._dispersy._statistics.add_received_introduction(candidate.sock_addr, introduced.sock_addr)
 
             else:
                 # update statistics
-                if self._dispersy._statistics.received_introductions is not None:
-                    self._dispersy._statistics.received_introductions[candidate.sock_addr]['-ignored-'] += 1
+                self._dispersy._statistics.add_received_introduction(candidate.sock_addr, u"-ignored-")
 
     def create_introduction_request(self, destination, allow_sync, forward=True, is_fast_walker=False, extra_payload=None):
         assert isinstance(destination, WalkCandidate), [type(destination), destination]
@@ -2672,7 +2976,9 @@ class Community(TaskManager):
         else:
             # flush any sync-able items left in the cache before we create a sync
             self.flush_batch_cache()
+            begin = time()
             sync = self.dispersy_claim_sync_bloom_filter(cache)
+            self._dispersy.instrumentation.add(u"bloom filter", time() - begin)
             if __debug__:
                 assert sync is None or isinstance(sync, tuple), sync
                 if not sync is None:
@@ -2739,9 +3045,10 @@ class Community(TaskManager):
 
         return request
 
-    def _get_packets_for_bloomfilters(self, requests, include_inactive=True):
+    def _get_sql_for_bloomfilters(self, requests, include_inactive=True):
         """
-        Return all packets matching a Bloomfilter request
+        Return the statement, and its bindings, that selects all packets matching a Bloomfilter
+        request
 
         @param requests: A list of requests, each of them being a tuple consisting of the request,
          time_low, time_high, offset, and modulo
@@ -2750,34 +3057,34 @@ class Community(TaskManager):
         @param include_inactive: When False only active packets (due to pruning) are returned
         @type include_inactive: bool
 
-        @return: An generator yielding the original request and a generator consisting of the packets matching the request
+        @return: An generator yielding the original request, the statement, and its bindings
         """
 
         assert isinstance(requests, list)
         assert all(isinstance(request, (list, tuple)) for request in requests)
         assert all(len(request) == 5 for request in requests)
 
-        def get_sub_select(meta):
+        def get_sub_select(meta, modulo_clause, global_time):
             direction = meta.distribution.synchronization_direction
             if direction == u"ASC":
                 return u"""
  SELECT * FROM
   (SELECT sync.packet FROM sync    -- """ + meta.name + """
-   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
-   ORDER BY sync.global_time ASC)"""
+   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND """ + modulo_clause + """
+   ORDER BY """ + global_time + """ ASC)"""
 
             if direction == u"DESC":
                 return u"""
  SELECT * FROM
   (SELECT sync.packet FROM sync    -- """ + meta.name + """
-   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
-   ORDER BY sync.global_time DESC)"""
+   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND """ + modulo_clause + """
+   ORDER BY """ + global_time + """ DESC)"""
 
             if direction == u"RANDOM":
                 return u"""
  SELECT * FROM
   (SELECT sync.packet FROM sync    -- """ + meta.name + """
-   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) % ? = 0
+   WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND """ + modulo_clause + """
    ORDER BY RANDOM())"""
 
             raise RuntimeError("Unknown synchronization_direction [%d]" % direction)
@@ -2789,11 +3096,18 @@ class Community(TaskManager):
                                 if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32],
                                key=lambda meta: meta.distribution.priority,
                                reverse=True)
-        # build multi-part SQL statement from meta_messages
-        sql = "".join((u"SELECT * FROM (", " UNION ALL ".join(get_sub_select(meta) for meta in meta_messages), ")"))
-        self._logger.debug(sql)
 
         for message, time_low, time_high, offset, modulo in requests:
+            # build multi-part SQL statement from meta_messages, the modulo clause depends on the
+            # request, see get_sync_modulo_clause
+            modulo_clause, modulo_arguments = get_sync_modulo_clause(offset, modulo, ordered=True)
+            # the unary + prevents SQLite from scanning the global_time index to avoid sorting, the
+            # bucket index finds the few rows of the slice directly.  small moduli keep the global
+            # time order of the index, their first rows are found without sorting
+            global_time = u"+sync.global_time" if is_sync_bucket_modulo(modulo, ordered=True) else u"sync.global_time"
+            sql = "".join((u"SELECT * FROM (", " UNION ALL ".join(get_sub_select(meta, modulo_clause, global_time) for meta in meta_messages), ")"))
+            self._logger.debug(sql)
+
             sql_arguments = []
             for meta in meta_messages:
                 if include_inactive:
@@ -2801,9 +3115,26 @@ class Community(TaskManager):
                 else:
                     _time_low = min(max(time_low, self.global_time - meta.distribution.pruning.inactive_threshold + 1), 2 ** 63 - 1) if isinstance(meta.distribution.pruning, GlobalTimePruning) else time_low
 
-                sql_arguments.extend((meta.database_id, _time_low, time_high, offset, modulo))
+                sql_arguments.extend((meta.database_id, _time_low, time_high))
+                sql_arguments.extend(modulo_arguments)
             self._logger.debug("%s", sql_arguments)
 
+            yield message, sql, sql_arguments
+
+    def _get_packets_for_bloomfilters(self, requests, include_inactive=True):
+        """
+        Return all packets matching a Bloomfilter request
+
+        @param requests: A list of requests, each of them being a tuple consisting of the request,
+         time_low, time_high, offset, and modulo
+        @type requests: list
+
+        @param include_inactive: When False only active packets (due to pruning) are returned
+        @type include_inactive: bool
+
+        @return: An generator yielding the original request and a generator consisting of the packets matching the request
+        """
+        for message, sql, sql_arguments in self._get_sql_for_bloomfilters(requests, include_inactive):
             yield message, ((str(packet),) for packet, in self._dispersy._database.execute(sql, sql_arguments))
 
     def check_puncture_request(self, messages):
@@ -2891,25 +3222,49 @@ class Community(TaskManager):
         request = meta.impl(distribution=(self.global_time,), destination=(candidate,), payload=(member, [global_time]))
         self._dispersy._forward([request])
 
+    def _send_missing_responses(self, responses, msg_type):
+        """
+        Sends the packets in RESPONSES, a list containing (candidate, packets) tuples.
+
+        The packets for one candidate are sent once, using one _send_packets call, as long as the
+        dispersy_missing_response_limit of that candidate allows.
+        """
+        candidates = OrderedDict()
+        for candidate, packets in responses:
+            _, unique, seen = candidates.setdefault(candidate.sock_addr, (candidate, [], set()))
+            for packet in packets:
+                if not packet in seen:
+                    seen.add(packet)
+                    unique.append(packet)
+
+        limit = self.dispersy_missing_response_limit
+        for candidate, packets, _ in candidates.itervalues():
+            claimed = self._missing_response_budget.claim(candidate, packets, limit)
+            if len(claimed) < len(packets):
+                self._logger.debug("Bandwidth throttle.  sending %d out of %d packets to %s",
+                                   len(claimed), len(packets), candidate)
+            if claimed:
+                self._dispersy._send_packets([candidate], claimed, self, msg_type)
+
     def on_missing_message(self, messages):
-        for message in messages:
+        rows = self._select_sync_rows(set((message.payload.member.database_id, global_time)
+                                          for message in messages
+                                          for global_time in message.payload.global_times))
 
-            responses = []
-            candidate = message.candidate
+        responses = []
+        for message in messages:
             member_database_id = message.payload.member.database_id
-            for global_time in message.payload.global_times:
-                try:
-                    packet, = self._dispersy._database.execute(u"SELECT packet FROM sync WHERE community = ? AND member = ? AND global_time = ?",
-                                                              (self.database_id, member_database_id, global_time)).next()
-                    responses.append(str(packet))
-                except StopIteration:
-                    pass
+            packets = [str(rows[(member_database_id, global_time)][2])
+                       for global_time in message.payload.global_times
+                       if (member_database_id, global_time) in rows]
 
-            if responses:
-                self._dispersy._send_packets([candidate], responses, self, "-caused by missing-message-")
+            if packets:
+                responses.append((message.candidate, packets))
             else:
                 self._logger.warning('could not find missing messages for candidate %s, global_times %s',
-                                     candidate, message.payload.global_times)
+                                     message.candidate, message.payload.global_times)
+
+        self._send_missing_responses(responses, "-caused by missing-message-")
 
     def create_identity(self, sign_with_master=False, store=True, update=True):
         """
@@ -2978,26 +3333,36 @@ class Community(TaskManager):
         @type messages: [Message.Implementation]
         """
         meta_id = self.get_meta_message(u"dispersy-identity").database_id
-        sql_member = u"SELECT id FROM member WHERE mid = ? LIMIT 10"
-        sql_packet = u"SELECT packet FROM sync WHERE community = ? AND member = ? AND meta_message = ? LIMIT 1"
 
+        # we are assuming that no more than 10 members have the same sha1 digest.  one identity is
+        # selected per member
+        mids = list(set(message.payload.mid for message in messages))
+        packets = defaultdict(list)
+        for index in xrange(0, len(mids), 400):
+            chunk = mids[index:index + 400]
+            for mid, packet in self._dispersy._database.execute(
+                    u"SELECT member.mid, sync.packet FROM member JOIN sync ON sync.member = member.id "
+                    u"WHERE member.mid IN (%s) AND sync.community = ? AND sync.meta_message = ? GROUP BY sync.member" %
+                    ", ".join("?" * len(chunk)),
+                    [buffer(mid) for mid in chunk] + [self.database_id, meta_id]):
+                mid = str(mid)
+                if len(packets[mid]) < 10:
+                    packets[mid].append(str(packet))
+
+        responses = []
         for message in messages:
             mid = message.payload.mid
+            if mid in packets:
+                self._logger.debug("responding with %d identity messages", len(packets[mid]))
+                responses.append((message.candidate, packets[mid]))
 
-            # we are assuming that no more than 10 members have the same sha1 digest.
-            for member_id in [member_id for member_id, in self._dispersy._database.execute(sql_member, (buffer(mid),))]:
-                packets = [str(packet) for packet, in self._dispersy._database.execute(sql_packet,
-                                                                                       (self.database_id, member_id, meta_id))]
-
-                if packets:
-                    self._logger.debug("responding with %d identity messages", len(packets))
-                    self._dispersy._send_packets([message.candidate], packets, self, "-caused by missing-identity-")
+            else:
+                assert not message.payload.mid == self.my_member.mid, "we should always have our own dispersy-identity"
+                self._logger.warning("could not find any missing members. "
+                                     " no response is sent [%s, mid:%s, cid:%s]",
+                                     mid.encode("HEX"), self.my_member.mid.encode("HEX"), self.cid.encode("HEX"))
 
-                else:
-                    assert not message.payload.mid == self.my_member.mid, "we should always have our own dispersy-identity"
-                    self._logger.warning("could not find any missing members. "
-                                         " no response is sent [%s, mid:%s, cid:%s]",
-                                         mid.encode("HEX"), self.my_member.mid.encode("HEX"), self.cid.encode("HEX"))
+        self._send_missing_responses(responses, "-caused by missing-identity-")
 
     def create_missing_sequence(self, candidate, member, message, missing_low, missing_high):
         meta = self.get_meta_message(u"dispersy-missing-sequence")
@@ -3015,9 +3380,8 @@ class Community(TaskManager):
         has been sent.  This magic number is subject to change.
 
         Sometimes peers will request overlapping sequence numbers.  Only unique messages will be
-        given back (per batch).  Also, if multiple sequence number ranges are requested, these
-        ranges are translated into one large range, and all containing sequence numbers are given
-        back.
+        given back (per batch).  Overlapping ranges are merged, and every merged range is read
+        separately, hence every packet that is read counts towards the limit.
 
         @param messages: dispersy-missing-sequence messages.
         @type messages: [Message.Implementation]
@@ -3042,32 +3406,15 @@ class Community(TaskManager):
                     cur_low, cur_high = low, high
             yield (cur_low, cur_high)
 
-        def fetch_packets(member_id, message_id, candidate, requests):
-            # We limit the response by byte_limit bytes per incoming candidate
-            byte_limit = self.dispersy_missing_sequence_response_limit
-
-            packets = []
+        def iter_packets(candidate, requests):
+            # every merged range is read separately, the packets between the ranges are never read
             for (member_id, message_id), sequences in requests.iteritems():
-                if not sequences:
-                    # empty set will fail min(...) and max(...)
-                    continue
+                for low, high in merge_ranges(sequences):
+                    self._logger.debug("fetching member:%d message:%d packets [%d:%d] for %s",
+                                       member_id, message_id, low, high, candidate)
 
-                self._logger.debug("fetching member:%d message:%d packets from database for %s",
-                                   member_id, message_id, candidate)
-                for range_min, range_max in merge_ranges(sequences):
-                    for packet, in self._dispersy._database.execute(
-                            u"SELECT packet FROM sync "
-                            u"WHERE member = ? AND meta_message = ? AND sequence BETWEEN ? AND ? "
-                            u"ORDER BY sequence",
-                            (member_id, message_id, range_min, range_max)):
-                        packet = str(packet)
-                        packets.append(packet)
-
-                        byte_limit -= len(packet)
-                        if byte_limit <= 0:
-                            self._logger.debug("Bandwidth throttle.  byte_limit:%d", byte_limit)
-                            return packets
-            return packets
+                    for _, packet in self._missing_sequence_cache.iter_packets(self._dispersy._database, member_id, message_id, low, high, now):
+                        yield packet
 
         sources = defaultdict(lambda: defaultdict(list))
         for message in messages:
@@ -3079,22 +3426,24 @@ class Community(TaskManager):
 
             sources[message.candidate][(member_id, message_id)].append((message.payload.missing_low, message.payload.missing_high))
 
+        now = time()
         for candidate, member_message_requests in sources.iteritems():
             assert isinstance(candidate, Candidate), type(candidate)
-            packets = fetch_packets(member_id, message_id, candidate, member_message_requests)
-            if __debug__:
-                # ensure we are sending the correct sequence numbers back
-                for packet in packets:
-                    msg = self._dispersy.convert_packet_to_message(packet, self)
-                    assert msg
-                    self._logger.debug("syncing %d bytes, member:%d message:%d sequence:%d to %s",
-                                 len(packet),
-                                 msg.authentication.member.database_id,
-                                 msg.database_id,
-                                 msg.distribution.sequence_number,
-                                 candidate)
-
-            self._dispersy._send_packets([candidate], packets, self, u"-sequence-")
+
+            # We limit the response by byte_limit bytes per incoming candidate
+            byte_limit = self.dispersy_missing_sequence_response_limit
+            packets = []
+            for packet in iter_packets(candidate, member_message_requests):
+                packets.append(packet)
+                byte_limit -= len(packet)
+                if byte_limit <= 0:
+                    self._logger.debug("Bandwidth throttle.  byte_limit:%d", byte_limit)
+                    break
+
+            if packets:
+                self._logger.debug("syncing %d packets (%d bytes) to %s",
+                                   len(packets), sum(len(packet) for packet in packets), candidate)
+                self._dispersy._send_packets([candidate], packets, self, u"-sequence-")
 
     def create_missing_proof(self, candidate, message):
         meta = self.get_meta_message(u"dispersy-missing-proof")
@@ -3102,25 +3451,33 @@ class Community(TaskManager):
         self._dispersy._forward([request])
 
     def on_missing_proof(self, messages):
-        for message in messages:
-            try:
-                packet, = self._dispersy._database.execute(u"SELECT packet FROM sync WHERE community = ? AND member = ? AND global_time = ? LIMIT 1",
-                                                          (self.database_id, message.payload.member.database_id, message.payload.global_time)).next()
+        targets = set((message.payload.member.database_id, message.payload.global_time) for message in messages)
+        rows = self._select_sync_rows(targets)
+
+        # the proofs for one message are only looked up once, even when requested by many candidates
+        proofs = {}
+        for target in targets:
+            if target in rows:
+                msg = self._dispersy.convert_packet_to_message(str(rows[target][2]), self, verify=False)
+                proofs[target] = self.timeline.check(msg) if msg else (False, [])
 
-            except StopIteration:
+        responses = []
+        for message in messages:
+            target = (message.payload.member.database_id, message.payload.global_time)
+            if not target in proofs:
                 self._logger.warning("someone asked for proof for a message that we do not have")
+                continue
+
+            allowed, packets = proofs[target]
+            if allowed and packets:
+                self._logger.debug("we found %d packets containing proof for %s", len(packets), message.candidate)
+                responses.append((message.candidate, [proof.packet for proof in packets]))
 
             else:
-                packet = str(packet)
-                msg = self._dispersy.convert_packet_to_message(packet, self, verify=False)
-                allowed, proofs = self.timeline.check(msg)
-                if allowed and proofs:
-                    self._logger.debug("we found %d packets containing proof for %s", len(proofs), message.candidate)
-                    self._dispersy._send_packets([message.candidate], [proof.packet for proof in proofs], self, "-caused by missing-proof-")
+                self._logger.debug("unable to give %s missing proof.  allowed:%s.  proofs:%d packets",
+                                   message.candidate, allowed, len(packets))
 
-                else:
-                    self._logger.debug("unable to give %s missing proof.  allowed:%s.  proofs:%d packets",
-                                       message.candidate, allowed, len(proofs))
+        self._send_missing_responses(responses, "-caused by missing-proof-")
 
     def create_authorize(self, permission_triplets, sign_with_master=False, store=True, update=True, forward=True):
         """
@@ -3324,12 +3681,10 @@ class Community(TaskManager):
                 undo_own_meta = self.get_meta_message(u"dispersy-undo-own")
                 undo_other_meta = self.get_meta_message(u"dispersy-undo-other")
                 for packet_id, message_id, packet in self._dispersy._database.execute(
-                        u"SELECT id, meta_message, packet FROM sync WHERE community = ? AND member = ? AND meta_message IN (?, ?)",
-                        (self.database_id, message.authentication.member.database_id, undo_own_meta.database_id, undo_other_meta.database_id)):
-                    self._logger.debug("checking: %s", message_id)
-                    msg = Packet(undo_own_meta if undo_own_meta.database_id == message_id else undo_other_meta, str(packet), packet_id).load_message()
-                    if message.distribution.global_time == msg.payload.global_time:
-                        return msg
+                        u"SELECT sync.id, sync.meta_message, sync.packet FROM undo JOIN sync ON sync.id = undo.sync "
+                        u"WHERE undo.community = ? AND undo.member = ? AND undo.global_time = ? ORDER BY sync.id LIMIT 1",
+                        (self.database_id, message.authentication.member.database_id, message.distribution.global_time)):
+                    return Packet(undo_own_meta if undo_own_meta.database_id == message_id else undo_other_meta, str(packet), packet_id).load_message()
 
                 # TODO(emilon): Review this statement
                 # Could not find the undo message that caused the sync.undone to be True.  The undone was probably
@@ -3352,6 +3707,52 @@ class Community(TaskManager):
                 self._dispersy.store_update_forward([msg], store, update, forward)
                 return msg
 
+    def _select_sync_rows(self, targets):
+        """
+        Returns a dictionary containing (packet_id, meta_message_name, packet, undone) values for
+        every (member_database_id, global_time) in TARGETS that is in the database.
+
+        Used by check_undo and the missing-message and missing-proof responders.
+        """
+        rows = {}
+        targets = list(targets)
+        # stay well below the maximum number of SQL variables
+        for index in xrange(0, len(targets), 400):
+            chunk = set(targets[index:index + 400])
+            members = list(set(member_id for member_id, _ in chunk))
+            global_times = list(set(global_time for _, global_time in chunk))
+            for packet_id, member_id, global_time, message_name, packet, undone in self._dispersy._database.execute(
+                    u"SELECT sync.id, sync.member, sync.global_time, meta_message.name, sync.packet, sync.undone "
+                    u"FROM sync JOIN meta_message ON meta_message.id = sync.meta_message "
+                    u"WHERE sync.community = ? AND sync.member IN (%s) AND sync.global_time IN (%s)" %
+                    (", ".join("?" * len(members)), ", ".join("?" * len(global_times))),
+                    [self.database_id] + members + global_times):
+                if (member_id, global_time) in chunk:
+                    rows[(member_id, global_time)] = (packet_id, message_name, packet, undone)
+        return rows
+
+    def _select_undo_own_packets(self, targets):
+        """
+        Returns a dictionary containing a list with the (packet_id, packet) of every
+        dispersy-undo-own message that undid (member_database_id, global_time) in TARGETS.
+        """
+        packets = defaultdict(list)
+        targets = list(targets)
+        undo_own_meta = self.get_meta_message(u"dispersy-undo-own")
+        for index in xrange(0, len(targets), 400):
+            chunk = set(targets[index:index + 400])
+            members = list(set(member_id for member_id, _ in chunk))
+            global_times = list(set(global_time for _, global_time in chunk))
+            for member_id, global_time, packet_id, packet in self._dispersy._database.execute(
+                    u"SELECT undo.member, undo.global_time, sync.id, sync.packet FROM undo JOIN sync ON sync.id = undo.sync "
+                    u"WHERE undo.community = ? AND undo.member IN (%s) AND undo.global_time IN (%s) "
+                    u"AND sync.member = undo.member AND sync.meta_message = ? ORDER BY sync.id" %
+                    (", ".join("?" * len(members)), ", ".join("?" * len(global_times))),
+                    [self.database_id] + members + global_times + [undo_own_meta.database_id]):
+                if (member_id, global_time) in chunk:
+                    packets[(member_id, global_time)].append((packet_id, packet))
+        return packets
+
     def check_undo(self, messages):
         # Note: previously all MESSAGES have been checked to ensure that the sequence numbers are
         # correct.  this check takes into account the messages in the batch.  hence, if one of these
@@ -3362,18 +3763,22 @@ class Community(TaskManager):
 
         dependencies = {}
 
+        # obtain the packets that we are attempting to undo, and whether they are undone, at once
+        targets = self._select_sync_rows(set((message.payload.member.database_id, message.payload.global_time)
+                                                for message in messages))
+        undo_own_packets = None
+
         for message in messages:
+            target = (message.payload.member.database_id, message.payload.global_time)
             if message.payload.packet is None:
                 # obtain the packet that we are attempting to undo
-                try:
-                    packet_id, message_name, packet_data = self._dispersy._database.execute(u"SELECT sync.id, meta_message.name, sync.packet FROM sync JOIN meta_message ON meta_message.id = sync.meta_message WHERE sync.community = ? AND sync.member = ? AND sync.global_time = ?",
-                                                                                           (self.database_id, message.payload.member.database_id, message.payload.global_time)).next()
-                except StopIteration:
+                if not target in targets:
                     delay = DelayMessageByMissingMessage(message, message.payload.member, message.payload.global_time)
                     dependencies[message.authentication.member.public_key] = (message.distribution.sequence_number, delay)
                     yield delay
                     continue
 
+                packet_id, message_name, packet_data, _ = targets[target]
                 message.payload.packet = Packet(self.get_meta_message(message_name), str(packet_data), packet_id)
 
             # ensure that the message in the payload allows undo
@@ -3402,45 +3807,43 @@ class Community(TaskManager):
                 yield consequence.duplicate(message)
                 continue
 
-            try:
-                undone, = self._dispersy._database.execute(u"SELECT undone FROM sync WHERE id = ?", (message.payload.packet.packet_id,)).next()
-            except StopIteration:
-                assert False, "The conversion ensures that the packet exists in the DB.  Hence this should never occur"
-                undone = 0
+            assert target in targets, "The conversion ensures that the packet exists in the DB.  Hence this should never occur"
+            undone = targets[target][3] if target in targets else 0
 
             if undone and message.name == u"dispersy-undo-own":
                 # look for other packets we received that undid this packet
                 member = message.authentication.member
                 undo_own_meta = self.get_meta_message(u"dispersy-undo-own")
-                for packet_id, packet in self._dispersy._database.execute(
-                        u"SELECT id, packet FROM sync WHERE community = ? AND member = ? AND meta_message = ?",
-                        (self.database_id, member.database_id, undo_own_meta.database_id)):
+                if undo_own_packets is None:
+                    undo_own_packets = self._select_undo_own_packets(set(
+                        (msg.payload.member.database_id, msg.payload.global_time)
+                        for msg in messages if msg.name == u"dispersy-undo-own"))
 
+                for packet_id, packet in undo_own_packets.get(target, ()):
+                    # we've found another packet which undid this packet
                     db_msg = Packet(undo_own_meta, str(packet), packet_id).load_message()
-                    if message.payload.global_time == db_msg.payload.global_time:
-                        # we've found another packet which undid this packet
-                        if member == self.my_member:
-                            self._logger.exception("We created a duplicate undo-own message")
-                        else:
-                            self._logger.warning("Someone else created a duplicate undo-own message")
-
-                        # Reply to this peer with a higher (or equally) ranked message in case we have one
-                        if db_msg.packet <= message.packet:
-                            message.payload.process_undo = False
-                            yield message
-                            # the sender apparently does not have the lower dispersy-undo message, lets give it back
-                            self._dispersy._send_packets([message.candidate], [db_msg.packet], self, db_msg.name)
-
-                            yield DispersyDuplicatedUndo(db_msg, message)
-                            break
-                        else:
-                            # The new message is binary lower. As we cannot delete the old one, what we do
-                            # instead, is we store both and mark the message we already have as undone by the new one.
-                            # To accomplish this, we yield a DispersyDuplicatedUndo so on_undo() can mark the other
-                            # message as undone by the newly reveived message.
-                            yield message
-                            yield DispersyDuplicatedUndo(message, db_msg)
-                            break
+                    if member == self.my_member:
+                        self._logger.exception("We created a duplicate undo-own message")
+                    else:
+                        self._logger.warning("Someone else created a duplicate undo-own message")
+
+                    # Reply to this peer with a higher (or equally) ranked message in case we have one
+                    if db_msg.packet <= message.packet:
+                        message.payload.process_undo = False
+                        yield message
+                        # the sender apparently does not have the lower dispersy-undo message, lets give it back
+                        self._dispersy._send_packets([message.candidate], [db_msg.packet], self, db_msg.name)
+
+                        yield DispersyDuplicatedUndo(db_msg, message)
+                        break
+                    else:
+                        # The new message is binary lower. As we cannot delete the old one, what we do
+                        # instead, is we store both and mark the message we already have as undone by the new one.
+                        # To accomplish this, we yield a DispersyDuplicatedUndo so on_undo() can mark the other
+                        # message as undone by the newly reveived message.
+                        yield message
+                        yield DispersyDuplicatedUndo(message, db_msg)
+                        break
                 else:
                     # did not break, hence, the message hasn't been undone more than once.
                     yield message
@@ -3459,6 +3862,7 @@ class Community(TaskManager):
         # We first need to extract the DispersyDuplicatedUndo objects from the messages list and deal with them
         real_messages = []
         parameters = []
+        undo_parameters = []
         for message in messages:
             if isinstance(message, DispersyDuplicatedUndo):
                 # Flag the higher undo message as undone by the lower one
@@ -3467,13 +3871,19 @@ class Community(TaskManager):
                                    message.high_message.authentication.member.database_id,
                                    message.high_message.distribution.global_time))
 
-            elif isinstance(message, Message.Implementation) and message.payload.process_undo:
-                # That's a normal undo message
-                parameters.append((message.packet_id, self.database_id, message.payload.member.database_id, message.payload.global_time))
-                real_messages.append(message)
+            elif isinstance(message, Message.Implementation):
+                # every stored undo message is added to the undo table, including duplicates
+                undo_parameters.append((self.database_id, message.payload.member.database_id, message.payload.global_time, message.packet_id))
+
+                if message.payload.process_undo:
+                    # That's a normal undo message
+                    parameters.append((message.packet_id, self.database_id, message.payload.member.database_id, message.payload.global_time))
+                    real_messages.append(message)
 
         self._dispersy._database.executemany(u"UPDATE sync SET undone = ? "
                                              u"WHERE community = ? AND member = ? AND global_time = ?", parameters)
+        self._dispersy._database.executemany(u"INSERT OR IGNORE INTO undo (community, member, global_time, sync) VALUES (?, ?, ?, ?)",
+                                             undo_parameters)
 
         for meta, sub_messages in groupby(real_messages, key=lambda x: x.payload.packet.meta):
             meta.undo_callback([(message.payload.member, message.payload.global_time, message.payload.packet) for message in sub_messages])
@@ -3572,6 +3982,7 @@ class Community(TaskManager):
                 # 2. cleanup sync table.  everything except what we need to tell others this
                 # community is no longer available
                 self._dispersy._database.execute(u"DELETE FROM sync WHERE community = ? AND id NOT IN (" + u", ".join(u"?" for _ in packet_ids) + ")", [self.database_id] + list(packet_ids))
+                self._missing_sequence_cache.clear()
 
             self._dispersy.reclassify_community(self, new_classification)
 
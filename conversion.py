@@ -84,7 +84,7 @@ class Conversion(object):
         assert isinstance(data, str), type(data)
         assert len(data) >= 23
 
-        return (len(data) >= 23 and data[:22] == self._prefix)
+        return (len(data) >= 23 and data.startswith(self._prefix))
 
     @abstractmethod
     def decode_meta_message(self, data):
@@ -158,25 +158,28 @@ class NoDefBinaryConversion(Conversion):
             self.payload = None
 
     class EncodeFunctions(object):
-        __slots__ = ["byte", "authentication", "resolution", "distribution", "payload"]
+        __slots__ = ["byte", "authentication", "resolution", "distribution", "payload", "compiled"]
 
-        def __init__(self, byte, authentication, resolution, distribution, payload):
+        def __init__(self, byte, authentication, resolution, distribution, payload, compiled=None):
             self.byte = byte
             self.authentication = authentication
             self.resolution = resolution
             self.distribution = distribution
             self.payload = payload
+            self.compiled = compiled
 
     class DecodeFunctions(object):
-        __slots__ = ["meta", "authentication", "resolution", "distribution", "destination", "payload"]
+        __slots__ = ["meta", "authentication", "resolution", "distribution", "destination", "payload", "compiled", "zero_copy"]
 
-        def __init__(self, meta, authentication, resolution, distribution, destination, payload):
+        def __init__(self, meta, authentication, resolution, distribution, destination, payload, compiled=None, zero_copy=False):
             self.meta = meta
             self.authentication = authentication
             self.resolution = resolution
             self.distribution = distribution
             self.destination = destination
             self.payload = payload
+            self.compiled = compiled
+            self.zero_copy = zero_copy
 
     def __init__(self, community, community_version):
         Conversion.__init__(self, community, "\x00", community_version)
@@ -213,7 +216,22 @@ class NoDefBinaryConversion(Conversion):
         self._encode_connection_type_map = {u"unknown": int("00000000", 2), u"public": int("10000000", 2), u"symmetric-NAT": int("11000000", 2)}
         self._decode_connection_type_map = dict((value, key) for key, value in self._encode_connection_type_map.iteritems())
 
-    def define_meta_message(self, byte, meta, encode_payload_func, decode_payload_func):
+    def define_meta_message(self, byte, meta, encode_payload_func, decode_payload_func, compiled=True, zero_copy=False):
+        """
+        Associate BYTE with META, using ENCODE_PAYLOAD_FUNC and DECODE_PAYLOAD_FUNC to convert the
+        payload.
+
+        When COMPILED is True, and the policies of META allow it, a specialized encode and decode
+        function is built for META.  These functions handle the authentication, resolution,
+        destination, and distribution policies in a single pass and read all fixed-size header
+        fields using one precompiled Struct.  Otherwise every packet is converted by calling the
+        separate policy functions.
+
+        When ZERO_COPY is True, DECODE_PAYLOAD_FUNC receives a read-only buffer on the signed part of
+        the packet instead of a str copy.  Slicing this buffer gives a str, as do len() and
+        struct.unpack_from, but str methods such as find or startswith are not available.  Only
+        decoders that restrict themselves to these operations should enable ZERO_COPY.
+        """
         assert isinstance(byte, str)
         assert len(byte) == 1
         assert isinstance(meta, Message)
@@ -222,6 +240,8 @@ class NoDefBinaryConversion(Conversion):
         assert not byte in self._decode_message_map, "This byte has already been defined (%d)" % ord(byte)
         assert callable(encode_payload_func)
         assert callable(decode_payload_func)
+        assert isinstance(compiled, bool), type(compiled)
+        assert isinstance(zero_copy, bool), type(zero_copy)
 
         mapping = {MemberAuthentication: self._encode_member_authentication,
                    DoubleMemberAuthentication: self._encode_double_member_authentication,
@@ -235,7 +255,8 @@ class NoDefBinaryConversion(Conversion):
                    LastSyncDistribution: self._encode_last_sync_distribution,
                    DirectDistribution: self._encode_direct_distribution}
 
-        self._encode_message_map[meta.name] = self.EncodeFunctions(byte, mapping[type(meta.authentication)], mapping[type(meta.resolution)], mapping[type(meta.distribution)], encode_payload_func)
+        self._encode_message_map[meta.name] = self.EncodeFunctions(byte, mapping[type(meta.authentication)], mapping[type(meta.resolution)], mapping[type(meta.distribution)], encode_payload_func,
+                                                                   self._compile_encoder(byte, meta, encode_payload_func) if compiled else None)
 
         mapping = {MemberAuthentication: self._decode_member_authentication,
                    DoubleMemberAuthentication: self._decode_double_member_authentication,
@@ -252,7 +273,9 @@ class NoDefBinaryConversion(Conversion):
                    CandidateDestination: self._decode_empty_destination,
                    CommunityDestination: self._decode_empty_destination}
 
-        self._decode_message_map[byte] = self.DecodeFunctions(meta, mapping[type(meta.authentication)], mapping[type(meta.resolution)], mapping[type(meta.distribution)], mapping[type(meta.destination)], decode_payload_func)
+        self._decode_message_map[byte] = self.DecodeFunctions(meta, mapping[type(meta.authentication)], mapping[type(meta.resolution)], mapping[type(meta.distribution)], mapping[type(meta.destination)], decode_payload_func,
+                                                              self._compile_decoder(meta, decode_payload_func, zero_copy) if compiled else None,
+                                                              zero_copy)
 
     def __get_authentication_encoding(self, authentication):
         encoding = authentication.encoding
@@ -265,6 +288,238 @@ class NoDefBinaryConversion(Conversion):
                 encoding = "bin"
         return encoding
 
+    #
+    # Compiled encode and decode plans
+    #
+
+    # the policy functions that the compiled plans replace, per policy type
+    _compiled_policy_functions = {MemberAuthentication: ("_encode_member_authentication", "_decode_member_authentication"),
+                                  NoAuthentication: ("_encode_no_authentication", "_decode_no_authentication"),
+
+                                  PublicResolution: ("_encode_public_resolution", "_decode_public_resolution"),
+                                  LinearResolution: ("_encode_linear_resolution", "_decode_linear_resolution"),
+                                  DynamicResolution: ("_encode_dynamic_resolution", "_decode_dynamic_resolution"),
+
+                                  FullSyncDistribution: ("_encode_full_sync_distribution", "_decode_full_sync_distribution"),
+                                  LastSyncDistribution: ("_encode_last_sync_distribution", "_decode_last_sync_distribution"),
+                                  DirectDistribution: ("_encode_direct_distribution", "_decode_direct_distribution"),
+
+                                  CandidateDestination: ("_decode_empty_destination",),
+                                  CommunityDestination: ("_decode_empty_destination",)}
+
+    def _compile_header(self, meta):
+        """
+        Returns a (authentication_encoding, header_struct, is_dynamic, has_sequence_number) tuple
+        describing how META is laid out on the wire, or None when META uses a policy combination
+        that is not supported by the compiled plans or when this conversion overrides one of the
+        policy functions that the compiled plans replace.
+
+        The header struct contains the optional DynamicResolution policy index followed by the
+        distribution fields, i.e. all fixed-size fields between the authentication and the payload.
+        """
+        authentication = meta.authentication
+        if type(authentication) is NoAuthentication:
+            encoding = None
+        elif type(authentication) is MemberAuthentication:
+            encoding = self.__get_authentication_encoding(authentication)
+            if not encoding in ("sha1", "bin"):
+                return None
+        else:
+            # DoubleMemberAuthentication is rare enough to use the separate policy functions
+            return None
+
+        if not type(meta.resolution) in (PublicResolution, LinearResolution, DynamicResolution):
+            return None
+        if not type(meta.destination) in (CandidateDestination, CommunityDestination):
+            return None
+        if not type(meta.distribution) in (FullSyncDistribution, LastSyncDistribution, DirectDistribution):
+            return None
+
+        # the compiled plans inline the policy functions below, a subclass that overrides any of
+        # them must use the separate policy functions
+        for policy in (meta.authentication, meta.resolution, meta.distribution, meta.destination):
+            for name in self._compiled_policy_functions[type(policy)]:
+                if getattr(type(self), name).im_func is not getattr(NoDefBinaryConversion, name).im_func:
+                    return None
+
+        is_dynamic = type(meta.resolution) is DynamicResolution
+        has_sequence_number = type(meta.distribution) is FullSyncDistribution and meta.distribution.enable_sequence_number
+        header = Struct(">" + ("B" if is_dynamic else "") + ("QL" if has_sequence_number else "Q"))
+        return encoding, header, is_dynamic, has_sequence_number
+
+    def _compile_encoder(self, byte, meta, encode_payload_func):
+        """
+        Returns a function that encodes a META implementation into a signed packet, or None when
+        META can not be compiled.
+        """
+        plan = self._compile_header(meta)
+        if plan is None:
+            return None
+        encoding, header, is_dynamic, has_sequence_number = plan
+
+        prefix = self._prefix + byte
+        pack_header = header.pack
+        pack_key_length = self._struct_H.pack
+        policies = meta.resolution.policies if is_dynamic else ()
+
+        def encode(message):
+            container = [prefix]
+
+            if encoding == "bin":
+                public_key = message.authentication.member.public_key
+                assert public_key
+                assert self._community.dispersy.crypto.is_valid_public_bin(public_key), public_key.encode("HEX")
+                container.append(pack_key_length(len(public_key)))
+                container.append(public_key)
+            elif encoding == "sha1":
+                container.append(message.authentication.member.mid)
+
+            distribution = message.distribution
+            assert distribution.global_time
+            if is_dynamic:
+                index = policies.index(message.resolution.policy.meta)
+                if has_sequence_number:
+                    assert distribution.sequence_number
+                    container.append(pack_header(index, distribution.global_time, distribution.sequence_number))
+                else:
+                    container.append(pack_header(index, distribution.global_time))
+            elif has_sequence_number:
+                assert distribution.sequence_number
+                container.append(pack_header(distribution.global_time, distribution.sequence_number))
+            else:
+                container.append(pack_header(distribution.global_time))
+
+            payload = encode_payload_func(message)
+            assert isinstance(payload, (tuple, list)), (type(payload), encode_payload_func)
+            assert all(isinstance(x, str) for x in payload)
+            container.extend(payload)
+
+            packet = "".join(container)
+            return packet + message.authentication.sign(packet)
+
+        return encode
+
+    def _compile_decoder(self, meta, decode_payload_func, zero_copy):
+        """
+        Returns a function that decodes a packet into a META implementation, or None when META can
+        not be compiled.
+
+        The returned function takes the same arguments as decode_message and raises the same
+        DropPacket and DelayPacket exceptions.  It assumes that can_decode_message has already been
+        checked.
+        """
+        plan = self._compile_header(meta)
+        if plan is None:
+            return None
+        encoding, header, is_dynamic, has_sequence_number = plan
+
+        community = self._community
+        logger = self._logger
+        Placeholder = self.Placeholder
+        unpack_header = header.unpack_from
+        header_size = header.size
+        unpack_key_length = self._struct_H.unpack_from
+
+        authentication = meta.authentication
+        resolution = meta.resolution
+        destination = meta.destination
+        distribution = meta.distribution
+        authentication_impl = authentication.Implementation
+        resolution_impl = resolution.Implementation
+        destination_impl = destination.Implementation
+        distribution_impl = distribution.Implementation
+        message_impl = meta.Implementation
+        policies = resolution.policies if is_dynamic else ()
+        time_index = 1 if is_dynamic else 0
+        check_global_time = not type(distribution) is DirectDistribution
+
+        def decode(candidate, data, verify, allow_empty_signature, source):
+            placeholder = Placeholder(candidate, meta, 23, data, verify, allow_empty_signature)
+            offset = 23
+
+            # authentication
+            if encoding is None:
+                first_signature_offset = len(data)
+                placeholder.authentication = authentication_impl(authentication)
+
+            else:
+                if encoding == "sha1":
+                    if len(data) < offset + 20:
+                        raise DropPacket("Insufficient packet size (_decode_member_authentication sha1)")
+                    member_id = data[offset:offset + 20]
+                    offset += 20
+
+                    member = community.get_member(mid=member_id)
+                    if not member:
+                        raise DelayPacketByMissingMember(community, member_id)
+
+                else:
+                    if len(data) < offset + 2:
+                        raise DropPacket("Insufficient packet size (_decode_member_authentication bin)")
+                    key_length, = unpack_key_length(data, offset)
+                    offset += 2
+                    if len(data) < offset + key_length:
+                        raise DropPacket("Insufficient packet size (_decode_member_authentication bin)")
+                    key = data[offset:offset + key_length]
+                    offset += key_length
+
+                    try:
+                        member = community.get_member(public_key=key)
+                    except:
+                        raise DropPacket("Invalid cryptographic key (_decode_member_authentication)")
+                    if not member:
+                        raise DropPacket("Invalid cryptographic key (_decode_member_authentication)")
+
+                first_signature_offset = len(data) - member.signature_length
+                placeholder.authentication = authentication_impl(authentication, member, data[first_signature_offset:])
+
+            # resolution, destination, and distribution
+            if first_signature_offset < offset + header_size:
+                raise DropPacket("Insufficient packet size (%s header)" % meta.name)
+            values = unpack_header(data, offset)
+            offset += header_size
+
+            if is_dynamic:
+                index = values[0]
+                if index >= len(policies):
+                    raise DropPacket("Invalid policy index")
+                meta_policy = policies[index]
+                placeholder.resolution = resolution_impl(resolution, meta_policy.Implementation(meta_policy))
+            else:
+                placeholder.resolution = resolution_impl(resolution)
+
+            placeholder.destination = destination_impl(destination)
+
+            global_time = values[time_index]
+            if check_global_time and not global_time:
+                raise DropPacket("Invalid global time value (%s)" % meta.name)
+            if has_sequence_number:
+                sequence_number = values[time_index + 1]
+                if not sequence_number:
+                    raise DropPacket("Invalid sequence number value (%s)" % meta.name)
+                placeholder.distribution = distribution_impl(distribution, global_time, sequence_number)
+            else:
+                placeholder.distribution = distribution_impl(distribution, global_time)
+
+            # payload
+            placeholder.offset = offset
+            placeholder.first_signature_offset = first_signature_offset
+            payload = buffer(data, 0, first_signature_offset)
+            offset, placeholder.payload = decode_payload_func(placeholder, offset, payload if zero_copy else data[:first_signature_offset])
+            if offset != first_signature_offset:
+                logger.warning("invalid packet size for %s data:%d; offset:%d", meta.name, first_signature_offset, offset)
+                raise DropPacket("Invalid packet size (there are unconverted bytes %d-%d)" % (offset, first_signature_offset))
+
+            assert isinstance(placeholder.payload, Payload.Implementation), type(placeholder.payload)
+
+            # verify payload
+            if verify and not placeholder.authentication.has_valid_signature_for(placeholder, payload):
+                raise DropPacket("Invalid signature")
+
+            return message_impl(meta, placeholder.authentication, placeholder.resolution, placeholder.distribution, placeholder.destination, placeholder.payload, conversion=self, candidate=candidate, source=source, packet=data)
+
+        return decode
+
     #
     # Dispersy payload
     #
@@ -977,6 +1232,8 @@ class NoDefBinaryConversion(Conversion):
         assert isinstance(message, Message.Implementation), message
         assert message.name in self._encode_message_map, message.name
         encode_functions = self._encode_message_map[message.name]
+        if encode_functions.compiled:
+            return encode_functions.compiled(message)
 
         # community prefix, message-id
         container = [self._prefix, encode_functions.byte]
@@ -1160,7 +1417,7 @@ class NoDefBinaryConversion(Conversion):
         """
         assert isinstance(data, str), type(data)
         return (len(data) >= 23 and
-                data[:22] == self._prefix and
+                data.startswith(self._prefix) and
                 data[22] in self._decode_message_map)
 
     def decode_meta_message(self, data):
@@ -1194,6 +1451,8 @@ class NoDefBinaryConversion(Conversion):
             raise DropPacket("Cannot decode message")
 
         decode_functions = self._decode_message_map[data[22]]
+        if decode_functions.compiled:
+            return decode_functions.compiled(candidate, data, verify, allow_empty_signature, source)
 
         # placeholder
         placeholder = self.Placeholder(candidate, decode_functions.meta, 23, data, verify, allow_empty_signature)
@@ -1214,9 +1473,11 @@ class NoDefBinaryConversion(Conversion):
         decode_functions.distribution(placeholder)
         assert isinstance(placeholder.distribution, Distribution.Implementation)
 
-        # payload
-        payload = placeholder.data[:placeholder.first_signature_offset]
-        placeholder.offset, placeholder.payload = decode_functions.payload(placeholder, placeholder.offset, payload)
+        # payload.  the signature check, and the payload functions that enabled zero_copy, receive a
+        # read-only view on the packet, slicing this view will materialize the requested bytes only
+        payload = buffer(placeholder.data, 0, placeholder.first_signature_offset)
+        placeholder.offset, placeholder.payload = decode_functions.payload(placeholder, placeholder.offset,
+                                                                           payload if decode_functions.zero_copy else placeholder.data[:placeholder.first_signature_offset])
         if placeholder.offset != placeholder.first_signature_offset:
             self._logger.warning("invalid packet size for %s data:%d; offset:%d",
                                  placeholder.meta.name, placeholder.first_signature_offset, placeholder.offset)
@@ -1251,7 +1512,9 @@ class BinaryConversion(NoDefBinaryConversion):
                 if __debug__:
                     debug_non_available.append(name)
             else:
-                self.define_meta_message(chr(value), meta, encode, decode)
+                # the decoders below are zero copy safe, an overriding decoder in a subclass might not be
+                zero_copy = getattr(type(self), decode.__name__).im_func is getattr(BinaryConversion, decode.__name__).im_func
+                self.define_meta_message(chr(value), meta, encode, decode, zero_copy=zero_copy)
 
         if __debug__:
             debug_non_available = []
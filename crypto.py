@@ -1,35 +1,71 @@
 from hashlib import sha1
+from importlib import import_module
 from math import ceil
 from struct import Struct
 import logging
 
-from M2Crypto import EC, BIO
-
 # Add libnacl submodule to the python path
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'libnacl'))
 
-import libnacl.dual
-
 from .util import attach_runtime_statistics
-from libnacl.encode import hex_encode
+
+
+class _LazyImport(object):
+
+    """
+    Behaves like the module NAMES[0], all modules in NAMES are imported when the first attribute is
+    used.  Importing the crypto backends takes a noticeable part of the Dispersy startup time.
+    """
+
+    def __init__(self, *names):
+        super(_LazyImport, self).__init__()
+        self._names = names
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None:
+            for module_name in self._names:
+                import_module(module_name)
+            self._module = sys.modules[self._names[0]]
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+
+EC = _LazyImport("M2Crypto.EC")
+BIO = _LazyImport("M2Crypto.BIO")
+libnacl = _LazyImport("libnacl", "libnacl.dual", "libnacl.public", "libnacl.sign", "libnacl.encode")
 
 _STRUCT_L = Struct(">L")
 
-# Allow all available curves.
-# Niels: 16-12-2013, if it starts with NID_
-_CURVES = dict((unicode(curve), (getattr(EC, curve), "M2Crypto")) for curve in dir(EC) if curve.startswith("NID_"))
+_CURVES = None
 
-# We want to provide a few default curves.  We will change these curves as new become available and
-# old ones to small to provide sufficient security.
-_CURVES.update({u"very-low": (EC.NID_sect163k1, "M2Crypto"),
-                u"low": (EC.NID_sect233k1, "M2Crypto"),
-                u"medium": (EC.NID_sect409k1, "M2Crypto"),
-                u"high": (EC.NID_sect571r1, "M2Crypto")})
 
-# Add custom curves, not provided by M2Crypto
-_CURVES.update({u'curve25519': (None, "libnacl")})
+def get_curves():
+    """
+    Returns a dictionary with security level:(curve, backend) pairs.
+    """
+    global _CURVES
+    if _CURVES is None:
+        # Allow all available curves.
+        # Niels: 16-12-2013, if it starts with NID_
+        curves = dict((unicode(curve), (getattr(EC, curve), "M2Crypto")) for curve in dir(EC.module) if curve.startswith("NID_"))
+
+        # We want to provide a few default curves.  We will change these curves as new become available and
+        # old ones to small to provide sufficient security.
+        curves.update({u"very-low": (EC.NID_sect163k1, "M2Crypto"),
+                       u"low": (EC.NID_sect233k1, "M2Crypto"),
+                       u"medium": (EC.NID_sect409k1, "M2Crypto"),
+                       u"high": (EC.NID_sect571r1, "M2Crypto")})
+
+        # Add custom curves, not provided by M2Crypto
+        curves.update({u'curve25519': (None, "libnacl")})
+        _CURVES = curves
+    return _CURVES
 
 logger = logging.getLogger(__name__)
 
@@ -113,7 +149,7 @@ class ECCrypto(DispersyCrypto):
         Returns the names of all available curves.
         @rtype: [unicode]
         """
-        return _CURVES.keys()
+        return get_curves().keys()
 
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}")
     def generate_key(self, security_level):
@@ -134,9 +170,9 @@ class ECCrypto(DispersyCrypto):
         @type security_level: unicode
         """
         assert isinstance(security_level, unicode)
-        assert security_level in _CURVES
+        assert security_level in get_curves()
 
-        curve = _CURVES[security_level]
+        curve = get_curves()[security_level]
         if curve[1] == "M2Crypto":
             return M2CryptoSK(curve[0])
 
@@ -203,7 +239,7 @@ class ECCrypto(DispersyCrypto):
         Returns True when SIGNATURE matches the DIGEST made using EC.
         """
         assert isinstance(ec, DispersyKey), ec
-        assert isinstance(data, str), type(data)
+        assert isinstance(data, (str, buffer)), type(data)
         assert isinstance(signature, str), type(signature)
         assert len(signature) == self.get_signature_length(ec), [len(signature), self.get_signature_length(ec)]
 
@@ -375,7 +411,7 @@ class LibNaCLPK(DispersyKey):
     def __init__(self, binarykey="", pk=None, hex_vk=None):
         if binarykey:
             pk, vk = binarykey[:libnacl.crypto_box_SECRETKEYBYTES], binarykey[libnacl.crypto_box_SECRETKEYBYTES: libnacl.crypto_box_SECRETKEYBYTES + libnacl.crypto_sign_SEEDBYTES]
-            hex_vk = hex_encode(vk)
+            hex_vk = libnacl.encode.hex_encode(vk)
 
         self.key = libnacl.public.PublicKey(pk)
         self.veri = libnacl.sign.Verifier(hex_vk)
@@ -388,7 +424,8 @@ class LibNaCLPK(DispersyKey):
 
     @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name}")
     def verify(self, signature, msg):
-        return self.veri.verify(signature + msg)
+        # libnacl expects the signature and message as one contiguous string
+        return self.veri.verify(signature + str(msg))
 
     def key_to_bin(self):
         return "LibNaCLPK:" + self.key.pk + self.veri.vk
@@ -8,8 +8,10 @@ This module provides basic database functionalty and simple version control.
 import logging
 import sys
 import thread
+from Queue import Empty, Queue
 from abc import ABCMeta, abstractmethod
 from sqlite3 import Connection
+from threading import Lock, Thread
 
 from .util import attach_runtime_statistics
 
@@ -84,6 +86,9 @@ class Database(object):
         # when _pending_commits > 0.  A commit is required when _pending_commits > 1.
         self._pending_commits = 0
 
+        # the total_changes of the connection at the last commit
+        self._committed_changes = 0
+
         if __debug__:
             self._debug_thread_ident = 0
 
@@ -150,9 +155,11 @@ class Database(object):
         # PRAGMA journal_mode = DELETE | TRUNCATE | PERSIST | MEMORY | WAL | OFF
         # http://www.sqlite.org/pragma.html#pragma_page_size
         #
+        # the locking mode must remain NORMAL, otherwise the connections of a
+        # ReadOnlyConnectionPool are unable to read while this connection is open
+        #
         if not (journal_mode == u"WAL" or self._file_path == u":memory:"):
             self._logger.debug("PRAGMA journal_mode = WAL (previously: %s) [%s]", journal_mode, self._file_path)
-            self._cursor.execute(u"PRAGMA locking_mode = EXCLUSIVE")
             self._cursor.execute(u"PRAGMA journal_mode = WAL")
 
         else:
@@ -204,6 +211,14 @@ class Database(object):
         """
         return self._file_path
 
+    @property
+    def has_uncommitted_changes(self):
+        """
+        True when rows were changed since the last commit, i.e. changes that other connections can
+        not see yet.
+        """
+        return self._connection.total_changes != self._committed_changes
+
     def __enter__(self):
         """
         Enters a no-commit state.  The commit will be performed by __exit__.
@@ -387,7 +402,9 @@ class Database(object):
                 except Exception as exception:
                     self._logger.exception("%s [%s]", exception, self._file_path)
 
-            return self._connection.commit()
+            result = self._connection.commit()
+            self._committed_changes = self._connection.total_changes
+            return result
 
     @abstractmethod
     def check_database(self, database_version):
@@ -415,3 +432,160 @@ class Database(object):
     def detach_commit_callback(self, func):
         assert func in self._commit_callbacks
         self._commit_callbacks.remove(func)
+
+
+class ReadOnlyConnectionPool(object):
+
+    """
+    A pool of worker threads that each own a read-only connection to a database file.
+
+    The database uses WAL, allowing these connections to read while the main connection, which is
+    used on the reactor thread, writes.  Note that a worker only sees the changes that the main
+    connection has committed.
+
+    An in-memory database can not be shared between connections, hence the pool is not available
+    for u':memory:'.
+    """
+
+    def __init__(self, file_path, threads=2, max_pending=8):
+        """
+        Initialize a new ReadOnlyConnectionPool instance.
+
+        The worker threads are started when the first job is submitted.
+
+        @param file_path: the path to the database file.
+        @type file_path: unicode
+
+        @param threads: the number of worker threads, i.e. read-only connections.
+        @type threads: int
+
+        @param max_pending: the maximum number of jobs that are queued or running at the same time.
+        @type max_pending: int
+        """
+        assert isinstance(file_path, unicode), type(file_path)
+        assert isinstance(threads, int), type(threads)
+        assert threads > 0, threads
+        assert isinstance(max_pending, int), type(max_pending)
+        assert max_pending > 0, max_pending
+        super(ReadOnlyConnectionPool, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._file_path = file_path
+        self._thread_count = threads
+        self._max_pending = max_pending
+        self._threads = []
+        self._queue = Queue()
+        self._lock = Lock()
+        self._pending = 0
+        self._submitted_count = 0
+        self._dropped_count = 0
+
+    @property
+    def file_path(self):
+        return self._file_path
+
+    @property
+    def available(self):
+        """
+        True when jobs can be submitted to this pool.
+        """
+        return self._file_path != u":memory:"
+
+    @property
+    def pending(self):
+        """
+        The number of jobs that are queued or running.
+        """
+        return self._pending
+
+    @property
+    def max_pending(self):
+        return self._max_pending
+
+    def get_dict(self):
+        with self._lock:
+            return {u"threads": len(self._threads),
+                    u"pending": self._pending,
+                    u"max_pending": self._max_pending,
+                    u"submitted": self._submitted_count,
+                    u"dropped": self._dropped_count}
+
+    def submit(self, func, *args):
+        """
+        Call FUNC(CURSOR, *ARGS) in one of the worker threads, where CURSOR is a cursor of the
+        read-only connection of that thread.
+
+        FUNC is not allowed to use the main connection, results must be passed to the reactor
+        thread, for instance using reactor.callFromThread.
+
+        Returns False, without calling FUNC, when MAX_PENDING jobs are already queued or running.
+        Otherwise True is returned.
+        """
+        assert self.available, "the pool is not available for %s" % self._file_path
+        assert callable(func), func
+        with self._lock:
+            if self._pending >= self._max_pending:
+                self._dropped_count += 1
+                return False
+            self._pending += 1
+            self._submitted_count += 1
+
+            if not self._threads:
+                for index in xrange(self._thread_count):
+                    worker = Thread(target=self._run, name="%s-%d" % (self.__class__.__name__, index))
+                    worker.daemon = True
+                    worker.start()
+                    self._threads.append(worker)
+
+        self._queue.put((func, args))
+        return True
+
+    def stop(self, timeout=10.0):
+        """
+        Discard the jobs that are still queued, wait for the running jobs to finish, and close all
+        connections.
+
+        Returns True when all worker threads have stopped.
+        """
+        with self._lock:
+            workers, self._threads = self._threads, []
+
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except Empty:
+                    break
+                self._pending -= 1
+
+        for _ in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join(timeout)
+        return not any(worker.is_alive() for worker in workers)
+
+    def _run(self):
+        # called in a worker thread
+        self._logger.debug("open read-only connection [%s]", self._file_path)
+        connection = Connection(self._file_path)
+        connection.execute(u"PRAGMA query_only = ON")
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+
+                func, args = job
+                # a separate cursor for each job ensures that the read transaction ends when the
+                # cursor is closed, even when FUNC did not consume all rows
+                cursor = connection.cursor()
+                try:
+                    func(cursor, *args)
+                except Exception:
+                    self._logger.exception("read-only job %s failed [%s]", func, self._file_path)
+                finally:
+                    cursor.close()
+                    with self._lock:
+                        self._pending -= 1
+
+        finally:
+            self._logger.debug("close read-only connection [%s]", self._file_path)
+            connection.close()
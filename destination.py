@@ -5,7 +5,7 @@ from .meta import MetaObject
 class Destination(MetaObject):
 
     class Implementation(MetaObject.Implementation):
-        pass
+        __slots__ = []
 
     def setup(self, message):
         """
@@ -24,6 +24,7 @@ class CandidateDestination(Destination):
     A destination policy where the message is sent to one or more specified candidates.
     """
     class Implementation(Destination.Implementation):
+        __slots__ = ["_candidates"]
 
         def __init__(self, meta, *candidates):
             """
@@ -55,6 +56,7 @@ class CommunityDestination(Destination):
     community.yield_random_candidates(...) to receive the message.
     """
     class Implementation(Destination.Implementation):
+        __slots__ = ["_candidates"]
 
         def __init__(self, meta, *candidates):
             """
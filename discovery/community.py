@@ -1,12 +1,16 @@
 # Written by Niels Zeilemaker, Egbert Bouman
 import logging
 import os
+import sys
 from collections import OrderedDict
-from random import random, shuffle
+from heapq import heapify, heappop, heappush, nlargest
+from itertools import count
+from random import random, sample, shuffle
 from time import time
 
 from twisted.internet import reactor
 from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 
 from ..authentication import MemberAuthentication, NoAuthentication
 from ..candidate import CANDIDATE_WALK_LIFETIME, Candidate, WalkCandidate
@@ -14,14 +18,17 @@ from ..community import Community
 from ..conversion import DefaultConversion
 from ..destination import CandidateDestination
 from ..distribution import DirectDistribution
+from ..exception import CommunityNotFoundException
 from ..member import Member
 from ..message import DelayMessageByProof, DropMessage, Message
 from ..requestcache import RandomNumberCache
 from ..resolution import PublicResolution
 from .bootstrap import Bootstrap
 from .conversion import DiscoveryConversion
+from .preferences import PreferenceVector
 from .payload import (ExtendedIntroPayload, PingPayload, PongPayload, SimilarityRequestPayload,
                       SimilarityResponsePayload)
+from .tastebuddies import ActualTasteBuddies, PossibleTasteBuddies
 
 
 DEBUG_VERBOSE = False
@@ -68,6 +75,11 @@ class TasteBuddy(object):
     def does_overlap(self, preference):
         return preference in self.preferences
 
+    @property
+    def sort_key(self):
+        # the order used by __cmp__
+        return (self.overlap, self.random_sort_value)
+
     def __cmp__(self, other):
         if isinstance(other, TasteBuddy):
             # we sort by overlap, then random
@@ -145,6 +157,10 @@ class PossibleTasteBuddy(TasteBuddy):
     def did_received_from(self, candidate):
         return candidate == self.received_from
 
+    @property
+    def sort_key(self):
+        return (self.overlap, self.timestamp, self.random_sort_value)
+
     def __cmp__(self, other):
         if isinstance(other, PossibleTasteBuddy):
             # we want to sort based on overlap, then time desc, then random
@@ -181,8 +197,9 @@ class DiscoveryCommunity(Community):
         self.peer_cache = PeerCache(os.path.join(self._dispersy._working_directory, PEERCACHE_FILENAME), self)
         self.max_prefs = max_prefs
         self.max_tbs = max_tbs
-        self.taste_buddies = []
-        self.possible_taste_buddies = []
+        self.taste_buddies = ActualTasteBuddies(PING_TIMEOUT)
+        self._preference_vector = None
+        self.possible_taste_buddies = PossibleTasteBuddies(PING_TIMEOUT)
         self.requested_introductions = {}
         self.recent_taste_buddies = LimitedOrderedDict(limit=1000)
 
@@ -288,16 +305,33 @@ class DiscoveryCommunity(Community):
         shuffle(my_prefs)
         return my_prefs
 
+    @property
+    def preference_vector(self):
+        """
+        The PreferenceVector of my_preferences, cached until a community is attached or detached.
+        """
+        if self._preference_vector is None:
+            self._preference_vector = PreferenceVector(self.my_preferences())
+        return self._preference_vector
+
+    def sample_preferences(self):
+        """
+        Returns at most max_prefs of my preferences in random order.
+        """
+        preferences = self.preference_vector.preferences
+        return sample(preferences, min(len(preferences), self.max_prefs))
+
     def new_community(self, community):
+        self._preference_vector = None
         if community.dispersy_enable_candidate_walker:
             for candidate in self.bootstrap.candidates:
                 self._logger.debug("Adding %s %s as discovered candidate", type(community), candidate)
                 community.add_discovered_candidate(candidate)
 
-    def add_taste_buddies(self, new_taste_buddies):
-        my_communities = dict((community.cid, community)
-                              for community in self._dispersy.get_communities() if community.dispersy_enable_candidate_walker)
+    def removed_community(self, community):
+        self._preference_vector = None
 
+    def add_taste_buddies(self, new_taste_buddies):
         for i in xrange(len(new_taste_buddies) - 1, -1, -1):
             new_taste_buddy = new_taste_buddies[i]
             self._logger.debug("DiscoveryCommunity: new taste buddy? %s", new_taste_buddy)
@@ -305,27 +339,36 @@ class DiscoveryCommunity(Community):
             if new_taste_buddy.should_cache():
                 self.peer_cache.add_or_update_peer(new_taste_buddy.candidate)
 
-            for taste_buddy in self.taste_buddies:
-                if new_taste_buddy == taste_buddy:
-                    self._logger.debug(
-                        "DiscoveryCommunity: new taste buddy? no, equal to %s %s", new_taste_buddy, taste_buddy)
+            taste_buddy = self.taste_buddies.get(new_taste_buddy.sock_addr)
+            if taste_buddy:
+                self._logger.debug(
+                    "DiscoveryCommunity: new taste buddy? no, equal to %s %s", new_taste_buddy, taste_buddy)
 
-                    taste_buddy.update_overlap(new_taste_buddy, self.compute_overlap)
-                    new_taste_buddies.pop(i)
-                    break
+                taste_buddy.update_overlap(new_taste_buddy, self.compute_overlap)
+                self.taste_buddies.add(taste_buddy)
+                new_taste_buddies.pop(i)
 
             # new peer
             else:
                 self._logger.debug("DiscoveryCommunity: new taste buddy? yes, adding to list")
-                self.taste_buddies.append(new_taste_buddy)
+                taste_buddy = new_taste_buddy
+                self.taste_buddies.add(taste_buddy)
+
+            # a taste buddy is no longer a possible taste buddy
+            if taste_buddy.overlap:
+                self.possible_taste_buddies.remove(taste_buddy.candidate_mid)
 
             # add taste buddy to overlapping communities
             for cid in new_taste_buddy.preferences:
-                if cid in my_communities:
-                    my_communities[cid].add_discovered_candidate(new_taste_buddy.candidate)
+                try:
+                    community = self._dispersy.get_community(cid, False, False)
+                except CommunityNotFoundException:
+                    continue
+                if community.dispersy_enable_candidate_walker:
+                    community.add_discovered_candidate(new_taste_buddy.candidate)
 
-        self.taste_buddies.sort(reverse=True)
-        self.taste_buddies = self.taste_buddies[:self.max_tbs * 4]
+        while len(self.taste_buddies) > self.max_tbs * 4:
+            self.taste_buddies.remove(self.taste_buddies.get_key(self.taste_buddies.least()))
 
         if DEBUG_VERBOSE:
             self._logger.debug("DiscoveryCommunity: current tastebuddy list %s %s", len(
@@ -334,45 +377,41 @@ class DiscoveryCommunity(Community):
             self._logger.debug("DiscoveryCommunity: current tastebuddy list %s", len(self.taste_buddies))
 
     def yield_taste_buddies(self, ignore_candidate=None):
-        for i in range(len(self.taste_buddies) - 1, -1, -1):
-            if self.taste_buddies[i].time_remaining() == 0:
-                self._logger.debug("DiscoveryCommunity: removing tastebuddy too old %s", self.taste_buddies[i])
-                self.taste_buddies.pop(i)
+        self.taste_buddies.expire(time())
 
-        taste_buddies = self.taste_buddies[:]
-        shuffle(taste_buddies)
         ignore_sock_addr = ignore_candidate.sock_addr if ignore_candidate else None
-
-        for taste_buddy in taste_buddies:
-            if taste_buddy.overlap and taste_buddy.candidate.sock_addr != ignore_sock_addr:
-                yield taste_buddy
+        taste_buddies = [taste_buddy for taste_buddy in self.taste_buddies
+                         if taste_buddy.overlap and taste_buddy.candidate.sock_addr != ignore_sock_addr]
+        shuffle(taste_buddies)
+        return iter(taste_buddies)
 
     def is_taste_buddy(self, candidate):
-        for tb in self.yield_taste_buddies():
-            if tb == candidate:
-                return tb
+        self.taste_buddies.expire(time())
+        tb = self.taste_buddies.get_candidate(candidate)
+        if tb and tb.overlap:
+            return tb
 
     def is_taste_buddy_mid(self, mid):
         assert isinstance(mid, str)
         assert len(mid) == 20
 
-        for tb in self.yield_taste_buddies():
-            if mid == tb.candidate_mid:
-                return tb
+        self.taste_buddies.expire(time())
+        tb = self.taste_buddies.get_mid(mid)
+        if tb and tb.overlap:
+            return tb
 
     def reset_taste_buddy(self, candidate):
-        for tb in self.yield_taste_buddies():
-            if tb == candidate:
-                tb.timestamp = time()
-                if tb.should_cache():
-                    self.peer_cache.add_or_update_peer(tb.candidate)
-                break
+        tb = self.is_taste_buddy(candidate)
+        if tb:
+            tb.timestamp = time()
+            self.taste_buddies.add(tb)
+            if tb.should_cache():
+                self.peer_cache.add_or_update_peer(tb.candidate)
 
     def remove_taste_buddy(self, candidate):
-        for tb in self.yield_taste_buddies():
-            if tb == candidate:
-                self.taste_buddies.remove(tb)
-                break
+        tb = self.is_taste_buddy(candidate)
+        if tb:
+            self.taste_buddies.remove(tb.sock_addr)
 
     def is_recent_taste_buddy(self, candidate):
         member = candidate.get_member()
@@ -402,20 +441,15 @@ class DiscoveryCommunity(Community):
                 possibles.pop(i)
                 continue
 
-            for i, possible in enumerate(self.possible_taste_buddies):
-                if possible == new_possible:
-                    new_possible.update_overlap(possible, self.compute_overlap)
-
-                    # replace in list
-                    self.possible_taste_buddies[i] = new_possible
-                    break
-
-            # new peer
+            possible = self.possible_taste_buddies.get(new_possible.candidate_mid)
+            if possible:
+                new_possible.update_overlap(possible, self.compute_overlap)
             else:
                 self._logger.debug("DiscoveryCommunity: new possible taste buddy? yes, adding to list")
-                self.possible_taste_buddies.append(new_possible)
 
-        self.possible_taste_buddies.sort(reverse=True)
+            # replaces the existing possible taste buddy
+            self.possible_taste_buddies.add(new_possible)
+
         if possibles:
             if DEBUG_VERBOSE:
                 self._logger.debug("DiscoveryCommunity: got possible taste buddies, current list %s %s",
@@ -425,46 +459,48 @@ class DiscoveryCommunity(Community):
                                    len(self.possible_taste_buddies))
 
     def clean_possible_taste_buddies(self):
-        low_sim = self.get_least_similar_tb()
-        for i in range(len(self.possible_taste_buddies) - 1, -1, -1):
-            to_low_sim = self.possible_taste_buddies[i] < low_sim
-            too_old = self.possible_taste_buddies[i].time_remaining() == 0
-            is_tb = self.is_taste_buddy_mid(self.possible_taste_buddies[i].candidate_mid)
+        # possible taste buddies that became taste buddies are removed in add_taste_buddies
+        self.possible_taste_buddies.expire(time())
 
-            if to_low_sim or too_old or is_tb:
-                self._logger.debug("DiscoveryCommunity: removing possible tastebuddy %s %s %s %s",
-                                   to_low_sim, too_old, is_tb, self.possible_taste_buddies[i])
-                self.possible_taste_buddies.pop(i)
+        # the store orders by (overlap, timestamp, random) while comparing with an ActualTasteBuddy
+        # uses (overlap, random).  hence every possible taste buddy with a lower overlap than LOW_SIM
+        # is smaller, while those with the same overlap must all be compared
+        low_sim = self.get_least_similar_tb()
+        low_overlap = low_sim.overlap if isinstance(low_sim, TasteBuddy) else low_sim
+        possible = self.possible_taste_buddies.least()
+        while possible and possible.overlap < low_overlap:
+            self._logger.debug("DiscoveryCommunity: removing possible tastebuddy %s", possible)
+            self.possible_taste_buddies.remove(possible.candidate_mid)
+            possible = self.possible_taste_buddies.least()
+
+        if possible and possible.overlap == low_overlap:
+            for possible in [possible for possible in self.possible_taste_buddies if possible.overlap == low_overlap and possible < low_sim]:
+                self._logger.debug("DiscoveryCommunity: removing possible tastebuddy %s", possible)
+                self.possible_taste_buddies.remove(possible.candidate_mid)
 
     def has_possible_taste_buddies(self, candidate):
-        for possible in self.possible_taste_buddies:
-            if possible.did_received_from(candidate):
-                return True
-        return False
+        return self.possible_taste_buddies.has_received_from(candidate)
 
     def is_possible_taste_buddy_mid(self, mid):
         assert isinstance(mid, str)
         assert len(mid) == 20
 
-        for ptb in self.possible_taste_buddies:
-            if mid == ptb.candidate_mid:
-                return ptb
+        return self.possible_taste_buddies.get(mid)
 
     def get_most_similar(self, candidate):
         assert isinstance(candidate, WalkCandidate), [type(candidate), candidate]
 
         self.clean_possible_taste_buddies()
 
-        if self.possible_taste_buddies:
-            most_similar = self.possible_taste_buddies.pop(0)
+        most_similar = self.possible_taste_buddies.most()
+        if most_similar:
+            self.possible_taste_buddies.remove(most_similar.candidate_mid)
             return most_similar.received_from, most_similar.candidate_mid
 
         return candidate, None
 
     def get_least_similar_tb(self):
-        if self.taste_buddies:
-            return self.taste_buddies[-1]
-        return 0
+        return self.taste_buddies.least() or 0
 
     class SimilarityAttempt(RandomNumberCache):
 
@@ -495,7 +531,7 @@ class DiscoveryCommunity(Community):
             self.send_introduction_request(destination, allow_sync=allow_sync)
 
     def create_similarity_request(self, destination, allow_sync=True):
-        payload = self.my_preferences()[:self.max_prefs]
+        payload = self.sample_preferences()
         if payload:
             cache = self._request_cache.add(DiscoveryCommunity.SimilarityAttempt(self, destination, payload, allow_sync))
             destination.walk(time())
@@ -554,21 +590,15 @@ class DiscoveryCommunity(Community):
             his_preferences = message.payload.preference_list[:self.max_prefs]
 
             # Determine overlap for top taste buddies
-            bitfields = []
-            tbs = []
-            for tb in self.taste_buddies:
-                if tb.time_remaining() > 5.0:
-                    if tb != message.candidate or True:
-                        tbs.append((self.compute_overlap(his_preferences, tb.preferences), random(), tb))
-
-            sorted_tbs = sorted(tbs, reverse=True)
-            for _, _, tb in sorted_tbs[:self.max_tbs]:
-                # Size of the bitfield is fixed and set to 4 bytes.
-                bitfield = sum([2 ** index for index in range(min(len(his_preferences), 4 * 8))
-                                if his_preferences[index] in tb.preferences])
-                bitfields.append((tb.candidate_mid, bitfield))
-
-            payload = (message.payload.identifier, self.my_preferences()[:self.max_prefs], bitfields)
+            deadline = time() - PING_TIMEOUT + 5.0
+            vector = PreferenceVector(his_preferences)
+            scores = [(overlap, random(), mask, tb)
+                      for overlap, mask, tb in vector.score(tb for tb in self.taste_buddies if tb.timestamp > deadline)]
+
+            # Size of the bitfield is fixed and set to 4 bytes.
+            bitfields = [(tb.candidate_mid, mask & 0xffffffff) for _, _, mask, tb in nlargest(self.max_tbs, scores)]
+
+            payload = (message.payload.identifier, self.sample_preferences(), bitfields)
             response_message = meta.impl(
                 authentication=(self.my_member,), distribution=(self.global_time,), payload=payload)
 
@@ -578,7 +608,9 @@ class DiscoveryCommunity(Community):
             self._dispersy._send([message.candidate], [response_message])
 
     def compute_overlap(self, his_prefs, my_prefs=None):
-        return len(set(his_prefs) & set(my_prefs or self.my_preferences()))
+        if my_prefs:
+            return len(set(his_prefs) & set(my_prefs))
+        return self.preference_vector.overlap(his_prefs)
 
     def check_similarity_response(self, messages):
         for message in messages:
@@ -739,6 +771,15 @@ class DiscoveryCommunity(Community):
 
 class PeerCache(object):
 
+    """
+    Remembers public taste buddies in FILENAME to walk towards them after a restart.
+
+    FILENAME is an append-only journal: every 30 seconds the peers that changed are appended, a
+    later line for a peer replaces an earlier one.  When the journal contains too many outdated
+    lines it is compacted, i.e. replaced by one line per peer.  Both are done in a thread to avoid
+    blocking the reactor, and at most one write is in progress at any time.
+    """
+
     def __init__(self, filename, community, limit=100):
         assert isinstance(filename, (str, unicode)), type(filename)
 
@@ -750,6 +791,17 @@ class PeerCache(object):
         self.walkcandidates = {}
         self.walkcandidates_limit = limit
         self.info_keys = ['last_seen', 'last_checked', 'num_fails']
+
+        # the peers that changed since the last write
+        self._dirty = set()
+        # the number of lines in the journal
+        self._journal_length = 0
+        # the deferred of the write in progress, or None
+        self._writing = None
+        # (last_checked, sequence, wcandidate) entries, outdated entries are skipped by get_peer
+        self._last_checked = []
+        self._sequence = count()
+
         self.load()
 
         self.community.register_task("clean_and_save_peer_cache", LoopingCall(self.clean_and_save)).start(30, now=False)
@@ -757,16 +809,23 @@ class PeerCache(object):
     def load(self):
         if os.path.exists(self.filename):
             with open(self.filename, 'r') as fp:
-                for line in fp.readlines():
+                for line in fp:
                     if not line.startswith('#'):
+                        self._journal_length += 1
                         result = self.parse_line(line)
                         if result is None:
                             continue
                         wcandidate, info = result
                         self.walkcandidates[wcandidate] = info
+            self.clean()
+            self._rebuild_last_checked()
             self._logger.info('PeerCache: loaded %s, got %d peers', self.filename, len(self.walkcandidates))
 
-    def clean_and_save(self):
+    def clean(self):
+        """
+        Forget the peers that failed too often and, when there are too many peers, the peers that
+        were seen the longest ago.
+        """
         old_num_candidates = len(self.walkcandidates)
 
         for wcandidate, info in self.walkcandidates.items():
@@ -775,20 +834,85 @@ class PeerCache(object):
 
         if len(self.walkcandidates) > self.walkcandidates_limit:
             sorted_keys = sorted([(info['last_seen'], wcandidate) for wcandidate, info in self.walkcandidates.iteritems()], reverse=True)
-            for _, wcandidate in sorted_keys[:self.walkcandidates_limit]:
+            for _, wcandidate in sorted_keys[self.walkcandidates_limit:]:
                 del self.walkcandidates[wcandidate]
 
         self._logger.debug('PeerCache: removed %d peers', old_num_candidates - len(self.walkcandidates))
 
-        with open(self.filename, 'w') as fp:
-            print >> fp, '# WAN address\tLAN address\tTunnel',
-            print >> fp, "\t".join(self.info_keys)
+    def clean_and_save(self):
+        """
+        Clean the peers and write the peers that changed, unless the previous write is still in
+        progress.  Returns the deferred of the write, or None.
+        """
+        if self._writing:
+            return None
+
+        if self._journal_length > 4 * len(self.walkcandidates) + self.walkcandidates_limit:
+            self.clean()
+            lines = [self.format_line(wcandidate, info) for wcandidate, info in self.walkcandidates.iteritems()]
+            compact = True
+
+        else:
+            # the changes are written before cleaning, when the journal is read the same peers are
+            # removed again
+            lines = [self.format_line(wcandidate, self.walkcandidates[wcandidate])
+                     for wcandidate in self._dirty if wcandidate in self.walkcandidates]
+            compact = False
+            self.clean()
+
+        if len(self._last_checked) > 2 * len(self.walkcandidates) + 64:
+            self._rebuild_last_checked()
+
+        if not lines and not compact:
+            self._dirty.clear()
+            return None
+
+        # peers that change while writing are written the next time
+        dirty, self._dirty = self._dirty, set()
+
+        def on_success(_):
+            self._journal_length = len(lines) if compact else self._journal_length + len(lines)
+
+        def on_failure(failure):
+            # the changes are written again the next time
+            self._dirty.update(dirty)
+            self._logger.error('PeerCache: unable to save %s: %s', self.filename, failure.value)
+
+        def on_finished(result):
+            self._writing = None
+            return result
+
+        self._writing = deferToThread(self._write, lines, compact)
+        self._writing.addCallbacks(on_success, on_failure)
+        self._writing.addBoth(on_finished)
+        return self._writing
+
+    def _write(self, lines, compact):
+        # called in a thread
+        if compact:
+            filename = self.filename + '.tmp'
+            mode = 'w'
+        else:
+            filename = self.filename
+            mode = 'a'
+
+        write_header = compact or not os.path.exists(filename)
+        with open(filename, mode) as fp:
+            if write_header:
+                fp.write('# WAN address\tLAN address\tTunnel\t' + '\t'.join(self.info_keys) + '\n')
+            fp.writelines(lines)
 
-            for wcandidate, info in self.walkcandidates.iteritems():
-                print >> fp, '%s:%d\t%s:%d\t%r\t' % (wcandidate.wan_address + wcandidate.lan_address + (wcandidate.tunnel,)),
-                print >> fp, '\t'.join([str(info[key]) for key in self.info_keys])
+        if compact:
+            # os.rename does not replace an existing file on Windows
+            if sys.platform == 'win32' and os.path.exists(self.filename):
+                os.remove(self.filename)
+            os.rename(filename, self.filename)
 
-            self._logger.debug('PeerCache: saved %d peers to %s', len(self.walkcandidates), self.filename)
+        self._logger.debug('PeerCache: %s %d peers to %s', 'saved' if compact else 'appended', len(lines), self.filename)
+
+    def format_line(self, wcandidate, info):
+        return '%s:%d\t%s:%d\t%r\t' % (wcandidate.wan_address + wcandidate.lan_address + (wcandidate.tunnel,)) + \
+            '\t'.join([str(info[key]) for key in self.info_keys]) + '\n'
 
     def add_or_update_peer(self, wcandidate):
         assert isinstance(wcandidate, WalkCandidate), type(wcandidate)
@@ -797,10 +921,20 @@ class PeerCache(object):
             self.walkcandidates[wcandidate]['last_seen'] = time()
         else:
             self.walkcandidates[wcandidate] = {'last_seen': time(), 'last_checked': 0, 'num_fails': 0}
+            heappush(self._last_checked, (0, next(self._sequence), wcandidate))
+        self._dirty.add(wcandidate)
 
     def get_peer(self):
-        sorted_keys = sorted([(info['last_checked'], wcandidate) for wcandidate, info in self.walkcandidates.iteritems()])
-        candidate = sorted_keys[0][1] if sorted_keys else None
+        heap = self._last_checked
+        candidate = None
+        while heap:
+            last_checked, _, wcandidate = heap[0]
+            info = self.walkcandidates.get(wcandidate)
+            if info and info['last_checked'] == last_checked:
+                candidate = wcandidate
+                break
+            heappop(heap)
+
         self._logger.debug('PeerCache: returning walk candidate %s', candidate)
         return candidate
 
@@ -810,10 +944,18 @@ class PeerCache(object):
     def inc_num_fails(self, wcandidate):
         if wcandidate in self.walkcandidates:
             self.walkcandidates[wcandidate]['num_fails'] += 1
+            self._dirty.add(wcandidate)
 
     def set_last_checked(self, wcandidate, last_checked):
         if wcandidate in self.walkcandidates:
             self.walkcandidates[wcandidate]['last_checked'] = last_checked
+            heappush(self._last_checked, (last_checked, next(self._sequence), wcandidate))
+            self._dirty.add(wcandidate)
+
+    def _rebuild_last_checked(self):
+        self._last_checked = [(info['last_checked'], next(self._sequence), wcandidate)
+                              for wcandidate, info in self.walkcandidates.iteritems()]
+        heapify(self._last_checked)
 
     def parse_line(self, line):
         trimmed_line = line.replace("\t\t", "\t")
@@ -8,10 +8,10 @@ from ..conversion import BinaryConversion
 class DiscoveryConversion(BinaryConversion):
     def __init__(self, community):
         super(DiscoveryConversion, self).__init__(community, "\x02")
-        self.define_meta_message(chr(1), community.get_meta_message(u"similarity-request"), self._encode_similarity_request, self._decode_similarity_request)
-        self.define_meta_message(chr(2), community.get_meta_message(u"similarity-response"), self._encode_similarity_response, self._decode_similarity_response)
-        self.define_meta_message(chr(3), community.get_meta_message(u"ping"), self._encode_ping, self._decode_ping)
-        self.define_meta_message(chr(4), community.get_meta_message(u"pong"), self._encode_pong, self._decode_pong)
+        self.define_meta_message(chr(1), community.get_meta_message(u"similarity-request"), self._encode_similarity_request, self._decode_similarity_request, zero_copy=True)
+        self.define_meta_message(chr(2), community.get_meta_message(u"similarity-response"), self._encode_similarity_response, self._decode_similarity_response, zero_copy=True)
+        self.define_meta_message(chr(3), community.get_meta_message(u"ping"), self._encode_ping, self._decode_ping, zero_copy=True)
+        self.define_meta_message(chr(4), community.get_meta_message(u"pong"), self._encode_pong, self._decode_pong, zero_copy=True)
 
     def _encode_similarity_request(self, message):
         preference_list = message.payload.preference_list
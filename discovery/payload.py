@@ -3,6 +3,8 @@ from ..payload import Payload, IntroductionRequestPayload
 
 class SimilarityRequestPayload(Payload):
     class Implementation(Payload.Implementation):
+        __slots__ = ["_identifier", "_preference_list", "_lan_address", "_wan_address", "_connection_type"]
+
         def __init__(self, meta, identifier, lan_address, wan_address, connection_type, preference_list):
             assert isinstance(identifier, int), type(identifier)
             assert not preference_list or isinstance(preference_list, (list, tuple)), type(preference_list)
@@ -40,6 +42,8 @@ class SimilarityRequestPayload(Payload):
 
 class SimilarityResponsePayload(Payload):
     class Implementation(Payload.Implementation):
+        __slots__ = ["_identifier", "_preference_list", "_tb_overlap"]
+
         def __init__(self, meta, identifier, preference_list, tb_overlap):
             assert isinstance(identifier, int), type(identifier)
             assert not preference_list or isinstance(preference_list, (list, tuple)), type(preference_list)
@@ -73,6 +77,7 @@ class SimilarityResponsePayload(Payload):
 
 class ExtendedIntroPayload(IntroductionRequestPayload):
     class Implementation(IntroductionRequestPayload.Implementation):
+        __slots__ = ["_introduce_me_to"]
 
         def __init__(self, meta, destination_address, source_lan_address, source_wan_address, advice, connection_type, sync, identifier, introduce_me_to=None):
             IntroductionRequestPayload.Implementation.__init__(
@@ -93,6 +98,8 @@ class ExtendedIntroPayload(IntroductionRequestPayload):
 
 class PingPayload(Payload):
     class Implementation(Payload.Implementation):
+        __slots__ = ["_identifier"]
+
         def __init__(self, meta, identifier):
             assert isinstance(identifier, int), type(identifier)
 
@@ -0,0 +1,67 @@
+"""
+Preference overlap using integer bitsets.
+
+A PreferenceVector assigns a bit to every preference in a list, the overlap of the list with a
+set of preferences is then the number of bits set in the mask of that set.  The mask also is the
+bitfield that a similarity-response contains for every taste buddy, since bit INDEX is set when
+the preference at INDEX in the list overlaps.
+"""
+
+
+def popcount(mask):
+    """
+    Returns the number of bits set in MASK.
+    """
+    return bin(mask).count("1")
+
+
+class PreferenceVector(object):
+
+    __slots__ = ["_preferences", "_bits"]
+
+    def __init__(self, preferences):
+        """
+        PREFERENCES is a list of cids, a cid that occurs more than once is given the bit of its
+        first occurrence.
+        """
+        super(PreferenceVector, self).__init__()
+        self._preferences = tuple(preferences)
+        self._bits = {}
+        for index, preference in enumerate(self._preferences):
+            self._bits.setdefault(preference, 1 << index)
+
+    @property
+    def preferences(self):
+        return self._preferences
+
+    def __len__(self):
+        return len(self._preferences)
+
+    def mask(self, preferences):
+        """
+        Returns an integer where bit INDEX is set when the preference at INDEX is in PREFERENCES.
+        """
+        bits = self._bits
+        mask = 0
+        for preference in preferences:
+            mask |= bits.get(preference, 0)
+        return mask
+
+    def overlap(self, preferences):
+        """
+        Returns the number of unique preferences in PREFERENCES that are also in this vector.
+        """
+        return popcount(self.mask(preferences))
+
+    def score(self, taste_buddies):
+        """
+        Returns (overlap, mask, taste_buddy) tuples for every taste buddy in TASTE_BUDDIES.
+        """
+        bits = self._bits
+        scores = []
+        for taste_buddy in taste_buddies:
+            mask = 0
+            for preference in taste_buddy.preferences:
+                mask |= bits.get(preference, 0)
+            scores.append((popcount(mask), mask, taste_buddy))
+        return scores
@@ -0,0 +1,194 @@
+"""
+Stores for the taste buddies of the DiscoveryCommunity.
+
+Every store keeps its taste buddies in a dictionary and orders them by their sort_key in two heaps,
+one giving the least and one giving the most similar taste buddy.  A third heap orders them by
+timestamp to expire them.  Heap entries are not removed when a taste buddy is updated or removed,
+instead every entry carries the version of the taste buddy it was pushed for and entries with an
+outdated version are skipped.  The heaps are rebuilt when they contain too many outdated entries.
+"""
+from abc import ABCMeta, abstractmethod
+from heapq import heapify, heappop, heappush
+from itertools import count
+
+
+class TasteBuddyStore(object):
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, lifetime):
+        """
+        Taste buddies expire LIFETIME seconds after their timestamp.
+        """
+        assert isinstance(lifetime, float), type(lifetime)
+        super(TasteBuddyStore, self).__init__()
+        self._lifetime = lifetime
+        # key:(taste_buddy, version) pairs
+        self._items = {}
+        self._versions = count()
+        # (sort_key, version, key) entries, in _most the sort_key is negated
+        self._least = []
+        self._most = []
+        # (timestamp, version, key) entries
+        self._expiry = []
+
+    @abstractmethod
+    def get_key(self, taste_buddy):
+        pass
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return (taste_buddy for taste_buddy, _ in self._items.itervalues())
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        item = self._items.get(key)
+        return item[0] if item else None
+
+    def add(self, taste_buddy):
+        """
+        Add TASTE_BUDDY, replacing the taste buddy with the same key.  Must also be called when the
+        sort_key or the timestamp of a stored taste buddy changed.
+        """
+        key = self.get_key(taste_buddy)
+        old = self._items.get(key)
+        if old:
+            self._unindex(old[0])
+
+        version = next(self._versions)
+        self._items[key] = (taste_buddy, version)
+        self._index(taste_buddy)
+
+        sort_key = taste_buddy.sort_key
+        heappush(self._least, (sort_key, version, key))
+        heappush(self._most, (tuple(-value for value in sort_key), version, key))
+        heappush(self._expiry, (taste_buddy.timestamp, version, key))
+
+        if len(self._expiry) > 2 * len(self._items) + 64:
+            self._rebuild()
+
+    def remove(self, key):
+        """
+        Remove and return the taste buddy with KEY, or None.
+        """
+        item = self._items.pop(key, None)
+        if item:
+            self._unindex(item[0])
+            return item[0]
+
+    def expire(self, now):
+        """
+        Remove the taste buddies whose timestamp is LIFETIME or more seconds before NOW.
+        """
+        deadline = now - self._lifetime
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= deadline:
+            _, version, key = heappop(expiry)
+            if self._is_current(version, key):
+                self.remove(key)
+
+    def least(self):
+        """
+        Returns the taste buddy with the lowest sort_key, or None.
+        """
+        return self._peek(self._least)
+
+    def most(self):
+        """
+        Returns the taste buddy with the highest sort_key, or None.
+        """
+        return self._peek(self._most)
+
+    def _is_current(self, version, key):
+        item = self._items.get(key)
+        return item is not None and item[1] == version
+
+    def _peek(self, heap):
+        while heap:
+            _, version, key = heap[0]
+            if self._is_current(version, key):
+                return self._items[key][0]
+            heappop(heap)
+        return None
+
+    def _rebuild(self):
+        self._least = [(taste_buddy.sort_key, version, key) for key, (taste_buddy, version) in self._items.iteritems()]
+        self._most = [(tuple(-value for value in sort_key), version, key) for sort_key, version, key in self._least]
+        self._expiry = [(taste_buddy.timestamp, version, key) for key, (taste_buddy, version) in self._items.iteritems()]
+        heapify(self._least)
+        heapify(self._most)
+        heapify(self._expiry)
+
+    def _index(self, taste_buddy):
+        pass
+
+    def _unindex(self, taste_buddy):
+        pass
+
+
+class ActualTasteBuddies(TasteBuddyStore):
+
+    """
+    ActualTasteBuddy instances, keyed by sock_addr and indexed by member id.
+    """
+
+    def __init__(self, lifetime):
+        super(ActualTasteBuddies, self).__init__(lifetime)
+        self._mids = {}
+
+    def get_key(self, taste_buddy):
+        return taste_buddy.sock_addr
+
+    def get_mid(self, mid):
+        return self._mids.get(mid)
+
+    def get_candidate(self, candidate):
+        """
+        Returns the taste buddy for CANDIDATE, compared as Candidate.__eq__ does: by member id when
+        CANDIDATE is associated with a member, otherwise by sock_addr.
+        """
+        member = candidate.get_member()
+        if member:
+            return self._mids.get(member.mid)
+        return self.get(candidate.sock_addr)
+
+    def _index(self, taste_buddy):
+        self._mids[taste_buddy.candidate_mid] = taste_buddy
+
+    def _unindex(self, taste_buddy):
+        if self._mids.get(taste_buddy.candidate_mid) is taste_buddy:
+            del self._mids[taste_buddy.candidate_mid]
+
+
+class PossibleTasteBuddies(TasteBuddyStore):
+
+    """
+    PossibleTasteBuddy instances, keyed by member id and indexed by the candidate they were received
+    from.
+    """
+
+    def __init__(self, lifetime):
+        super(PossibleTasteBuddies, self).__init__(lifetime)
+        # sock_addr:count pairs
+        self._received_from = {}
+
+    def get_key(self, taste_buddy):
+        return taste_buddy.candidate_mid
+
+    def has_received_from(self, candidate):
+        return candidate.sock_addr in self._received_from
+
+    def _index(self, taste_buddy):
+        sock_addr = taste_buddy.received_from.sock_addr
+        self._received_from[sock_addr] = self._received_from.get(sock_addr, 0) + 1
+
+    def _unindex(self, taste_buddy):
+        sock_addr = taste_buddy.received_from.sock_addr
+        if self._received_from[sock_addr] == 1:
+            del self._received_from[sock_addr]
+        else:
+            self._received_from[sock_addr] -= 1
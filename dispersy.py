@@ -40,7 +40,7 @@ import logging
 import os
 from collections import defaultdict, Iterable, OrderedDict
 from hashlib import sha1
-from itertools import groupby, count
+from itertools import groupby
 from pprint import pformat
 from socket import inet_aton, error as socket_error
 from struct import unpack_from
@@ -50,6 +50,7 @@ import netifaces
 from twisted.internet import reactor
 from twisted.internet.defer import maybeDeferred, gatherResults
 from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 from twisted.python.failure import Failure
 from twisted.python.threadable import isInIOThread
 
@@ -57,26 +58,34 @@ from .authentication import MemberAuthentication, DoubleMemberAuthentication
 from .candidate import LoopbackCandidate, WalkCandidate, Candidate
 from .community import Community
 from .crypto import DispersyCrypto, ECCrypto
+from .database import ReadOnlyConnectionPool
 from .destination import CommunityDestination, CandidateDestination
 from .discovery.community import DiscoveryCommunity
-from .dispersydatabase import DispersyDatabase
+from .dispersydatabase import DispersyDatabase, SYNC_BUCKETS
 from .distribution import (SyncDistribution, FullSyncDistribution, LastSyncDistribution,
                            DirectDistribution)
 from .endpoint import Endpoint
-from .exception import CommunityNotFoundException, ConversionNotFoundException, MetaNotFoundException
+from .exception import CommunityNotFoundException, ConversionNotFoundException
 from .member import DummyMember, Member
 from .message import (Message, DropMessage, DelayMessageBySequence,
                       DropPacket, DelayPacket)
-from .statistics import DispersyStatistics, _runtime_statistics
+from .sanitycheck import SanityCheck
+from .statistics import DispersyStatistics, Instrumentation, _runtime_statistics
 from .taskmanager import TaskManager
 from .util import attach_runtime_statistics, init_instrumentation, blocking_call_on_reactor_thread, is_valid_address
+from .walkscheduler import WalkScheduler
 
 
 # Set up the instrumentation utilities
 init_instrumentation()
 
 FLUSH_DATABASE_INTERVAL = 60.0
+# the database is committed at most once every this many seconds to show new packets to the
+# read-only connections that select sync responses
+READERS_COMMIT_INTERVAL = 1.0
 STATS_DETAILED_CANDIDATES_INTERVAL = 5.0
+# the maximum number of packets kept for a community that is loaded in the background
+MAX_PENDING_PACKETS = 1000
 
 
 class Dispersy(TaskManager):
@@ -86,7 +95,7 @@ class Dispersy(TaskManager):
     outgoing data for, possibly, multiple communities.
     """
 
-    def __init__(self, endpoint, working_directory, database_filename=u"dispersy.db", crypto=ECCrypto()):
+    def __init__(self, endpoint, working_directory, database_filename=u"dispersy.db", crypto=ECCrypto(), instrumentation=False):
         """
         Initialise a Dispersy instance.
 
@@ -98,11 +107,15 @@ class Dispersy(TaskManager):
 
         @param database_filename: The database filename or u":memory:"
         @type database_filename: unicode
+
+        @param instrumentation: Measure the reactor lag and stage latencies, see enable_instrumentation.
+        @type instrumentation: bool
         """
         assert isinstance(endpoint, Endpoint), type(endpoint)
         assert isinstance(working_directory, unicode), type(working_directory)
         assert isinstance(database_filename, unicode), type(database_filename)
         assert isinstance(crypto, DispersyCrypto), type(crypto)
+        assert isinstance(instrumentation, bool), type(instrumentation)
         super(Dispersy, self).__init__()
         self._logger = logging.getLogger(self.__class__.__name__)
 
@@ -116,6 +129,9 @@ class Dispersy(TaskManager):
 
         self._discovery_community = None
 
+        # (phase, seconds) pairs measured by start
+        self._startup_times = []
+
         self._member_cache_by_hash = OrderedDict()
 
         # our data storage
@@ -125,6 +141,9 @@ class Dispersy(TaskManager):
                 os.makedirs(database_directory)
             database_filename = os.path.join(database_directory, database_filename)
         self._database = DispersyDatabase(database_filename)
+        # worker threads with read-only connections, used to serve sync responses
+        self._database_readers = ReadOnlyConnectionPool(database_filename)
+        self._readers_commit_deadline = 0.0
 
         self._crypto = crypto
 
@@ -144,10 +163,22 @@ class Dispersy(TaskManager):
 
         # communities that can be auto loaded.  classification:(cls, args, kargs) pairs.
         self._auto_load_communities = OrderedDict()
+        # classifications that are auto loaded in the background, see define_auto_load
+        self._lazy_auto_load_classifications = set()
 
         # loaded communities.  cid:Community pairs.
         self._communities = {}
 
+        # communities that are loaded in the background.  cid:[(packets, cache, timestamp, source)]
+        # pairs, the packets that are received meanwhile are processed once the community is loaded
+        self._pending_communities = {}
+        # cid:count pairs, the number of packets in _pending_communities
+        self._pending_packet_counts = {}
+
+        # the meta_message rows of all communities, read on start.  community-database-id:{name:
+        # (database-id, priority, direction)} pairs
+        self._meta_message_rows = {}
+
         self._check_distribution_batch_map = {DirectDistribution: self._check_direct_distribution_batch,
                                               FullSyncDistribution: self._check_full_sync_distribution_batch,
                                               LastSyncDistribution: self._check_last_sync_distribution_batch}
@@ -155,9 +186,15 @@ class Dispersy(TaskManager):
         # progress handlers (used to notify the user when something will take a long time)
         self._progress_handlers = []
 
+        # reactor lag and stage latencies, must exist before the statistics are updated
+        self._instrumentation = Instrumentation(enabled=instrumentation)
+
         # statistics...
         self._statistics = DispersyStatistics(self)
 
+        # takes the walker steps of all communities
+        self._walk_scheduler = WalkScheduler(self)
+
 
     @staticmethod
     def _get_interface_addresses():
@@ -339,6 +376,25 @@ class Dispersy(TaskManager):
         """
         return self._database
 
+    @property
+    def database_readers(self):
+        """
+        The read-only connections to the Dispersy database, not available for a :memory: database.
+        @rtype: ReadOnlyConnectionPool
+        """
+        return self._database_readers
+
+    def commit_for_database_readers(self):
+        """
+        Commit the database when it has uncommitted changes, making them visible to the read-only
+        connections of database_readers.  Commits at most once every READERS_COMMIT_INTERVAL
+        seconds, otherwise new packets are selected by a later sync.
+        """
+        now = time()
+        if now >= self._readers_commit_deadline and self._database.has_uncommitted_changes:
+            self._readers_commit_deadline = now + READERS_COMMIT_INTERVAL
+            self._flush_database()
+
     @property
     def crypto(self):
         """
@@ -354,7 +410,42 @@ class Dispersy(TaskManager):
         """
         return self._statistics
 
-    def define_auto_load(self, community_cls, my_member, args=(), kargs=None, load=False):
+    @property
+    def instrumentation(self):
+        """
+        The Instrumentation instance measuring the reactor lag and stage latencies.
+        """
+        return self._instrumentation
+
+    def enable_instrumentation(self, enable):
+        """
+        Start or stop measuring the reactor lag and stage latencies.
+
+        While enabled a heartbeat runs on the reactor every Instrumentation.heartbeat_interval
+        seconds, it is disabled by default.
+        """
+        assert isinstance(enable, bool), type(enable)
+        self._instrumentation.enabled = enable
+        if self.running:
+            if enable:
+                self._start_instrumentation_heartbeat()
+            else:
+                self.cancel_pending_task("instrumentation heartbeat")
+                self._instrumentation.stop()
+
+    def _start_instrumentation_heartbeat(self):
+        if not self.is_pending_task_active("instrumentation heartbeat"):
+            self.register_task("instrumentation heartbeat",
+                               LoopingCall(self._instrumentation.heartbeat)).start(self._instrumentation.heartbeat_interval)
+
+    @property
+    def walk_scheduler(self):
+        """
+        The WalkScheduler instance.
+        """
+        return self._walk_scheduler
+
+    def define_auto_load(self, community_cls, my_member, args=(), kargs=None, load=False, lazy=False):
         """
         Tell Dispersy how to load COMMUNITY if need be.
 
@@ -367,6 +458,13 @@ class Dispersy(TaskManager):
 
         When LOAD is True all available communities of this type will be immediately loaded.
 
+        When LAZY is True a community of this type that receives packets before it is loaded is
+        loaded in the background: the packets are kept until the community is loaded, in a later
+        reactor iteration, and are then processed one batch per reactor iteration.  Hence the
+        packets of other communities are not delayed by loading it.  The community itself, including
+        its conversions and timeline, is initialized in a single reactor iteration since the kept
+        packets can not be decoded or checked before both are available.
+
         Returns a list with loaded communities.
         """
         assert isInIOThread(), "Must be called from the callback thread"
@@ -375,10 +473,13 @@ class Dispersy(TaskManager):
         assert kargs is None or isinstance(kargs, dict), type(kargs)
         assert not community_cls.get_classification() in self._auto_load_communities
         assert isinstance(load, bool), type(load)
+        assert isinstance(lazy, bool), type(lazy)
 
         if kargs is None:
             kargs = {}
         self._auto_load_communities[community_cls.get_classification()] = (community_cls, my_member, args, kargs)
+        if lazy:
+            self._lazy_auto_load_classifications.add(community_cls.get_classification())
 
         communities = []
         if load:
@@ -401,6 +502,7 @@ class Dispersy(TaskManager):
         assert issubclass(community, Community)
         assert community.get_classification() in self._auto_load_communities
         del self._auto_load_communities[community.get_classification()]
+        self._lazy_auto_load_classifications.discard(community.get_classification())
 
     def attach_community(self, community):
         # add community to communities dict
@@ -414,6 +516,10 @@ class Dispersy(TaskManager):
     def detach_community(self, community):
         del self._communities[community.cid]
 
+        # let discovery community know
+        if self._discovery_community:
+            self._discovery_community.removed_community(community)
+
     def attach_progress_handler(self, func):
         assert callable(func), "handler must be callable"
         self._progress_handlers.append(func)
@@ -674,6 +780,109 @@ class Dispersy(TaskManager):
         """
         return self._communities.values()
 
+    def _load_community_lazily(self, cid):
+        """
+        Start loading the community CID in the background when it may be auto loaded and its
+        classification was defined using define_auto_load(..., lazy=True).  Returns True when the
+        community is being loaded.
+        """
+        try:
+            classification, auto_load_flag = self._database.execute(u"SELECT community.classification, community.auto_load FROM community JOIN member ON member.id = community.master WHERE mid = ?",
+                                                                    (buffer(cid),)).next()
+        except StopIteration:
+            return False
+
+        if not (auto_load_flag and classification in self._lazy_auto_load_classifications):
+            return False
+
+        self._logger.debug("loading %s [%s] in the background", cid.encode("HEX"), classification)
+        self._pending_communities[cid] = []
+        self._pending_packet_counts[cid] = 0
+        self.register_task("load community %s" % cid.encode("HEX"), reactor.callLater(0, self._load_pending_community, cid))
+        return True
+
+    def _add_pending_packets(self, cid, packets, cache, timestamp, source):
+        """
+        Keep PACKETS until the community CID is loaded, at most MAX_PENDING_PACKETS packets are kept
+        per community.
+        """
+        count = self._pending_packet_counts[cid]
+        if count + len(packets) > MAX_PENDING_PACKETS:
+            self._logger.warning("drop %d packets (community %s is still being loaded)", len(packets), cid.encode("HEX"))
+            self._statistics.msg_statistics.increase_count(u"drop", u"on_incoming_packets:community is being loaded", len(packets))
+            return
+        self._pending_packet_counts[cid] = count + len(packets)
+        self._pending_communities[cid].append((packets, cache, timestamp, source))
+
+    def _drop_pending_packets(self, cid, reason):
+        pending = self._pending_communities.pop(cid, [])
+        self._pending_packet_counts.pop(cid, None)
+        self._logger.warning("drop %d packets (%s %s)",
+                             sum(len(packets) for packets, _, _, _ in pending), reason, cid.encode("HEX"))
+
+    def _load_pending_community(self, cid):
+        try:
+            self.get_community(cid, auto_load=True)
+
+        except CommunityNotFoundException:
+            self._drop_pending_packets(cid, "unable to load community")
+
+        except Exception:
+            self._logger.exception("error while loading community %s", cid.encode("HEX"))
+            self._drop_pending_packets(cid, "error while loading community")
+
+        else:
+            self._process_pending_packets(cid)
+
+    def _process_pending_packets(self, cid):
+        """
+        Process the oldest batch of packets that was received while the community CID was loaded,
+        the next batch is processed in the next reactor iteration.
+        """
+        pending = self._pending_communities.get(cid)
+        if pending is None:
+            return
+
+        try:
+            if pending:
+                packets, cache, timestamp, source = pending.pop(0)
+                self._pending_packet_counts[cid] -= len(packets)
+                self.get_community(cid).on_incoming_packets(packets, cache, timestamp, source)
+
+        except Exception:
+            self._logger.exception("error while processing the packets of community %s", cid.encode("HEX"))
+            self._drop_pending_packets(cid, "error while processing the packets of community")
+
+        else:
+            if pending:
+                self.register_task("load community %s" % cid.encode("HEX"), reactor.callLater(0, self._process_pending_packets, cid))
+            else:
+                del self._pending_communities[cid]
+                del self._pending_packet_counts[cid]
+
+    def _load_meta_message_rows(self):
+        """
+        Read the meta_message rows of all communities using a single query, see
+        get_meta_message_rows.
+        """
+        self._meta_message_rows = {}
+        for community_database_id, database_id, name, priority, direction in self._database.execute(
+                u"SELECT community, id, name, priority, direction FROM meta_message"):
+            self._meta_message_rows.setdefault(community_database_id, {})[name] = (database_id, priority, direction)
+
+    def get_meta_message_rows(self, community_database_id):
+        """
+        Returns a name:(database_id, priority, direction) dictionary with the meta_message rows of
+        the community with COMMUNITY_DATABASE_ID.
+
+        The rows of all communities are read when Dispersy starts, hence loading a community does
+        not query the meta_message table, also not the first time after a restart.  Changes to the
+        meta_message rows of a community must also be made to this dictionary.
+        """
+        assert isinstance(community_database_id, (int, long)), type(community_database_id)
+        # a community without rows is new
+        return self._meta_message_rows.setdefault(community_database_id, {})
+
     def get_message(self, community, member, global_time):
         """
         Returns a Member.Implementation instance uniquely identified by its community, member, and
@@ -1005,6 +1214,7 @@ class Dispersy(TaskManager):
                             # TODO we should undo the messages that we are about to remove (when applicable)
                             execute(u"DELETE FROM sync WHERE member = ? AND meta_message = ? AND global_time >= ?",
                                     (message.authentication.member.database_id, message.database_id, global_time))
+                            message.community.missing_sequence_cache.discard(message.authentication.member.database_id, message.database_id)
 
                             # by deleting messages we changed SEQ and the HIGHEST cache
                             last_global_time, last_seq, count = execute(u"SELECT MAX(global_time), MAX(sequence), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
@@ -1456,6 +1666,12 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
             sort_key = lambda tup: (tup[1][2:22], tup[1][1], 0 if tup[1][22] == chr(248) else tup[1][22])  # community ID, community version, message meta type
             groupby_key = lambda tup: tup[1][2:22]  # community ID
             for community_id, iterator in groupby(sorted(packets, key=sort_key), key=groupby_key):
+                # keep the packets of communities that are loaded in the background
+                if community_id in self._pending_communities or \
+                        (self._lazy_auto_load_classifications and not community_id in self._communities and self._load_community_lazily(community_id)):
+                    self._add_pending_packets(community_id, list(iterator), cache, timestamp, source)
+                    continue
+
                 # find associated community
                 try:
                     community = self.get_community(community_id)
@@ -1518,8 +1734,8 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
 
             # add packet to database
             message.packet_id = self._database.execute(
-                u"INSERT INTO sync (community, member, global_time, meta_message, packet, sequence) "
-                u"VALUES (?, ?, ?, ?, ?, ?)",
+                u"INSERT INTO sync (community, member, global_time, meta_message, packet, sequence, bucket) "
+                u"VALUES (?, ?, ?, ?, ?, ?, ?)",
                (message.community.database_id,
                 message.authentication.member.database_id,
                 message.distribution.global_time,
@@ -1527,7 +1743,8 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                 buffer(message.packet),
                 (message.distribution.sequence_number if
                  isinstance(meta.distribution, FullSyncDistribution)
-                 and message.distribution.enable_sequence_number else None)
+                 and message.distribution.enable_sequence_number else None),
+                message.distribution.global_time % SYNC_BUCKETS
                 ), get_lastrowid=True)
 
             # ensure that we can reference this packet
@@ -1692,10 +1909,15 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
 
         store = store and isinstance(messages[0].meta.distribution, SyncDistribution)
         if store:
+            begin = time()
             self._store(messages)
+            self._instrumentation.add(u"store", time() - begin)
 
         if update:
-            if self._update(possibly_messages) == False:
+            begin = time()
+            updated = self._update(possibly_messages)
+            self._instrumentation.add(u"handle", time() - begin)
+            if updated == False:
                 return False
 
         # 07/10/11 Boudewijn: we will only commit if it the message was create by our self.
@@ -1705,7 +1927,9 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
             my_messages = sum(message.authentication.member == message.community.my_member for message in messages)
             if my_messages:
                 self._logger.debug("commit user generated message")
+                begin = time()
                 self._database.commit()
+                self._instrumentation.add(u"commit", time() - begin)
 
                 messages[0].community.statistics.increase_msg_count(u"created", messages[0].meta.name, my_messages)
 
@@ -1753,6 +1977,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         assert all(message.community == messages[0].community for message in messages)
         assert all(message.meta == messages[0].meta for message in messages)
 
+        begin = time()
         result = True
         meta = messages[0].meta
         if isinstance(meta.destination, (CommunityDestination, CandidateDestination)):
@@ -1771,6 +1996,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         else:
             raise NotImplementedError(meta.destination)
 
+        self._instrumentation.add(u"forward", time() - begin)
         return result
 
     def _delay(self, delay, packet, candidate):
@@ -1841,225 +2067,14 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         """
         Check everything we can about a community.
 
-        Note that messages that are disabled, i.e. not included in community.get_meta_messages(),
-        will NOT be checked.
-
-        - the dispersy-identity for my member must be in the database
-        - the dispersy-identity must be in the database for each member that has one or more messages in the database
-        - all packets in the database must be valid
-        - check sequence numbers for FullSyncDistribution
-        - check history size for LastSyncDistribution
-        """
-        def select(sql, bindings):
-            assert isinstance(sql, unicode)
-            assert isinstance(bindings, tuple)
-            limit = 1000
-            for offset in (i * limit for i in count()):
-                rows = list(self._database.execute(sql, bindings + (limit, offset)))
-                if rows:
-                    for row in rows:
-                        yield row
-                else:
-                    break
+        Raises a ValueError on the first inconsistency that is found.  The same checks can also
+        run in the background, see Community.start_sanity_check.
 
+        @see: SanityCheck
+        """
         self._logger.debug("%s start sanity check [database-id:%d]", community.cid.encode("HEX"), community.database_id)
-        enabled_messages = set(meta.database_id for meta in community.get_meta_messages())
-
-        if test_identity:
-            try:
-                # ensure that the dispersy-identity for my member must be in the database
-                meta_identity = community.get_meta_message(u"dispersy-identity")
-
-                try:
-                    member_id, = self._database.execute(u"SELECT id FROM member WHERE mid = ?", (buffer(community.my_member.mid),)).next()
-                except StopIteration:
-                    raise ValueError("unable to find the public key for my member")
-
-                if not member_id == community.my_member.database_id:
-                    raise ValueError("my member's database id is invalid", member_id, community.my_member.database_id)
-
-                try:
-                    self._database.execute(u"SELECT 1 FROM member WHERE id = ? AND private_key IS NOT NULL", (member_id,)).next()
-                except StopIteration:
-                    raise ValueError("unable to find the private key for my member")
-
-                try:
-                    self._database.execute(u"SELECT 1 FROM sync WHERE member = ? AND meta_message = ?", (member_id, meta_identity.database_id)).next()
-                except StopIteration:
-                    raise ValueError("unable to find the dispersy-identity message for my member")
-
-                self._logger.debug("my identity is OK")
-
-                #
-                # the dispersy-identity must be in the database for each member that has one or more
-                # messages in the database
-                #
-                A = set(id_ for id_, in self._database.execute(u"SELECT member FROM sync WHERE community = ? GROUP BY member", (community.database_id,)))
-                B = set(id_ for id_, in self._database.execute(u"SELECT member FROM sync WHERE meta_message = ?", (meta_identity.database_id,)))
-                if not len(A) == len(B):
-                    raise ValueError("inconsistent dispersy-identity messages.", A.difference(B))
-
-            except MetaNotFoundException:
-                # identity is not enabled
-                pass
-
-        if test_undo_other:
-            try:
-                # ensure that we have proof for every dispersy-undo-other message
-                meta_undo_other = community.get_meta_message(u"dispersy-undo-other")
-
-                # TODO we are not taking into account that undo messages can be undone
-                for undo_packet_id, undo_packet_global_time, undo_packet in select(u"SELECT id, global_time, packet FROM sync WHERE community = ? AND meta_message = ? ORDER BY id LIMIT ? OFFSET ?", (community.database_id, meta_undo_other.database_id)):
-                    undo_packet = str(undo_packet)
-                    undo_message = self.convert_packet_to_message(undo_packet, community, verify=False)
-
-                    # 10/10/12 Boudewijn: the check_callback is required to obtain the
-                    # message.payload.packet
-                    for _ in undo_message.check_callback([undo_message]):
-                        pass
-
-                    # get the message that undo_message refers to
-                    try:
-                        packet, undone = self._database.execute(u"SELECT packet, undone FROM sync WHERE community = ? AND member = ? AND global_time = ?", (community.database_id, undo_message.payload.member.database_id, undo_message.payload.global_time)).next()
-                    except StopIteration:
-                        raise ValueError("found dispersy-undo-other but not the message that it refers to")
-                    packet = str(packet)
-                    message = self.convert_packet_to_message(packet, community, verify=False)
-
-                    if not undone:
-                        raise ValueError("found dispersy-undo-other but the message that it refers to is not undone")
-
-                    if message.undo_callback is None:
-                        raise ValueError("found dispersy-undo-other but the message that it refers to does not have an undo_callback")
-
-                    # get the proof that undo_message is valid
-                    allowed, proofs = community.timeline.check(undo_message)
-
-                    if not allowed:
-                        raise ValueError("found dispersy-undo-other that, according to the timeline, is not allowed")
-
-                    if not proofs:
-                        raise ValueError("found dispersy-undo-other that, according to the timeline, has no proof")
-
-                    self._logger.debug("dispersy-undo-other packet %d@%d referring %s %d@%d is OK",
-                                       undo_packet_id, undo_packet_global_time,
-                                       undo_message.payload.packet.name,
-                                       undo_message.payload.member.database_id,
-                                       undo_message.payload.global_time)
-
-
-            except MetaNotFoundException:
-                # undo-other is not enabled
-                pass
-
-        if test_binary:
-            #
-            # ensure all packets in the database are valid and that the binary packets are consistent
-            # with the information stored in the database
-            #
-            for packet_id, member_id, global_time, meta_message_id, packet in select(u"SELECT id, member, global_time, meta_message, packet FROM sync WHERE community = ? ORDER BY id LIMIT ? OFFSET ?", (community.database_id,)):
-                if meta_message_id in enabled_messages:
-                    packet = str(packet)
-                    message = self.convert_packet_to_message(packet, community, verify=True)
-
-                    if not message:
-                        raise ValueError("unable to convert packet ", packet_id, "@", global_time, " to message")
-
-                    if not member_id == message.authentication.member.database_id:
-                        raise ValueError("inconsistent member in packet ", packet_id, "@", global_time)
-
-                    if not message.authentication.member.public_key:
-                        raise ValueError("missing public key for member ", member_id, " in packet ", packet_id, "@", global_time)
-
-                    if not global_time == message.distribution.global_time:
-                        raise ValueError("inconsistent global time in packet ", packet_id, "@", global_time)
-
-                    if not meta_message_id == message.database_id:
-                        raise ValueError("inconsistent meta message in packet ", packet_id, "@", global_time)
-
-                    if not packet == message.packet:
-                        raise ValueError("inconsistent binary in packet ", packet_id, "@", global_time)
-
-                    self._logger.debug("packet %d@%d is OK", packet_id, global_time)
-
-        if test_sequence_number:
-            for meta in community.get_meta_messages():
-                #
-                # ensure that we have all sequence numbers for FullSyncDistribution packets
-                #
-                if isinstance(meta.distribution, FullSyncDistribution) and meta.distribution.enable_sequence_number:
-                    counter = 0
-                    counter_member_id = 0
-                    exception = None
-                    for packet_id, member_id, packet in select(u"SELECT id, member, packet FROM sync WHERE meta_message = ? ORDER BY member, global_time LIMIT ? OFFSET ?", (meta.database_id,)):
-                        packet = str(packet)
-                        message = self.convert_packet_to_message(packet, community, verify=False)
-                        assert message
-
-                        if member_id != counter_member_id:
-                            counter_member_id = member_id
-                            counter = 1
-                            if exception:
-                                break
-
-                        if not counter == message.distribution.sequence_number:
-                            self._logger.error("%s for member %d has sequence number %d expected %d\n%s",
-                                               meta.name, member_id,
-                                               message.distribution.sequence_number, counter, packet.encode("HEX"))
-                            exception = ValueError("inconsistent sequence numbers in packet ", packet_id)
-
-                        counter += 1
-
-                    if exception:
-                        raise exception
-
-        if test_last_sync:
-            for meta in community.get_meta_messages():
-                #
-                # ensure that we have only history-size messages per member
-                #
-                if isinstance(meta.distribution, LastSyncDistribution):
-                    if meta.distribution.custom_callback:
-                        continue
-
-                    if isinstance(meta.authentication, MemberAuthentication):
-                        counter = 0
-                        counter_member_id = 0
-                        for packet_id, member_id, packet in select(u"SELECT id, member, packet FROM sync WHERE meta_message = ? ORDER BY member ASC, global_time DESC LIMIT ? OFFSET ?", (meta.database_id,)):
-                            message = self.convert_packet_to_message(str(packet), community, verify=False)
-                            assert message
-
-                            if member_id == counter_member_id:
-                                counter += 1
-                            else:
-                                counter_member_id = member_id
-                                counter = 1
-
-                            if counter > meta.distribution.history_size:
-                                raise ValueError("pruned packet ", packet_id, " still in database")
-
-                            self._logger.debug("LastSyncDistribution for %s is OK", meta.name)
-
-                    else:
-                        assert isinstance(meta.authentication, DoubleMemberAuthentication)
-                        for packet_id, member_id, packet in select(u"SELECT id, member, packet FROM sync WHERE meta_message = ? ORDER BY member ASC, global_time DESC LIMIT ? OFFSET ?", (meta.database_id,)):
-                            message = self.convert_packet_to_message(str(packet), community, verify=False)
-                            assert message
-
-                            try:
-                                member1, member2 = self._database.execute(u"SELECT member1, member2 FROM double_signed_sync WHERE sync = ?", (packet_id,)).next()
-                            except StopIteration:
-                                raise ValueError("found double signed message without an entry in the double_signed_sync table")
-
-                            if not member1 < member2:
-                                raise ValueError("member1 (", member1, ") must always be smaller than member2 (", member2, ")")
-
-                            if not (member1 == member_id or member2 == member_id):
-                                raise ValueError("member1 (", member1, ") or member2 (", member2, ") must be the message creator (", member_id, ")")
-
-                        self._logger.debug("LastSyncDistribution for %s is OK", meta.name)
-
-        self._logger.debug("%s success", community.cid.encode("HEX"))
+        SanityCheck(self, community, test_identity, test_undo_other, test_binary, test_sequence_number, test_last_sync,
+                    raise_on_failure=True).run()
 
     def _flush_database(self):
         """
@@ -2067,24 +2082,40 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         """
         try:
             # flush changes to disk every 1 minutes
+            begin = time()
             self._database.commit()
+            self._instrumentation.add(u"commit", time() - begin)
 
         except Exception as exception:
             # OperationalError: database is locked
             self._logger.exception("%s", exception)
 
+    @property
+    def startup_times(self):
+        """
+        The (phase, seconds) pairs measured during the last start, in the order that the phases
+        finished.  When the DiscoveryCommunity is loaded after start returns, its u"discovery"
+        phase is added once it is loaded.
+        """
+        return self._startup_times
+
     # TODO(emilon): Shouldn't start() just raise an exception if something goes wrong?, that would clean up a lot of cruft
     @blocking_call_on_reactor_thread
-    def start(self, autoload_discovery=True):
+    def start(self, autoload_discovery=True, fast_start=False):
         """
         Starts Dispersy.
 
         1. opens database
         2. opens endpoint
         3. loads the DiscoveryCommunity
+
+        When FAST_START is True the DiscoveryCommunity reuses the member that it used before, rather
+        than generating a new key, and it is loaded, and starts resolving its bootstrap addresses,
+        after start returns, i.e. once the endpoint is already serving packets.
         """
 
         assert isInIOThread()
+        assert isinstance(fast_start, bool), type(fast_start)
 
         if self.running:
             raise RuntimeError("Dispersy is already running")
@@ -2092,18 +2123,28 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         # start
         self._logger.info("starting the Dispersy core...")
         results = []
+        self._startup_times = []
 
         assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
 
+        begin = time()
         results.append((u"database", self._database.open()))
         assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
+        # the database may have changed, i.e. a new :memory: database
+        self._load_meta_message_rows()
+        self._startup_times.append((u"database", time() - begin))
 
+        begin = time()
         results.append((u"endpoint", self._endpoint.open(self)))
         assert all(isinstance(result, bool) for _, result in results), [type(result) for _, result in results]
         self._endpoint_ready()
+        self._startup_times.append((u"endpoint", time() - begin))
 
         # commit changes to the database periodically
         self.register_task("flush_database", LoopingCall(self._flush_database)).start(FLUSH_DATABASE_INTERVAL)
+        # measure the reactor lag
+        if self._instrumentation.enabled:
+            self._start_instrumentation_heartbeat()
         # output candidate statistics
         self.register_task("candidates",
                            LoopingCall(self._stats_detailed_candidates)).start(STATS_DETAILED_CANDIDATES_INTERVAL)
@@ -2115,11 +2156,12 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
             self.running = True
 
             if autoload_discovery:
-                # Load DiscoveryCommunity
-                self._logger.info("Dispersy core loading DiscoveryCommunity")
-
-                # TODO: pass None instead of new member, let community decide if we need a new member or not.
-                self._discovery_community = self.define_auto_load(DiscoveryCommunity, self.get_new_member(), load=True)[0]
+                if fast_start:
+                    self.register_task("load_discovery_community", reactor.callLater(0, self._load_discovery_community, True))
+                else:
+                    self._load_discovery_community(False)
+            else:
+                self._log_startup_times()
             return True
 
         else:
@@ -2127,6 +2169,38 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                          ", ".join("{0}:{1}".format(key, value) for key, value in results))
             return False
 
+    def _load_discovery_community(self, reuse_member):
+        """
+        Loads the DiscoveryCommunity.  When REUSE_MEMBER is True, and the DiscoveryCommunity was
+        loaded before, the member that it used is loaded from the database rather than generating a
+        new one.
+        """
+        self._logger.info("Dispersy core loading DiscoveryCommunity")
+        begin = time()
+
+        my_member = None
+        if reuse_member:
+            master, = DiscoveryCommunity.get_master_members(self)
+            try:
+                private_key, = self._database.execute(u"SELECT member.private_key FROM community JOIN member ON member.id = community.member WHERE community.master = ?",
+                                                      (master.database_id,)).next()
+            except StopIteration:
+                pass
+            else:
+                if private_key:
+                    my_member = self.get_member(private_key=str(private_key))
+
+        # TODO: pass None instead of new member, let community decide if we need a new member or not.
+        self._discovery_community = self.define_auto_load(DiscoveryCommunity, my_member or self.get_new_member(), load=True)[0]
+
+        self._startup_times.append((u"discovery", time() - begin))
+        self._log_startup_times()
+
+    def _log_startup_times(self):
+        self._logger.info("Dispersy startup took %.3fs (%s)",
+                          sum(seconds for _, seconds in self._startup_times),
+                          ", ".join("%s: %.3fs" % (phase, seconds) for phase, seconds in self._startup_times))
+
     @blocking_call_on_reactor_thread
     def stop(self, timeout=10.0):
         """
@@ -2153,6 +2227,10 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         self.running = False
 
         self.cancel_all_pending_tasks()
+        self._instrumentation.stop()
+        self._walk_scheduler.stop()
+        self._pending_communities.clear()
+        self._pending_packet_counts.clear()
 
         def unload_communities(communities):
             for community in communities:
@@ -2193,7 +2271,9 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
         # stop endpoint
         results[u"endpoint"] = maybeDeferred(self._endpoint.close, timeout)
 
-        # stop the database
+        # stop the database, the read-only connections are closed in a thread as they may still be
+        # selecting packets
+        results[u"database readers"] = deferToThread(self._database_readers.stop)
         results[u"database"] = maybeDeferred(self._database.close)
 
         def check_stop_status(return_values):
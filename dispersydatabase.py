@@ -12,7 +12,26 @@ from .database import Database
 from .distribution import FullSyncDistribution
 
 
-LATEST_VERSION = 21
+LATEST_VERSION = 24
+
+# sync.bucket stores global_time % SYNC_BUCKETS.  2520 is the least common multiple of 1 to 10, its
+# many divisors allow most modulo sync slices to be selected using the sync.bucket index
+SYNC_BUCKETS = 2520
+_SYNC_BUCKETS_DIVISORS = [divisor for divisor in xrange(1, SYNC_BUCKETS + 1) if SYNC_BUCKETS % divisor == 0]
+
+# the smallest modulo that is selected using sync.bucket.  for smaller moduli the slice contains so
+# many rows that scanning sync_meta_message_undone_global_time_index is as fast.  measured on 50000
+# rows per meta message: selecting all rows of a slice using the bucket index is faster from modulo
+# 6 onwards, while the sync response, which reads the first rows in global time order, only gains
+# from modulo 105 onwards since the bucket index returns the rows out of order
+SYNC_BUCKETS_MIN_MODULO = 6
+SYNC_BUCKETS_MIN_ORDERED_MODULO = 105
+
+# the buckets of a slice are generated by SQLite, hence the statement is the same for every offset
+# and modulo and remains in the statement cache
+_SYNC_BUCKETS_CLAUSE = (u"sync.bucket IN (WITH RECURSIVE modulo_bucket(bucket) AS "
+                        u"(SELECT ? UNION ALL SELECT bucket + ? FROM modulo_bucket WHERE bucket + ? < %d) "
+                        u"SELECT bucket FROM modulo_bucket)" % SYNC_BUCKETS)
 
 schema = u"""
 CREATE TABLE member(
@@ -59,15 +78,68 @@ CREATE TABLE sync(
  undone INTEGER DEFAULT 0,
  packet BLOB,
  sequence INTEGER,
+ bucket INTEGER,                                        -- global_time % SYNC_BUCKETS
  UNIQUE(community, member, global_time));
 CREATE INDEX sync_meta_message_undone_global_time_index ON sync(meta_message, undone, global_time);
-CREATE INDEX sync_meta_message_member ON sync(meta_message, member);
+CREATE INDEX sync_meta_message_member_sequence ON sync(meta_message, member, sequence);
+CREATE INDEX sync_meta_message_undone_bucket_global_time_index ON sync(meta_message, undone, bucket, global_time);
+
+CREATE TABLE undo(
+ community INTEGER REFERENCES community(id),
+ member INTEGER REFERENCES member(id),                  -- the creator of the undone message
+ global_time INTEGER,                                   -- the global time of the undone message
+ sync INTEGER REFERENCES sync(id),                      -- the dispersy-undo-own or dispersy-undo-other message
+ UNIQUE(community, member, global_time, sync));
 
 CREATE TABLE option(key TEXT PRIMARY KEY, value BLOB);
 INSERT INTO option(key, value) VALUES('database_version', '""" + str(LATEST_VERSION) + """');
 """
 
 
+def get_sync_modulo(modulo):
+    """
+    Returns the smallest divisor of SYNC_BUCKETS that is at least MODULO, or MODULO itself when it
+    is larger than SYNC_BUCKETS.
+    """
+    assert isinstance(modulo, (int, long)), type(modulo)
+    assert modulo > 0, modulo
+    for divisor in _SYNC_BUCKETS_DIVISORS:
+        if divisor >= modulo:
+            return divisor
+    return modulo
+
+
+def is_sync_bucket_modulo(modulo, ordered=False):
+    """
+    Returns True when the rows of a MODULO slice should be selected using sync.bucket.
+
+    ORDERED must be True when the rows are read in global time order and the reader may stop
+    early, see SYNC_BUCKETS_MIN_ORDERED_MODULO.
+    """
+    return modulo >= (SYNC_BUCKETS_MIN_ORDERED_MODULO if ordered else SYNC_BUCKETS_MIN_MODULO) and SYNC_BUCKETS % modulo == 0
+
+
+def get_sync_modulo_clause(offset, modulo, ordered=False):
+    """
+    Returns an SQL expression, and its bindings, that selects the sync rows where
+    (global_time + OFFSET) % MODULO == 0.
+
+    When is_sync_bucket_modulo(MODULO, ORDERED) the expression only uses sync.bucket, allowing
+    the rows to be found using the sync_meta_message_undone_bucket_global_time_index.
+    """
+    assert isinstance(offset, (int, long)), type(offset)
+    assert isinstance(modulo, (int, long)), type(modulo)
+    assert modulo > 0, modulo
+    if modulo == 1:
+        return u"1", ()
+
+    if is_sync_bucket_modulo(modulo, ordered):
+        # global_time % MODULO == bucket % MODULO because MODULO is a divisor of SYNC_BUCKETS
+        return _SYNC_BUCKETS_CLAUSE, (-offset % modulo, modulo, modulo)
+
+    return u"(sync.global_time + ?) % ? = 0", (offset, modulo)
+
+
 class DispersyDatabase(Database):
     if __debug__:
         __doc__ = schema
@@ -491,10 +563,61 @@ UPDATE option SET value = '21' WHERE key = 'database_version';""")
                 self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
 
             new_db_version = 22
+            if database_version < new_db_version:
+                # add the undo table that maps an undone message to its dispersy-undo-own and
+                # dispersy-undo-other messages.  existing databases only know the undo message
+                # that sync.undone points to, duplicate undo messages received before the upgrade
+                # are not indexed
+                self._logger.debug("upgrade database %d -> %d", database_version, new_db_version)
+                self.executescript(u"""
+CREATE TABLE undo(
+ community INTEGER REFERENCES community(id),
+ member INTEGER REFERENCES member(id),                  -- the creator of the undone message
+ global_time INTEGER,                                   -- the global time of the undone message
+ sync INTEGER REFERENCES sync(id),                      -- the dispersy-undo-own or dispersy-undo-other message
+ UNIQUE(community, member, global_time, sync));
+
+INSERT INTO undo(community, member, global_time, sync)
+  SELECT target.community, target.member, target.global_time, target.undone FROM sync AS target
+  JOIN sync AS undo_sync ON undo_sync.id = target.undone
+  JOIN meta_message ON meta_message.id = undo_sync.meta_message
+  WHERE target.undone > 0 AND meta_message.name IN ('dispersy-undo-own', 'dispersy-undo-other');
+
+UPDATE option SET value = '22' WHERE key = 'database_version';""")
+                self.commit()
+                self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
+
+            new_db_version = 23
+            if database_version < new_db_version:
+                # on_missing_sequence selects the packets of one member and meta message ordered by
+                # sequence number.  the new index replaces sync_meta_message_member, which is a
+                # prefix of it
+                self._logger.debug("upgrade database %d -> %d", database_version, new_db_version)
+                self.executescript(u"""
+DROP INDEX IF EXISTS sync_meta_message_member;
+CREATE INDEX sync_meta_message_member_sequence ON sync(meta_message, member, sequence);
+UPDATE option SET value = '23' WHERE key = 'database_version';""")
+                self.commit()
+                self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
+
+            new_db_version = 24
+            if database_version < new_db_version:
+                # add the bucket column, allowing modulo sync slices to be selected using an index
+                # rather than evaluating (global_time + offset) % modulo for every row
+                self._logger.debug("upgrade database %d -> %d", database_version, new_db_version)
+                self.executescript(u"""
+ALTER TABLE sync ADD COLUMN bucket INTEGER;
+UPDATE sync SET bucket = global_time %% %d;
+CREATE INDEX sync_meta_message_undone_bucket_global_time_index ON sync(meta_message, undone, bucket, global_time);
+UPDATE option SET value = '24' WHERE key = 'database_version';""" % SYNC_BUCKETS)
+                self.commit()
+                self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
+
+            new_db_version = 25
             if database_version < new_db_version:
                 # there is no version new_db_version yet...
                 # self._logger.debug("upgrade database %d -> %d", database_version, new_db_version)
-                # self.executescript(u"""UPDATE option SET value = '22' WHERE key = 'database_version';""")
+                # self.executescript(u"""UPDATE option SET value = '25' WHERE key = 'database_version';""")
                 # self.commit()
                 # self._logger.debug("upgrade database %d -> %d (done)", database_version, new_db_version)
                 pass
@@ -23,6 +23,7 @@ class Pruning(MetaObject):
     class Implementation(MetaObject.Implementation):
 
         __metaclass__ = ABCMeta
+        __slots__ = ["_distribution"]
 
         def __init__(self, meta, distribution):
             assert isinstance(distribution, SyncDistribution.Implementation), type(distribution)
@@ -54,6 +55,7 @@ class Pruning(MetaObject):
 class NoPruning(Pruning):
 
     class Implementation(Pruning.Implementation):
+        __slots__ = []
 
         def is_active(self):
             return True
@@ -68,6 +70,7 @@ class NoPruning(Pruning):
 class GlobalTimePruning(Pruning):
 
     class Implementation(Pruning.Implementation):
+        __slots__ = []
 
         @property
         def inactive_threshold(self):
@@ -117,6 +120,7 @@ class GlobalTimePruning(Pruning):
 class Distribution(MetaObject):
 
     class Implementation(MetaObject.Implementation):
+        __slots__ = ["_global_time"]
 
         def __init__(self, meta, global_time):
             assert isinstance(meta, Distribution)
@@ -154,6 +158,7 @@ class SyncDistribution(Distribution):
     """
 
     class Implementation(Distribution.Implementation):
+        __slots__ = ["_pruning"]
 
         def __init__(self, meta, global_time):
             super(SyncDistribution.Implementation, self).__init__(meta, global_time)
@@ -258,6 +263,7 @@ class FullSyncDistribution(SyncDistribution):
     is not currently, and my never be, implemented.
     """
     class Implementation(SyncDistribution.Implementation):
+        __slots__ = ["_sequence_number"]
 
         def __init__(self, meta, global_time, sequence_number=0):
             assert isinstance(sequence_number, (int, long))
@@ -291,6 +297,7 @@ class FullSyncDistribution(SyncDistribution):
 class LastSyncDistribution(SyncDistribution):
 
     class Implementation(SyncDistribution.Implementation):
+        __slots__ = []
 
         @property
         def history_size(self):
@@ -316,10 +323,10 @@ class LastSyncDistribution(SyncDistribution):
 class DirectDistribution(Distribution):
 
     class Implementation(Distribution.Implementation):
-        pass
+        __slots__ = []
 
 
 class RelayDistribution(Distribution):
 
     class Implementation(Distribution.Implementation):
-        pass
+        __slots__ = []
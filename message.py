@@ -219,17 +219,26 @@ class DropMessage(Exception):
 #
 class BatchConfiguration(object):
 
-    def __init__(self, max_window=0.0):
+    def __init__(self, max_window=0.0, adaptive=False, max_duration=0.05):
         """
         Per meta message configuration on batch handling.
 
         MAX_WINDOW sets the maximum size, in seconds, of the window.  A larger window results in
         larger batches and a longer average delay for incoming messages.  Setting MAX_WINDOW to zero
         disables batching, in this case all other parameters are ignored.
+
+        When ADAPTIVE is True the window is chosen, up to MAX_WINDOW, from the observed arrival rate
+        and processing cost of the messages.  A batch is processed as soon as processing it is
+        expected to take MAX_DURATION seconds.  See BatchWindow.
         """
         assert isinstance(max_window, float), type(max_window)
         assert 0.0 <= max_window, max_window
+        assert isinstance(adaptive, bool), type(adaptive)
+        assert isinstance(max_duration, float), type(max_duration)
+        assert 0.0 < max_duration, max_duration
         self._max_window = max_window
+        self._adaptive = adaptive
+        self._max_duration = max_duration
 
     @property
     def enabled(self):
@@ -240,11 +249,117 @@ class BatchConfiguration(object):
     def max_window(self):
         return self._max_window
 
+    @property
+    def adaptive(self):
+        return self._adaptive
+
+    @property
+    def max_duration(self):
+        return self._max_duration
+
+
+class BatchWindow(object):
+
+    """
+    The window and maximum size of the batches of one meta message, chosen from the observed load.
+
+    The arrival rate and the processing cost per message are exponential moving averages.  When
+    fewer than MIN_BATCH_SIZE messages are expected to arrive within the maximum window, batching
+    only adds latency and the window is zero.  Otherwise the window is the time needed to receive
+    one full batch, where a full batch is expected to take max_duration seconds to process.
+    """
+
+    __slots__ = ["_configuration", "_last_arrival", "_interval", "_cost", "_window", "_max_size"]
+
+    # weight of the newest observation in the moving averages
+    SMOOTHING = 0.2
+    MIN_BATCH_SIZE = 2
+
+    def __init__(self, configuration):
+        assert isinstance(configuration, BatchConfiguration), type(configuration)
+        assert configuration.adaptive
+        super(BatchWindow, self).__init__()
+        self._configuration = configuration
+        self._last_arrival = 0.0
+        # average seconds between two messages, and seconds needed to process one message
+        self._interval = 0.0
+        self._cost = 0.0
+        # until the load is known the configured window is used
+        self._window = configuration.max_window
+        self._max_size = 0
+
+    @property
+    def window(self):
+        """
+        The number of seconds to wait before processing a new batch, zero when the messages should
+        be processed immediately.
+        """
+        return self._window
+
+    @property
+    def max_size(self):
+        """
+        The number of messages after which a batch is processed, zero when unbounded.
+        """
+        return self._max_size
+
+    @property
+    def arrival_rate(self):
+        """
+        The average number of messages per second.
+        """
+        return 1.0 / self._interval if self._interval else 0.0
+
+    @property
+    def cost(self):
+        """
+        The average number of seconds needed to process one message.
+        """
+        return self._cost
+
+    def _smooth(self, average, value):
+        return value if average == 0.0 else average + self.SMOOTHING * (value - average)
+
+    def arrived(self, count, timestamp):
+        """
+        COUNT messages arrived at TIMESTAMP.
+        """
+        assert isinstance(count, int), type(count)
+        assert 0 < count, count
+        assert isinstance(timestamp, float), type(timestamp)
+        if self._last_arrival:
+            self._interval = self._smooth(self._interval, max(0.0, timestamp - self._last_arrival) / count)
+            self._update()
+        self._last_arrival = timestamp
+
+    def processed(self, count, duration):
+        """
+        Processing COUNT messages took DURATION seconds.
+        """
+        assert isinstance(count, int), type(count)
+        assert 0 < count, count
+        assert isinstance(duration, float), type(duration)
+        self._cost = self._smooth(self._cost, duration / count)
+        self._update()
+
+    def _update(self):
+        if self._cost:
+            self._max_size = max(self.MIN_BATCH_SIZE, int(self._configuration.max_duration / self._cost))
+
+        max_window = self._configuration.max_window
+        if self._interval * self.MIN_BATCH_SIZE > max_window:
+            self._window = 0.0
+        elif self._max_size:
+            self._window = min(max_window, self._interval * self._max_size)
+        else:
+            self._window = max_window
+
 
 #
 # packet
 #
 class Packet(MetaObject.Implementation):
+    __slots__ = ["_packet", "_packet_id"]
 
     def __init__(self, meta, packet, packet_id):
         assert isinstance(packet, str), type(packet)
@@ -317,6 +432,8 @@ class Packet(MetaObject.Implementation):
 class Message(MetaObject):
 
     class Implementation(Packet):
+        __slots__ = ["_authentication", "_resolution", "_distribution", "_destination", "_payload", "_candidate",
+                     "_source", "_resume", "_conversion", "_undone"]
 
         def __init__(self, meta, authentication, resolution, distribution, destination, payload, conversion=None, candidate=None, source=u"unknown", packet="", packet_id=0, sign=True):
             from .conversion import Conversion
@@ -338,11 +455,13 @@ class Message(MetaObject):
             self._payload = payload
             self._candidate = candidate
             self._source = source
-            self._logger = logging.getLogger(self.__class__.__name__)
 
             # _RESUME contains the message that caused SELF to be processed after it was delayed
             self._resume = None
 
+            # _UNDONE contains the sync.undone value when SELF was loaded from the database
+            self._undone = 0
+
             # allow setup parts.  used to setup callback when something changes that requires the
             # self._packet to be generated again
             self._authentication.setup(self)
@@ -366,7 +485,7 @@ class Message(MetaObject):
                         self._conversion.decode_message(LoopbackCandidate(), self._packet, verify=sign, allow_empty_signature=True)
                     except DropPacket:
                         from binascii import hexlify
-                        self._logger.error("Could not decode message created by me, hex '%s'", hexlify(self._packet))
+                        logging.getLogger(self.__class__.__name__).error("Could not decode message created by me, hex '%s'", hexlify(self._packet))
                         raise
 
         @property
@@ -410,6 +529,15 @@ class Message(MetaObject):
             assert isinstance(message, Message.Implementation), type(message)
             self._resume = message
 
+        @property
+        def undone(self):
+            return self._undone
+
+        @undone.setter
+        def undone(self, undone):
+            assert isinstance(undone, (int, long)), type(undone)
+            self._undone = undone
+
         def load_message(self):
             return self
 
@@ -6,6 +6,10 @@ class MetaObject(object):
 
     class Implementation(object):
 
+        # implementations are created for every message that is created or received, hence every
+        # Implementation subclass defines __slots__ to avoid a per instance __dict__
+        __slots__ = ["_meta"]
+
         def __init__(self, meta):
             assert isinstance(meta, MetaObject), type(meta)
             self._meta = meta
@@ -15,7 +15,7 @@ if __debug__:
 class Payload(MetaObject):
 
     class Implementation(MetaObject.Implementation):
-        pass
+        __slots__ = []
 
     def setup(self, message):
         """
@@ -31,6 +31,8 @@ class Payload(MetaObject):
 class IntroductionRequestPayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_destination_address", "_source_lan_address", "_source_wan_address", "_advice", "_connection_type",
+                     "_identifier", "_time_low", "_time_high", "_modulo", "_offset", "_bloom_filter"]
 
         def __init__(self, meta, destination_address, source_lan_address, source_wan_address, advice, connection_type, sync, identifier):
             """
@@ -156,6 +158,8 @@ class IntroductionRequestPayload(Payload):
 class IntroductionResponsePayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_destination_address", "_source_lan_address", "_source_wan_address", "_lan_introduction_address",
+                     "_wan_introduction_address", "_connection_type", "_tunnel", "_identifier"]
 
         def __init__(self, meta, destination_address, source_lan_address, source_wan_address, lan_introduction_address, wan_introduction_address, connection_type, tunnel, identifier):
             """
@@ -248,6 +252,7 @@ class IntroductionResponsePayload(Payload):
 class PunctureRequestPayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_lan_walker_address", "_wan_walker_address", "_identifier"]
 
         def __init__(self, meta, lan_walker_address, wan_walker_address, identifier):
             """
@@ -292,6 +297,7 @@ class PunctureRequestPayload(Payload):
 class PuncturePayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_source_lan_address", "_source_wan_address", "_identifier"]
 
         def __init__(self, meta, source_lan_address, source_wan_address, identifier):
             """
@@ -331,6 +337,7 @@ class PuncturePayload(Payload):
 class AuthorizePayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_permission_triplets"]
 
         def __init__(self, meta, permission_triplets):
             """
@@ -365,6 +372,7 @@ class AuthorizePayload(Payload):
 class RevokePayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_permission_triplets"]
 
         def __init__(self, meta, permission_triplets):
             """
@@ -398,6 +406,7 @@ class RevokePayload(Payload):
 class UndoPayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_member", "_global_time", "_packet", "_process_undo"]
 
         def __init__(self, meta, member, global_time, packet=None):
             from .member import Member
@@ -442,6 +451,7 @@ class UndoPayload(Payload):
 class MissingSequencePayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_member", "_message", "_missing_low", "_missing_high"]
 
         def __init__(self, meta, member, message, missing_low, missing_high):
             """
@@ -482,6 +492,7 @@ class MissingSequencePayload(Payload):
 class SignaturePayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_identifier", "_message"]
 
         def __init__(self, meta, identifier, message):
             from .message import Message
@@ -504,24 +515,25 @@ class SignaturePayload(Payload):
 class SignatureRequestPayload(SignaturePayload):
 
     class Implementation(SignaturePayload.Implementation):
-        pass
+        __slots__ = []
 
 
 class SignatureResponsePayload(SignaturePayload):
 
     class Implementation(SignaturePayload.Implementation):
-        pass
+        __slots__ = []
 
 
 class IdentityPayload(Payload):
 
     class Implementation(Payload.Implementation):
-        pass
+        __slots__ = []
 
 
 class MissingIdentityPayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_mid"]
 
         def __init__(self, meta, mid):
             assert isinstance(mid, str)
@@ -537,6 +549,7 @@ class MissingIdentityPayload(Payload):
 class DestroyCommunityPayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_degree"]
 
         def __init__(self, meta, degree):
             assert isinstance(degree, unicode)
@@ -560,6 +573,7 @@ class DestroyCommunityPayload(Payload):
 class MissingMessagePayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_member", "_global_times"]
 
         def __init__(self, meta, member, global_times):
             from .member import Member
@@ -585,6 +599,7 @@ class MissingMessagePayload(Payload):
 class MissingLastMessagePayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_member", "_message", "_count"]
 
         def __init__(self, meta, member, message, count):
             from .member import Member
@@ -610,6 +625,7 @@ class MissingLastMessagePayload(Payload):
 class MissingProofPayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_member", "_global_time"]
 
         def __init__(self, meta, member, global_time):
             from .member import Member
@@ -632,6 +648,7 @@ class MissingProofPayload(Payload):
 class DynamicSettingsPayload(Payload):
 
     class Implementation(Payload.Implementation):
+        __slots__ = ["_policies"]
 
         def __init__(self, meta, policies):
             """
@@ -0,0 +1,391 @@
+"""
+Incremental sanity check of the database content of a community.
+
+A SanityCheck consists of a list of steps.  Every step processes at most CHUNK_SIZE rows per call
+and returns a cursor that tells where the next call continues.  The name of the current step, its
+cursor, and the findings so far are stored in the option table, allowing a check that runs in the
+background to resume after a restart.  Dispersy.sanity_check runs all steps at once and raises a
+ValueError on the first finding.
+"""
+import json
+import logging
+
+from .authentication import MemberAuthentication, DoubleMemberAuthentication
+from .distribution import FullSyncDistribution, LastSyncDistribution
+from .exception import MetaNotFoundException
+
+
+class SanityCheck(object):
+
+    def __init__(self, dispersy, community, test_identity=True, test_undo_other=True, test_binary=False,
+                 test_sequence_number=True, test_last_sync=True, raise_on_failure=False):
+        """
+        Check everything we can about COMMUNITY.
+
+        Note that messages that are disabled, i.e. not included in community.get_meta_messages(),
+        will NOT be checked.
+
+        - the dispersy-identity for my member must be in the database
+        - the dispersy-identity must be in the database for each member that has one or more messages in the database
+        - all packets in the database must be valid
+        - check sequence numbers for FullSyncDistribution
+        - check history size for LastSyncDistribution
+
+        When RAISE_ON_FAILURE is True a ValueError is raised for the first finding, otherwise all
+        findings are collected in self.findings.
+        """
+        super(SanityCheck, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._dispersy = dispersy
+        self._database = dispersy.database
+        self._community = community
+        self._raise_on_failure = raise_on_failure
+        self._enabled_messages = set(meta.database_id for meta in community.get_meta_messages())
+
+        # every step is a (name, check, cursor_length) tuple
+        metas = sorted(community.get_meta_messages(), key=lambda meta: meta.name)
+        self._steps = []
+        if test_identity:
+            self._steps.append((u"identity", self._check_identity, 1))
+        if test_undo_other:
+            self._steps.append((u"undo-other", self._check_undo_other, 1))
+        if test_binary:
+            self._steps.append((u"binary", self._check_binary, 1))
+        if test_sequence_number:
+            self._steps.extend((u"sequence-number %s" % meta.name, self._make_check(self._check_sequence_number, meta), 2)
+                               for meta in metas
+                               if isinstance(meta.distribution, FullSyncDistribution) and meta.distribution.enable_sequence_number)
+        if test_last_sync:
+            self._steps.extend((u"last-sync %s" % meta.name, self._make_check(self._check_last_sync, meta), 2)
+                               for meta in metas
+                               if isinstance(meta.distribution, LastSyncDistribution) and not meta.distribution.custom_callback)
+
+        self.chunk_size = 1000
+        self.findings = []
+        self.rows_checked = 0
+        self._step = 0
+        self._cursor = ()
+
+    @staticmethod
+    def _make_check(check, meta):
+        return lambda cursor, limit: check(meta, cursor, limit)
+
+    @property
+    def option_key(self):
+        return u"sanity-check %s" % self._community.cid.encode("HEX")
+
+    @property
+    def steps(self):
+        return [name for name, _, _ in self._steps]
+
+    @property
+    def current_step(self):
+        return self._steps[self._step][0] if self._step < len(self._steps) else None
+
+    @property
+    def done(self):
+        return self._step >= len(self._steps)
+
+    def get_progress(self):
+        """
+        Returns a dictionary describing the progress and findings of this check.
+        """
+        return {u"step": self.current_step,
+                u"steps_done": self._step,
+                u"steps_total": len(self._steps),
+                u"rows_checked": self.rows_checked,
+                u"findings": list(self.findings),
+                u"done": self.done}
+
+    def load(self):
+        """
+        Continue from the step, cursor, and findings stored in the database, if any.
+
+        The step is found by name since the steps change when meta messages are added or removed.
+        When the stored step no longer exists the check starts from the beginning, when its cursor
+        does not fit the step, the step starts from the beginning.
+        """
+        try:
+            value, = self._database.execute(u"SELECT value FROM option WHERE key = ?", (self.option_key,)).next()
+            state = json.loads(value)
+            name = state[u"step"]
+            cursor = tuple(state[u"cursor"])
+            findings = [tuple(finding) for finding in state[u"findings"]]
+        except (StopIteration, ValueError, TypeError, KeyError):
+            return False
+
+        for index, (step_name, _, cursor_length) in enumerate(self._steps):
+            if step_name == name:
+                if not (len(cursor) == cursor_length and all(isinstance(value, (int, long)) for value in cursor)):
+                    self._logger.warning("restarting sanity check step %s, invalid cursor %s", name, cursor)
+                    cursor = ()
+                self._step = index
+                self._cursor = cursor
+                self.findings = findings
+                self._logger.debug("resuming sanity check at %s %s", self.current_step, self._cursor)
+                return True
+
+        self._logger.warning("restarting sanity check, unknown step %s", name)
+        return False
+
+    def save(self):
+        """
+        Store the current step, cursor, and findings in the database, or remove them once the check
+        is done.
+        """
+        if self.done:
+            self._database.execute(u"DELETE FROM option WHERE key = ?", (self.option_key,))
+        else:
+            value = json.dumps({u"step": self.current_step, u"cursor": self._cursor, u"findings": self.findings})
+            self._database.execute(u"INSERT OR REPLACE INTO option (key, value) VALUES (?, ?)", (self.option_key, value.decode("UTF-8")))
+
+    def step(self):
+        """
+        Check at most chunk_size rows.  Returns False when the check is done.
+        """
+        if self.done:
+            return False
+
+        name, check, _ = self._steps[self._step]
+        rows, cursor = check(self._cursor, self.chunk_size)
+        self.rows_checked += rows
+        if cursor is None:
+            self._logger.debug("%s %s is OK", self._community.cid.encode("HEX"), name)
+            self._step += 1
+            self._cursor = ()
+        else:
+            self._cursor = cursor
+        return not self.done
+
+    def run(self):
+        """
+        Run all remaining steps at once.
+        """
+        while self.step():
+            pass
+        self._logger.debug("%s success", self._community.cid.encode("HEX"))
+
+    def _fail(self, *args):
+        if self._raise_on_failure:
+            raise ValueError(*args)
+        finding = u" ".join(unicode(arg) for arg in args)
+        self._logger.error("%s sanity check %s: %s", self._community.cid.encode("HEX"), self.current_step, finding)
+        self.findings.append((self.current_step, finding))
+
+    def _check_identity(self, cursor, limit):
+        community = self._community
+        try:
+            meta_identity = community.get_meta_message(u"dispersy-identity")
+        except MetaNotFoundException:
+            # identity is not enabled
+            return 0, None
+
+        if not cursor:
+            # ensure that the dispersy-identity for my member must be in the database
+            try:
+                member_id, = self._database.execute(u"SELECT id FROM member WHERE mid = ?", (buffer(community.my_member.mid),)).next()
+            except StopIteration:
+                self._fail("unable to find the public key for my member")
+                return 0, None
+
+            if not member_id == community.my_member.database_id:
+                self._fail("my member's database id is invalid", member_id, community.my_member.database_id)
+
+            try:
+                self._database.execute(u"SELECT 1 FROM member WHERE id = ? AND private_key IS NOT NULL", (member_id,)).next()
+            except StopIteration:
+                self._fail("unable to find the private key for my member")
+
+            try:
+                self._database.execute(u"SELECT 1 FROM sync WHERE member = ? AND meta_message = ?", (member_id, meta_identity.database_id)).next()
+            except StopIteration:
+                self._fail("unable to find the dispersy-identity message for my member")
+
+            self._logger.debug("my identity is OK")
+            cursor = (0,)
+
+        #
+        # the dispersy-identity must be in the database for each member that has one or more
+        # messages in the database
+        #
+        members = [member_id for member_id, in self._database.execute(
+            u"SELECT DISTINCT member FROM sync WHERE community = ? AND member > ? ORDER BY member LIMIT ?",
+            (community.database_id, cursor[0], limit))]
+        if not members:
+            return 0, None
+
+        identities = set(member_id for member_id, in self._database.execute(
+            u"SELECT member FROM sync WHERE meta_message = ? AND member IN (%s)" % ", ".join("?" * len(members)),
+            [meta_identity.database_id] + members))
+        missing = [member_id for member_id in members if not member_id in identities]
+        if missing:
+            self._fail("inconsistent dispersy-identity messages.", missing)
+        return len(members), (members[-1],)
+
+    def _check_undo_other(self, cursor, limit):
+        community = self._community
+        convert_packet_to_message = self._dispersy.convert_packet_to_message
+        try:
+            meta_undo_other = community.get_meta_message(u"dispersy-undo-other")
+        except MetaNotFoundException:
+            # undo-other is not enabled
+            return 0, None
+
+        rows = list(self._database.execute(u"SELECT id, global_time, packet FROM sync WHERE community = ? AND meta_message = ? AND id > ? ORDER BY id LIMIT ?",
+                                           (community.database_id, meta_undo_other.database_id, cursor[0] if cursor else 0, limit)))
+
+        # TODO we are not taking into account that undo messages can be undone
+        for undo_packet_id, undo_packet_global_time, undo_packet in rows:
+            undo_message = convert_packet_to_message(str(undo_packet), community, verify=False)
+
+            # 10/10/12 Boudewijn: the check_callback is required to obtain the
+            # message.payload.packet
+            for _ in undo_message.check_callback([undo_message]):
+                pass
+
+            # get the message that undo_message refers to
+            try:
+                packet, undone = self._database.execute(u"SELECT packet, undone FROM sync WHERE community = ? AND member = ? AND global_time = ?",
+                                                        (community.database_id, undo_message.payload.member.database_id, undo_message.payload.global_time)).next()
+            except StopIteration:
+                self._fail("found dispersy-undo-other but not the message that it refers to", undo_packet_id)
+                continue
+            message = convert_packet_to_message(str(packet), community, verify=False)
+
+            if not undone:
+                self._fail("found dispersy-undo-other but the message that it refers to is not undone", undo_packet_id)
+
+            if message.undo_callback is None:
+                self._fail("found dispersy-undo-other but the message that it refers to does not have an undo_callback", undo_packet_id)
+
+            # get the proof that undo_message is valid
+            allowed, proofs = community.timeline.check(undo_message)
+
+            if not allowed:
+                self._fail("found dispersy-undo-other that, according to the timeline, is not allowed", undo_packet_id)
+
+            elif not proofs:
+                self._fail("found dispersy-undo-other that, according to the timeline, has no proof", undo_packet_id)
+
+            self._logger.debug("dispersy-undo-other packet %d@%d referring %s %d@%d is checked",
+                               undo_packet_id, undo_packet_global_time,
+                               undo_message.payload.packet.name,
+                               undo_message.payload.member.database_id,
+                               undo_message.payload.global_time)
+
+        return len(rows), (rows[-1][0],) if rows else None
+
+    def _check_binary(self, cursor, limit):
+        #
+        # ensure all packets in the database are valid and that the binary packets are consistent
+        # with the information stored in the database
+        #
+        community = self._community
+        rows = list(self._database.execute(u"SELECT id, member, global_time, meta_message, packet FROM sync WHERE community = ? AND id > ? ORDER BY id LIMIT ?",
+                                           (community.database_id, cursor[0] if cursor else 0, limit)))
+        for packet_id, member_id, global_time, meta_message_id, packet in rows:
+            if meta_message_id in self._enabled_messages:
+                packet = str(packet)
+                message = self._dispersy.convert_packet_to_message(packet, community, verify=True)
+
+                if not message:
+                    self._fail("unable to convert packet ", packet_id, "@", global_time, " to message")
+                    continue
+
+                if not member_id == message.authentication.member.database_id:
+                    self._fail("inconsistent member in packet ", packet_id, "@", global_time)
+
+                if not message.authentication.member.public_key:
+                    self._fail("missing public key for member ", member_id, " in packet ", packet_id, "@", global_time)
+
+                if not global_time == message.distribution.global_time:
+                    self._fail("inconsistent global time in packet ", packet_id, "@", global_time)
+
+                if not meta_message_id == message.database_id:
+                    self._fail("inconsistent meta message in packet ", packet_id, "@", global_time)
+
+                if not packet == message.packet:
+                    self._fail("inconsistent binary in packet ", packet_id, "@", global_time)
+
+                self._logger.debug("packet %d@%d is checked", packet_id, global_time)
+
+        return len(rows), (rows[-1][0],) if rows else None
+
+    def _check_sequence_number(self, meta, cursor, limit):
+        #
+        # ensure that we have all sequence numbers for FullSyncDistribution packets
+        #
+        if cursor:
+            member_id, global_time = cursor
+            # the number of packets of this member that were checked before
+            counter, = self._database.execute(u"SELECT COUNT(*) FROM sync WHERE meta_message = ? AND member = ? AND global_time <= ?",
+                                              (meta.database_id, member_id, global_time)).next()
+            counter += 1
+        else:
+            member_id, global_time, counter = 0, 0, 1
+
+        rows = list(self._database.execute(u"SELECT id, member, global_time, packet FROM sync WHERE meta_message = ? AND (member > ? OR (member = ? AND global_time > ?)) ORDER BY member, global_time LIMIT ?",
+                                           (meta.database_id, member_id, member_id, global_time, limit)))
+        for packet_id, row_member_id, row_global_time, packet in rows:
+            packet = str(packet)
+            message = self._dispersy.convert_packet_to_message(packet, self._community, verify=False)
+            assert message
+
+            if row_member_id != member_id:
+                member_id = row_member_id
+                counter = 1
+
+            if not counter == message.distribution.sequence_number:
+                self._logger.error("%s for member %d has sequence number %d expected %d\n%s",
+                                   meta.name, member_id,
+                                   message.distribution.sequence_number, counter, packet.encode("HEX"))
+                self._fail("inconsistent sequence numbers in packet ", packet_id)
+
+            counter += 1
+
+        return len(rows), (rows[-1][1], rows[-1][2]) if rows else None
+
+    def _check_last_sync(self, meta, cursor, limit):
+        #
+        # ensure that we have only history-size messages per member
+        #
+        if cursor:
+            member_id, global_time = cursor
+            # the number of packets of this member that were checked before
+            counter, = self._database.execute(u"SELECT COUNT(*) FROM sync WHERE meta_message = ? AND member = ? AND global_time >= ?",
+                                              (meta.database_id, member_id, global_time)).next()
+        else:
+            # member identifiers start at one
+            member_id, global_time, counter = 0, 0, 0
+
+        rows = list(self._database.execute(u"SELECT id, member, global_time, packet FROM sync WHERE meta_message = ? AND (member > ? OR (member = ? AND global_time < ?)) ORDER BY member ASC, global_time DESC LIMIT ?",
+                                           (meta.database_id, member_id, member_id, global_time, limit)))
+        for packet_id, row_member_id, _, packet in rows:
+            message = self._dispersy.convert_packet_to_message(str(packet), self._community, verify=False)
+            assert message
+
+            if isinstance(meta.authentication, MemberAuthentication):
+                if row_member_id == member_id:
+                    counter += 1
+                else:
+                    member_id = row_member_id
+                    counter = 1
+
+                if counter > meta.distribution.history_size:
+                    self._fail("pruned packet ", packet_id, " still in database")
+
+            else:
+                assert isinstance(meta.authentication, DoubleMemberAuthentication)
+                try:
+                    member1, member2 = self._database.execute(u"SELECT member1, member2 FROM double_signed_sync WHERE sync = ?", (packet_id,)).next()
+                except StopIteration:
+                    self._fail("found double signed message without an entry in the double_signed_sync table")
+                    continue
+
+                if not member1 < member2:
+                    self._fail("member1 (", member1, ") must always be smaller than member2 (", member2, ")")
+
+                if not (member1 == row_member_id or member2 == row_member_id):
+                    self._fail("member1 (", member1, ") or member2 (", member2, ") must be the message creator (", row_member_id, ")")
+
+        return len(rows), (rows[-1][1], rows[-1][2]) if rows else None
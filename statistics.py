@@ -1,5 +1,8 @@
 from abc import ABCMeta, abstractmethod
+from array import array
+from bisect import bisect_left
 from collections import defaultdict
+from heapq import heapify, heappop, heappush
 from threading import RLock
 from time import time
 
@@ -49,6 +52,165 @@ class Statistics(object):
         pass
 
 
+class CountMinSketch(object):
+    """
+    Estimates the count of every key in a fixed amount of memory.
+
+    An estimate is never lower than the real count.  It is higher by at most 2 / WIDTH times the
+    total of all counts, except with a probability of 2 ** -DEPTH.
+    """
+
+    def __init__(self, width=1024, depth=4):
+        assert isinstance(width, int), type(width)
+        assert width > 0, width
+        assert isinstance(depth, int), type(depth)
+        assert depth > 0, depth
+        self._width = width
+        self._depth = depth
+        self._table = array("l", [0]) * (width * depth)
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def _get_indexes(self, key):
+        # double hashing over a mixed hash(KEY), small integers hash to themselves
+        value = (hash(key) * 0x9e3779b97f4a7c15) & 0xffffffffffffffff
+        first, second = value >> 32, (value & 0xffffffff) | 1
+        width = self._width
+        return [row * width + (first + row * second) % width for row in xrange(self._depth)]
+
+    def add(self, key, value=1):
+        """
+        Adds VALUE to the count of KEY and returns the new estimate.
+
+        Only the rows that hold the lowest count are increased (conservative update), this keeps
+        the estimates of the other keys lower.
+        """
+        assert value >= 0, value
+        table = self._table
+        indexes = self._get_indexes(key)
+        estimate = min(table[index] for index in indexes) + value
+        for index in indexes:
+            if table[index] < estimate:
+                table[index] = estimate
+        return estimate
+
+    def estimate(self, key):
+        " Returns the estimated count of KEY. "
+        table = self._table
+        return min(table[index] for index in self._get_indexes(key))
+
+
+class HeavyHitters(dict):
+    """
+    A dictionary that counts the keys that occur most often, using at most CAPACITY keys.
+
+    Counts are exact as long as there are no more than CAPACITY different keys.  After that, a
+    CountMinSketch estimates the count of every key, and a new key replaces the tracked key with
+    the lowest count when its estimate is higher (space-saving).  Reading a key that is not tracked
+    returns its estimate.
+    """
+
+    def __init__(self, capacity=256):
+        super(HeavyHitters, self).__init__()
+        assert isinstance(capacity, int), type(capacity)
+        assert capacity > 0, capacity
+        self._capacity = capacity
+        # (count, key) tuples, an entry is outdated when its count is not the count of its key
+        self._heap = []
+        # created when the first key is evicted
+        self._sketch = None
+        self._evicted = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def evicted(self):
+        " Returns the number of keys that were replaced by a key with a higher count. "
+        return self._evicted
+
+    @property
+    def exact(self):
+        " Returns True while no key has been evicted, i.e. when all counts are exact. "
+        return self._sketch is None
+
+    def __missing__(self, key):
+        return 0 if self._sketch is None else self._sketch.estimate(key)
+
+    def __setitem__(self, key, value):
+        """
+        Sets the count of KEY to VALUE.
+
+        Raises ValueError when VALUE is lower than the count of a key that is not tracked, as its
+        estimate can not be lowered.
+        """
+        delta = value - self[key]
+        if delta >= 0:
+            self.increment(key, delta)
+
+        elif key in self:
+            # the estimate in the sketch can not be lowered, the tracked count is exact
+            self._track(key, value)
+
+        else:
+            raise ValueError("unable to lower the count of %r, it is not tracked" % (key,))
+
+    def _track(self, key, count):
+        dict.__setitem__(self, key, count)
+        heap = self._heap
+        heappush(heap, (count, key))
+        if len(heap) > 2 * self._capacity:
+            heap[:] = [(count, key) for key, count in self.iteritems()]
+            heapify(heap)
+
+    def _pop_lowest(self):
+        heap = self._heap
+        while True:
+            count, key = heappop(heap)
+            if dict.get(self, key) == count:
+                dict.__delitem__(self, key)
+                return count
+
+    def increment(self, key, value=1):
+        " Adds VALUE to the count of KEY. "
+        sketch = self._sketch
+        if key in self:
+            if sketch is not None:
+                sketch.add(key, value)
+            self._track(key, dict.__getitem__(self, key) + value)
+
+        elif len(self) < self._capacity:
+            self._track(key, value if sketch is None else sketch.add(key, value))
+
+        else:
+            if sketch is None:
+                sketch = self._sketch = CountMinSketch()
+                for tracked_key, count in self.iteritems():
+                    sketch.add(tracked_key, count)
+
+            estimate = sketch.add(key, value)
+            heap = self._heap
+            while dict.get(self, heap[0][1]) != heap[0][0]:
+                heappop(heap)
+            if estimate > heap[0][0]:
+                self._pop_lowest()
+                self._evicted += 1
+                self._track(key, estimate)
+
+    def clear(self):
+        super(HeavyHitters, self).clear()
+        self._heap = []
+        self._sketch = None
+        self._evicted = 0
+
+
 class MessageStatistics(object):
 
     def __init__(self):
@@ -103,7 +265,7 @@ class MessageStatistics(object):
         with self._lock:
             if self._enabled != enabled:
                 self._enabled = enabled
-                assigned_value = lambda: defaultdict(int) if enabled else None
+                assigned_value = lambda: HeavyHitters() if enabled else None
 
                 self.success_dict = assigned_value()
                 self.outgoing_dict = assigned_value()
@@ -186,11 +348,15 @@ class DispersyStatistics(Statistics):
         self.endpoint_recv = None
         self.endpoint_send = None
         self.received_introductions = None
+        self._received_introductions = None
 
         # list with {count=int, duration=float, average=float, entry=str} dictionaries.  each entry
         # represents a key from the attach_runtime_statistics decorator
         self.runtime = None
 
+        # the reactor lag and stage latencies, see Instrumentation.get_dict
+        self.instrumentation = None
+
         self._enabled = None
         self.msg_statistics = MessageStatistics()
         self.enable_debug_statistics(__debug__)
@@ -201,6 +367,14 @@ class DispersyStatistics(Statistics):
     def database_version(self):
         return self._dispersy.database.database_version
 
+    @property
+    def database_readers(self):
+        """
+        The threads, pending jobs, and submitted and dropped job counts of the read-only database
+        connections.
+        """
+        return self._dispersy.database_readers.get_dict()
+
     @property
     def lan_address(self):
         return self._dispersy.lan_address
@@ -218,7 +392,7 @@ class DispersyStatistics(Statistics):
             self._enabled = enable
             self.msg_statistics.enable(enable)
 
-            dict_assigned_value = lambda: defaultdict(int) if enable else None
+            dict_assigned_value = lambda: HeavyHitters() if enable else None
             self.walk_failure_dict = dict_assigned_value()
             self.incoming_intro_dict = dict_assigned_value()
             self.outgoing_intro_dict = dict_assigned_value()
@@ -227,8 +401,9 @@ class DispersyStatistics(Statistics):
             self.endpoint_recv = dict_assigned_value()
             self.endpoint_send = dict_assigned_value()
 
-            # SOURCE:INTRODUCED:COUNT nested dictionary
-            self.received_introductions = defaultdict(lambda: defaultdict(int)) if enable else None
+            # SOURCE:INTRODUCED:COUNT nested dictionary, built from (SOURCE, INTRODUCED):COUNT in update
+            self._received_introductions = dict_assigned_value()
+            self.received_introductions = dict() if enable else None
 
             for community in self._dispersy.get_communities():
                 community.statistics.enable_debug_statistics(enable)
@@ -236,6 +411,13 @@ class DispersyStatistics(Statistics):
     def are_debug_statistics_enabled(self):
         return self._enabled
 
+    def add_received_introduction(self, source, introduced):
+        """
+        Counts that SOURCE introduced us to INTRODUCED, INTRODUCED is u"-ignored-" when the
+        introduction was not used.
+        """
+        self.dict_inc(u"_received_introductions", (source, introduced))
+
     def update(self, database=False):
         self.timestamp = time()
 
@@ -249,6 +431,16 @@ class DispersyStatistics(Statistics):
         self.runtime.sort(reverse=True)
         self.runtime = [statistic[1] for statistic in self.runtime]
 
+        instrumentation = self._dispersy.instrumentation
+        self.instrumentation = instrumentation.get_dict() if instrumentation.enabled else None
+
+        with self._lock:
+            if self._received_introductions is not None:
+                received_introductions = defaultdict(dict)
+                for (source, introduced), count in self._received_introductions.iteritems():
+                    received_introductions[source][introduced] = count
+                self.received_introductions = dict(received_introductions)
+
     def reset(self):
         self.total_down = 0
         self.total_up = 0
@@ -272,14 +464,15 @@ class DispersyStatistics(Statistics):
         self.msg_statistics.reset()
 
         if self.are_debug_statistics_enabled():
-            self.walk_failure_dict = defaultdict(int)
-            self.incoming_intro_dict = defaultdict(int)
-            self.outgoing_intro_dict = defaultdict(int)
+            self.walk_failure_dict = HeavyHitters()
+            self.incoming_intro_dict = HeavyHitters()
+            self.outgoing_intro_dict = HeavyHitters()
 
-            self.attachment = defaultdict(int)
-            self.endpoint_recv = defaultdict(int)
-            self.endpoint_send = defaultdict(int)
-            self.received_introductions = defaultdict(lambda: defaultdict(int))
+            self.attachment = HeavyHitters()
+            self.endpoint_recv = HeavyHitters()
+            self.endpoint_send = HeavyHitters()
+            self._received_introductions = HeavyHitters()
+            self.received_introductions = dict()
 
 
 class CommunityStatistics(Statistics):
@@ -345,6 +538,26 @@ class CommunityStatistics(Statistics):
                 for candidate in self._community.candidates.itervalues()
                 if candidate.get_category(now) in [u'walk', u'stumble', u'intro']]
 
+    @property
+    def sanity_check(self):
+        """
+        The progress and findings of the sanity check that runs in the background, or None.
+        """
+        sanity_check = self._community.sanity_check
+        return sanity_check.get_progress() if sanity_check else None
+
+    @property
+    def batch_windows(self):
+        """
+        The window, maximum batch size, arrival rate, and processing cost per message chosen for
+        every meta message that uses adaptive batching.
+        """
+        return dict((meta.name, {u"window": batch_window.window,
+                                 u"max_size": batch_window.max_size,
+                                 u"arrival_rate": batch_window.arrival_rate,
+                                 u"cost": batch_window.cost})
+                    for meta, batch_window in self._community.batch_windows.iteritems())
+
     def enable_debug_statistics(self, enabled):
         self.msg_statistics.enable(enabled)
 
@@ -359,11 +572,17 @@ class CommunityStatistics(Statistics):
         self.msg_statistics.reset()
 
 
+# upper bounds, in seconds, of the RuntimeStatistic histogram buckets.  the last bucket counts all
+# durations above RUNTIME_HISTOGRAM_BOUNDS[-1]
+RUNTIME_HISTOGRAM_BOUNDS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
 class RuntimeStatistic(object):
 
     def __init__(self):
         self._count = 0
         self._duration = 0.0
+        self._histogram = [0] * (len(RUNTIME_HISTOGRAM_BOUNDS) + 1)
 
     @property
     def count(self):
@@ -380,14 +599,152 @@ class RuntimeStatistic(object):
         " Returns the average time spent in a method. "
         return self._duration / self._count
 
-    def increment(self, duration):
-        " Increase self.count with 1 and self.duration with DURATION. "
+    @property
+    def histogram(self):
+        " Returns a list with (upper bound, count) tuples, the last upper bound is infinite. "
+        return zip(RUNTIME_HISTOGRAM_BOUNDS + (float("inf"),), self._histogram)
+
+    def percentile(self, fraction):
+        """
+        Returns the upper bound of the histogram bucket that contains the FRACTION percentile, or
+        None when nothing was measured.
+        """
+        assert isinstance(fraction, float), type(fraction)
+        assert 0.0 <= fraction <= 1.0, fraction
+        threshold = fraction * self._count
+        cumulative = 0
+        for bound, count in self.histogram:
+            cumulative += count
+            if count and cumulative >= threshold:
+                return bound
+        return None
+
+    def increment(self, duration, weight=1):
+        """
+        Increase self.count with WEIGHT and self.duration with DURATION * WEIGHT.
+
+        WEIGHT is larger than one when only one in every WEIGHT calls is measured.
+        """
         assert isinstance(duration, float), type(duration)
-        self._duration += duration
-        self._count += 1
+        assert isinstance(weight, (int, long)), type(weight)
+        self._duration += duration * weight
+        self._count += weight
+        self._histogram[bisect_left(RUNTIME_HISTOGRAM_BOUNDS, duration)] += weight
 
     def get_dict(self, **kargs):
         " Returns a dictionary with the statistics. "
         return dict(count=self.count, duration=self.duration, average=self.average, **kargs)
 
-_runtime_statistics = defaultdict(RuntimeStatistic)
+
+class RuntimeStatistics(defaultdict):
+    """
+    Maps the entries generated by the attach_runtime_statistics decorator to RuntimeStatistic
+    instances.
+
+    When SAMPLE_INTERVAL is larger than one, only one in every SAMPLE_INTERVAL calls to a decorated
+    function is measured, the measurement is weighted accordingly.
+    """
+
+    def __init__(self):
+        super(RuntimeStatistics, self).__init__(RuntimeStatistic)
+        self.sample_interval = 1
+
+_runtime_statistics = RuntimeStatistics()
+
+
+class Instrumentation(object):
+    """
+    Measures how long the reactor is blocked.
+
+    The reactor lag is the delay of a heartbeat that should be called every HEARTBEAT_INTERVAL
+    seconds, see Dispersy.enable_instrumentation.  The stage latencies measure the time spent in each step of
+    processing incoming packets, see INSTRUMENTATION_STAGES, and in other operations that run on
+    the reactor, such as u"commit" and u"bloom filter".
+
+    Nothing is measured while ENABLED is False.
+    """
+
+    # the steps of processing incoming packets, in order:
+    # - receive: the time the first packet of a batch waited, between the endpoint and decoding
+    # - decode: converting the packets of a batch into messages
+    # - check: the distribution and community checks
+    # - store: storing the messages in the database
+    # - handle: the handle_callback of the messages
+    # - forward: sending the messages to other members
+    STAGES = (u"receive", u"decode", u"check", u"store", u"handle", u"forward")
+
+    def __init__(self, heartbeat_interval=0.1, enabled=True):
+        assert isinstance(heartbeat_interval, float), type(heartbeat_interval)
+        assert heartbeat_interval > 0.0, heartbeat_interval
+        assert isinstance(enabled, bool), type(enabled)
+        super(Instrumentation, self).__init__()
+        self._heartbeat_interval = heartbeat_interval
+        self.enabled = enabled
+        self._last_heartbeat = None
+        self._lag = RuntimeStatistic()
+        self._max_lag = 0.0
+        self._stages = defaultdict(RuntimeStatistic)
+
+    @property
+    def heartbeat_interval(self):
+        return self._heartbeat_interval
+
+    @property
+    def max_lag(self):
+        " Returns the largest delay of the heartbeat, in seconds. "
+        return self._max_lag
+
+    @property
+    def stages(self):
+        " Returns a dictionary with STAGE:RuntimeStatistic pairs. "
+        return self._stages
+
+    def heartbeat(self):
+        """
+        Called every HEARTBEAT_INTERVAL seconds on the reactor thread.
+        """
+        now = time()
+        if self._last_heartbeat is not None:
+            lag = max(0.0, now - self._last_heartbeat - self._heartbeat_interval)
+            self._lag.increment(lag)
+            if lag > self._max_lag:
+                self._max_lag = lag
+        self._last_heartbeat = now
+
+    def stop(self):
+        """
+        Called when the heartbeat stops, the time until it starts again is not lag.
+        """
+        self._last_heartbeat = None
+
+    def add(self, stage, duration):
+        """
+        Add one DURATION, in seconds, to the latency histogram of STAGE.
+        """
+        if self.enabled:
+            self._stages[stage].increment(duration)
+
+    def reset(self):
+        self._lag = RuntimeStatistic()
+        self._max_lag = 0.0
+        self._stages.clear()
+
+    @staticmethod
+    def _get_statistic_dict(statistic):
+        if not statistic.count:
+            return dict(count=0, duration=0.0, average=0.0, p50=None, p90=None, p99=None, histogram=[])
+        return statistic.get_dict(p50=statistic.percentile(0.5),
+                                  p90=statistic.percentile(0.9),
+                                  p99=statistic.percentile(0.99),
+                                  histogram=[(bound, count) for bound, count in statistic.histogram if count])
+
+    def get_dict(self):
+        """
+        Returns a dictionary with the reactor lag and the latency of each stage.
+
+        Each latency is a dictionary with the keys: count, duration, average, p50, p90, p99 and
+        histogram.  The percentiles are the upper bounds of histogram buckets, the histogram is a
+        list with the (upper bound, count) pairs of the buckets that are not empty.
+        """
+        return {u"reactor_lag": dict(max=self._max_lag, **self._get_statistic_dict(self._lag)),
+                u"stages": dict((stage, self._get_statistic_dict(statistic)) for stage, statistic in self._stages.iteritems())}
@@ -187,6 +187,15 @@ class DebugCommunity(Community):
                         self._generic_timeline_check,
                         self.on_text,
                         batch=BatchConfiguration(max_window=5.0)),
+                Message(self, u"adaptive-batched-text",
+                        MemberAuthentication(),
+                        PublicResolution(),
+                        FullSyncDistribution(enable_sequence_number=False, synchronization_direction=u"ASC", priority=128),
+                        CommunityDestination(node_count=10),
+                        TextPayload(),
+                        self._generic_timeline_check,
+                        self.on_text,
+                        batch=BatchConfiguration(max_window=5.0, adaptive=True)),
                 ])
         return messages
 
@@ -821,3 +821,9 @@ class DebugNode(object):
         Returns a new BATCHED-text message.
         """
         return self._create_text(u"batched-text", text, global_time)
+
+    def create_adaptive_batched_text(self, text, global_time=None):
+        """
+        Returns a new ADAPTIVE-BATCHED-text message.
+        """
+        return self._create_text(u"adaptive-batched-text", text, global_time)
@@ -7,6 +7,7 @@ class TextPayload(Payload):
     TextPayload is used to hold a single string.
     """
     class Implementation(Payload.Implementation):
+        __slots__ = ["_text"]
 
         def __init__(self, meta, text):
             assert isinstance(text, str)
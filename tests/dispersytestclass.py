@@ -1,5 +1,7 @@
 import os
 import logging
+import shutil
+import tempfile
 from unittest import TestCase
 
 # Do not (re)move the reactor import, even if we aren't using it
@@ -28,6 +30,8 @@ class DispersyTestFunc(TestCase):
     def __init__(self, *args, **kwargs):
         super(DispersyTestFunc, self).__init__(*args, **kwargs)
         self._logger = logging.getLogger(self.__class__.__name__)
+        # temporary directories of the nodes that use a database file
+        self._directories = []
 
     def on_callback_exception(self, exception, is_fatal):
         return True
@@ -54,6 +58,9 @@ class DispersyTestFunc(TestCase):
             if os.path.isfile(peercache):
                 os.unlink(peercache)
 
+        for directory in self._directories:
+            shutil.rmtree(directory, ignore_errors=True)
+
         pending = reactor.getDelayedCalls()
         if pending:
             self._logger.warning("Found delayed calls in reactor:")
@@ -63,15 +70,21 @@ class DispersyTestFunc(TestCase):
             self._logger.warning("Failing")
         assert not pending, "The reactor was not clean after shutting down all dispersy instances."
 
-    def create_nodes(self, amount=1, store_identity=True, tunnel=False, communityclass=DebugCommunity, autoload_discovery=False):
+    def create_nodes(self, amount=1, store_identity=True, tunnel=False, communityclass=DebugCommunity, autoload_discovery=False, memory_database=True):
         @inlineCallbacks
-        def _create_nodes(amount, store_identity, tunnel, communityclass, autoload_discovery):
+        def _create_nodes(amount, store_identity, tunnel, communityclass, autoload_discovery, memory_database):
             nodes = []
             for _ in range(amount):
                 # TODO(emilon): do the log observer stuff instead
                 # callback.attach_exception_handler(self.on_callback_exception)
 
-                dispersy = Dispersy(ManualEnpoint(0), u".", u":memory:")
+                if memory_database:
+                    dispersy = Dispersy(ManualEnpoint(0), u".", u":memory:")
+                else:
+                    # each node needs its own database file
+                    directory = tempfile.mkdtemp()
+                    self._directories.append(directory)
+                    dispersy = Dispersy(ManualEnpoint(0), unicode(directory), u"dispersy.db")
                 dispersy.start(autoload_discovery=autoload_discovery)
 
                 self.dispersy_objects.append(dispersy)
@@ -83,4 +96,4 @@ class DispersyTestFunc(TestCase):
             self._logger.debug("create_nodes, nodes created: %s", nodes)
             returnValue(nodes)
 
-        return blockingCallFromThread(reactor, _create_nodes, amount, store_identity, tunnel, communityclass, autoload_discovery)
+        return blockingCallFromThread(reactor, _create_nodes, amount, store_identity, tunnel, communityclass, autoload_discovery, memory_database)
@@ -1,8 +1,43 @@
 from time import time, sleep
+from unittest import TestCase
 
+from ..message import BatchConfiguration, BatchWindow
+from ..util import blocking_call_on_reactor_thread
 from .dispersytestclass import DispersyTestFunc
 
 
+class TestBatchWindow(TestCase):
+
+    def test_light_load(self):
+        """
+        When less than two messages arrive within the maximum window they must not be batched.
+        """
+        batch_window = BatchWindow(BatchConfiguration(max_window=5.0, adaptive=True))
+        self.assertEqual(batch_window.window, 5.0)
+        for timestamp in xrange(0, 100, 10):
+            batch_window.arrived(1, float(timestamp))
+        self.assertEqual(batch_window.window, 0.0)
+        self.assertAlmostEqual(batch_window.arrival_rate, 0.1)
+
+    def test_heavy_load(self):
+        """
+        Under heavy load the batch must be limited to the messages that can be processed within
+        max_duration, and the window to the time needed to receive them.
+        """
+        batch_window = BatchWindow(BatchConfiguration(max_window=5.0, adaptive=True, max_duration=0.05))
+        for index in xrange(100):
+            batch_window.arrived(10, index * 0.01)
+        batch_window.processed(100, 0.1)
+        self.assertEqual(batch_window.max_size, 50)
+        self.assertAlmostEqual(batch_window.window, 0.05)
+
+        # when processing becomes more expensive the batches must become smaller
+        for _ in xrange(20):
+            batch_window.processed(10, 0.1)
+        self.assertLess(batch_window.max_size, 10)
+        self.assertGreaterEqual(batch_window.max_size, BatchWindow.MIN_BATCH_SIZE)
+
+
 class TestBatch(DispersyTestFunc):
 
     def __init__(self, *args, **kargs):
@@ -87,3 +122,30 @@ class TestBatch(DispersyTestFunc):
 
         if self._big_batch_took and self._small_batches_took:
             self.assertSmaller(self._big_batch_took, self._small_batches_took * 1.1)
+
+    @blocking_call_on_reactor_thread
+    def _set_cost(self, node, name, cost):
+        community = node._community
+        community._get_batch_window(community.get_meta_message(name)).processed(1, cost)
+
+    def test_adaptive_batch(self):
+        """
+        An adaptive batch must be processed as soon as it reaches its maximum size, and the chosen
+        window must be available in the community statistics.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        messages = [node.create_adaptive_batched_text("adaptive", i + 10) for i in range(10)]
+        other.give_messages(messages[:2], node, cache=True)
+        # until the load is known the maximum window is used
+        other.assert_count(messages[0], 0)
+
+        # a processing cost of one second per message allows the minimum batch size
+        self._set_cost(other, u"adaptive-batched-text", 1.0)
+        other.give_messages(messages[2:], node, cache=True)
+        other.assert_count(messages[0], 10)
+
+        batch_windows = other.community.statistics.batch_windows
+        self.assertEqual(batch_windows[u"adaptive-batched-text"][u"max_size"], BatchWindow.MIN_BATCH_SIZE)
+        self.assertGreater(batch_windows[u"adaptive-batched-text"][u"cost"], 0.0)
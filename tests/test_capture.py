@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+
+from nose.twistedtools import reactor
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from ..capture import CAPTURE_MAGIC, CaptureEndpoint, CaptureWriter, prepare_replay_directory, read_capture, replay
+from ..dispersy import Dispersy
+from ..endpoint import ManualEnpoint, TUNNEL_PREFIX
+from ..util import blockingCallFromThread
+from .debugcommunity.community import DebugCommunity
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestCapture(DispersyTestFunc):
+
+    def setUp(self):
+        super(TestCapture, self).setUp()
+        self._directory = tempfile.mkdtemp()
+        self._filename = os.path.join(self._directory, "capture.bin")
+
+    def tearDown(self):
+        super(TestCapture, self).tearDown()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def test_format(self):
+        """
+        Reading a capture must return the written datagrams, an incomplete record must be ignored.
+        """
+        writer = CaptureWriter(self._filename)
+        writer.write(1.5, [(("1.2.3.4", 5), "a" * 30), (("5.6.7.8", 65535), TUNNEL_PREFIX + "b" * 30)])
+        writer.write(2.5, [(("1.2.3.4", 5), "")])
+        writer.close()
+        self.assertEqual((writer.packet_count, writer.byte_count), (3, 64))
+
+        expected = [(1.5, ("1.2.3.4", 5), "a" * 30),
+                    (1.5, ("5.6.7.8", 65535), TUNNEL_PREFIX + "b" * 30),
+                    (2.5, ("1.2.3.4", 5), "")]
+        self.assertEqual(list(read_capture(self._filename)), expected)
+
+        with open(self._filename, "ab") as stream:
+            stream.write("incomplete")
+        self.assertEqual(list(read_capture(self._filename)), expected)
+
+        with open(self._filename, "wb") as stream:
+            stream.write(CAPTURE_MAGIC[:-1])
+        self.assertRaises(ValueError, list, read_capture(self._filename))
+
+    def test_capture_endpoint(self):
+        """
+        The datagrams passed to Dispersy must be captured.
+        """
+        endpoint = CaptureEndpoint(self._filename, 0)
+        node, other = self.create_nodes(2)
+        messages = [other.create_full_sync_text("Message %d" % index, index + 10) for index in xrange(3)]
+
+        def receive():
+            endpoint.open(node._dispersy)
+            endpoint.dispersythread_data_came_in([(other.lan_address, message.packet) for message in messages], 42.0)
+            endpoint.close()
+        node.call(receive)
+
+        self.assertEqual(list(read_capture(self._filename)),
+                         [(42.0, other.lan_address, message.packet) for message in messages])
+
+    def test_replay(self):
+        """
+        Replaying a capture must process its messages and report every stage.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+        messages = [other.create_full_sync_text("Message %d" % index, index + 10) for index in xrange(10)]
+
+        writer = CaptureWriter(self._filename)
+        for index, message in enumerate(messages):
+            writer.write(100.0 + index * 0.5, [(other.lan_address, message.packet)])
+        writer.close()
+
+        report = blockingCallFromThread(reactor, replay, node._dispersy, self._filename)
+        node.assert_is_stored(messages=messages)
+        self.assertEqual(report[u"packets"], 10)
+        self.assertEqual(report[u"bytes"], sum(len(message.packet) for message in messages))
+        self.assertEqual(report[u"success"], 10)
+        self.assertEqual(report[u"drop"], 0)
+        for stage in (u"receive", u"decode", u"check", u"store", u"handle"):
+            self.assertGreater(report[u"stages"][stage][u"count"], 0, stage)
+
+        # replaying at ten times the original speed must take about half a second, the stored
+        # messages are dropped as duplicates
+        report = blockingCallFromThread(reactor, replay, node._dispersy, self._filename, speed=10.0)
+        self.assertGreaterEqual(report[u"duration"], 0.4)
+        self.assertEqual(report[u"drop"], 10)
+
+    def test_replay_directory(self):
+        """
+        Replaying on a copy of the database must give the same result every time and must not
+        change the original database.
+        """
+        node, other = self.create_nodes(2, memory_database=False)
+        other.send_identity(node)
+        messages = [other.create_full_sync_text("Message %d" % index, index + 10) for index in xrange(10)]
+
+        writer = CaptureWriter(self._filename)
+        writer.write(100.0, [(other.lan_address, message.packet) for message in messages])
+        writer.close()
+
+        cid = node._community.cid
+        private_key = node._dispersy.crypto.key_to_bin(node._community.my_member.private_key)
+        working_directory = node._dispersy.working_directory
+        node.call(node._dispersy.stop)
+        self.dispersy_objects.remove(node._dispersy)
+
+        @inlineCallbacks
+        def replay_copy():
+            directory = prepare_replay_directory(working_directory, u"dispersy.db")
+            dispersy = Dispersy(ManualEnpoint(0), directory, u"dispersy.db")
+            self.dispersy_objects.append(dispersy)
+            try:
+                self.assertTrue(dispersy.start(autoload_discovery=False))
+                dispersy.define_auto_load(DebugCommunity, dispersy.get_member(private_key=private_key))
+                dispersy.get_community(cid)
+                report = yield replay(dispersy, self._filename)
+            finally:
+                dispersy.stop()
+                self.dispersy_objects.remove(dispersy)
+                shutil.rmtree(directory, ignore_errors=True)
+            returnValue(report)
+
+        for _ in xrange(2):
+            report = blockingCallFromThread(reactor, replay_copy)
+            self.assertEqual(report[u"success"], 10)
+            self.assertEqual(report[u"drop"], 0)
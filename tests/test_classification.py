@@ -1,5 +1,13 @@
+from time import sleep, time
+
+from nose.twistedtools import reactor
+
+from .. import dispersy as dispersy_module
+from ..candidate import Candidate
+from ..dispersy import Dispersy
+from ..endpoint import ManualEnpoint
 from ..exception import CommunityNotFoundException
-from ..util import call_on_reactor_thread
+from ..util import blockingCallFromThread, blocking_call_on_reactor_thread, call_on_reactor_thread
 from .debugcommunity.community import DebugCommunity
 from .dispersytestclass import DispersyTestFunc
 
@@ -171,3 +179,137 @@ class TestClassification(DispersyTestFunc):
 
     def test_enable_disable_autoload(self):
         self.test_enable_autoload(False)
+
+    def test_lazy_autoload(self):
+        """
+        A community that is defined using lazy=True must be loaded after the packet that woke it up
+        was received, and then process that packet.
+        """
+        cid = self._community.cid
+
+        @blocking_call_on_reactor_thread
+        def wakeup():
+            self._dispersy.define_auto_load(DebugCommunity, self._community.my_member, lazy=True)
+            message = self._mm.create_full_sync_text("Should lazily auto-load", 42)
+            self._community.unload_community()
+
+            self._dispersy.on_incoming_packets([(Candidate(self._mm.lan_address, False), message.packet)], timestamp=time())
+            self.assertIn(cid, self._dispersy._pending_communities)
+            self.assertRaises(CommunityNotFoundException, self._dispersy.get_community, cid, auto_load=False)
+            return message
+
+        message = wakeup()
+        for _ in xrange(100):
+            if not cid in self._dispersy._pending_communities:
+                break
+            sleep(0.01)
+
+        self.assertNotIn(cid, self._dispersy._pending_communities)
+        self._mm._community = self._dispersy.get_community(cid, auto_load=False)
+        self._mm.assert_count(message, 1)
+
+    def test_lazy_autoload_error(self):
+        """
+        A community that fails to load must no longer keep the packets that are received for it.
+        """
+        class FailingCommunity(DebugCommunity):
+
+            @classmethod
+            def get_classification(cls):
+                return DebugCommunity.get_classification()
+
+            def __init__(self, *args, **kargs):
+                raise RuntimeError("unable to initialize")
+
+        cid = self._community.cid
+
+        @blocking_call_on_reactor_thread
+        def wakeup():
+            self._dispersy.define_auto_load(FailingCommunity, self._community.my_member, lazy=True)
+            message = self._mm.create_full_sync_text("Should fail to auto-load", 42)
+            self._community.unload_community()
+            self._dispersy.on_incoming_packets([(Candidate(self._mm.lan_address, False), message.packet)], timestamp=time())
+            self.assertIn(cid, self._dispersy._pending_communities)
+
+        wakeup()
+        for _ in xrange(100):
+            if not cid in self._dispersy._pending_communities:
+                break
+            sleep(0.01)
+
+        self.assertNotIn(cid, self._dispersy._pending_communities)
+        self.assertNotIn(cid, self._dispersy._pending_packet_counts)
+
+    @blocking_call_on_reactor_thread
+    def test_lazy_autoload_limit(self):
+        """
+        At most MAX_PENDING_PACKETS packets must be kept for a community that is being loaded.
+        """
+        self._dispersy.define_auto_load(DebugCommunity, self._community.my_member, lazy=True)
+        messages = [self._mm.create_full_sync_text("Pending #%d" % index, 42 + index) for index in xrange(3)]
+        self._community.unload_community()
+
+        max_pending_packets = dispersy_module.MAX_PENDING_PACKETS
+        dispersy_module.MAX_PENDING_PACKETS = 2
+        try:
+            for message in messages:
+                self._dispersy.on_incoming_packets([(Candidate(self._mm.lan_address, False), message.packet)], timestamp=time())
+        finally:
+            dispersy_module.MAX_PENDING_PACKETS = max_pending_packets
+
+        self.assertEqual(len(self._dispersy._pending_communities[self._community.cid]), 2)
+        self.assertEqual(self._dispersy._pending_packet_counts[self._community.cid], 2)
+
+    @blocking_call_on_reactor_thread
+    def test_meta_message_rows(self):
+        """
+        A community that is loaded again must use the meta_message rows of the previous load.
+        """
+        database_ids = dict((meta.name, meta.database_id) for meta in self._community.get_meta_messages())
+        self.assertEqual(dict((name, row[0]) for name, row in self._dispersy.get_meta_message_rows(self._community.database_id).iteritems()),
+                         database_ids)
+
+        cid = self._community.cid
+        self._dispersy.define_auto_load(DebugCommunity, self._community.my_member)
+        self._community.unload_community()
+        # the meta_message table is not queried again
+        self._dispersy.database.execute(u"DELETE FROM meta_message")
+
+        community = self._dispersy.get_community(cid)
+        self.assertEqual(dict((meta.name, meta.database_id) for meta in community.get_meta_messages()), database_ids)
+
+    def test_meta_message_rows_restart(self):
+        """
+        The meta_message rows of all communities must be read on start, loading a community after a
+        restart must not query the meta_message table.
+        """
+        node, = self.create_nodes(memory_database=False)
+        cid = node._community.cid
+        private_key = node._dispersy.crypto.key_to_bin(node._community.my_member.private_key)
+        database_ids = dict((meta.name, meta.database_id) for meta in node._community.get_meta_messages())
+
+        def restart():
+            node._dispersy.stop()
+            self.dispersy_objects.remove(node._dispersy)
+            dispersy = Dispersy(ManualEnpoint(0), node._dispersy.working_directory, u"dispersy.db")
+            self.dispersy_objects.append(dispersy)
+            self.assertTrue(dispersy.start(autoload_discovery=False))
+            dispersy.define_auto_load(DebugCommunity, dispersy.get_member(private_key=private_key))
+
+            executed = []
+            execute = dispersy.database.execute
+
+            def counting_execute(statement, *args, **kargs):
+                executed.append(statement)
+                return execute(statement, *args, **kargs)
+
+            dispersy.database.execute = counting_execute
+            try:
+                community = dispersy.get_community(cid)
+            finally:
+                del dispersy.database.execute
+            return community, executed
+
+        community, executed = blockingCallFromThread(reactor, restart)
+        self.assertEqual(dict((meta.name, meta.database_id) for meta in community.get_meta_messages()), database_ids)
+        self.assertFalse([statement for statement in executed if u"FROM meta_message" in statement], executed)
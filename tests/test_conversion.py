@@ -0,0 +1,232 @@
+from os import environ
+from time import time
+from unittest import skipUnless
+
+from ..conversion import NoDefBinaryConversion
+from ..resolution import PublicResolution
+from .debugcommunity.conversion import DebugCommunityConversion
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestConversion(DispersyTestFunc):
+
+    def _create_packets(self, node, length):
+        """
+        Returns LENGTH packets, created by NODE, using a mix of message types.
+        """
+        policy, _ = node.get_resolution_policy(node._community.get_meta_message(u"dynamic-resolution-text"), 1)
+        assert isinstance(policy, PublicResolution), policy
+
+        packets = []
+        for global_time in xrange(10, 10 + length):
+            kind = global_time % 5
+            if kind == 0:
+                message = node.create_full_sync_text("full sync #%d" % global_time, global_time)
+            elif kind == 1:
+                message = node.create_last_9_test("last 9 #%d" % global_time, global_time)
+            elif kind == 2:
+                message = node.create_bin_key_text("bin key #%d" % global_time, global_time)
+            elif kind == 3:
+                message = node.create_dynamic_resolution_text("dynamic #%d" % global_time, policy.implement(), global_time)
+            else:
+                message = node.create_sequence_text("sequence #%d" % global_time, global_time, (global_time - 9) // 5)
+            packets.append(node.encode_message(message))
+        return packets
+
+    def _decode_packets(self, node, packets, compiled, verify=True):
+        """
+        Decodes PACKETS using the conversion of NODE, with or without the compiled decoders.
+        Returns a (messages, duration) tuple.
+        """
+        def decode():
+            conversion = node._community.get_conversion_for_packet(packets[0])
+            saved = dict((byte, functions.compiled) for byte, functions in conversion._decode_message_map.iteritems())
+            if not compiled:
+                for functions in conversion._decode_message_map.itervalues():
+                    functions.compiled = None
+
+            try:
+                candidate = node.my_candidate
+                begin = time()
+                messages = [conversion.decode_message(candidate, packet, verify) for packet in packets]
+                return messages, time() - begin
+
+            finally:
+                for byte, functions in conversion._decode_message_map.iteritems():
+                    functions.compiled = saved[byte]
+
+        return node.call(decode)
+
+    def test_compiled_decode(self):
+        """
+        The compiled decoders must give the same messages as the generic decoders.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        packets = self._create_packets(node, 50)
+        compiled, _ = self._decode_packets(other, packets, True)
+        generic, _ = self._decode_packets(other, packets, False)
+
+        self.assertEqual(len(compiled), len(generic))
+        for a, b in zip(compiled, generic):
+            self.assertEqual(a.name, b.name)
+            self.assertEqual(a.packet, b.packet)
+            self.assertEqual(a.authentication.member, b.authentication.member)
+            self.assertEqual(type(a.resolution), type(b.resolution))
+            self.assertEqual(a.distribution.global_time, b.distribution.global_time)
+            self.assertEqual(getattr(a.distribution, "sequence_number", 0), getattr(b.distribution, "sequence_number", 0))
+            self.assertEqual(a.payload.text, b.payload.text)
+
+    def test_compiled_encode(self):
+        """
+        The compiled encoders must give the same packets as the generic encoders.
+        """
+        node, = self.create_nodes(1)
+        message = node.create_full_sync_text("compiled", 42)
+        packet = node.encode_message(message)
+
+        conversion = node._community.get_conversion_for_message(message)
+        functions = conversion._encode_message_map[message.name]
+        compiled, functions.compiled = functions.compiled, None
+        try:
+            self.assertEqual(node.call(conversion.encode_message, message), packet)
+        finally:
+            functions.compiled = compiled
+
+    def test_compiled_override(self):
+        """
+        A conversion that overrides a policy function must not use the compiled plans for the
+        messages that use this policy.
+        """
+        class OverridingConversion(DebugCommunityConversion):
+
+            def __init__(self, community):
+                self.decoded = []
+                super(OverridingConversion, self).__init__(community)
+
+            def _decode_full_sync_distribution(self, placeholder):
+                self.decoded.append(placeholder.meta.name)
+                return super(OverridingConversion, self)._decode_full_sync_distribution(placeholder)
+
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        full_sync = node.encode_message(node.create_full_sync_text("override", 42))
+        last_9 = node.encode_message(node.create_last_9_test("override", 43))
+
+        def decode():
+            conversion = OverridingConversion(other._community)
+            self.assertIsNone(conversion._decode_message_map[full_sync[22]].compiled)
+            self.assertIsNone(conversion._encode_message_map[u"full-sync-text"].compiled)
+            self.assertIsNotNone(conversion._decode_message_map[last_9[22]].compiled)
+
+            message = conversion.decode_message(other.my_candidate, full_sync)
+            self.assertEqual(message.payload.text, "override")
+            conversion.decode_message(other.my_candidate, last_9)
+            self.assertEqual(conversion.decoded, [u"full-sync-text"])
+
+        other.call(decode)
+
+    @skipUnless(environ.get("TEST_BENCHMARK") == "yes", "This 'unittest' measures the decoders, as such, this is not part of the code review process")
+    def test_decode_benchmark(self, length=2000):
+        """
+        Decode a mix of message types with and without the compiled decoders.
+
+        Signatures are not verified, as the cryptography would otherwise dominate the measurement.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        packets = self._create_packets(node, length)
+        # warm up the member cache
+        self._decode_packets(other, packets[:10], True)
+
+        _, generic_took = self._decode_packets(other, packets, False, False)
+        _, compiled_took = self._decode_packets(other, packets, True, False)
+        self._logger.info("decoding %d packets took %.3fs generic and %.3fs compiled (%.1f%% speedup)",
+                          length, generic_took, compiled_took, 100.0 * (generic_took - compiled_took) / generic_took)
+
+    def test_zero_copy_decode(self):
+        """
+        The signature check must receive a view on the packet instead of a copy of the signed bytes.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        packets = self._create_packets(node, 10)
+        crypto = other._dispersy.crypto
+        received = []
+
+        def is_valid_signature(ec, data, signature):
+            received.append(data)
+            return original(ec, data, signature)
+
+        original, crypto.is_valid_signature = crypto.is_valid_signature, is_valid_signature
+        try:
+            for compiled in (True, False):
+                del received[:]
+                messages, _ = self._decode_packets(other, packets, compiled)
+                self.assertEqual(len(received), len(packets))
+                self.assertTrue(all(isinstance(data, buffer) for data in received), [type(data) for data in received])
+                self.assertEqual([str(data) for data in received], [message.packet[:-message.authentication.member.signature_length] for message in messages])
+        finally:
+            del crypto.is_valid_signature
+
+    def test_zero_copy_opt_in(self):
+        """
+        Only the payload decoders that enable zero_copy receive a buffer, all others receive a str.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        packet = node.encode_message(node.create_full_sync_text("opt in", 42))
+        meta = other._community.get_meta_message(u"full-sync-text")
+        received = []
+
+        def encode_text(message):
+            return message.payload.text,
+
+        def decode_text(placeholder, offset, data):
+            received.append(type(data))
+            return len(data), placeholder.meta.payload.implement(data[offset:])
+
+        def decode():
+            for compiled in (True, False):
+                for zero_copy in (True, False):
+                    del received[:]
+                    conversion = NoDefBinaryConversion(other._community, packet[1])
+                    conversion.define_meta_message(packet[22], meta, encode_text, decode_text, compiled, zero_copy)
+                    message = conversion.decode_message(other.my_candidate, packet)
+                    self.assertEqual(message.payload.text, "opt in")
+                    self.assertEqual(received, [buffer if zero_copy else str])
+
+        other.call(decode)
+
+    @skipUnless(environ.get("TEST_BENCHMARK") == "yes", "This 'unittest' measures the signature verification, as such, this is not part of the code review process")
+    def test_zero_copy_benchmark(self, length=2000):
+        """
+        Decode a mix of message types, with signature verification, and report the number of signed
+        bytes that are copied per packet.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        packets = self._create_packets(node, length)
+        crypto = other._dispersy.crypto
+        copied = [0]
+
+        def is_valid_signature(ec, data, signature):
+            if not isinstance(data, buffer):
+                copied[0] += len(data)
+            return original(ec, data, signature)
+
+        original, crypto.is_valid_signature = crypto.is_valid_signature, is_valid_signature
+        try:
+            _, took = self._decode_packets(other, packets, True)
+        finally:
+            del crypto.is_valid_signature
+
+        self._logger.info("decoding %d packets took %.3fs (%.1fus per packet), %.1f signed bytes copied per packet",
+                          length, took, 1000000.0 * took / length, float(copied[0]) / length)
+        self.assertEqual(copied[0], 0)
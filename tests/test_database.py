@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+from sqlite3 import Connection
+from threading import Event
+from unittest import TestCase
+
+from ..database import ReadOnlyConnectionPool
+from ..dispersydatabase import SYNC_BUCKETS, get_sync_modulo, get_sync_modulo_clause, is_sync_bucket_modulo
+
+
+class TestReadOnlyConnectionPool(TestCase):
+
+    def setUp(self):
+        super(TestReadOnlyConnectionPool, self).setUp()
+        self._directory = tempfile.mkdtemp()
+        self._file_path = unicode(os.path.join(self._directory, "test.db"))
+
+        # the main connection remains open, as it would in Dispersy
+        self._connection = Connection(self._file_path)
+        self._connection.execute(u"PRAGMA journal_mode = WAL")
+        self._connection.execute(u"CREATE TABLE item (value INTEGER)")
+        self._connection.executemany(u"INSERT INTO item (value) VALUES (?)", [(value,) for value in xrange(10)])
+        self._connection.commit()
+
+        self._pool = ReadOnlyConnectionPool(self._file_path, threads=1, max_pending=2)
+
+    def tearDown(self):
+        super(TestReadOnlyConnectionPool, self).tearDown()
+        self.assertTrue(self._pool.stop())
+        self._connection.close()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def test_memory(self):
+        """
+        An in-memory database can not be shared between connections.
+        """
+        self.assertFalse(ReadOnlyConnectionPool(u":memory:").available)
+        self.assertTrue(self._pool.available)
+
+    def test_submit(self):
+        """
+        A job must be able to read the committed rows while the main connection writes.
+        """
+        finished = Event()
+        results = []
+
+        def job(cursor, minimum):
+            results.extend(value for value, in cursor.execute(u"SELECT value FROM item WHERE value >= ?", (minimum,)))
+            finished.set()
+
+        self._connection.execute(u"INSERT INTO item (value) VALUES (10)")
+        self.assertTrue(self._pool.submit(job, 5))
+        self.assertTrue(finished.wait(5.0))
+        # the insert has not been committed yet
+        self.assertEqual(sorted(results), range(5, 10))
+
+    def test_read_only(self):
+        """
+        A job must not be able to change the database.
+        """
+        finished = Event()
+
+        def job(cursor):
+            try:
+                cursor.execute(u"DELETE FROM item")
+            finally:
+                finished.set()
+
+        self.assertTrue(self._pool.submit(job))
+        self.assertTrue(finished.wait(5.0))
+        self.assertEqual(self._connection.execute(u"SELECT COUNT(*) FROM item").fetchone(), (10,))
+
+    def test_max_pending(self):
+        """
+        No more than MAX_PENDING jobs may be queued or running.
+        """
+        release = Event()
+        finished = Event()
+
+        def blocking_job(cursor):
+            release.wait(5.0)
+
+        def job(cursor):
+            finished.set()
+
+        self.assertTrue(self._pool.submit(blocking_job))
+        self.assertTrue(self._pool.submit(job))
+        self.assertFalse(self._pool.submit(job))
+        self.assertEqual(self._pool.pending, 2)
+
+        release.set()
+        self.assertTrue(finished.wait(5.0))
+        self.assertTrue(self._pool.submit(job))
+
+        statistics = self._pool.get_dict()
+        self.assertEqual(statistics[u"submitted"], 3)
+        self.assertEqual(statistics[u"dropped"], 1)
+
+
+class TestSyncBuckets(TestCase):
+
+    def test_get_sync_modulo(self):
+        """
+        The modulo must be rounded up to a divisor of SYNC_BUCKETS.
+        """
+        self.assertEqual([get_sync_modulo(modulo) for modulo in (1, 2, 10, 11, 100, 2520)], [1, 2, 10, 12, 105, 2520])
+        self.assertEqual(get_sync_modulo(2521), 2521)
+
+    def test_get_sync_modulo_clause(self):
+        """
+        The bucket clause must select the same global times as the predicate, and must be the same
+        statement for every offset.  Small moduli must use the predicate.
+        """
+        connection = Connection(u":memory:")
+        connection.execute(u"CREATE TABLE sync (global_time INTEGER, bucket INTEGER)")
+        connection.executemany(u"INSERT INTO sync (global_time, bucket) VALUES (?, ?)",
+                               [(global_time, global_time % SYNC_BUCKETS) for global_time in xrange(1, 6000)])
+
+        self.assertEqual([modulo for modulo in xrange(1, 11) if is_sync_bucket_modulo(modulo)], [6, 7, 8, 9, 10])
+        self.assertFalse(is_sync_bucket_modulo(10, ordered=True))
+        self.assertTrue(is_sync_bucket_modulo(105, ordered=True))
+
+        for modulo in (1, 2, 3, 4, 5, 6, 7, 11, 105, 360, 2520, 2521):
+            for ordered in (False, True):
+                clauses = set()
+                for offset in (0, 1, modulo - 1):
+                    clause, arguments = get_sync_modulo_clause(offset, modulo, ordered)
+                    self.assertEqual(clause.startswith(u"sync.bucket"), is_sync_bucket_modulo(modulo, ordered))
+                    clauses.add(clause)
+                    global_times = [global_time for global_time, in connection.execute(u"SELECT global_time FROM sync WHERE %s" % clause, arguments)]
+                    self.assertEqual(global_times, [global_time for global_time in xrange(1, 6000) if (global_time + offset) % modulo == 0])
+                self.assertEqual(len(clauses), 1)
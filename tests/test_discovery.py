@@ -1,10 +1,20 @@
 from .dispersytestclass import DispersyTestFunc
-from ..discovery.community import DiscoveryCommunity, BOOTSTRAP_FILE_ENVNAME
+from ..candidate import WalkCandidate
+from ..discovery.community import ActualTasteBuddy, DiscoveryCommunity, PossibleTasteBuddy, BOOTSTRAP_FILE_ENVNAME
 from ..discovery.bootstrap import _DEFAULT_ADDRESSES
+from ..util import blocking_call_on_reactor_thread
+from .debugcommunity.community import DebugCommunity
 import os
 import time
 
 
+class WalkingDebugCommunity(DebugCommunity):
+
+    @property
+    def dispersy_enable_candidate_walker(self):
+        return True
+
+
 class TestDiscovery(DispersyTestFunc):
 
     def setUp(self):
@@ -70,3 +80,50 @@ class TestDiscovery(DispersyTestFunc):
 
     def create_nodes(self, *args, **kwargs):
         return super(TestDiscovery, self).create_nodes(*args, communityclass=DiscoveryCommunity, **kwargs)
+
+    @blocking_call_on_reactor_thread
+    def test_preference_vector(self):
+        """
+        The preference vector must be rebuilt when a community is attached or detached.
+        """
+        community = self._community
+        # the discovery community is not auto loaded in these tests
+        self._dispersy._discovery_community = community
+        self.assertEqual(set(community.preference_vector.preferences), set(community.my_preferences()))
+
+        other = WalkingDebugCommunity.create_community(self._dispersy, self._mm.my_member)
+        self.assertIn(other.cid, community.preference_vector.preferences)
+        self.assertEqual(set(community.preference_vector.preferences), set(community.my_preferences()))
+
+        other.unload_community()
+        self.assertNotIn(other.cid, community.preference_vector.preferences)
+
+    @blocking_call_on_reactor_thread
+    def test_clean_possible_taste_buddies(self):
+        """
+        Every possible taste buddy that is less similar than the least similar taste buddy must be
+        removed, also when it is not the first in timestamp order.
+        """
+        community = self._community
+        now = time.time()
+
+        def create_candidate(index):
+            sock_addr = ("1.1.1.%d" % index, index + 1)
+            candidate = WalkCandidate(sock_addr, False, sock_addr, sock_addr, u"unknown")
+            candidate.associate(self._dispersy.get_new_member(u"very-low"))
+            return candidate
+
+        taste_buddy = ActualTasteBuddy(2, set(), now, create_candidate(1))
+        taste_buddy.random_sort_value = 0.5
+        community.taste_buddies.add(taste_buddy)
+
+        received_from = create_candidate(2)
+        possibles = []
+        for overlap, age, random_sort_value in ((1, 0, 0.9), (2, 10, 0.9), (2, 0, 0.1), (3, 20, 0.1)):
+            possible = PossibleTasteBuddy(overlap, set(), now - age, self._dispersy.get_new_member(u"very-low").mid, received_from)
+            possible.random_sort_value = random_sort_value
+            community.possible_taste_buddies.add(possible)
+            possibles.append(possible)
+
+        community.clean_possible_taste_buddies()
+        self.assertEqual(sorted(community.possible_taste_buddies, key=possibles.index), [possibles[1], possibles[3]])
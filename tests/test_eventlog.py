@@ -0,0 +1,99 @@
+from StringIO import StringIO
+from os import environ
+from time import time
+from unittest import TestCase, skipUnless
+import logging
+
+from ..tracker.eventlog import (DESTROY_OUT, DROP_NEWEST, DROP_OLDEST, REQ_IN2, RES_IN2, EventLog, format_event,
+                                iter_events)
+
+
+CID = "c" * 20
+MID = "m" * 20
+
+
+class TestEventLog(TestCase):
+
+    def setUp(self):
+        super(TestEventLog, self).setUp()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def test_text(self):
+        """
+        Text events must use the REQ_IN2 HEX(COMMUNITY) hex(MEMBER) DISPERSY-VERSION OVERLAY-VERSION
+        ADDRESS PORT format.
+        """
+        stream = StringIO()
+        event_log = EventLog(stream)
+        event_log.record(REQ_IN2, CID, MID, "\x01", "\x02", ("1.2.3.4", 5))
+        event_log.record(DESTROY_OUT, CID, MID, "\x01", "\x02", ("1.2.3.4", 6))
+        self.assertEqual(stream.getvalue(), "")
+
+        event_log.stop()
+        self.assertEqual(stream.getvalue(),
+                         "REQ_IN2 %s %s 1 2 1.2.3.4 5\n" % (CID.encode("HEX"), MID.encode("HEX")) +
+                         "DESTROY_OUT %s %s 1 2 1.2.3.4 6\n" % (CID.encode("HEX"), MID.encode("HEX")))
+
+    def test_binary(self):
+        """
+        Binary events must convert to the same lines as text events, a truncated record is ignored.
+        """
+        text = StringIO()
+        binary = StringIO()
+        for stream, event_log in ((text, EventLog(text)), (binary, EventLog(binary, binary=True))):
+            for port in xrange(10):
+                event_log.record(RES_IN2, CID, MID, "\x01", "\x02", ("1.2.3.4", port))
+            event_log.stop()
+
+        binary = StringIO(binary.getvalue()[:-1])
+        self.assertEqual("".join(format_event(*event) + "\n" for event in iter_events(binary)),
+                         "".join(text.getvalue().splitlines(True)[:-1]))
+
+    def test_drop(self):
+        """
+        A full buffer must drop either the newest or the oldest events.
+        """
+        for drop, ports in ((DROP_NEWEST, range(5)), (DROP_OLDEST, range(5, 10))):
+            stream = StringIO()
+            event_log = EventLog(stream, binary=True, max_events=5, drop=drop)
+            for port in xrange(10):
+                event_log.record(REQ_IN2, CID, MID, "\x01", "\x02", ("1.2.3.4", port))
+            self.assertEqual(event_log.dropped_count, 5)
+            event_log.stop()
+
+            stream.seek(0)
+            self.assertEqual([event[-1] for event in iter_events(stream)], ports)
+
+    def test_thread(self):
+        """
+        The background thread must write the events.
+        """
+        stream = StringIO()
+        event_log = EventLog(stream, flush_interval=0.01)
+        event_log.start()
+        event_log.record(REQ_IN2, CID, MID, "\x01", "\x02", ("1.2.3.4", 5))
+        end = time() + 5.0
+        while not stream.getvalue() and time() < end:
+            event_log._wakeup.wait(0.01)
+        self.assertEqual(len(stream.getvalue().splitlines()), 1)
+        event_log.stop()
+
+    @skipUnless(environ.get("TEST_BENCHMARK") == "yes", "This 'unittest' measures the event log, as such, this is not part of the code review process")
+    def test_record_benchmark(self, length=100000):
+        """
+        Report the cost of recording an event on the reactor thread compared to printing it.
+        """
+        event_log = EventLog(StringIO(), max_events=length)
+        begin = time()
+        for port in xrange(length):
+            event_log.record(REQ_IN2, CID, MID, "\x01", "\x02", ("1.2.3.4", port))
+        recorded = time() - begin
+
+        stream = StringIO()
+        begin = time()
+        for port in xrange(length):
+            print >> stream, "REQ_IN2", CID.encode("HEX"), MID.encode("HEX"), ord("\x01"), ord("\x02"), "1.2.3.4", port
+        printed = time() - begin
+
+        self._logger.info("recording an event takes %.2fus, printing it took %.2fus",
+                          1000000.0 * recorded / length, 1000000.0 * printed / length)
@@ -0,0 +1,54 @@
+from os import environ
+from sys import getsizeof
+from unittest import skipUnless
+
+from .dispersytestclass import DispersyTestFunc
+
+
+class _Unslotted(object):
+    pass
+
+
+class TestMessage(DispersyTestFunc):
+
+    def _implementations(self, message):
+        return [message, message.authentication, message.resolution, message.distribution, message.destination, message.payload]
+
+    def _slot_names(self, implementation):
+        return [name for cls in type(implementation).__mro__ for name in getattr(cls, "__slots__", ())]
+
+    def test_slots(self):
+        """
+        Messages created or decoded by a node, and their policy implementations, must not have a __dict__.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+
+        messages = [node.create_full_sync_text("slots", 10),
+                    node.create_sequence_text("slots", 11, 1),
+                    node.create_introduction_request(other.my_candidate, node.lan_address, node.wan_address, True, u"unknown", None, 1, 12)]
+        messages.extend([other.call(other._community.get_conversion_for_packet(message.packet).decode_message, other.my_candidate, message.packet)
+                         for message in messages])
+
+        for message in messages:
+            for implementation in self._implementations(message):
+                self.assertFalse(hasattr(implementation, "__dict__"), implementation)
+
+    @skipUnless(environ.get("TEST_BENCHMARK") == "yes", "This 'unittest' reports the memory used by messages, as such, this is not part of the code review process")
+    def test_memory_benchmark(self):
+        """
+        Report the memory used by a message and its policy implementations, compared to the same
+        instances using a per instance __dict__.
+        """
+        node, = self.create_nodes(1)
+        for message in (node.create_full_sync_text("memory", 10),
+                        node.create_introduction_request(node.my_candidate, node.lan_address, node.wan_address, True, u"unknown", None, 1, 11)):
+            slotted = dictionary = 0
+            for implementation in self._implementations(message):
+                slotted += getsizeof(implementation)
+                attributes = dict((name, getattr(implementation, name)) for name in self._slot_names(implementation) if hasattr(implementation, name))
+                dictionary += getsizeof(_Unslotted()) + getsizeof(attributes)
+
+            self._logger.info("%s uses %d bytes with __slots__ and %d bytes with __dict__ (%d bytes saved per message)",
+                              message.name, slotted, dictionary, dictionary - slotted)
+            self.assertLess(slotted, dictionary)
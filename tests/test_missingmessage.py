@@ -1,8 +1,29 @@
 from random import shuffle
+from unittest import TestCase
 
+from ..candidate import Candidate
+from ..community import ResponseBudget
 from .dispersytestclass import DispersyTestFunc
 
 
+class TestResponseBudget(TestCase):
+
+    def test_claim(self):
+        """
+        The packets claimed for one candidate must stop after the limit is reached, until the window
+        has passed.
+        """
+        budget = ResponseBudget(window=1.0)
+        candidate = Candidate(("1.2.3.4", 5), False)
+        other = Candidate(("1.2.3.4", 6), False)
+        packets = ["x" * 10] * 5
+
+        self.assertEqual(budget.claim(candidate, packets, 25, now=100.0), packets[:3])
+        self.assertEqual(budget.claim(candidate, packets, 25, now=100.5), [])
+        self.assertEqual(budget.claim(other, packets, 25, now=100.5), packets[:3])
+        self.assertEqual(budget.claim(candidate, packets, 25, now=101.0), packets[:3])
+
+
 class TestMissingMessage(DispersyTestFunc):
 
     def _test_with_order(self, batchFUNC):
@@ -45,3 +66,22 @@ class TestMissingMessage(DispersyTestFunc):
                 batches.append([messages[i], messages[i + 1]])
             return batches
         self._test_with_order(batch)
+
+    def test_batched_requests(self):
+        """
+        Overlapping requests from one candidate that are processed in one batch must be answered
+        with every message once.
+        """
+        node, other = self.create_nodes(2)
+        node.send_identity(other)
+
+        messages = [node.create_full_sync_text("Message #%d" % i, i + 10) for i in xrange(10)]
+        node.give_messages(messages, node)
+
+        global_times = [message.distribution.global_time for message in messages]
+        requests = [other.create_missing_message(node.my_member, global_times[:6]),
+                    other.create_missing_message(node.my_member, global_times[4:])]
+        node.give_messages(requests, other)
+
+        responses = [response for _, response in other.receive_messages(names=[messages[0].name])]
+        self.assertEqual(sorted(response.distribution.global_time for response in responses), global_times)
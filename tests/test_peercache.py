@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+
+from nose.twistedtools import reactor
+
+from ..discovery.community import DiscoveryCommunity, PeerCache
+from ..util import blockingCallFromThread, blocking_call_on_reactor_thread
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestPeerCache(DispersyTestFunc):
+
+    def setUp(self):
+        super(TestPeerCache, self).setUp()
+        self._directory = tempfile.mkdtemp()
+        self._filename = os.path.join(self._directory, "peercache.txt")
+
+    def tearDown(self):
+        super(TestPeerCache, self).tearDown()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def create_nodes(self, *args, **kwargs):
+        return super(TestPeerCache, self).create_nodes(*args, communityclass=DiscoveryCommunity, **kwargs)
+
+    @blocking_call_on_reactor_thread
+    def _create_peer_cache(self, limit=100):
+        # the peer cache of the community uses the same task name
+        self._community.cancel_pending_task("clean_and_save_peer_cache")
+        return PeerCache(self._filename, self._community, limit)
+
+    @blocking_call_on_reactor_thread
+    def _create_candidate(self, index):
+        sock_addr = ("1.1.1.%d" % index, index)
+        return self._community.create_or_update_walkcandidate(sock_addr, sock_addr, sock_addr, False, u"public")
+
+    def _save(self, peer_cache):
+        return blockingCallFromThread(reactor, peer_cache.clean_and_save)
+
+    def _read_lines(self):
+        with open(self._filename, "r") as stream:
+            return [line for line in stream if not line.startswith("#")]
+
+    def test_journal(self):
+        """
+        Only the peers that changed must be appended, and loading the journal must restore the
+        latest information.
+        """
+        peer_cache = self._create_peer_cache()
+        candidates = [self._create_candidate(index) for index in xrange(1, 4)]
+        for candidate in candidates:
+            peer_cache.add_or_update_peer(candidate)
+        self._save(peer_cache)
+        self.assertEqual(len(self._read_lines()), 3)
+
+        peer_cache.set_last_checked(candidates[0], 42.0)
+        peer_cache.inc_num_fails(candidates[1])
+        self._save(peer_cache)
+        self.assertEqual(len(self._read_lines()), 5)
+
+        loaded = self._create_peer_cache()
+        self.assertEqual(len(loaded.walkcandidates), 3)
+        self.assertEqual(loaded.get_peer_info(candidates[0])["last_checked"], 42.0)
+        self.assertEqual(loaded.get_peer_info(candidates[1])["num_fails"], 1)
+        self.assertIn(loaded.get_peer(), candidates[1:])
+
+    def test_get_peer(self):
+        """
+        get_peer must return the peer that was checked the longest ago.
+        """
+        peer_cache = self._create_peer_cache()
+        candidates = [self._create_candidate(index) for index in xrange(1, 4)]
+        for index, candidate in enumerate(candidates):
+            peer_cache.add_or_update_peer(candidate)
+            peer_cache.set_last_checked(candidate, 10.0 + index)
+        self.assertEqual(peer_cache.get_peer(), candidates[0])
+
+        peer_cache.set_last_checked(candidates[0], 20.0)
+        self.assertEqual(peer_cache.get_peer(), candidates[1])
+
+        for _ in xrange(4):
+            peer_cache.inc_num_fails(candidates[1])
+        self._save(peer_cache)
+        self.assertEqual(peer_cache.get_peer(), candidates[2])
+
+        # the failed peer must not be loaded again
+        loaded = self._create_peer_cache()
+        self.assertIsNone(loaded.get_peer_info(candidates[1]))
+
+    def test_compact(self):
+        """
+        A journal with many outdated lines must be replaced by one line per peer, and only the most
+        recently seen peers are kept.
+        """
+        peer_cache = self._create_peer_cache(limit=2)
+        candidates = [self._create_candidate(index) for index in xrange(1, 4)]
+        for candidate in candidates:
+            peer_cache.add_or_update_peer(candidate)
+        for _ in xrange(10):
+            for candidate in candidates:
+                peer_cache.set_last_checked(candidate, 1.0)
+            self._save(peer_cache)
+        # without compaction the journal would contain 21 lines
+        self.assertLessEqual(len(self._read_lines()), 4 * 2 + 2 + 3)
+
+        self.assertEqual(len(peer_cache.walkcandidates), 2)
+        self.assertNotIn(candidates[0], peer_cache.walkcandidates)
+        loaded = self._create_peer_cache()
+        self.assertEqual(sorted(loaded.walkcandidates), sorted(candidates[1:]))
+
+    def test_failed_write(self):
+        """
+        The peers of a write that failed must be written the next time.
+        """
+        peer_cache = self._create_peer_cache()
+        candidates = [self._create_candidate(index) for index in xrange(1, 4)]
+        for candidate in candidates:
+            peer_cache.add_or_update_peer(candidate)
+
+        def failing_write(lines, compact):
+            raise IOError("disk full")
+        peer_cache._write = failing_write
+        self._save(peer_cache)
+        self.assertFalse(os.path.exists(self._filename))
+        self.assertEqual(peer_cache._journal_length, 0)
+
+        del peer_cache._write
+        self._save(peer_cache)
+        self.assertEqual(len(self._read_lines()), 3)
+        self.assertEqual(peer_cache._journal_length, 3)
@@ -0,0 +1,76 @@
+import logging
+from os import environ
+from random import random
+from time import time
+from unittest import TestCase, skipUnless
+
+from ..discovery.community import TasteBuddy
+from ..discovery.preferences import PreferenceVector
+
+
+class TestPreferenceVector(TestCase):
+
+    def setUp(self):
+        super(TestPreferenceVector, self).setUp()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def test_overlap(self):
+        """
+        The overlap must equal the size of the set intersection and the mask must contain the bit of
+        every overlapping index.
+        """
+        his_preferences = [str(index) * 20 for index in xrange(5)]
+        vector = PreferenceVector(his_preferences)
+        preferences = set([his_preferences[1], his_preferences[3], "x" * 20])
+
+        self.assertEqual(vector.overlap(preferences), len(set(his_preferences) & preferences))
+        self.assertEqual(vector.mask(preferences), 2 ** 1 + 2 ** 3)
+        self.assertEqual(vector.overlap([]), 0)
+
+    def test_duplicates(self):
+        """
+        A preference that occurs more than once must be counted once.
+        """
+        vector = PreferenceVector(["a" * 20, "b" * 20, "a" * 20])
+        self.assertEqual(vector.overlap(["a" * 20]), 1)
+        self.assertEqual(vector.mask(["a" * 20, "b" * 20]), 3)
+
+    def test_score(self):
+        """
+        score must give the same overlap and bitfield as the original per-index computation.
+        """
+        his_preferences = ["%020d" % index for index in xrange(25)]
+        vector = PreferenceVector(his_preferences)
+        taste_buddies = [TasteBuddy(0, set(his_preferences[index] for index in xrange(len(his_preferences)) if random() < 0.3), None)
+                         for _ in xrange(50)]
+
+        for overlap, mask, taste_buddy in vector.score(taste_buddies):
+            self.assertEqual(overlap, len(set(his_preferences) & taste_buddy.preferences))
+            self.assertEqual(mask, sum([2 ** index for index in range(len(his_preferences))
+                                        if his_preferences[index] in taste_buddy.preferences]))
+
+    @skipUnless(environ.get("TEST_BENCHMARK") == "yes", "This 'unittest' measures the preference vector, as such, this is not part of the code review process")
+    def test_score_benchmark(self, taste_buddy_count=100, rounds=200):
+        """
+        Report the time needed to score taste buddies compared to building sets and bitfields for
+        every taste buddy.
+        """
+        my_preferences = ["%020d" % index for index in xrange(25)]
+        his_preferences = ["%020d" % index for index in xrange(10, 35)]
+        taste_buddies = [TasteBuddy(0, set(my_preferences[:index % 25]), None) for index in xrange(taste_buddy_count)]
+
+        begin = time()
+        for _ in xrange(rounds):
+            for tb in taste_buddies:
+                len(set(his_preferences) & set(tb.preferences))
+                sum([2 ** index for index in range(min(len(his_preferences), 4 * 8))
+                     if his_preferences[index] in tb.preferences])
+        sets = time() - begin
+
+        begin = time()
+        for _ in xrange(rounds):
+            PreferenceVector(his_preferences).score(taste_buddies)
+        vectors = time() - begin
+
+        self._logger.info("scoring %d taste buddies %d times took %.2fs using sets and %.2fs using a preference vector",
+                          taste_buddy_count, rounds, sets, vectors)
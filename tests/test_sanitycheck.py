@@ -0,0 +1,155 @@
+import json
+from time import sleep
+
+from ..sanitycheck import SanityCheck
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestSanityCheck(DispersyTestFunc):
+
+    def _create_messages(self, node, other):
+        messages = [other.create_sequence_text("Sequence message #%d" % sequence, sequence + 10, sequence)
+                    for sequence in xrange(1, 11)]
+        messages.extend(other.create_full_sync_text("Full sync #%d" % index, index + 30) for index in xrange(5))
+        messages.append(other.create_last_1_test("Last #1", 40))
+        node.give_messages(messages, other)
+        return messages
+
+    def _delete(self, node, message):
+        def delete():
+            member = node._dispersy.get_member(public_key=message.authentication.member.public_key)
+            node._dispersy.database.execute(u"DELETE FROM sync WHERE member = ? AND global_time = ?",
+                                            (member.database_id, message.distribution.global_time))
+        node.call(delete)
+
+    def test_sanity_check(self):
+        """
+        A consistent database must pass the sanity check, checking a few rows at a time must give
+        the same result.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+        self._create_messages(node, other)
+
+        node.call(node._dispersy.sanity_check, node._community, test_binary=True)
+
+        def run_in_chunks():
+            sanity_check = SanityCheck(node._dispersy, node._community, test_binary=True)
+            sanity_check.chunk_size = 3
+            sanity_check.run()
+            return sanity_check
+        sanity_check = node.call(run_in_chunks)
+        self.assertEqual(sanity_check.findings, [])
+        self.assertGreater(sanity_check.rows_checked, 16)
+
+    def test_findings(self):
+        """
+        A missing sequence number must raise a ValueError in the blocking sanity check and be
+        reported by the background sanity check.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+        messages = self._create_messages(node, other)
+        self._delete(node, messages[4])
+
+        self.assertRaises(ValueError, node.call, node._dispersy.sanity_check, node._community)
+
+        node.call(node._community.start_sanity_check, chunk_size=2, interval=0.01)
+        for _ in xrange(100):
+            progress = node._community.statistics.sanity_check
+            if progress[u"done"]:
+                break
+            sleep(0.05)
+
+        self.assertTrue(progress[u"done"])
+        # every message after the missing one has an unexpected sequence number
+        self.assertEqual([step for step, _ in progress[u"findings"]], [u"sequence-number sequence-text"] * 5)
+
+    def test_resume(self):
+        """
+        A sanity check must continue at the stored step and cursor.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+        self._create_messages(node, other)
+
+        def interrupt():
+            sanity_check = SanityCheck(node._dispersy, node._community)
+            sanity_check.chunk_size = 2
+            for _ in xrange(3):
+                sanity_check.step()
+            sanity_check.save()
+            return sanity_check.current_step, sanity_check.rows_checked
+
+        def resume():
+            sanity_check = SanityCheck(node._dispersy, node._community)
+            sanity_check.chunk_size = 2
+            self.assertTrue(sanity_check.load())
+            step = sanity_check.current_step
+            sanity_check.run()
+            sanity_check.save()
+            return step, sanity_check.rows_checked, sanity_check.findings
+
+        def fresh():
+            return SanityCheck(node._dispersy, node._community).load()
+
+        step, rows = node.call(interrupt)
+        resumed_step, resumed_rows, findings = node.call(resume)
+        self.assertEqual(resumed_step, step)
+        self.assertEqual(findings, [])
+
+        # the resumed check must not check the rows that were already checked
+        def full():
+            sanity_check = SanityCheck(node._dispersy, node._community)
+            sanity_check.run()
+            return sanity_check.rows_checked
+        self.assertEqual(rows + resumed_rows, node.call(full))
+
+        # a finished check must remove its cursor
+        self.assertFalse(node.call(fresh))
+
+    def test_resume_changed_steps(self):
+        """
+        A sanity check must continue at the stored step by name, also when the steps changed, and
+        must restart a step whose stored cursor does not fit.
+        """
+        node, other = self.create_nodes(2)
+        other.send_identity(node)
+        messages = self._create_messages(node, other)
+        self._delete(node, messages[4])
+        step_name = u"sequence-number sequence-text"
+
+        def interrupt():
+            sanity_check = SanityCheck(node._dispersy, node._community)
+            sanity_check.chunk_size = 7
+            while sanity_check.current_step != step_name or not sanity_check.findings:
+                sanity_check.step()
+            sanity_check.save()
+            return sanity_check.findings
+
+        def resume(**kargs):
+            # without the identity and undo-other steps the step index differs
+            sanity_check = SanityCheck(node._dispersy, node._community, test_identity=False, test_undo_other=False)
+            self.assertTrue(sanity_check.load())
+            self.assertEqual(sanity_check.current_step, step_name)
+            cursor = sanity_check._cursor
+            sanity_check.run()
+            return cursor, sanity_check.findings
+
+        def corrupt():
+            node._dispersy.database.execute(u"UPDATE option SET value = ? WHERE key = ?",
+                                            (json.dumps({u"step": step_name, u"cursor": [1], u"findings": []}).decode("UTF-8"),
+                                             SanityCheck(node._dispersy, node._community).option_key))
+
+        findings = node.call(interrupt)
+        cursor, resumed_findings = node.call(resume)
+        self.assertEqual(len(cursor), 2)
+        # the findings from before the restart must be kept
+        self.assertEqual(resumed_findings[:len(findings)], findings)
+        self.assertEqual(len(resumed_findings), 5)
+
+        node.call(interrupt)
+        node.call(corrupt)
+        cursor, resumed_findings = node.call(resume)
+        self.assertEqual(cursor, ())
+        self.assertEqual(len(resumed_findings), 5)
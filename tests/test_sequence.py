@@ -1,8 +1,103 @@
 from collections import defaultdict
+from unittest import TestCase
 
+from ..community import MissingSequenceCache
 from .dispersytestclass import DispersyTestFunc
 
 
+class SequenceDatabase(object):
+
+    """
+    Answers the missing-sequence query from a list of (sequence, packet) tuples and counts the queries.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def execute(self, statement, bindings):
+        _, _, low, high = bindings
+        self.queries += 1
+        return [(sequence, packet) for sequence, packet in self.rows if low <= sequence <= high]
+
+
+class TestMissingSequenceCache(TestCase):
+
+    def test_cached_ranges(self):
+        """
+        Repeated requests must be answered from the cache, only sequence numbers above the cached
+        range may be read from the database.
+        """
+        database = SequenceDatabase([(sequence, "packet #%d" % sequence) for sequence in xrange(1, 11)])
+        cache = MissingSequenceCache()
+
+        self.assertEqual([sequence for sequence, _ in cache.iter_packets(database, 1, 2, 1, 5, now=100.0)], range(1, 6))
+        self.assertEqual([sequence for sequence, _ in cache.iter_packets(database, 1, 2, 2, 4, now=100.0)], range(2, 5))
+        self.assertEqual(database.queries, 1)
+
+        self.assertEqual([sequence for sequence, _ in cache.iter_packets(database, 1, 2, 3, 10, now=100.0)], range(3, 11))
+        self.assertEqual(database.queries, 2)
+        self.assertEqual([sequence for sequence, _ in cache.iter_packets(database, 1, 2, 1, 8, now=100.0)], range(1, 9))
+        self.assertEqual(database.queries, 2)
+
+        # stopping early must leave the entry covering the packets that were read
+        packets = cache.iter_packets(database, 1, 3, 1, 10, now=100.0)
+        next(packets)
+        packets.close()
+        self.assertEqual([sequence for sequence, _ in cache.iter_packets(database, 1, 3, 1, 10, now=100.0)], range(1, 11))
+        self.assertEqual(database.queries, 4)
+
+    def test_expire(self):
+        """
+        Entries must be read from the database again after their lifetime or after being discarded.
+        """
+        database = SequenceDatabase([(sequence, "packet #%d" % sequence) for sequence in xrange(1, 11)])
+        cache = MissingSequenceCache(lifetime=5.0)
+
+        list(cache.iter_packets(database, 1, 2, 1, 5, now=100.0))
+        list(cache.iter_packets(database, 1, 2, 1, 5, now=106.0))
+        self.assertEqual(database.queries, 2)
+
+        cache.discard(1, 2)
+        list(cache.iter_packets(database, 1, 2, 1, 5, now=106.0))
+        self.assertEqual(database.queries, 3)
+
+        # discarding the meta message must discard the packets of every member
+        list(cache.iter_packets(database, 3, 2, 1, 5, now=106.0))
+        list(cache.iter_packets(database, 1, 4, 1, 5, now=106.0))
+        cache.discard_meta(2)
+        list(cache.iter_packets(database, 1, 2, 1, 5, now=106.0))
+        list(cache.iter_packets(database, 3, 2, 1, 5, now=106.0))
+        list(cache.iter_packets(database, 1, 4, 1, 5, now=106.0))
+        self.assertEqual(database.queries, 7)
+
+    def test_byte_limits(self):
+        """
+        Entries must not cache more than ENTRY_BYTES bytes and the cache must not hold more than
+        TOTAL_BYTES bytes.
+        """
+        database = SequenceDatabase([(sequence, "packet #%02d" % sequence) for sequence in xrange(1, 21)])
+        cache = MissingSequenceCache(entry_bytes=30, total_bytes=60)
+
+        # only the first three packets fit the entry, the others are read every time
+        self.assertEqual([sequence for sequence, _ in cache.iter_packets(database, 1, 2, 1, 5, now=100.0)], range(1, 6))
+        self.assertEqual(cache.bytes, 30)
+        self.assertEqual([sequence for sequence, _ in cache.iter_packets(database, 1, 2, 1, 3, now=100.0)], range(1, 4))
+        self.assertEqual(database.queries, 1)
+        self.assertEqual([sequence for sequence, _ in cache.iter_packets(database, 1, 2, 1, 5, now=100.0)], range(1, 6))
+        self.assertEqual(database.queries, 2)
+
+        # the least recently used entry is removed
+        list(cache.iter_packets(database, 3, 2, 1, 3, now=100.0))
+        list(cache.iter_packets(database, 4, 2, 1, 3, now=100.0))
+        self.assertEqual(cache.bytes, 60)
+        list(cache.iter_packets(database, 1, 2, 1, 3, now=100.0))
+        self.assertEqual(database.queries, 5)
+
+        cache.discard_meta(2)
+        self.assertEqual(cache.bytes, 0)
+
+
 class TestIncomingMissingSequence(DispersyTestFunc):
 
     def incoming_simple_conflict_different_global_time(self):
@@ -188,6 +283,36 @@ class TestIncomingMissingSequence(DispersyTestFunc):
     def test_requests_2_24(self):
         self.requests(2, [], (11, 11), (11, 50), (100, 200))
 
+    def test_separate_ranges(self):
+        """
+        NODE requests two ranges from OTHER in one batch, OTHER must not read the sequence numbers
+        between these ranges.
+        """
+        other, node = self.create_nodes(2)
+        other.send_identity(node)
+
+        messages = [other.create_sequence_text("Sequence message #%d" % i, i + 10, i) for i in range(1, 11)]
+        other.store(messages)
+
+        database = other._dispersy.database
+        ranges = []
+
+        def execute(statement, bindings=(), get_lastrowid=False):
+            if statement.startswith(u"SELECT sequence, packet FROM sync"):
+                ranges.append(bindings[2:])
+            return original(statement, bindings, get_lastrowid)
+
+        original, database.execute = database.execute, execute
+        try:
+            other.give_messages([node.create_missing_sequence(other.my_member, messages[0].meta, low, high)
+                                 for low, high in ((8, 9), (2, 3))], node, cache=True)
+            responses = [response.distribution.sequence_number for _, response in node.receive_messages(names=[u"sequence-text"], timeout=0.1)]
+        finally:
+            del database.execute
+
+        self.assertEqual(responses, [2, 3, 8, 9])
+        self.assertEqual(ranges, [(2, 3), (8, 9)])
+
     def requests(self, node_count, expected_responses, *pairs):
         """
         NODE1 through NODE<NODE_COUNT> requests OTHER (non)overlapping sequences, OTHER should send back the requested messages
@@ -0,0 +1,42 @@
+from struct import pack
+from unittest import TestCase
+
+from ..endpoint import TUNNEL_PREFIX
+from ..tracker.shard import STATISTICS_PREFIX, ShardProcessProtocol, aggregate_statistics, get_shard
+
+
+class TestShard(TestCase):
+
+    def _packet(self, value, tunnel=False):
+        packet = "\x00\x01" + pack(">L", value) + "\x00" * 16 + "payload"
+        return TUNNEL_PREFIX + packet if tunnel else packet
+
+    def test_get_shard(self):
+        """
+        Packets must be routed using the community identifier, also when tunnelled.
+        """
+        for value in (0, 1, 2, 3, 7, 2 ** 32 - 1):
+            self.assertEqual(get_shard(self._packet(value), 4), value % 4)
+            self.assertEqual(get_shard(self._packet(value, tunnel=True), 4), value % 4)
+        self.assertEqual(get_shard("\x00\x01short", 4), 0)
+
+    def test_aggregate_statistics(self):
+        """
+        Reports must be summed element wise and key wise.
+        """
+        reports = [{u"bandwidth": [10, 20], u"communities": 1, u"outgoing": {u"a": 1}},
+                   {u"bandwidth": [1, 2], u"communities": 2, u"outgoing": {u"a": 2, u"b": 3}}]
+        self.assertEqual(aggregate_statistics(reports),
+                         {u"bandwidth": [11, 22], u"communities": 3, u"outgoing": {u"a": 3, u"b": 3}})
+
+    def test_process_protocol(self):
+        """
+        Statistics lines must be parsed, also when they arrive in pieces.
+        """
+        reports = []
+        protocol = ShardProcessProtocol(1, lambda shard, report: reports.append((shard, report)), None)
+        line = STATISTICS_PREFIX + '{"communities": 5}\n'
+        protocol.outReceived(line[:10])
+        self.assertEqual(reports, [])
+        protocol.outReceived(line[10:])
+        self.assertEqual(reports, [(1, {u"communities": 5})])
@@ -0,0 +1,105 @@
+from unittest import TestCase
+
+from nose.twistedtools import reactor
+from twisted.internet.task import Clock
+
+from ..tool.simulator import SimulatedNetwork, Simulation
+from ..util import blockingCallFromThread
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestSimulatedNetwork(TestCase):
+
+    def setUp(self):
+        super(TestSimulatedNetwork, self).setUp()
+        self._clock = Clock()
+
+    def test_latency(self):
+        """
+        A datagram must be delivered after the latency.
+        """
+        network = SimulatedNetwork(latency=0.5, clock=self._clock)
+        first, second = network.create_endpoint(), network.create_endpoint()
+        network.send(first, second.wan_address, "data")
+        self._clock.advance(0.4)
+        self.assertEqual(second.packets_down, 0)
+        self._clock.advance(0.1)
+        self.assertEqual((second.packets_down, second.bytes_down), (1, 4))
+
+        # unknown addresses and undelivered datagrams
+        network.send(first, ("1.2.3.4", 5), "data")
+        network.send(first, second.wan_address, "data")
+        network.stop()
+        self._clock.advance(1.0)
+        self.assertEqual(second.packets_down, 1)
+        self.assertEqual(network.unreachable_count, 1)
+
+    def test_cone_nat(self):
+        """
+        A cone NAT must only accept datagrams from hosts it has sent a datagram to.
+        """
+        network = SimulatedNetwork(latency=0.0, clock=self._clock)
+        public, cone = network.create_endpoint(u"public"), network.create_endpoint(u"cone-NAT")
+        self.assertNotEqual(cone.lan_address, cone.wan_address)
+
+        network.send(public, cone.wan_address, "data")
+        network.send(cone, public.wan_address, "data")
+        network.send(public, cone.wan_address, "data")
+        self._clock.advance(0.0)
+        self.assertEqual((public.packets_down, cone.packets_down), (1, 1))
+        self.assertEqual(network.filtered_count, 1)
+
+    def test_symmetric_nat(self):
+        """
+        A symmetric NAT must use a different address for every destination, and only accept
+        datagrams from that destination.
+        """
+        network = SimulatedNetwork(latency=0.0, clock=self._clock)
+        first, second, symmetric = [network.create_endpoint(nat_type) for nat_type in (u"public", u"public", u"symmetric-NAT")]
+        first_mapping = symmetric.get_source_address(first.wan_address)
+        second_mapping = symmetric.get_source_address(second.wan_address)
+        self.assertNotEqual(first_mapping, second_mapping)
+        self.assertEqual(symmetric.get_source_address(first.wan_address), first_mapping)
+
+        network.send(first, first_mapping, "data")
+        network.send(second, first_mapping, "data")
+        network.send(second, second_mapping, "data")
+        self._clock.advance(0.0)
+        self.assertEqual(symmetric.packets_down, 2)
+        self.assertEqual(network.filtered_count, 1)
+        self.assertIs(network.get_endpoint(second_mapping), symmetric)
+
+    def test_loss(self):
+        """
+        Datagrams must be lost with the given probability.
+        """
+        network = SimulatedNetwork(latency=0.0, loss=0.5, seed=42, clock=self._clock)
+        first, second = network.create_endpoint(), network.create_endpoint()
+        for _ in xrange(1000):
+            network.send(first, second.wan_address, "data")
+        self._clock.advance(0.0)
+        self.assertEqual(second.packets_down + network.lost_count, 1000)
+        self.assertTrue(400 < network.lost_count < 600, network.lost_count)
+
+
+class TestSimulation(DispersyTestFunc):
+
+    def test_convergence(self):
+        """
+        All nodes must receive all messages and get to know each other.
+        """
+        network = SimulatedNetwork(latency=0.01, seed=42)
+        simulation = Simulation(network, 6, {u"public": 0.5, u"cone-NAT": 0.5}, walk_interval=0.5)
+        blockingCallFromThread(reactor, simulation.start)
+        try:
+            # the message is created by the first node, which every node walks to first
+            report = blockingCallFromThread(reactor, simulation.run, 60.0, message_count=1, sample_interval=0.5)
+        finally:
+            blockingCallFromThread(reactor, simulation.stop)
+
+        self.assertEqual(report[u"nodes"], 6)
+        self.assertIsNotNone(report[u"convergence_time"])
+        self.assertEqual(report[u"convergence"][-1][1], 1.0)
+        self.assertGreater(report[u"coverage"][u"mean"], 0.0)
+        self.assertGreater(report[u"bytes_up"][u"mean"], 0)
+        self.assertGreater(report[u"cpu"][u"max"], 0.0)
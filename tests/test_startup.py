@@ -0,0 +1,99 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import sleep
+
+from ..discovery.community import BOOTSTRAP_FILE_ENVNAME
+from ..dispersy import Dispersy
+from ..endpoint import ManualEnpoint
+from ..util import blocking_call_on_reactor_thread
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestStartup(DispersyTestFunc):
+
+    def setUp(self):
+        super(TestStartup, self).setUp()
+        self._directory = tempfile.mkdtemp()
+        # do not resolve the default bootstrap addresses
+        self._bootstrap_file = os.path.join(self._directory, "bootstrap.txt")
+        with open(self._bootstrap_file, "w") as stream:
+            stream.write("127.0.0.1 1\n")
+        self._environ = os.environ.get(BOOTSTRAP_FILE_ENVNAME)
+        os.environ[BOOTSTRAP_FILE_ENVNAME] = self._bootstrap_file
+
+    def tearDown(self):
+        super(TestStartup, self).tearDown()
+        if self._environ is None:
+            del os.environ[BOOTSTRAP_FILE_ENVNAME]
+        else:
+            os.environ[BOOTSTRAP_FILE_ENVNAME] = self._environ
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _create_dispersy(self):
+        dispersy = Dispersy(ManualEnpoint(0), unicode(self._directory), u"dispersy.db")
+        self.dispersy_objects.append(dispersy)
+        return dispersy
+
+    @blocking_call_on_reactor_thread
+    def _start(self, dispersy, fast_start):
+        """
+        Returns the result of start and the DiscoveryCommunity that was loaded when it returned.
+        """
+        return dispersy.start(fast_start=fast_start), dispersy._discovery_community
+
+    @blocking_call_on_reactor_thread
+    def _discovery_member(self, dispersy):
+        return dispersy._discovery_community.my_member if dispersy._discovery_community else None
+
+    def _wait_for_discovery(self, dispersy):
+        for _ in xrange(100):
+            if self._discovery_member(dispersy):
+                break
+            sleep(0.01)
+
+    def test_fast_start(self):
+        """
+        A fast start must load the DiscoveryCommunity after start returns and reuse its member.
+        """
+        dispersy = self._create_dispersy()
+        self.assertEqual(self._start(dispersy, True), (True, None))
+        self._wait_for_discovery(dispersy)
+        mid = self._discovery_member(dispersy).mid
+        self.assertEqual([phase for phase, _ in dispersy.startup_times], [u"database", u"endpoint", u"discovery"])
+        dispersy.stop()
+        self.dispersy_objects.remove(dispersy)
+
+        dispersy = self._create_dispersy()
+        dispersy.start(fast_start=True)
+        self._wait_for_discovery(dispersy)
+        self.assertEqual(self._discovery_member(dispersy).mid, mid)
+
+    def test_startup_times(self):
+        """
+        A normal start must load the DiscoveryCommunity before start returns, using a new member.
+        """
+        dispersy = self._create_dispersy()
+        result, community = self._start(dispersy, False)
+        self.assertTrue(result)
+        mid = community.my_member.mid
+        self.assertEqual([phase for phase, _ in dispersy.startup_times], [u"database", u"endpoint", u"discovery"])
+        self.assertTrue(all(seconds >= 0.0 for _, seconds in dispersy.startup_times))
+        dispersy.stop()
+        self.dispersy_objects.remove(dispersy)
+
+        dispersy = self._create_dispersy()
+        dispersy.start()
+        self.assertNotEqual(self._discovery_member(dispersy).mid, mid)
+
+    def test_lazy_crypto(self):
+        """
+        Importing Dispersy must not import the crypto backends.
+        """
+        package = __name__.rsplit(".", 2)[0]
+        code = "import sys, %s.dispersy; print 'M2Crypto' in sys.modules or 'libnacl' in sys.modules" % package
+        directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=directory)
+        self.assertEqual(output.strip(), "False")
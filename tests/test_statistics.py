@@ -0,0 +1,390 @@
+import functools
+import json
+import logging
+from collections import defaultdict
+from os import environ
+from time import sleep, time
+from unittest import TestCase, skipUnless
+
+from twisted.test.proto_helpers import StringTransport
+
+from .. import util as util_module
+from ..statistics import CountMinSketch, HeavyHitters, Instrumentation, MessageStatistics, Statistics, _runtime_statistics
+from ..tool.main import InstrumentationDumpFactory
+from ..util import attach_runtime_statistics
+from .dispersytestclass import DispersyTestFunc
+
+
+class Named(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+def attach_formatted_runtime_statistics(format_):
+    """
+    The attach_runtime_statistics decorator as it was, formatting FORMAT_ on every call.
+    """
+    def helper(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kargs):
+            return_value = None
+            start = time()
+            try:
+                return_value = func(*args, **kargs)
+                return return_value
+            finally:
+                end = time()
+                entry = format_.format(function_name=func.__name__, return_value=return_value, *args, **kargs)
+                _runtime_statistics[entry].increment(end - start)
+        return wrapper
+    return helper
+
+
+class PlainStatistics(Statistics):
+
+    def __init__(self):
+        super(PlainStatistics, self).__init__()
+        self.plain_dict = defaultdict(int)
+
+    def update(self):
+        pass
+
+
+class Tracked(object):
+
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {1.name} {2[0]} {moo}")
+    def foo(self, named, items, moo=u"milk"):
+        return len(items)
+
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {return_value}")
+    def bar(self, value):
+        return value * 2
+
+    @attach_runtime_statistics(u"{0.__class__.__name__}.{function_name} {1.name}")
+    def compiled(self, named):
+        pass
+
+    @attach_formatted_runtime_statistics(u"{0.__class__.__name__}.{function_name} {1.name}")
+    def formatted(self, named):
+        pass
+
+    def plain(self, named):
+        pass
+
+
+class TestRuntimeStatistics(TestCase):
+
+    def setUp(self):
+        super(TestRuntimeStatistics, self).setUp()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        _runtime_statistics.clear()
+        _runtime_statistics.sample_interval = 1
+
+    def tearDown(self):
+        super(TestRuntimeStatistics, self).tearDown()
+        _runtime_statistics.clear()
+        _runtime_statistics.sample_interval = 1
+
+    def test_entries(self):
+        """
+        The entries must be the formatted strings, even though FORMAT_ is only formatted once per key.
+        """
+        tracked = Tracked()
+        for _ in xrange(3):
+            tracked.foo(Named(u"a"), [1, 2], moo=u"cow")
+            tracked.foo(Named(u"b"), [1, 2], moo=u"cow")
+            tracked.bar(21)
+        # unhashable keys are formatted every call
+        tracked.foo(Named([u"c"]), [3], moo=u"cow")
+
+        self.assertEqual(dict((entry, statistic.count) for entry, statistic in _runtime_statistics.iteritems()),
+                         {u"Tracked.foo a 1 cow": 3,
+                          u"Tracked.foo b 1 cow": 3,
+                          u"Tracked.foo [u'c'] 3 cow": 1,
+                          u"Tracked.bar 42": 3})
+
+    def test_histogram(self):
+        """
+        Every measurement must end up in exactly one histogram bucket.
+        """
+        tracked = Tracked()
+        for _ in xrange(10):
+            tracked.bar(1)
+
+        statistic = _runtime_statistics[u"Tracked.bar 2"]
+        self.assertEqual(sum(count for _, count in statistic.histogram), 10)
+        self.assertEqual(statistic.histogram[-1][0], float("inf"))
+
+    def test_sampling(self):
+        """
+        Sampled measurements must be weighted by the sample interval.
+        """
+        _runtime_statistics.sample_interval = 10
+        tracked = Tracked()
+        for _ in xrange(100):
+            tracked.bar(1)
+
+        statistic = _runtime_statistics[u"Tracked.bar 2"]
+        self.assertEqual(statistic.count, 100)
+        self.assertEqual(sum(count for _, count in statistic.histogram), 100)
+
+    def test_sampled_measurements(self):
+        """
+        Only one in every sample_interval calls must be measured, every measurement must count for
+        sample_interval calls.
+        """
+        measurements = []
+
+        def measuring_time():
+            measurements.append(None)
+            return original()
+
+        _runtime_statistics.sample_interval = 16
+        tracked = Tracked()
+        named = Named(u"sampled")
+        original, util_module.time = util_module.time, measuring_time
+        try:
+            for _ in xrange(160):
+                tracked.compiled(named)
+        finally:
+            util_module.time = original
+
+        # every measurement reads the time before and after the call
+        self.assertEqual(len(measurements), 2 * 10)
+        statistic = _runtime_statistics[u"Tracked.compiled sampled"]
+        self.assertEqual(statistic.count, 160)
+        self.assertEqual(sum(count for _, count in statistic.histogram), 160)
+
+    @skipUnless(environ.get("TEST_BENCHMARK") == "yes", "This 'unittest' measures the decorator overhead, as such, this is not part of the code review process")
+    def test_overhead_benchmark(self, length=100000):
+        """
+        Report the overhead of the decorator compared to formatting the entry on every call.
+        """
+        tracked = Tracked()
+        named = Named(u"benchmark")
+
+        def run(method):
+            begin = time()
+            for _ in xrange(length):
+                method(named)
+            return time() - begin
+
+        plain = run(tracked.plain)
+        formatted = run(tracked.formatted) - plain
+        compiled = run(tracked.compiled) - plain
+        _runtime_statistics.sample_interval = 16
+        sampled = run(tracked.compiled) - plain
+
+        self._logger.info("decorator overhead is %.2fus formatted, %.2fus compiled, and %.2fus sampled 1:16 per call",
+                          1000000.0 * formatted / length, 1000000.0 * compiled / length, 1000000.0 * sampled / length)
+
+
+class TestInstrumentation(TestCase):
+
+    def test_reactor_lag(self):
+        """
+        A late heartbeat must be measured as lag, a heartbeat after stop must not.
+        """
+        instrumentation = Instrumentation(0.01)
+        instrumentation.heartbeat()
+        sleep(0.05)
+        instrumentation.heartbeat()
+        self.assertGreaterEqual(instrumentation.max_lag, 0.03)
+
+        instrumentation.reset()
+        instrumentation.stop()
+        sleep(0.05)
+        instrumentation.heartbeat()
+        self.assertEqual(instrumentation.get_dict()[u"reactor_lag"][u"count"], 0)
+
+    def test_stages(self):
+        """
+        Every stage must have its own histogram and percentiles.
+        """
+        instrumentation = Instrumentation()
+        for _ in xrange(98):
+            instrumentation.add(u"decode", 0.00005)
+        instrumentation.add(u"decode", 0.02)
+        instrumentation.add(u"decode", 2.0)
+        instrumentation.add(u"store", 0.2)
+
+        stages = instrumentation.get_dict()[u"stages"]
+        self.assertEqual(sorted(stages), [u"decode", u"store"])
+        self.assertEqual(stages[u"decode"][u"count"], 100)
+        self.assertEqual(stages[u"decode"][u"p50"], 0.0001)
+        self.assertEqual(stages[u"decode"][u"p99"], 0.05)
+        self.assertEqual(stages[u"decode"][u"histogram"], [(0.0001, 98), (0.05, 1), (5.0, 1)])
+        self.assertEqual(stages[u"store"][u"p50"], 0.5)
+
+
+class TestHeavyHitters(TestCase):
+
+    def test_exact(self):
+        """
+        Counts must be exact as long as there are no more keys than the capacity.
+        """
+        counts = HeavyHitters(capacity=4)
+        for index in xrange(10):
+            counts.increment(index % 4, index)
+        counts[u"ignored"]
+        counts[0] += 1
+        self.assertEqual(counts, {0: 13, 1: 15, 2: 8, 3: 10})
+        self.assertTrue(counts.exact)
+        self.assertEqual(counts[u"missing"], 0)
+
+    def test_bounded(self):
+        """
+        Many keys that occur once must not replace the keys that occur most often.
+        """
+        counts = HeavyHitters(capacity=16)
+        for index in xrange(10000):
+            counts.increment(u"heavy-%d" % (index % 4))
+            counts.increment(u"light-%d" % index)
+
+        self.assertEqual(len(counts), 16)
+        self.assertFalse(counts.exact)
+        self.assertGreater(counts.evicted, 0)
+        for index in xrange(4):
+            # estimates are never too low
+            self.assertGreaterEqual(counts[u"heavy-%d" % index], 2500)
+            self.assertLess(counts[u"heavy-%d" % index], 2600)
+        self.assertGreaterEqual(counts[u"light-1"], 1)
+
+        counts.clear()
+        self.assertEqual(len(counts), 0)
+        self.assertTrue(counts.exact)
+        self.assertEqual(counts[u"heavy-0"], 0)
+
+    def test_lower(self):
+        """
+        Lowering the count of a tracked key must also work after a key was evicted, lowering the
+        estimate of a key that is not tracked must be refused.
+        """
+        counts = HeavyHitters(capacity=2)
+        counts[u"a"] = 5
+        counts[u"a"] = 3
+        self.assertEqual(counts, {u"a": 3})
+
+        counts[u"b"] = 2
+        counts[u"c"] = 4
+        self.assertFalse(counts.exact)
+        self.assertEqual(sorted(counts), [u"a", u"c"])
+        counts[u"a"] = 1
+        self.assertEqual(counts[u"a"], 1)
+        counts[u"a"] += 2
+        self.assertEqual(counts[u"a"], 3)
+        self.assertRaises(ValueError, counts.__setitem__, u"b", 0)
+
+    def test_plain_dictionaries(self):
+        """
+        The statistics must keep working with plain dictionaries.
+        """
+        statistics = PlainStatistics()
+        statistics.dict_inc(u"plain_dict", u"a")
+        statistics.dict_inc(u"plain_dict", u"a", 2)
+        self.assertEqual(statistics.plain_dict, {u"a": 3})
+
+        msg_statistics = MessageStatistics()
+        msg_statistics.success_dict = defaultdict(int)
+        msg_statistics.increase_count(u"success", u"a", 2)
+        self.assertEqual(msg_statistics.success_dict, {u"a": 2})
+        self.assertEqual(msg_statistics.success_count, 2)
+
+    def test_sketch(self):
+        """
+        Estimates must never be lower than the real counts.
+        """
+        sketch = CountMinSketch(width=64, depth=4)
+        for index in xrange(1000):
+            sketch.add(index, index % 7)
+        self.assertTrue(all(sketch.estimate(index) >= index % 7 for index in xrange(1000)))
+        self.assertEqual(sketch.add(u"new", 3), sketch.estimate(u"new"))
+
+
+class TestDispersyStatistics(DispersyTestFunc):
+
+    def test_received_introductions(self):
+        """
+        Received introductions must be reported as a SOURCE:INTRODUCED:COUNT nested dictionary.
+        """
+        node, = self.create_nodes()
+
+        def introduce():
+            statistics = node._dispersy.statistics
+            statistics.enable_debug_statistics(True)
+            for _ in xrange(3):
+                statistics.add_received_introduction(("1.1.1.1", 1), ("2.2.2.2", 2))
+            statistics.add_received_introduction(("1.1.1.1", 1), u"-ignored-")
+            statistics.update()
+            return statistics.get_dict()[u"received_introductions"]
+
+        self.assertEqual(node.call(introduce), {("1.1.1.1", 1): {("2.2.2.2", 2): 3, u"-ignored-": 1}})
+
+
+class TestDispersyInstrumentation(DispersyTestFunc):
+
+    def test_stages(self):
+        """
+        Processing incoming messages must be measured for each stage.
+        """
+        node, other = self.create_nodes(2)
+        node.call(node._dispersy.enable_instrumentation, True)
+        other.send_identity(node)
+        node.give_messages([other.create_full_sync_text("Message %d" % index, index + 10) for index in xrange(5)], other)
+        # NODE forwards an introduction response
+        node.give_message(other.create_introduction_request(node.my_candidate, other.lan_address, other.wan_address, False, u"unknown", None, 42), other)
+
+        def get_instrumentation():
+            node._dispersy.statistics.update()
+            return node._dispersy.statistics.instrumentation
+        stages = node.call(get_instrumentation)[u"stages"]
+        for stage in Instrumentation.STAGES:
+            self.assertGreater(stages[stage][u"count"], 0, stage)
+
+    def test_reactor_lag(self):
+        """
+        Blocking the reactor must be measured as reactor lag.
+        """
+        node, = self.create_nodes()
+        node.call(node._dispersy.enable_instrumentation, True)
+        node.call(sleep, 0.3)
+        # wait for the next heartbeat
+        sleep(0.2)
+        self.assertGreaterEqual(node._dispersy.instrumentation.max_lag, 0.15)
+
+    def test_disabled(self):
+        """
+        The instrumentation must be disabled by default, without heartbeat and without measurements.
+        """
+        node, other = self.create_nodes(2)
+        self.assertFalse(node._dispersy.is_pending_task_active("instrumentation heartbeat"))
+        other.send_identity(node)
+        node.give_messages([other.create_full_sync_text("Message %d" % index, index + 10) for index in xrange(5)], other)
+        self.assertEqual(node._dispersy.instrumentation.stages, {})
+
+        def get_instrumentation():
+            node._dispersy.statistics.update()
+            return node._dispersy.statistics.instrumentation
+        self.assertIsNone(node.call(get_instrumentation))
+
+        node.call(node._dispersy.enable_instrumentation, True)
+        self.assertTrue(node._dispersy.is_pending_task_active("instrumentation heartbeat"))
+        node.call(node._dispersy.enable_instrumentation, False)
+        self.assertFalse(node._dispersy.is_pending_task_active("instrumentation heartbeat"))
+
+    def test_dump(self):
+        """
+        The dump command must receive the instrumentation statistics as JSON.
+        """
+        node, = self.create_nodes()
+        node.call(node._dispersy.enable_instrumentation, True)
+
+        def dump():
+            transport = StringTransport()
+            protocol = InstrumentationDumpFactory(node._dispersy).buildProtocol(None)
+            protocol.makeConnection(transport)
+            return transport.value()
+
+        dumped = json.loads(node.call(dump))
+        self.assertEqual(sorted(dumped), [u"reactor_lag", u"stages"])
@@ -1,3 +1,8 @@
+from os import environ
+from time import time
+from unittest import skipUnless
+
+from ..dispersydatabase import SYNC_BUCKETS, get_sync_modulo_clause
 from .dispersytestclass import DispersyTestFunc
 
 
@@ -34,6 +39,92 @@ class TestSync(DispersyTestFunc):
                 self.assertEqual(sorted(global_times), sorted(response_times))
 
 
+    def test_modulo_not_a_divisor(self):
+        """
+        A modulo that is not a divisor of SYNC_BUCKETS can not use the bucket index, the packets
+        must be selected using the (global_time + offset) % modulo predicate instead.
+        """
+        node, other, messages = self._create_nodes_messages()
+
+        for modulo in (11, 13, 2521):
+            for offset in (0, 1, modulo - 1):
+                global_times = [message.distribution.global_time for message in messages if (message.distribution.global_time + offset) % modulo == 0]
+
+                sync = (1, 0, modulo, offset, [])
+                other.give_message(node.create_introduction_request(other.my_candidate, node.lan_address, node.wan_address, False, u"unknown", sync, 42), node)
+
+                responses = node.receive_messages(names=[u"full-sync-text"], return_after=len(global_times))
+                response_times = [message.distribution.global_time for _, message in responses]
+
+                self.assertEqual(sorted(global_times), sorted(response_times))
+
+    def _select_modulo_slices(self, length, moduli=(2, 3, 4, 5, 10, 105, 420), first=50):
+        """
+        Select modulo slices from a database with LENGTH messages, using the (global_time + offset)
+        % modulo predicate and using get_sync_modulo_clause, for both the bloom filter and the sync
+        response.  The bloom filter reads every row, the sync response only the FIRST rows.
+
+        Returns a list with a (modulo, predicate, bloom filter, sync response) tuple per modulo, the
+        last three are the seconds spent selecting the slice.
+        """
+        node, = self.create_nodes()
+        community = node._community
+        meta = community.get_meta_message(u"full-sync-text")
+        # the global times of the identity of NODE are lower
+        global_times = range(1000, 1000 + length)
+
+        def fill():
+            node._dispersy.database.executemany(u"INSERT INTO sync (community, member, global_time, meta_message, packet, bucket) VALUES (?, ?, ?, ?, ?, ?)",
+                                                ((community.database_id, node.my_member.database_id, global_time, meta.database_id, buffer("packet %d" % global_time), global_time % SYNC_BUCKETS)
+                                                 for global_time in global_times))
+        node.call(fill)
+
+        def select(sql, arguments, limit=None):
+            begin = time()
+            cursor = node._dispersy.database.execute(sql, arguments)
+            packets = [str(packet) for packet, in (cursor if limit is None else cursor.fetchmany(limit))]
+            return packets, time() - begin
+
+        def bloom_filter_slice(offset, modulo):
+            modulo_clause, modulo_arguments = get_sync_modulo_clause(offset, modulo)
+            return select(u"SELECT sync.packet FROM sync WHERE meta_message IN (%d) AND sync.undone = 0 AND %s" % (meta.database_id, modulo_clause), modulo_arguments)
+
+        def sync_response_slice(offset, modulo):
+            (_, sql, arguments), = community._get_sql_for_bloomfilters([(None, 1, global_times[-1], offset, modulo)])
+            return select(sql, arguments, first)
+
+        timings = []
+        for modulo in moduli:
+            offset = modulo // 3
+            packets, predicate_took = node.call(select, u"SELECT sync.packet FROM sync WHERE meta_message IN (%d) AND sync.undone = 0 AND (sync.global_time + ?) %% ? = 0" % meta.database_id, (offset, modulo))
+            self.assertEqual(len(packets), len([global_time for global_time in global_times if (global_time + offset) % modulo == 0]))
+
+            bloom_filter_packets, bloom_filter_took = node.call(bloom_filter_slice, offset, modulo)
+            self.assertEqual(sorted(bloom_filter_packets), sorted(packets))
+
+            # full-sync-text is synchronized in ascending global time order
+            sync_response_packets, sync_response_took = node.call(sync_response_slice, offset, modulo)
+            self.assertEqual(sync_response_packets, sorted(packets, key=lambda packet: int(packet.split()[1]))[:first])
+
+            timings.append((modulo, predicate_took, bloom_filter_took, sync_response_took))
+        return timings
+
+    def test_modulo_slices(self):
+        """
+        The bucket index must select the same packets as the (global_time + offset) % modulo
+        predicate.
+        """
+        self._select_modulo_slices(2000)
+
+    @skipUnless(environ.get("TEST_BENCHMARK") == "yes", "This 'unittest' measures the bucket index, as such, this is not part of the code review process")
+    def test_modulo_benchmark(self, length=50000):
+        """
+        Report the time needed to select modulo slices from a large database.
+        """
+        for modulo, predicate_took, bloom_filter_took, sync_response_took in self._select_modulo_slices(length, (2, 3, 4, 5, 6, 10, 60, 105, 420)):
+            self._logger.info("modulo %d of %d packets took %.4fs using the predicate, %.4fs for the bloom filter, and %.4fs for the first sync response packets",
+                              modulo, length, predicate_took, bloom_filter_took, sync_response_took)
+
     def test_range(self):
         node, other, messages = self._create_nodes_messages()
 
@@ -51,6 +142,50 @@ class TestSync(DispersyTestFunc):
                 self.assertEqual(sorted(global_times), sorted(response_times))
 
 
+    def test_read_only_connections(self):
+        """
+        OTHER uses a database file, hence the packets for NODE must be selected by a read-only
+        connection of OTHER and streamed back to the reactor.
+        """
+        node, = self.create_nodes()
+        other, = self.create_nodes(memory_database=False)
+        other.send_identity(node)
+
+        messages = [other.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(30)]
+        other.store(messages)
+        # the read-only connections only see committed changes
+        other.call(other._dispersy.database.commit)
+
+        other.give_message(node.create_introduction_request(other.my_candidate, node.lan_address, node.wan_address, False, u"unknown", (1, 0, 1, 0, []), 42), node)
+
+        responses = node.receive_messages(names=[u"full-sync-text"], return_after=len(messages), timeout=2.0)
+        self.assertEqual(sorted(message.distribution.global_time for _, message in responses),
+                         sorted(message.distribution.global_time for message in messages))
+
+        statistics = other._dispersy.database_readers.get_dict()
+        self.assertEqual(statistics[u"submitted"], 1)
+        self.assertEqual(statistics[u"dropped"], 0)
+
+    def test_read_only_connections_uncommitted(self):
+        """
+        Packets that OTHER stored but did not commit yet must also be selected by the read-only
+        connections.
+        """
+        node, = self.create_nodes()
+        other, = self.create_nodes(memory_database=False)
+        other.send_identity(node)
+
+        messages = [other.create_full_sync_text("Message %d" % i, i + 10) for i in xrange(10)]
+        other.store(messages)
+        self.assertTrue(other.call(lambda: other._dispersy.database.has_uncommitted_changes))
+
+        other.give_message(node.create_introduction_request(other.my_candidate, node.lan_address, node.wan_address, False, u"unknown", (1, 0, 1, 0, []), 42), node)
+
+        responses = node.receive_messages(names=[u"full-sync-text"], return_after=len(messages), timeout=2.0)
+        self.assertEqual(sorted(message.distribution.global_time for _, message in responses),
+                         sorted(message.distribution.global_time for message in messages))
+        self.assertFalse(other.call(lambda: other._dispersy.database.has_uncommitted_changes))
+
     def test_in_order(self):
         node, other, messages = self._create_nodes_messages('create_in_order_text')
         global_times = [message.distribution.global_time for message in messages]
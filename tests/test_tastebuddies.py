@@ -0,0 +1,100 @@
+from time import time
+
+from ..candidate import WalkCandidate
+from ..discovery.community import ActualTasteBuddy, PossibleTasteBuddy
+from ..discovery.tastebuddies import ActualTasteBuddies, PossibleTasteBuddies
+from ..util import blocking_call_on_reactor_thread
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestTasteBuddies(DispersyTestFunc):
+
+    def _create_candidate(self, index):
+        sock_addr = ("1.1.1.%d" % index, index + 1)
+        candidate = WalkCandidate(sock_addr, False, sock_addr, sock_addr, u"unknown")
+        candidate.associate(self._dispersy.get_new_member(u"very-low"))
+        return candidate
+
+    def _create_taste_buddy(self, index, overlap, timestamp):
+        return ActualTasteBuddy(overlap, set(), timestamp, self._create_candidate(index))
+
+    @blocking_call_on_reactor_thread
+    def test_order(self):
+        """
+        least and most must follow the order of the taste buddies, also after they changed.
+        """
+        now = time()
+        store = ActualTasteBuddies(60.0)
+        taste_buddies = [self._create_taste_buddy(index, overlap, now) for index, overlap in enumerate([3, 1, 2])]
+        for taste_buddy in taste_buddies:
+            store.add(taste_buddy)
+        self.assertIs(store.least(), taste_buddies[1])
+        self.assertIs(store.most(), taste_buddies[0])
+
+        taste_buddies[1].overlap = 4
+        store.add(taste_buddies[1])
+        self.assertEqual(len(store), 3)
+        self.assertIs(store.least(), taste_buddies[2])
+        self.assertIs(store.most(), taste_buddies[1])
+
+        store.remove(taste_buddies[1].sock_addr)
+        self.assertIs(store.most(), taste_buddies[0])
+        self.assertEqual(sorted(store), sorted(taste_buddies[::2]))
+
+    @blocking_call_on_reactor_thread
+    def test_expire(self):
+        """
+        Taste buddies must expire lifetime seconds after their last timestamp.
+        """
+        store = ActualTasteBuddies(60.0)
+        old = self._create_taste_buddy(1, 1, 100.0)
+        new = self._create_taste_buddy(2, 1, 130.0)
+        store.add(old)
+        store.add(new)
+
+        # the old taste buddy is reset
+        old.timestamp = 150.0
+        store.add(old)
+
+        store.expire(195.0)
+        self.assertEqual(len(store), 1)
+        self.assertIs(store.get_mid(old.candidate_mid), old)
+        self.assertIsNone(store.get_mid(new.candidate_mid))
+        self.assertIs(store.get_candidate(old.candidate), old)
+
+    @blocking_call_on_reactor_thread
+    def test_possible(self):
+        """
+        Possible taste buddies must be replaced by member and indexed by the candidate they were
+        received from.
+        """
+        now = time()
+        store = PossibleTasteBuddies(60.0)
+        received_from = self._create_candidate(1)
+        mid = self._dispersy.get_new_member(u"very-low").mid
+        store.add(PossibleTasteBuddy(1, set(), now, mid, received_from))
+        replacement = PossibleTasteBuddy(2, set(), now, mid, received_from)
+        store.add(replacement)
+
+        self.assertEqual(len(store), 1)
+        self.assertIs(store.most(), replacement)
+        self.assertTrue(store.has_received_from(received_from))
+        self.assertFalse(store.has_received_from(self._create_candidate(2)))
+
+        store.remove(mid)
+        self.assertFalse(store.has_received_from(received_from))
+        self.assertIsNone(store.least())
+
+    @blocking_call_on_reactor_thread
+    def test_rebuild(self):
+        """
+        Updating taste buddies many times must not grow the heaps without bound.
+        """
+        now = time()
+        store = ActualTasteBuddies(60.0)
+        taste_buddy = self._create_taste_buddy(1, 1, now)
+        for overlap in xrange(1000):
+            taste_buddy.overlap = overlap
+            store.add(taste_buddy)
+        self.assertLess(len(store._least), 100)
+        self.assertIs(store.least(), taste_buddy)
@@ -0,0 +1,84 @@
+from time import time
+from unittest import TestCase
+
+from ..conversion import BinaryConversion
+from ..tracker.community import TrackerCommunity
+from ..tracker.eviction import CommunityEviction, CommunitySnapshot
+from ..util import blocking_call_on_reactor_thread
+from .dispersytestclass import DispersyTestFunc
+
+
+class TestCommunityEviction(TestCase):
+
+    def test_inactive(self):
+        """
+        Only communities without activity for inactive_timeout seconds must be evicted, least
+        recently active first.
+        """
+        eviction = CommunityEviction(10.0)
+        for index in xrange(5):
+            eviction.touch("cid%d" % index, 100.0 + index)
+        # activity moves cid0 to the back
+        eviction.touch("cid0", 108.0)
+
+        self.assertEqual(eviction.evict(105.0), [])
+        self.assertEqual(eviction.evict(113.5), ["cid1", "cid2", "cid3"])
+        self.assertEqual(eviction.evict(200.0), ["cid4", "cid0"])
+        self.assertEqual(len(eviction), 0)
+
+    def test_max_communities(self):
+        """
+        When too many communities are loaded the least recently active must be evicted.
+        """
+        eviction = CommunityEviction(1000.0, max_communities=3)
+        for index in xrange(5):
+            eviction.touch("cid%d" % index, 100.0 + index)
+        eviction.touch("cid1", 110.0)
+        eviction.forget("cid2")
+
+        self.assertEqual(eviction.evict(111.0), ["cid0"])
+        self.assertEqual(len(eviction), 3)
+
+    def test_max_snapshots(self):
+        """
+        The oldest snapshots must be dropped first.
+        """
+        eviction = CommunityEviction(10.0, max_snapshots=2)
+        snapshots = [object.__new__(CommunitySnapshot) for _ in xrange(3)]
+        for index, snapshot in enumerate(snapshots):
+            eviction.store_snapshot("cid%d" % index, snapshot)
+
+        self.assertEqual(eviction.snapshot_count, 2)
+        self.assertIsNone(eviction.pop_snapshot("cid0"))
+        self.assertIs(eviction.pop_snapshot("cid2"), snapshots[2])
+        self.assertIsNone(eviction.pop_snapshot("cid2"))
+
+
+class TestCommunitySnapshot(DispersyTestFunc):
+
+    @blocking_call_on_reactor_thread
+    def test_restore(self):
+        """
+        A reloaded community must get the global time, conversions, and active candidates back.
+        """
+        my_member = self._dispersy.get_new_member(u"very-low")
+        self._dispersy.define_auto_load(TrackerCommunity, my_member)
+        community = TrackerCommunity.create_community(self._dispersy, my_member)
+        community.update_global_time(42)
+        community.add_conversion(BinaryConversion(community, "\x05"))
+        now = time()
+        active = community.create_candidate(("1.1.1.1", 1), False, ("1.1.1.1", 1), ("1.1.1.1", 1), u"unknown")
+        active.associate(my_member)
+        active.stumble(now)
+        community.create_candidate(("2.2.2.2", 2), False, ("2.2.2.2", 2), ("2.2.2.2", 2), u"unknown")
+
+        snapshot = CommunitySnapshot(community, now)
+        cid = community.cid
+        community.unload_community()
+
+        community = self._dispersy.get_community(cid, load=True)
+        self.assertLess(community.global_time, 42)
+        snapshot.restore(community, now)
+        self.assertEqual(community.global_time, 42)
+        self.assertEqual(sorted(conversion.community_version for conversion in community.conversions), ["\x00", "\x05"])
+        self.assertEqual(community.candidates.keys(), [("1.1.1.1", 1)])
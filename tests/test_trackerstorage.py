@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+from time import time
+from unittest import skipUnless
+
+from ..candidate import Candidate
+from ..dispersy import Dispersy
+from ..endpoint import ManualEnpoint
+from ..exception import CommunityNotFoundException
+from ..tracker.community import TrackerCommunity, TrackerHardKilledCommunity
+from ..tracker.storage import read_persistent_storage, replay_persistent_storage
+from ..util import blocking_call_on_reactor_thread
+from .dispersytestclass import DispersyTestFunc
+
+
+class StorageDispersy(Dispersy):
+
+    """
+    Creates unknown communities and collects the persistent storage, like TrackerDispersy does.
+    """
+
+    def __init__(self, *args, **kargs):
+        super(StorageDispersy, self).__init__(*args, **kargs)
+        self.lines = []
+
+    def get_community(self, cid, load=False, auto_load=True):
+        try:
+            return super(StorageDispersy, self).get_community(cid, True, True)
+        except CommunityNotFoundException:
+            return TrackerCommunity.init_community(self, self.get_member(mid=cid), self._my_member)
+
+    def write_persistent_storage(self, lines):
+        self.lines.extend(lines)
+
+
+class TestTrackerStorage(DispersyTestFunc):
+
+    def setUp(self):
+        super(TestTrackerStorage, self).setUp()
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestTrackerStorage, self).tearDown()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _create_dispersy(self):
+        dispersy = StorageDispersy(ManualEnpoint(0), unicode(self._directory), u":memory:")
+        dispersy.start(autoload_discovery=False)
+        dispersy._my_member = dispersy.get_new_member(u"very-low")
+        self.dispersy_objects.append(dispersy)
+        return dispersy
+
+    def _create_storage(self, community_count, copies=1):
+        """
+        Destroy COMMUNITY_COUNT communities and returns the filename of their persistent storage,
+        which contains every entry COPIES times.
+        """
+        dispersy = self._create_dispersy()
+        for _ in xrange(community_count):
+            community = TrackerCommunity.create_community(dispersy, dispersy._my_member)
+            community.create_destroy_community(u"hard-kill", sign_with_master=True)
+
+        filename = os.path.join(self._directory, "persistent-storage.data")
+        with open(filename, "w") as stream:
+            for _ in xrange(copies):
+                stream.write("".join(dispersy.lines))
+        return filename
+
+    @blocking_call_on_reactor_thread
+    def test_replay(self):
+        """
+        Replaying must destroy every community once, duplicate entries are ignored.
+        """
+        filename = self._create_storage(10, copies=2)
+
+        packets, duplicates = read_persistent_storage([filename])
+        self.assertEqual(len(packets), duplicates)
+
+        dispersy = self._create_dispersy()
+        replay_persistent_storage(dispersy, packets)
+        communities = [community for community in dispersy.get_communities() if isinstance(community, TrackerHardKilledCommunity)]
+        self.assertEqual(len(communities), 10)
+        self.assertEqual(set(community.cid for community in communities), set(packet[2:22] for packet in packets))
+
+    @blocking_call_on_reactor_thread
+    def test_replay_error(self):
+        """
+        A batch that raises an exception must not prevent replaying the other communities.
+        """
+        filename = self._create_storage(3)
+        packets, _ = read_persistent_storage([filename])
+        failing_cid = packets[0][2:22]
+
+        dispersy = self._create_dispersy()
+        get_community = dispersy.get_community
+
+        def failing_get_community(cid, *args, **kargs):
+            community = get_community(cid, *args, **kargs)
+            if cid == failing_cid:
+                def on_messages(messages):
+                    raise RuntimeError("unable to process")
+                community.on_messages = on_messages
+            return community
+        dispersy.get_community = failing_get_community
+
+        replay_persistent_storage(dispersy, packets)
+        destroyed = set(community.cid for community in dispersy.get_communities() if isinstance(community, TrackerHardKilledCommunity))
+        self.assertEqual(destroyed, set(packet[2:22] for packet in packets) - set([failing_cid]))
+
+    @skipUnless(os.environ.get("TEST_BENCHMARK") == "yes", "This 'unittest' measures the tracker startup, as such, this is not part of the code review process")
+    @blocking_call_on_reactor_thread
+    def test_replay_benchmark(self, community_count=200):
+        """
+        Report the time needed to replay the persistent storage compared to processing each packet
+        using on_incoming_packets.
+        """
+        filename = self._create_storage(community_count)
+        packets, _ = read_persistent_storage([filename])
+
+        def destroyed(dispersy):
+            return sum(1 for community in dispersy.get_communities() if isinstance(community, TrackerHardKilledCommunity))
+
+        dispersy = self._create_dispersy()
+        begin = time()
+        # on_incoming_packets asserts a valid address, which LoopbackCandidate does not have
+        candidate = Candidate(("127.0.0.1", 1), False)
+        for packet in packets:
+            dispersy.on_incoming_packets([(candidate, packet)], cache=False, timestamp=time())
+        incoming = time() - begin
+        self.assertEqual(destroyed(dispersy), community_count)
+
+        dispersy = self._create_dispersy()
+        begin = time()
+        replay_persistent_storage(dispersy, packets)
+        replayed = time() - begin
+        self.assertEqual(destroyed(dispersy), community_count)
+
+        self._logger.info("loading %d entries took %.2fs using on_incoming_packets and %.2fs replayed",
+                          len(packets), incoming, replayed)
@@ -135,6 +135,33 @@ class TestUndo(DispersyTestFunc):
         other.assert_is_undone(high_message, undone_by=low_message)
         other.assert_is_undone(message, undone_by=low_message)
 
+    def test_undo_index(self):
+        """
+        Both undo messages must be added to the undo table.  When the binary lower undo message is
+        received last it must undo the message and the undo message that was received first.
+        """
+        node, other = self.create_nodes(2)
+        node.send_identity(other)
+
+        message = node.create_full_sync_text("Should undo @%d" % 10, 10)
+        undo1 = node.create_undo_own(message, 11, 1)
+        undo2 = node.create_undo_own(message, 12, 2)
+        low_message, high_message = sorted([undo1, undo2], key=lambda message: message.packet)
+        other.give_message(message, node)
+        other.give_message(high_message, node)
+        other.give_message(low_message, node)
+
+        def fetch_undo_packets():
+            member = other._dispersy.get_member(public_key=node.my_member.public_key)
+            return [str(packet) for packet, in other._dispersy.database.execute(
+                u"SELECT sync.packet FROM undo JOIN sync ON sync.id = undo.sync WHERE undo.member = ? AND undo.global_time = ?",
+                (member.database_id, message.distribution.global_time))]
+        self.assertEqual(sorted(other.call(fetch_undo_packets)), sorted([low_message.packet, high_message.packet]))
+
+        other.assert_is_done(low_message)
+        other.assert_is_undone(high_message, undone_by=low_message)
+        other.assert_is_undone(message, undone_by=low_message)
+
     def test_missing_message(self):
         """
         NODE generates a few messages without sending them to OTHER. Following, NODE undoes the
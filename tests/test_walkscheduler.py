@@ -0,0 +1,116 @@
+from time import time
+
+from ..util import blocking_call_on_reactor_thread
+from ..walkscheduler import WalkScheduler
+from .dispersytestclass import DispersyTestFunc
+
+
+class FakeStatistics(object):
+
+    def __init__(self):
+        self.total_up = 0
+
+
+class FakeDispersy(object):
+
+    def __init__(self):
+        self.statistics = FakeStatistics()
+
+
+class TestWalkScheduler(DispersyTestFunc):
+
+    def setUp(self):
+        super(TestWalkScheduler, self).setUp()
+        self._scheduler = WalkScheduler(FakeDispersy())
+
+    @blocking_call_on_reactor_thread
+    def tearDown(self):
+        self._scheduler.stop()
+        super(TestWalkScheduler, self).tearDown()
+
+    def _step(self, steps, community, size=100):
+        def step():
+            steps.append(community)
+            self._scheduler._dispersy.statistics.total_up += size
+        return step
+
+    @blocking_call_on_reactor_thread
+    def test_spread(self):
+        """
+        The first steps of communities that are scheduled together must be spread over the interval.
+        """
+        now = time()
+        for community in xrange(100):
+            self._scheduler.schedule(community, lambda: None, 5.0)
+
+        offsets = sorted(due - now for due, _, _ in self._scheduler._heap)
+        self.assertGreaterEqual(offsets[0], 0.0)
+        self.assertLessEqual(offsets[-1], 5.1)
+        self.assertLess(max(b - a for a, b in zip(offsets, offsets[1:])), 0.2)
+
+    @blocking_call_on_reactor_thread
+    def test_batch(self):
+        """
+        All steps that are due must be taken during a single wakeup, each community is rescheduled.
+        """
+        steps = []
+        for community in xrange(10):
+            self._scheduler.schedule(community, self._step(steps, community), 5.0, delay=0.0)
+
+        self._scheduler._take_steps()
+        self.assertEqual(sorted(steps), range(10))
+        self.assertEqual(self._scheduler.step_count, 10)
+        self.assertTrue(all(due > time() + 4.0 for due, _, _ in self._scheduler._heap))
+
+    @blocking_call_on_reactor_thread
+    def test_unschedule(self):
+        """
+        Unscheduled and replaced steps must not be taken.
+        """
+        steps = []
+        for community in xrange(10):
+            self._scheduler.schedule(community, self._step(steps, community), 5.0, delay=0.0)
+        self._scheduler.unschedule(3)
+        self._scheduler.schedule(4, self._step(steps, u"replaced"), 5.0, delay=0.0)
+
+        self._scheduler._take_steps()
+        self.assertEqual(sorted(steps), [0, 1, 2, 5, 6, 7, 8, 9, u"replaced"])
+        self.assertFalse(self._scheduler.is_scheduled(3))
+
+    @blocking_call_on_reactor_thread
+    def test_bandwidth_cap(self):
+        """
+        Steps must stop when the bandwidth is exhausted, the communities that waited longest must step
+        first when bandwidth becomes available.
+        """
+        steps = []
+        self._scheduler.max_bytes_per_second = 1000
+        for community in xrange(50):
+            self._scheduler.schedule(community, self._step(steps, community), 5.0, delay=0.0)
+
+        self._scheduler._take_steps()
+        self.assertEqual(steps, range(10))
+        self.assertEqual(self._scheduler.delayed_count, 1)
+
+        # a second later there is bandwidth for the next ten communities
+        self._scheduler._tokens_timestamp -= 1.0
+        self._scheduler._take_steps()
+        self.assertEqual(steps, range(20))
+
+    @blocking_call_on_reactor_thread
+    def test_start_walking(self):
+        """
+        The first step of a community that starts walking must be taken immediately.
+        """
+        community = self._community
+        scheduler = self._dispersy.walk_scheduler
+        # other communities are spread over the interval
+        scheduler.schedule(u"other", lambda: None, 5.0)
+        scheduler.unschedule(u"other")
+
+        now = time()
+        community.start_walking()
+
+        _, _, order = scheduler._scheduled[community]
+        due, = [due for due, entry_order, _ in scheduler._heap if entry_order == order]
+        self.assertLessEqual(due, now + 0.1)
@@ -19,11 +19,11 @@ from M2Crypto import EC
 # Note that both explicit and implicit relative imports are based on the name of the current
 # module. Since the name of the main module is always "__main__", modules intended for use as the
 # main module of a Python application should always use absolute imports.
-from dispersy.crypto import ECCrypto, _CURVES
+from dispersy.crypto import ECCrypto, get_curves
 
 def ec_name(eccrypto, curve):
     assert isinstance(curve, unicode)
-    curve_id = _CURVES[curve]
+    curve_id = get_curves()[curve]
 
     for name in dir(EC):
         value = getattr(EC, name)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+"""
+Convert binary tracker event logs, as written by 'twistd tracker --eventlog FILE', into the
+REQ_IN2, RES_IN2, DESTROY_IN, and DESTROY_OUT text lines that the tracker prints to stdout.
+"""
+
+import argparse
+import sys
+import time
+
+# From: http://docs.python.org/2/tutorial/modules.html#intra-package-references
+# Note that both explicit and implicit relative imports are based on the name of the current
+# module. Since the name of the main module is always "__main__", modules intended for use as the
+# main module of a Python application should always use absolute imports.
+from dispersy.tracker.eventlog import format_event, iter_events
+
+
+def convert(stream, timestamps):
+    for event in iter_events(stream):
+        line = format_event(*event)
+        if timestamps:
+            print time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event[1])), line
+        else:
+            print line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", metavar="FILE", nargs="*", help="binary event log (default: stdin)")
+    parser.add_argument("--timestamps", action="store_true", help="prefix every line with the time of the event")
+    args = parser.parse_args()
+
+    if args.files:
+        for filename in args.files:
+            with open(filename, "rb") as stream:
+                convert(stream, args.timestamps)
+    else:
+        convert(sys.stdin, args.timestamps)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,22 @@
 """
 Run Dispersy in standalone mode.
 """
+import json
 import logging
 import optparse  # deprecated since python 2.7
 import os
+import shutil
 import signal
+import socket
+import sys
 
 from twisted.internet import reactor
+from twisted.internet.protocol import Factory, Protocol
 from twisted.python.log import addObserver
 
+from ..capture import CaptureEndpoint, prepare_replay_directory, replay
 from ..dispersy import Dispersy
-from ..endpoint import StandaloneEndpoint
+from ..endpoint import NullEndpoint, StandaloneEndpoint
 
 
 # use logger.conf if it exists
@@ -45,6 +51,70 @@ def start_script(dispersy, opt):
     script.next_testcase()
 
 
+def start_replay(dispersy, opt):
+    """
+    Replay the capture file given with --replay, write the report as JSON to stdout, and stop.
+    """
+    def write_report(report):
+        sys.stdout.write(json.dumps(report, indent=1, sort_keys=True) + "\n")
+
+    def stop(result):
+        dispersy.stop()
+        reactor.stop()
+        # the replay ran on a copy of the database, see prepare_replay_directory
+        shutil.rmtree(dispersy.working_directory, ignore_errors=True)
+        return result
+
+    deferred = replay(dispersy, opt.replay, opt.replay_speed or None)
+    deferred.addCallback(write_report)
+    deferred.addBoth(stop)
+    return deferred
+
+
+class InstrumentationDumpProtocol(Protocol):
+
+    """
+    Writes the instrumentation statistics, as JSON, to every connection and closes it.
+    """
+
+    def connectionMade(self):
+        self.transport.write(json.dumps(self.factory.get_instrumentation(), indent=1, sort_keys=True) + "\n")
+        self.transport.loseConnection()
+
+
+class InstrumentationDumpFactory(Factory):
+
+    protocol = InstrumentationDumpProtocol
+
+    def __init__(self, dispersy):
+        self._dispersy = dispersy
+
+    def get_instrumentation(self):
+        self._dispersy.statistics.update()
+        return self._dispersy.statistics.instrumentation
+
+
+def listen_instrumentation(dispersy, port):
+    """
+    Serve the instrumentation statistics of DISPERSY on 127.0.0.1:PORT.  Only local connections are
+    accepted.
+    """
+    return reactor.listenTCP(port, InstrumentationDumpFactory(dispersy), interface="127.0.0.1")
+
+
+def dump_instrumentation(port, stream=sys.stdout):
+    """
+    Write the instrumentation statistics, served by a Dispersy running with --instrumentation-port
+    PORT on this machine, to STREAM.
+    """
+    connection = socket.create_connection(("127.0.0.1", port))
+    try:
+        for data in iter(lambda: connection.recv(65536), ""):
+            stream.write(data)
+    finally:
+        connection.close()
+
+
 def main_real(setup=None):
     assert setup is None or callable(setup)
 
@@ -60,6 +130,14 @@ def main_real(setup=None):
     command_line_parser.add_option("--kargs", action="store", type="string", help="Executes --script with these arguments.  Example 'startingtimestamp=1292333014,endingtimestamp=12923340000'")
     command_line_parser.add_option("--debugstatistics", action="store_true", help="turn on debug statistics", default=False)
     command_line_parser.add_option("--strict", action="store_true", help="Exit on any exception", default=False)
+    command_line_parser.add_option("--fast-start", action="store_true", help="reuse the DiscoveryCommunity member and load it after starting", default=False)
+    command_line_parser.add_option("--profile-startup", action="store_true", help="report the time spent in each startup phase", default=False)
+    command_line_parser.add_option("--instrumentation-port", action="store", type="int", help="serve the reactor lag and stage latencies on 127.0.0.1:PORT", default=0)
+    command_line_parser.add_option("--dump-instrumentation", action="store", type="int", metavar="PORT", help="print the reactor lag and stage latencies of the Dispersy serving them on 127.0.0.1:PORT and exit", default=0)
+    command_line_parser.add_option("--capture", action="store", type="string", metavar="FILE", help="write all incoming datagrams to the capture file FILE", default="")
+    command_line_parser.add_option("--replay", action="store", type="string", metavar="FILE", help="feed the capture file FILE to Dispersy after starting --script, without sending any packets, print the throughput and stage latencies and exit.  The replay runs on a temporary copy of the database in --statedir", default="")
+    command_line_parser.add_option("--replay-speed", action="store", type="float", help="replay at the original speed multiplied by REPLAY_SPEED, as fast as possible when 0", default=0.0)
+    command_line_parser.add_option("--max-walk-bandwidth", action="store", type="int", metavar="BYTES", help="limit the outgoing bytes caused by the walker steps of all communities to BYTES per second, unlimited when 0", default=0)
     # swift
     # command_line_parser.add_option("--swiftproc", action="store_true", help="Use swift to tunnel all traffic", default=False)
     # command_line_parser.add_option("--swiftpath", action="store", type="string", default="./swift")
@@ -70,6 +148,10 @@ def main_real(setup=None):
 
     # parse command-line arguments
     opt, args = command_line_parser.parse_args()
+    if opt.dump_instrumentation:
+        dump_instrumentation(opt.dump_instrumentation)
+        exit(0)
+
     if not opt.script:
         command_line_parser.print_help()
         exit(1)
@@ -79,8 +161,19 @@ def main_real(setup=None):
         addObserver(unhandled_error_observer)
 
     # setup
-    dispersy = Dispersy(StandaloneEndpoint(opt.port, opt.ip), unicode(opt.statedir), unicode(opt.databasefile))
+    working_directory = unicode(opt.statedir)
+    if opt.replay:
+        endpoint = NullEndpoint((opt.ip, opt.port))
+        # every replay starts from the same database
+        working_directory = prepare_replay_directory(working_directory, unicode(opt.databasefile))
+    elif opt.capture:
+        endpoint = CaptureEndpoint(opt.capture, opt.port, opt.ip)
+    else:
+        endpoint = StandaloneEndpoint(opt.port, opt.ip)
+    dispersy = Dispersy(endpoint, working_directory, unicode(opt.databasefile))
     dispersy.statistics.enable_debug_statistics(opt.debugstatistics)
+    if opt.max_walk_bandwidth:
+        dispersy.walk_scheduler.max_bytes_per_second = opt.max_walk_bandwidth
 
     def signal_handler(sig, frame):
         logger.warning("Received signal '%s' in %s (shutting down)", sig, frame)
@@ -90,12 +183,22 @@ def main_real(setup=None):
     signal.signal(signal.SIGTERM, signal_handler)
 
     # start
-    if not dispersy.start():
+    if not dispersy.start(fast_start=opt.fast_start):
         raise RuntimeError("Unable to start Dispersy")
 
+    if opt.instrumentation_port:
+        dispersy.enable_instrumentation(True)
+        listen_instrumentation(dispersy, opt.instrumentation_port)
+
+    if opt.profile_startup:
+        # scheduled after the DiscoveryCommunity is loaded when using --fast-start
+        reactor.callLater(0, lambda: logger.warning("startup times: %s", ", ".join("%s %.3fs" % (phase, seconds) for phase, seconds in dispersy.startup_times)))
+
     # This has to be scheduled _after_ starting dispersy so the DB is opened by when this is actually executed.
     # register tasks
     reactor.callLater(0, start_script, dispersy, opt)
+    if opt.replay:
+        reactor.callLater(0, start_replay, dispersy, opt)
 
 
 def main(setup=None):
@@ -0,0 +1,520 @@
+#!/usr/bin/env python
+
+"""
+Simulate a network of many Dispersy instances within one process.
+
+Every node is a Dispersy instance with an in-memory database and a SimulatedEndpoint.  The
+endpoints exchange datagrams through a SimulatedNetwork, which adds latency, drops datagrams, and
+filters them as a NAT would.  The first node is public and is used by all other nodes to bootstrap
+the candidate walker.  A number of messages is created at the start of the simulation, the nodes
+are sampled regularly to measure how long it takes until every node has every message, how many
+of the other nodes every node got to know, and the bandwidth and time used by every node.
+
+Dispersy schedules its work on the global reactor using wall-clock time, hence the simulation runs
+in real time.  Only the SimulatedNetwork can use another IReactorTime, i.e. twisted.internet.task.Clock
+in unit tests.
+
+Run as 'python -m dispersy.tool.simulator --help'.
+"""
+
+import argparse
+import json
+import logging
+import sys
+from collections import defaultdict
+from itertools import count
+from random import Random
+from socket import inet_aton
+from struct import unpack_from
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredList, inlineCallbacks, returnValue
+from twisted.internet.task import deferLater
+from twisted.python.threadable import isInIOThread
+
+from ..candidate import Candidate
+from ..community import TAKE_STEP_INTERVAL
+from ..dispersy import Dispersy
+from ..endpoint import NullEndpoint
+from ..tests.debugcommunity.community import DebugCommunity
+
+
+# u"public" endpoints accept datagrams from everyone.  u"cone-NAT" endpoints use one external
+# address and accept datagrams from hosts they have sent a datagram to.  u"symmetric-NAT" endpoints
+# use a different external port for every destination and only accept datagrams from that
+# destination
+NAT_TYPES = (u"public", u"cone-NAT", u"symmetric-NAT")
+
+SIMULATED_PORT = 7759
+
+logger = logging.getLogger(__name__)
+
+
+def _get_ip(prefix, index):
+    return "%d.%d.%d.%d" % (prefix, index >> 16 & 255, index >> 8 & 255, index & 255)
+
+
+class SimulatedNetwork(object):
+
+    """
+    Delivers datagrams between SimulatedEndpoint instances.
+
+    Every datagram is delayed by LATENCY plus a random delay of up to JITTER seconds, and is lost
+    with probability LOSS.  CLOCK is used to schedule the deliveries.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, loss=0.0, seed=None, clock=reactor):
+        assert isinstance(latency, float), type(latency)
+        assert latency >= 0.0, latency
+        assert isinstance(jitter, float), type(jitter)
+        assert jitter >= 0.0, jitter
+        assert isinstance(loss, float), type(loss)
+        assert 0.0 <= loss < 1.0, loss
+        super(SimulatedNetwork, self).__init__()
+        self._latency = latency
+        self._jitter = jitter
+        self._loss = loss
+        self._clock = clock
+        self.random = Random(seed)
+
+        # sock_addr:SimulatedEndpoint pairs, contains public addresses and NAT mappings
+        self._addresses = {}
+        self._endpoint_index = count(1)
+        self._port = count(20000)
+        # delivery:DelayedCall pairs
+        self._deliveries = {}
+        self._delivery = count()
+
+        self.lost_count = 0
+        self.filtered_count = 0
+        self.unreachable_count = 0
+
+    def create_endpoint(self, nat_type=u"public"):
+        """
+        Returns a new SimulatedEndpoint of NAT_TYPE, with its own LAN and WAN address.
+        """
+        assert nat_type in NAT_TYPES, nat_type
+        index = next(self._endpoint_index)
+        if nat_type == u"public":
+            lan_address = wan_address = (_get_ip(11, index), SIMULATED_PORT)
+        else:
+            lan_address = (_get_ip(10, index), SIMULATED_PORT)
+            wan_address = (_get_ip(12, index), SIMULATED_PORT)
+
+        endpoint = SimulatedEndpoint(self, nat_type, lan_address, wan_address)
+        if nat_type != u"symmetric-NAT":
+            self._addresses[wan_address] = endpoint
+        return endpoint
+
+    def create_mapping(self, endpoint):
+        """
+        Returns a new external address for the symmetric NAT of ENDPOINT.
+        """
+        sock_addr = (endpoint.wan_address[0], next(self._port))
+        self._addresses[sock_addr] = endpoint
+        return sock_addr
+
+    def get_endpoint(self, sock_addr):
+        """
+        Returns the SimulatedEndpoint that can be reached at SOCK_ADDR, or None.
+        """
+        return self._addresses.get(sock_addr)
+
+    def send(self, endpoint, sock_addr, data):
+        """
+        Sends DATA from ENDPOINT to SOCK_ADDR.
+        """
+        source = endpoint.get_source_address(sock_addr)
+
+        if self.random.random() < self._loss:
+            self.lost_count += 1
+            return
+
+        receiver = self._addresses.get(sock_addr)
+        if receiver is None:
+            self.unreachable_count += 1
+            return
+
+        if not receiver.accepts(source, sock_addr):
+            self.filtered_count += 1
+            return
+
+        delay = self._latency + self.random.uniform(0.0, self._jitter)
+        delivery = next(self._delivery)
+        self._deliveries[delivery] = self._clock.callLater(delay, self._deliver, delivery, receiver, source, data)
+
+    def _deliver(self, delivery, receiver, source, data):
+        del self._deliveries[delivery]
+        receiver.deliver(source, data)
+
+    def stop(self):
+        """
+        Cancels all datagrams that were not yet delivered.
+        """
+        for delayed_call in self._deliveries.itervalues():
+            delayed_call.cancel()
+        self._deliveries.clear()
+
+
+class SimulatedEndpoint(NullEndpoint):
+
+    """
+    An endpoint that sends and receives datagrams through a SimulatedNetwork.
+    """
+
+    def __init__(self, network, nat_type, lan_address, wan_address):
+        assert isinstance(network, SimulatedNetwork), type(network)
+        assert nat_type in NAT_TYPES, nat_type
+        super(SimulatedEndpoint, self).__init__(lan_address)
+        self._network = network
+        self._nat_type = nat_type
+        self._wan_address = wan_address
+        # u"cone-NAT": the hosts we have sent a datagram to
+        self._permitted_hosts = set()
+        # u"symmetric-NAT": destination:external address and external address:destination pairs
+        self._mappings = {}
+        self._destinations = {}
+
+        self.packets_up = 0
+        self.packets_down = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        # seconds spent processing incoming datagrams and taking walker steps
+        self.cpu = 0.0
+
+    @property
+    def nat_type(self):
+        return self._nat_type
+
+    @property
+    def lan_address(self):
+        return self._address
+
+    @property
+    def wan_address(self):
+        return self._wan_address
+
+    def get_source_address(self, destination):
+        """
+        Returns the address that DESTINATION sees datagrams from us coming from, opening our NAT
+        for DESTINATION.
+        """
+        if self._nat_type == u"public":
+            return self._address
+
+        if self._nat_type == u"cone-NAT":
+            self._permitted_hosts.add(destination[0])
+            return self._wan_address
+
+        sock_addr = self._mappings.get(destination)
+        if sock_addr is None:
+            sock_addr = self._mappings[destination] = self._network.create_mapping(self)
+            self._destinations[sock_addr] = destination
+        return sock_addr
+
+    def accepts(self, source, sock_addr):
+        """
+        Returns True when our NAT lets a datagram from SOURCE to SOCK_ADDR through.
+        """
+        if self._nat_type == u"public":
+            return True
+
+        if self._nat_type == u"cone-NAT":
+            return source[0] in self._permitted_hosts
+
+        return self._destinations.get(sock_addr) == source
+
+    def send(self, candidates, packets):
+        super(SimulatedEndpoint, self).send(candidates, packets)
+        for candidate in candidates:
+            for packet in packets:
+                self._send(candidate.sock_addr, packet)
+
+    def send_packet(self, candidate, packet):
+        super(SimulatedEndpoint, self).send_packet(candidate, packet)
+        self._send(candidate.sock_addr, packet)
+
+    def _send(self, sock_addr, packet):
+        self.packets_up += 1
+        self.bytes_up += len(packet)
+        self._network.send(self, sock_addr, packet)
+
+    def deliver(self, source, data):
+        """
+        Gives DATA, received from SOURCE, to Dispersy.
+        """
+        self.packets_down += 1
+        self.bytes_down += len(data)
+        if self._dispersy and self._dispersy.running:
+            begin = time()
+            self._dispersy.statistics.total_down += len(data)
+            self._dispersy.on_incoming_packets([(Candidate(source, False), data)], True, begin, u"simulation")
+            self.cpu += time() - begin
+
+
+class SimulatedInterface(object):
+
+    """
+    The network interface of a SimulatedDispersy, every node is alone on its LAN.
+    """
+
+    def __init__(self, address):
+        self.name = "simulated"
+        self.address = address
+        self.netmask = "255.255.255.255"
+        self.broadcast = address
+        self._l_address, = unpack_from(">L", inet_aton(address))
+
+    def __contains__(self, address):
+        assert isinstance(address, str), type(address)
+        l_address, = unpack_from(">L", inet_aton(address))
+        return l_address == self._l_address
+
+
+class SimulatedDispersy(Dispersy):
+
+    """
+    A Dispersy with an in-memory database that uses the LAN address of its SimulatedEndpoint.
+    """
+
+    def __init__(self, endpoint):
+        assert isinstance(endpoint, SimulatedEndpoint), type(endpoint)
+        super(SimulatedDispersy, self).__init__(endpoint, u".", u":memory:")
+
+    def _get_interface_addresses(self):
+        yield SimulatedInterface(self._endpoint.lan_address[0])
+
+
+class SimulatedCommunity(DebugCommunity):
+
+    """
+    A DebugCommunity that walks every WALK_INTERVAL seconds.
+    """
+
+    def initialize(self, walk_interval=float(TAKE_STEP_INTERVAL)):
+        assert isinstance(walk_interval, float), type(walk_interval)
+        self._walk_interval = walk_interval
+        super(SimulatedCommunity, self).initialize()
+
+    @property
+    def dispersy_enable_candidate_walker(self):
+        return True
+
+    def start_walking(self):
+        self._dispersy.walk_scheduler.schedule(self, self.take_step, self._walk_interval)
+
+    def take_step(self):
+        begin = time()
+        super(SimulatedCommunity, self).take_step()
+        self._dispersy.endpoint.cpu += time() - begin
+
+    def create_text(self, text):
+        """
+        Creates, stores, and forwards a new full-sync-text message.
+        """
+        meta = self.get_meta_message(u"full-sync-text")
+        message = meta.impl(authentication=(self.my_member,),
+                            distribution=(self.claim_global_time(),),
+                            payload=(text,))
+        self._dispersy.store_update_forward([message], True, True, True)
+        return message
+
+
+def _get_summary(values):
+    values = list(values)
+    return {u"mean": sum(values) / float(len(values)), u"max": max(values)}
+
+
+class Simulation(object):
+
+    """
+    Runs NODE_COUNT SimulatedDispersy instances, each with a SimulatedCommunity, on NETWORK.
+
+    NAT_TYPES maps the NAT types to the fraction of the nodes that use it, the first node is always
+    public.
+    """
+
+    def __init__(self, network, node_count, nat_types=None, walk_interval=float(TAKE_STEP_INTERVAL)):
+        assert isinstance(network, SimulatedNetwork), type(network)
+        assert isinstance(node_count, int), type(node_count)
+        assert node_count > 1, node_count
+        assert nat_types is None or all(nat_type in NAT_TYPES for nat_type in nat_types), nat_types
+        super(Simulation, self).__init__()
+        self._network = network
+        self._node_count = node_count
+        self._nat_types = nat_types or {u"public": 1.0}
+        self._walk_interval = walk_interval
+        self._communities = []
+        self._seen = []
+
+    @property
+    def network(self):
+        return self._network
+
+    @property
+    def communities(self):
+        return self._communities
+
+    def _choose_nat_type(self):
+        total = sum(self._nat_types.itervalues())
+        threshold = self._network.random.random() * total
+        for nat_type, fraction in sorted(self._nat_types.iteritems()):
+            threshold -= fraction
+            if threshold < 0.0:
+                return nat_type
+        return u"public"
+
+    def start(self):
+        """
+        Starts all nodes, the nodes start walking towards the first node.
+        """
+        assert isInIOThread(), "Must be called from the callback thread"
+        master = None
+        for index in xrange(self._node_count):
+            endpoint = self._network.create_endpoint(self._choose_nat_type() if index else u"public")
+            dispersy = SimulatedDispersy(endpoint)
+            dispersy.start(autoload_discovery=False)
+
+            my_member = dispersy.get_new_member(u"very-low")
+            if master is None:
+                community = SimulatedCommunity.create_community(dispersy, my_member, walk_interval=self._walk_interval)
+                master = community.master_member
+                bootstrap = Candidate(endpoint.wan_address, False)
+            else:
+                community = SimulatedCommunity.init_community(dispersy, dispersy.get_member(public_key=master.public_key),
+                                                              my_member, walk_interval=self._walk_interval)
+                community.add_discovered_candidate(bootstrap)
+
+            self._communities.append(community)
+            self._seen.append(set())
+
+    def create_messages(self, message_count):
+        """
+        Creates MESSAGE_COUNT full-sync-text messages, spread evenly over the nodes.
+        """
+        assert isInIOThread(), "Must be called from the callback thread"
+        for index in xrange(message_count):
+            self._communities[index % len(self._communities)].create_text("Simulated message #%d" % index)
+
+    def _get_message_count(self, community):
+        meta = community.get_meta_message(u"full-sync-text")
+        count, = community.dispersy.database.execute(u"SELECT COUNT(*) FROM sync WHERE meta_message = ?",
+                                                     (meta.database_id,)).next()
+        return count
+
+    def _update_seen(self):
+        indexes = dict((community.dispersy.endpoint, index) for index, community in enumerate(self._communities))
+        for community, seen in zip(self._communities, self._seen):
+            for candidate in community.candidates.itervalues():
+                endpoint = self._network.get_endpoint(candidate.sock_addr)
+                if endpoint in indexes:
+                    seen.add(indexes[endpoint])
+
+    @inlineCallbacks
+    def run(self, duration, message_count=100, sample_interval=1.0, stop_on_convergence=True):
+        """
+        Creates MESSAGE_COUNT messages and samples the nodes every SAMPLE_INTERVAL seconds, for
+        DURATION seconds or until every node has every message.
+
+        Returns a Deferred that fires with a dictionary containing the sync convergence time, the
+        fraction of nodes that have all messages over time, the walker coverage, i.e. the fraction
+        of the other nodes that every node has seen as a candidate, and the bandwidth and time used
+        per node.
+        """
+        assert isInIOThread(), "Must be called from the callback thread"
+        assert self._communities, "Must be called after start()"
+        begin = time()
+        self.create_messages(message_count)
+
+        convergence = []
+        convergence_time = None
+        while True:
+            yield deferLater(reactor, sample_interval, lambda: None)
+            elapsed = time() - begin
+            self._update_seen()
+            complete = sum(1 for community in self._communities if self._get_message_count(community) >= message_count)
+            convergence.append((elapsed, complete / float(len(self._communities))))
+            if convergence_time is None and complete == len(self._communities):
+                convergence_time = elapsed
+            if elapsed >= duration or (convergence_time is not None and stop_on_convergence):
+                break
+
+        endpoints = [community.dispersy.endpoint for community in self._communities]
+        others = float(len(self._communities) - 1)
+        nat_types = defaultdict(int)
+        connection_types = defaultdict(int)
+        for community in self._communities:
+            nat_types[community.dispersy.endpoint.nat_type] += 1
+            connection_types[community.dispersy.connection_type] += 1
+
+        returnValue({u"nodes": len(self._communities),
+                     u"nat_types": dict(nat_types),
+                     u"connection_types": dict(connection_types),
+                     u"duration": time() - begin,
+                     u"messages": message_count,
+                     u"convergence_time": convergence_time,
+                     u"convergence": convergence,
+                     u"coverage": _get_summary(len(seen) / others for seen in self._seen),
+                     u"bytes_up": _get_summary(endpoint.bytes_up for endpoint in endpoints),
+                     u"bytes_down": _get_summary(endpoint.bytes_down for endpoint in endpoints),
+                     u"packets_up": _get_summary(endpoint.packets_up for endpoint in endpoints),
+                     u"packets_down": _get_summary(endpoint.packets_down for endpoint in endpoints),
+                     u"cpu": _get_summary(endpoint.cpu for endpoint in endpoints),
+                     u"lost": self._network.lost_count,
+                     u"filtered": self._network.filtered_count,
+                     u"unreachable": self._network.unreachable_count})
+
+    def stop(self):
+        """
+        Stops all nodes, returns a DeferredList that fires when they are stopped.
+        """
+        assert isInIOThread(), "Must be called from the callback thread"
+        deferreds = [community.dispersy.stop() for community in self._communities]
+        self._network.stop()
+        self._communities = []
+        return DeferredList(deferreds)
+
+
+def main():
+    logging.basicConfig(format="%(asctime)-15s [%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="Simulate a network of Dispersy instances within one process.")
+    parser.add_argument("--nodes", type=int, default=100, help="the number of Dispersy instances")
+    parser.add_argument("--messages", type=int, default=100, help="the number of messages to synchronize")
+    parser.add_argument("--duration", type=float, default=300.0, help="the maximum duration in seconds")
+    parser.add_argument("--latency", type=float, default=0.05, help="the latency of every datagram in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="the maximum random latency added to every datagram")
+    parser.add_argument("--loss", type=float, default=0.0, help="the probability that a datagram is lost")
+    parser.add_argument("--cone-nat", type=float, default=0.0, help="the fraction of nodes behind a cone NAT")
+    parser.add_argument("--symmetric-nat", type=float, default=0.0, help="the fraction of nodes behind a symmetric NAT")
+    parser.add_argument("--walk-interval", type=float, default=float(TAKE_STEP_INTERVAL), help="the seconds between walker steps")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="the seconds between samples")
+    parser.add_argument("--seed", type=int, default=None, help="the seed of the random latency, loss, and NAT types")
+    args = parser.parse_args()
+
+    nat_types = {u"public": max(0.0, 1.0 - args.cone_nat - args.symmetric_nat),
+                 u"cone-NAT": args.cone_nat,
+                 u"symmetric-NAT": args.symmetric_nat}
+    network = SimulatedNetwork(args.latency, args.jitter, args.loss, args.seed)
+    simulation = Simulation(network, args.nodes, nat_types, args.walk_interval)
+
+    def write_report(report):
+        sys.stdout.write(json.dumps(report, indent=1, sort_keys=True) + "\n")
+
+    def stop(result):
+        simulation.stop().addBoth(lambda _: reactor.stop())
+        return result
+
+    def start():
+        simulation.start()
+        deferred = simulation.run(args.duration, args.messages, args.sample_interval)
+        deferred.addCallback(write_report)
+        deferred.addBoth(stop)
+
+    reactor.callWhenRunning(start)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
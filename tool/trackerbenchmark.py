@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+Measure how the throughput of a tracker scales with its number of worker processes.
+
+For every worker count a tracker is started on localhost using 'twistd tracker --shards N'.  It is
+sent introduction requests for many communities, from several UDP sockets, for a fixed duration.
+The number of requests sent and the number of packets received in return are reported.
+
+twistd must be able to find the tracker plugin, i.e. run from the same environment as
+scripts/start_tracker.sh.
+"""
+
+import argparse
+import errno
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+from select import select
+from time import time, sleep
+
+from twisted.internet import reactor
+# From: http://docs.python.org/2/tutorial/modules.html#intra-package-references
+# Note that both explicit and implicit relative imports are based on the name of the current
+# module. Since the name of the main module is always "__main__", modules intended for use as the
+# main module of a Python application should always use absolute imports.
+from dispersy.dispersy import Dispersy
+from dispersy.endpoint import NullEndpoint
+from dispersy.tracker.community import TrackerCommunity
+
+
+def create_packets(tracker_address, community_count):
+    """
+    Returns (identities, requests) lists containing the dispersy-identity and an introduction
+    request, addressed to TRACKER_ADDRESS, for each of COMMUNITY_COUNT new communities.
+    """
+    dispersy = Dispersy(NullEndpoint(("127.0.0.1", 1)), unicode(tempfile.gettempdir()), u":memory:")
+    dispersy.start(autoload_discovery=False)
+    try:
+        my_member = dispersy.get_new_member(u"very-low")
+        identities = []
+        requests = []
+        for _ in xrange(community_count):
+            community = TrackerCommunity.init_community(dispersy, dispersy.get_member(mid=os.urandom(20)), my_member)
+            packet, = dispersy.database.execute(u"SELECT packet FROM sync WHERE community = ? AND meta_message = ?",
+                                                (community.database_id, community.get_meta_message(u"dispersy-identity").database_id)).next()
+            identities.append(str(packet))
+
+            candidate = community.create_candidate(tracker_address, False, tracker_address, tracker_address, u"unknown")
+            requests.append(community.create_introduction_request(candidate, False, forward=False).packet)
+        return identities, requests
+
+    finally:
+        dispersy.stop()
+
+
+def receive(sockets, timeout):
+    """
+    Returns the number of datagrams received on SOCKETS within TIMEOUT seconds.
+    """
+    received = 0
+    readable, _, _ = select(sockets, [], [], timeout)
+    for sock in readable:
+        try:
+            while sock.recvfrom(65535):
+                received += 1
+        except socket.error as e:
+            if e.errno != errno.EAGAIN:
+                raise
+    return received
+
+
+def measure(args, workers, identities, packets):
+    """
+    Start a tracker with WORKERS worker processes and returns the (sent, received) packet counts.
+    """
+    tracker_address = ("127.0.0.1", args.port)
+    statedir = tempfile.mkdtemp()
+    tracker = subprocess.Popen([args.twistd, "--nodaemon", "--pidfile=", "tracker",
+                                "--silent",
+                                "--ip", tracker_address[0],
+                                "--port", str(tracker_address[1]),
+                                "--statedir", statedir,
+                                "--shards", str(workers)])
+
+    sockets = []
+    try:
+        for _ in xrange(args.senders):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
+            sock.bind(("127.0.0.1", 0))
+            sock.setblocking(0)
+            sockets.append(sock)
+
+        # wait until the tracker responds
+        for _ in xrange(60):
+            sockets[0].sendto(packets[0], tracker_address)
+            if receive(sockets, 0.5):
+                break
+        else:
+            raise RuntimeError("tracker with %d workers did not respond" % workers)
+
+        # the tracker needs our identity in every community to respond with introductions
+        for index, packet in enumerate(identities):
+            sockets[index % len(sockets)].sendto(packet, tracker_address)
+            if index % 100 == 0:
+                receive(sockets, 0.01)
+        sleep(1.0)
+        receive(sockets, 0.0)
+
+        sent = received = index = 0
+        end = time() + args.duration
+        while time() < end:
+            for sock in sockets:
+                for _ in xrange(args.burst):
+                    try:
+                        sock.sendto(packets[index % len(packets)], tracker_address)
+                        sent += 1
+                    except socket.error as e:
+                        if e.errno != errno.EAGAIN:
+                            raise
+                    index += 1
+            received += receive(sockets, 0.001)
+
+        # packets that are still underway
+        deadline = time() + 1.0
+        while time() < deadline:
+            received += receive(sockets, 0.1)
+
+        return sent, received
+
+    finally:
+        for sock in sockets:
+            sock.close()
+        tracker.terminate()
+        tracker.wait()
+        shutil.rmtree(statedir, ignore_errors=True)
+
+
+def run(args):
+    try:
+        identities, packets = create_packets(("127.0.0.1", args.port), args.communities)
+
+        print "%8s %12s %12s %8s" % ("workers", "sent/s", "received/s", "speedup")
+        baseline = None
+        for workers in args.workers:
+            sent, received = measure(args, workers, identities, packets)
+            baseline = baseline or received
+            print "%8d %12.1f %12.1f %7.2fx" % (workers, sent / args.duration, received / args.duration, float(received) / baseline)
+
+    finally:
+        reactor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts (default: 1,2,4)")
+    parser.add_argument("--port", type=int, default=16421, help="tracker port (default: 16421)")
+    parser.add_argument("--communities", type=int, default=1000, help="number of communities (default: 1000)")
+    parser.add_argument("--senders", type=int, default=16, help="number of sending sockets (default: 16)")
+    parser.add_argument("--burst", type=int, default=8, help="packets sent per socket per round (default: 8)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per measurement (default: 10)")
+    parser.add_argument("--twistd", default="twistd", help="twistd executable (default: twistd)")
+    args = parser.parse_args()
+    args.workers = [int(workers) for workers in args.workers.split(",")]
+
+    reactor.callWhenRunning(run, args)
+    reactor.run()
+
+if __name__ == "__main__":
+    main()
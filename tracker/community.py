@@ -1,30 +1,24 @@
 from ..community import Community, HardKilledCommunity
 from ..conversion import BinaryConversion
 from ..exception import ConversionNotFoundException
+from .eventlog import REQ_IN2, RES_IN2, DESTROY_IN, DESTROY_OUT
 
 
 class TrackerHardKilledCommunity(HardKilledCommunity):
 
     def __init__(self, *args, **kargs):
         super(TrackerHardKilledCommunity, self).__init__(*args, **kargs)
-        # communities are cleaned based on a 'strike' rule.  periodically, we will check is there
-        # are active candidates, when there are 'strike' is set to zero, otherwise it is incremented
-        # by one.  once 'strike' reaches a predefined value the community is cleaned
-        self._strikes = 0
-
-    def update_strikes(self, now):
-        # does the community have any active candidates
-        self._strikes += 1
-        return self._strikes
+        # None when the tracker runs silent
+        self._event_log = getattr(self._dispersy, "event_log", None)
 
     def dispersy_on_introduction_request(self, messages):
-        hex_cid = messages[0].community.cid.encode("HEX")
-        for message in messages:
-            host, port = message.candidate.sock_addr
-            print "DESTROY_OUT", hex_cid,
-            message.authentication.member.mid.encode("HEX"),
-            ord(message.conversion.dispersy_version),
-            ord(message.conversion.community_version), host, port
+        if self._event_log:
+            record = self._event_log.record
+            cid = self._cid
+            for message in messages:
+                conversion = message.conversion
+                record(DESTROY_OUT, cid, message.authentication.member.mid,
+                       conversion.dispersy_version, conversion.community_version, message.candidate.sock_addr)
 
         return super(TrackerHardKilledCommunity, self).dispersy_on_introduction_request(messages)
 
@@ -37,10 +31,8 @@ class TrackerCommunity(Community):
 
     def __init__(self, *args, **kargs):
         super(TrackerCommunity, self).__init__(*args, **kargs)
-        # communities are cleaned based on a 'strike' rule.  periodically, we will check is there
-        # are active candidates, when there are 'strike' is set to zero, otherwise it is incremented
-        # by one.  once 'strike' reaches a predefined value the community is cleaned
-        self._strikes = 0
+        # None when the tracker runs silent
+        self._event_log = getattr(self._dispersy, "event_log", None)
 
         self._walked_stumbled_candidates = self._iter_categories([u'walk', u'stumble'])
 
@@ -80,14 +72,6 @@ class TrackerCommunity(Community):
         # we will accept the full 64 bit global time range
         return 2 ** 64 - self._global_time
 
-    def update_strikes(self, now):
-        # does the community have any active candidates
-        if any(self.dispersy_yield_verified_candidates()):
-            self._strikes = 0
-        else:
-            self._strikes += 1
-        return self._strikes
-
     def initiate_conversions(self):
         return [BinaryConversion(self, "\x00")]
 
@@ -116,12 +100,13 @@ class TrackerCommunity(Community):
     def dispersy_cleanup_community(self, message):
         # since the trackers use in-memory databases, we need to store the destroy-community
         # message, and all associated proof, separately.
-        host, port = message.candidate.sock_addr
-        print "DESTROY_IN", self._cid.encode("HEX"), message.authentication.member.mid.encode("HEX"),
-        ord(message.conversion.dispersy_version), ord(message.conversion.community_version), host, port
+        if self._event_log:
+            self._event_log.record(DESTROY_IN, self._cid, message.authentication.member.mid,
+                                   message.conversion.dispersy_version, message.conversion.community_version,
+                                   message.candidate.sock_addr)
 
-        write = open(self._dispersy.persistent_storage_filename, "a+").write
-        write("# received dispersy-destroy-community from %s\n" % (str(message.candidate),))
+        lines = ["# received dispersy-destroy-community from %s\n" % (str(message.candidate),)]
+        write = lines.append
 
         identity_id = self._meta_messages[u"dispersy-identity"].database_id
         execute = self._dispersy.database.execute
@@ -146,28 +131,27 @@ class TrackerCommunity(Community):
                 _, proofs = self._timeline.check(message)
                 messages.extend(proofs)
 
+        self._dispersy.write_persistent_storage(lines)
         return TrackerHardKilledCommunity
 
     def on_introduction_request(self, messages):
-        if not self._dispersy._silent:
-            hex_cid = self.cid.encode("HEX")
+        if self._event_log:
+            record = self._event_log.record
+            cid = self._cid
             for message in messages:
-                host, port = message.candidate.sock_addr
-                print "REQ_IN2", hex_cid,
-                message.authentication.member.mid.encode("HEX"),
-                ord(message.conversion.dispersy_version),
-                ord(message.conversion.community_version), host, port
+                conversion = message.conversion
+                record(REQ_IN2, cid, message.authentication.member.mid,
+                       conversion.dispersy_version, conversion.community_version, message.candidate.sock_addr)
 
         return super(TrackerCommunity, self).on_introduction_request(messages)
 
     def on_introduction_response(self, messages):
-        if not self._dispersy._silent:
-            hex_cid = self.cid.encode("HEX")
+        if self._event_log:
+            record = self._event_log.record
+            cid = self._cid
             for message in messages:
-                host, port = message.candidate.sock_addr
-                print "RES_IN2", hex_cid,
-                message.authentication.member.mid.encode("HEX"),
-                ord(message.conversion.dispersy_version),
-                ord(message.conversion.community_version), host, port
+                conversion = message.conversion
+                record(RES_IN2, cid, message.authentication.member.mid,
+                       conversion.dispersy_version, conversion.community_version, message.candidate.sock_addr)
 
         return super(TrackerCommunity, self).on_introduction_response(messages)
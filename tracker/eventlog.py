@@ -0,0 +1,172 @@
+"""
+Record the REQ_IN2, RES_IN2, DESTROY_IN, and DESTROY_OUT tracker events without blocking the reactor.
+
+The reactor thread only appends the raw fields of an event to a bounded buffer.  A background
+thread periodically takes the buffered events, encodes them, and writes them to the stream.  When
+the buffer is full either the newest or the oldest events are dropped, depending on the drop
+policy.
+
+Events are encoded either as text lines, identical to the output the tracker always had, or as
+fixed size binary records following EVENT_LOG_MAGIC.  tool/eventlogreader.py converts binary logs
+back into text lines.
+"""
+import logging
+import socket
+import threading
+from collections import deque
+from struct import Struct
+from time import time
+
+
+REQ_IN2 = 1
+RES_IN2 = 2
+DESTROY_IN = 3
+DESTROY_OUT = 4
+
+EVENT_NAMES = {REQ_IN2: "REQ_IN2",
+               RES_IN2: "RES_IN2",
+               DESTROY_IN: "DESTROY_IN",
+               DESTROY_OUT: "DESTROY_OUT"}
+
+EVENT_LOG_MAGIC = "DISPERSY-TRACKER-EVENTS-1\n"
+
+DROP_NEWEST = u"newest"
+DROP_OLDEST = u"oldest"
+
+# kind, timestamp, cid, mid, dispersy version, community version, ipv4 address, port
+_record = Struct(">Bd20s20sss4sH")
+
+
+def format_event(kind, timestamp, cid, mid, dispersy_version, community_version, host, port):
+    """
+    Returns the text line for an event, without the trailing newline.
+    """
+    return "%s %s %s %d %d %s %d" % (EVENT_NAMES[kind], cid.encode("HEX"), mid.encode("HEX"),
+                                     ord(dispersy_version), ord(community_version), host, port)
+
+
+def encode_event(kind, timestamp, cid, mid, dispersy_version, community_version, host, port):
+    """
+    Returns the binary record for an event.
+    """
+    return _record.pack(kind, timestamp, cid, mid, dispersy_version, community_version, socket.inet_aton(host), port)
+
+
+def iter_events(stream):
+    """
+    Yields (kind, timestamp, cid, mid, dispersy_version, community_version, host, port) tuples for
+    all events in the binary log STREAM.  A truncated trailing record is ignored.
+    """
+    if stream.read(len(EVENT_LOG_MAGIC)) != EVENT_LOG_MAGIC:
+        raise ValueError("not a tracker event log")
+
+    size = _record.size
+    unpack_from = _record.unpack_from
+    while True:
+        data = stream.read(size * 1024)
+        # ignore a truncated record, e.g. when the tracker was killed while writing
+        data = data[:len(data) - len(data) % size]
+        if not data:
+            break
+        for offset in xrange(0, len(data), size):
+            kind, timestamp, cid, mid, dispersy_version, community_version, host, port = unpack_from(data, offset)
+            yield kind, timestamp, cid, mid, dispersy_version, community_version, socket.inet_ntoa(host), port
+
+
+class EventLog(object):
+
+    def __init__(self, stream, binary=False, max_events=100000, drop=DROP_NEWEST, flush_interval=1.0):
+        """
+        Buffer at most MAX_EVENTS events and write them to STREAM every FLUSH_INTERVAL seconds, or
+        sooner when half the buffer is used.
+
+        When the buffer is full, DROP decides whether the event being recorded (DROP_NEWEST) or the
+        oldest buffered event (DROP_OLDEST) is dropped.
+        """
+        assert hasattr(stream, "write"), stream
+        assert isinstance(binary, bool), type(binary)
+        assert isinstance(max_events, (int, long)), type(max_events)
+        assert max_events > 0, max_events
+        assert drop in (DROP_NEWEST, DROP_OLDEST), drop
+        assert isinstance(flush_interval, float), type(flush_interval)
+        super(EventLog, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._stream = stream
+        self._binary = binary
+        self._max_events = max_events
+        self._drop = drop
+        self._flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._events = deque()
+        self._thread = None
+        self._running = False
+
+        self.recorded_count = 0
+        self.dropped_count = 0
+
+        # binary logs are appended to when the tracker restarts, only a new log starts with the magic
+        if binary and stream.tell() == 0:
+            stream.write(EVENT_LOG_MAGIC)
+
+    def record(self, kind, cid, mid, dispersy_version, community_version, sock_addr):
+        """
+        Record an event.  This is called on the reactor thread, hence the fields are buffered as
+        they are, the background thread will encode them.
+        """
+        with self._lock:
+            events = self._events
+            if len(events) >= self._max_events:
+                self.dropped_count += 1
+                if self._drop == DROP_NEWEST:
+                    return
+                events.popleft()
+
+            events.append((kind, time(), cid, mid, dispersy_version, community_version, sock_addr[0], sock_addr[1]))
+            self.recorded_count += 1
+            if len(events) == self._max_events // 2:
+                self._wakeup.set()
+
+    def start(self):
+        assert self._thread is None, "Already started"
+        self._running = True
+        self._thread = threading.Thread(name="EventLog", target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """
+        Stop the background thread and write all events that are still buffered.
+        """
+        if self._thread:
+            self._running = False
+            self._wakeup.set()
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """
+        Write all buffered events to the stream.
+        """
+        with self._lock:
+            events = self._events
+            self._events = deque()
+
+        if events:
+            try:
+                if self._binary:
+                    self._stream.write("".join(encode_event(*event) for event in events))
+                else:
+                    self._stream.write("".join(format_event(*event) + "\n" for event in events))
+                self._stream.flush()
+            except (IOError, ValueError, socket.error):
+                self._logger.exception("unable to write %d events", len(events))
+
+    def _loop(self):
+        while self._running:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self.flush()
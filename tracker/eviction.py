@@ -0,0 +1,134 @@
+"""
+Unload tracker communities that are no longer used, without visiting every loaded community.
+
+A tracker loads a community for every cid that it receives packets for.  CommunityEviction keeps
+the time of the last activity of every loaded community in a heap, hence only the communities
+that may have to be unloaded are visited.  Before a community is unloaded a CommunitySnapshot is
+taken, when the community is loaded again the snapshot is restored.
+"""
+from collections import OrderedDict
+from heapq import heappush, heappop, heapreplace
+
+from ..conversion import BinaryConversion
+
+
+class CommunitySnapshot(object):
+
+    """
+    The state of an unloaded tracker community that is not stored in the database: its global time,
+    the community versions that it created conversions for, and its candidates that were still
+    active.
+    """
+
+    __slots__ = ["global_time", "community_versions", "candidates"]
+
+    def __init__(self, community, now):
+        self.global_time = community.global_time
+        self.community_versions = tuple(conversion.community_version for conversion in community.conversions
+                                        if isinstance(conversion, BinaryConversion))
+        self.candidates = tuple(candidate for candidate in community.candidates.itervalues()
+                                if candidate.get_category(now))
+
+    def restore(self, community, now):
+        community.update_global_time(self.global_time)
+
+        community_versions = set(conversion.community_version for conversion in community.conversions)
+        for community_version in self.community_versions:
+            if not community_version in community_versions:
+                community.add_conversion(BinaryConversion(community, community_version))
+
+        for candidate in self.candidates:
+            if candidate.get_category(now) and not candidate.sock_addr in community.candidates:
+                community.add_candidate(candidate)
+
+
+class CommunityEviction(object):
+
+    def __init__(self, inactive_timeout, max_communities=0, max_snapshots=100000):
+        """
+        Communities are evicted when they had no activity for INACTIVE_TIMEOUT seconds, or, when
+        MAX_COMMUNITIES is non-zero and more communities are loaded, the communities that were
+        inactive the longest are evicted.
+
+        At most MAX_SNAPSHOTS snapshots are kept, the oldest snapshot is dropped first.
+        """
+        assert isinstance(inactive_timeout, float), type(inactive_timeout)
+        assert isinstance(max_communities, (int, long)), type(max_communities)
+        assert max_communities >= 0, max_communities
+        assert isinstance(max_snapshots, (int, long)), type(max_snapshots)
+        assert max_snapshots >= 0, max_snapshots
+        super(CommunityEviction, self).__init__()
+        self._inactive_timeout = inactive_timeout
+        self._max_communities = max_communities
+        self._max_snapshots = max_snapshots
+
+        # cid:last-activity pairs.  the heap contains (activity, cid) tuples where activity may be
+        # older than the last activity of cid, such entries are moved when they reach the top
+        self._activity = {}
+        self._heap = []
+        self._snapshots = OrderedDict()
+
+    def __len__(self):
+        return len(self._activity)
+
+    @property
+    def snapshot_count(self):
+        return len(self._snapshots)
+
+    def touch(self, cid, now):
+        """
+        Register activity for the community CID.
+        """
+        if cid in self._activity:
+            self._activity[cid] = now
+        else:
+            self._activity[cid] = now
+            heappush(self._heap, (now, cid))
+
+    def forget(self, cid):
+        """
+        Stop tracking the community CID, i.e. because it is no longer loaded.
+        """
+        self._activity.pop(cid, None)
+
+    def evict(self, now):
+        """
+        Returns the cids of the communities that must be evicted, least recently active first.
+        These communities are no longer tracked.
+        """
+        heap = self._heap
+        activity = self._activity
+        deadline = now - self._inactive_timeout
+        evicted = []
+        while heap:
+            timestamp, cid = heap[0]
+            last_activity = activity.get(cid)
+            if last_activity is None:
+                heappop(heap)
+
+            elif last_activity != timestamp:
+                heapreplace(heap, (last_activity, cid))
+
+            elif timestamp < deadline or (self._max_communities and len(activity) > self._max_communities):
+                heappop(heap)
+                del activity[cid]
+                evicted.append(cid)
+
+            else:
+                break
+
+        return evicted
+
+    def store_snapshot(self, cid, snapshot):
+        assert isinstance(snapshot, CommunitySnapshot), type(snapshot)
+        if self._max_snapshots:
+            self._snapshots.pop(cid, None)
+            self._snapshots[cid] = snapshot
+            while len(self._snapshots) > self._max_snapshots:
+                self._snapshots.popitem(last=False)
+
+    def pop_snapshot(self, cid):
+        """
+        Returns and removes the snapshot of the community CID, or None.
+        """
+        return self._snapshots.pop(cid, None)
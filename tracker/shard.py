@@ -0,0 +1,227 @@
+"""
+Run a tracker as multiple worker processes.
+
+Every worker runs its own TrackerDispersy and binds the public tracker port using SO_REUSEPORT,
+the kernel distributes the incoming datagrams over the workers.  Each community is owned by
+exactly one worker, selected by get_shard using the community identifier at packet[2:22].  A
+datagram that arrives at a worker that does not own its community is forwarded to the owning
+worker over a local UDP socket.  Responses are always sent from the public tracker port.
+
+Workers report their statistics as a single STATISTICS_PREFIX line on stdout.  The supervising
+process aggregates these reports, all other output is passed through unchanged.
+"""
+import errno
+import json
+import logging
+import socket
+import sys
+import threading
+from select import select
+from struct import Struct, unpack_from
+from time import time
+
+from twisted.internet.protocol import ProcessProtocol
+
+from ..endpoint import StandaloneEndpoint, TUNNEL_PREFIX, TUNNEL_PREFIX_LENGHT
+
+
+# python 2.7 does not expose SO_REUSEPORT, use the Linux value
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", 15)
+
+STATISTICS_PREFIX = "SHARD_STATISTICS "
+
+# forwarded datagrams are prefixed with the IPv4 address and port of their sender
+_forward_header = Struct(">4sH")
+
+
+def get_shard(packet, shard_count):
+    """
+    Returns the shard, in [0, SHARD_COUNT), that owns the community PACKET belongs to.
+
+    The community identifier is a SHA1 digest, hence its first four bytes are already uniformly
+    distributed.  Packets that are too short to contain a community identifier belong to shard 0.
+    """
+    offset = 2 + TUNNEL_PREFIX_LENGHT if packet.startswith(TUNNEL_PREFIX) else 2
+    if len(packet) < offset + 20:
+        return 0
+    return unpack_from(">L", packet, offset)[0] % shard_count
+
+
+def aggregate_statistics(reports):
+    """
+    Returns the sum of REPORTS, where each report is a dictionary as returned by
+    TrackerDispersy.get_statistics().  Lists are summed element wise and dictionaries key wise.
+    """
+    def add(a, b):
+        if isinstance(a, dict):
+            result = dict(a)
+            for key, value in b.iteritems():
+                result[key] = add(result[key], value) if key in result else value
+            return result
+        if isinstance(a, list):
+            return [add(x, y) for x, y in zip(a, b)]
+        return a + b
+
+    return reduce(add, reports)
+
+
+class ShardEndpoint(StandaloneEndpoint):
+
+    def __init__(self, port, ip, shard, shard_count, shard_port):
+        """
+        Endpoint for worker SHARD out of SHARD_COUNT workers sharing PORT.
+
+        Worker i receives forwarded datagrams on 127.0.0.1:SHARD_PORT+i.
+        """
+        assert isinstance(shard, int), type(shard)
+        assert isinstance(shard_count, int), type(shard_count)
+        assert 0 <= shard < shard_count, (shard, shard_count)
+        assert isinstance(shard_port, int), type(shard_port)
+        super(ShardEndpoint, self).__init__(port, ip)
+        self._shard = shard
+        self._shard_count = shard_count
+        self._shard_port = shard_port
+        self._forward_socket = None
+        self.forward_count = 0
+
+    @property
+    def shard(self):
+        return self._shard
+
+    @property
+    def shard_count(self):
+        return self._shard_count
+
+    def open(self, dispersy):
+        # skip StandaloneEndpoint.open, all workers must bind the same port hence we can not try the
+        # next port when binding fails
+        super(StandaloneEndpoint, self).open(dispersy)
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
+        self._socket.bind((self._ip, self._port))
+        self._socket.setblocking(0)
+        self._port = self._socket.getsockname()[1]
+
+        self._forward_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._forward_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 870400)
+        self._forward_socket.bind(("127.0.0.1", self._shard_port + self._shard))
+        self._forward_socket.setblocking(0)
+        self._logger.debug("shard %d/%d listening at %d, forwarding at %d",
+                           self._shard, self._shard_count, self._port, self._shard_port + self._shard)
+
+        self._running = True
+        self._thread = threading.Thread(name="ShardEndpoint", target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def close(self, timeout=10.0):
+        result = super(ShardEndpoint, self).close(timeout)
+        try:
+            self._forward_socket.close()
+        except socket.error as exception:
+            self._logger.exception("%s", exception)
+            result = False
+        return result
+
+    def _receive(self, recvfrom):
+        packets = []
+        try:
+            while True:
+                (data, sock_addr) = recvfrom(65535)
+                if data:
+                    packets.append((sock_addr, data))
+                else:
+                    break
+
+        except socket.error as e:
+            if e.errno != errno.EAGAIN:
+                self._dispersy.statistics.dict_inc(u"endpoint_recv", u"socket-error-'%s'" % repr(e))
+
+        return packets
+
+    def _forward(self, shard, sock_addr, data):
+        try:
+            self._forward_socket.sendto(_forward_header.pack(socket.inet_aton(sock_addr[0]), sock_addr[1]) + data,
+                                        ("127.0.0.1", self._shard_port + shard))
+            self.forward_count += 1
+        except socket.error:
+            self._dispersy.statistics.dict_inc(u"endpoint_send", u"shard-forward-error")
+
+    def _loop(self):
+        assert self._dispersy, "Should not be called before open(...)"
+        recvfrom = self._socket.recvfrom
+        forward_recvfrom = self._forward_socket.recvfrom
+        public_fileno = self._socket.fileno()
+        forward_fileno = self._forward_socket.fileno()
+        socket_list = [public_fileno, forward_fileno]
+
+        prev_sendqueue = 0
+        while self._running:
+            # see StandaloneEndpoint._loop, only the public socket has a sendqueue
+            if self._sendqueue and (time() - prev_sendqueue) > 0.1:
+                read_list, write_list, _ = select(socket_list, [public_fileno], [], 0.1)
+            else:
+                read_list, write_list, _ = select(socket_list, [], [], 0.1)
+
+            if write_list:
+                self._process_sendqueue()
+                prev_sendqueue = time()
+
+            packets = []
+            if public_fileno in read_list:
+                for sock_addr, data in self._receive(recvfrom):
+                    shard = get_shard(data, self._shard_count)
+                    if shard == self._shard:
+                        packets.append((sock_addr, data))
+                    else:
+                        self._forward(shard, sock_addr, data)
+
+            if forward_fileno in read_list:
+                for _, data in self._receive(forward_recvfrom):
+                    if len(data) > _forward_header.size:
+                        host, port = _forward_header.unpack_from(data)
+                        packets.append(((socket.inet_ntoa(host), port), data[_forward_header.size:]))
+
+            if packets:
+                self._logger.debug('%d came in, %d bytes in total', len(packets), sum(len(packet) for _, packet in packets))
+                self.data_came_in(packets)
+
+
+class ShardProcessProtocol(ProcessProtocol):
+
+    """
+    Passes the output of a worker through to our stdout and stderr, except for its statistics
+    reports which are given to ON_STATISTICS(shard, report).  ON_EXIT(shard, reason) is called when
+    the worker ends.
+    """
+
+    def __init__(self, shard, on_statistics, on_exit):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.shard = shard
+        self._on_statistics = on_statistics
+        self._on_exit = on_exit
+        self._buffer = ""
+
+    def outReceived(self, data):
+        lines = (self._buffer + data).split("\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            if line.startswith(STATISTICS_PREFIX):
+                try:
+                    report = json.loads(line[len(STATISTICS_PREFIX):])
+                except ValueError:
+                    self._logger.exception("invalid statistics from shard %d", self.shard)
+                else:
+                    self._on_statistics(self.shard, report)
+            else:
+                sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+    def errReceived(self, data):
+        sys.stderr.write(data)
+
+    def processEnded(self, reason):
+        self._on_exit(self.shard, reason)
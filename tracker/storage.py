@@ -0,0 +1,106 @@
+"""
+Replay the persistent storage of a tracker.
+
+Trackers use an in-memory database, hence the dispersy-destroy-community messages that they
+received, and the dispersy-identity and proof messages needed to accept them, are appended to a
+persistent storage file (see TrackerCommunity.dispersy_cleanup_community).  These messages are
+replayed when the tracker starts.
+"""
+import logging
+from itertools import groupby
+
+from ..candidate import LoopbackCandidate
+from ..exception import CommunityNotFoundException, ConversionNotFoundException
+from ..message import DelayPacket, DropPacket
+
+
+# the message type byte of dispersy-identity, identities are replayed before any other message of a
+# community to avoid delaying messages for members that are still unknown
+IDENTITY_BYTE = chr(248)
+
+logger = logging.getLogger(__name__)
+
+
+def read_persistent_storage(filenames):
+    """
+    Returns (packets, duplicates) where PACKETS contains the unique packets stored in FILENAMES in
+    the order in which they must be replayed, and DUPLICATES is the number of duplicate entries.
+
+    Each file contains "NAME HEX(PACKET)" lines and "#" comment lines.  Entries are appended when a
+    community is destroyed, the proofs of a message are written after the message itself, hence
+    the entries are replayed in reverse order.
+    """
+    entries = []
+    for filename in filenames:
+        try:
+            with open(filename, "r") as stream:
+                entries.extend(line.split()[1] for line in stream if line.strip() and not line.startswith("#"))
+        except IOError:
+            logger.exception("unable to read %s", filename)
+
+    packets = []
+    seen = set()
+    for entry in reversed(entries):
+        if not entry in seen:
+            seen.add(entry)
+            packets.append(entry.decode("HEX"))
+    return packets, len(entries) - len(packets)
+
+
+def replay_persistent_storage(dispersy, packets):
+    """
+    Process PACKETS, as returned by read_persistent_storage, and returns the number of messages that
+    were accepted.
+
+    Unlike dispersy.on_incoming_packets, the packets of every community are decoded without
+    verifying their signatures, since they were verified before the tracker stored them, and are
+    given to community.on_messages as one batch per meta message.  The distribution and timeline
+    checks are still performed.
+    """
+    candidate = LoopbackCandidate()
+    source = u"persistent-storage"
+
+    # group by community, keeping the replay order of the communities and of their packets
+    communities = {}
+    order = []
+    for packet in packets:
+        cid = packet[2:22]
+        if cid in communities:
+            communities[cid].append(packet)
+        else:
+            communities[cid] = [packet]
+            order.append(cid)
+
+    accepted = 0
+    for cid in order:
+        community_packets = sorted(communities.pop(cid), key=lambda packet: packet[22] != IDENTITY_BYTE)
+        for _, iterator in groupby(community_packets, key=lambda packet: (packet[1], packet[22])):
+            batch = list(iterator)
+            try:
+                # a dispersy-destroy-community reclassifies the community, hence it is obtained for
+                # every batch
+                community = dispersy.get_community(cid, True, True)
+                conversion = community.get_conversion_for_packet(batch[0])
+            except (CommunityNotFoundException, ConversionNotFoundException):
+                logger.warning("unable to replay %d packets for %s", len(batch), cid.encode("HEX"))
+                continue
+            except Exception:
+                logger.exception("unable to replay %d packets for %s", len(batch), cid.encode("HEX"))
+                continue
+
+            messages = []
+            for packet in batch:
+                try:
+                    messages.append(conversion.decode_message(candidate, packet, verify=False, source=source))
+                except (DropPacket, DelayPacket) as exception:
+                    logger.warning("unable to replay a %d byte packet (%s)", len(packet), exception)
+
+            if messages:
+                # one batch that can not be processed must not prevent replaying the others
+                try:
+                    accepted += community.on_messages(messages) or 0
+                except Exception:
+                    logger.exception("unable to replay %d %s messages for %s",
+                                     len(messages), messages[0].name, cid.encode("HEX"))
+
+    return accepted
@@ -17,20 +17,36 @@ Outputs destroyed communities whenever notified by a candidate:
 
 Note that there is no output for REQ_IN2 for destroyed overlays.  Instead a DESTROY_OUT is given
 whenever a introduction request is received for a destroyed overlay.
+
+These events are written by a background thread, see dispersy/tracker/eventlog.py.  With
+--eventlog FILE they are appended to FILE as binary records instead, tool/eventlogreader.py converts
+such a file to the lines above.  At most --eventlog-size events are buffered, --eventlog-drop
+chooses whether the newest or the oldest events are dropped when the buffer is full.
+
+With --shards N the tracker runs N worker processes that share the port (requires SO_REUSEPORT,
+i.e. Linux 3.9 or later), see dispersy/tracker/shard.py.  The statistics of all workers are
+aggregated, in which case the output also contains:
+- SHARDS COUNT(WORKERS) COUNT(FORWARDED-PACKETS)
 """
 import errno
+import json
 import os
 import signal
 import sys
+from glob import glob
 from time import time
 
-from dispersy.candidate import LoopbackCandidate
 from dispersy.crypto import NoVerifyCrypto, NoCrypto
 from dispersy.discovery.community import DiscoveryCommunity
 from dispersy.dispersy import Dispersy
 from dispersy.endpoint import StandaloneEndpoint
 from dispersy.exception import CommunityNotFoundException
 from dispersy.tracker.community import TrackerCommunity, TrackerHardKilledCommunity
+from dispersy.tracker.eventlog import DROP_NEWEST, DROP_OLDEST, EventLog
+from dispersy.tracker.eviction import CommunityEviction, CommunitySnapshot
+from dispersy.tracker.storage import read_persistent_storage, replay_persistent_storage
+from dispersy.tracker.shard import (STATISTICS_PREFIX, ShardEndpoint, ShardProcessProtocol, aggregate_statistics,
+                                    get_shard)
 from twisted.application.service import IServiceMaker, MultiService
 from twisted.conch import manhole_tap
 from twisted.internet import reactor
@@ -44,6 +60,8 @@ from zope.interface import implements
 
 
 COMMUNITY_CLEANUP_INTERVAL = 180.0
+# communities that did not receive packets for this many seconds are unloaded
+COMMUNITY_INACTIVE_TIMEOUT = 3 * COMMUNITY_CLEANUP_INTERVAL
 
 if sys.platform == 'win32':
     SOCKET_BLOCK_ERRORCODE = 10035  # WSAEWOULDBLOCK
@@ -51,19 +69,49 @@ else:
     SOCKET_BLOCK_ERRORCODE = errno.EWOULDBLOCK
 
 
+def print_statistics(statistics):
+    """
+    Print STATISTICS, as returned by TrackerDispersy.get_statistics().
+    """
+    print "BANDWIDTH", statistics["bandwidth"][0], statistics["bandwidth"][1]
+    print "COMMUNITY", statistics["community"][0], statistics["community"][1], statistics["community"][2]
+    print "CANDIDATE2", statistics["candidate"][0], statistics["candidate"][1], statistics["candidate"][2]
+
+    if "shards" in statistics:
+        print "SHARDS", statistics["shards"], statistics["forwarded"]
+
+    for key, value in statistics["outgoing"].iteritems():
+        print "OUTGOING", key, value
+
+
 class TrackerDispersy(Dispersy):
 
-    def __init__(self, endpoint, working_directory, silent=False, crypto=NoVerifyCrypto()):
+    def __init__(self, endpoint, working_directory, silent=False, crypto=NoVerifyCrypto(), event_log=None,
+                 max_communities=0):
+        assert event_log is None or isinstance(event_log, EventLog), type(event_log)
         super(TrackerDispersy, self).__init__(endpoint, working_directory, u":memory:", crypto)
 
-        # location of persistent storage
-        self._persistent_storage_filename = os.path.join(working_directory, "persistent-storage.data")
+        # location of persistent storage, every shard writes its own file
+        if isinstance(endpoint, ShardEndpoint):
+            self._persistent_storage_filename = os.path.join(working_directory, "persistent-storage-%d.data" % endpoint.shard)
+        else:
+            self._persistent_storage_filename = os.path.join(working_directory, "persistent-storage.data")
+        self._persistent_storage = None
+        self._loading_persistent_storage = False
         self._silent = silent
         self._my_member = None
+        self._eviction = CommunityEviction(COMMUNITY_INACTIVE_TIMEOUT, max_communities)
+
+        # the REQ_IN2, RES_IN2, DESTROY_IN, and DESTROY_OUT lines are written to stdout unless silent
+        if event_log is None and not silent:
+            event_log = EventLog(sys.stdout)
+        self._event_log = event_log
 
     def start(self):
         assert isInIOThread()
         if super(TrackerDispersy, self).start():
+            if self._event_log:
+                self._event_log.start()
             self._create_my_member()
             self._load_persistent_storage()
 
@@ -80,6 +128,15 @@ class TrackerDispersy(Dispersy):
             return True
         return False
 
+    def stop(self, timeout=10.0):
+        result = super(TrackerDispersy, self).stop(timeout)
+        if self._event_log:
+            self._event_log.stop(timeout)
+        if self._persistent_storage:
+            self._persistent_storage.close()
+            self._persistent_storage = None
+        return result
+
     def _create_my_member(self):
         # generate a new my-member
         ec = self.crypto.generate_key(u"very-low")
@@ -89,59 +146,173 @@ class TrackerDispersy(Dispersy):
     def persistent_storage_filename(self):
         return self._persistent_storage_filename
 
+    @property
+    def event_log(self):
+        return self._event_log
+
+    def write_persistent_storage(self, lines):
+        """
+        Append LINES to the persistent storage, the file is kept open between calls.
+        """
+        if self._loading_persistent_storage:
+            return
+        if self._persistent_storage is None:
+            self._persistent_storage = open(self._persistent_storage_filename, "a+")
+        self._persistent_storage.write("".join(lines))
+        self._persistent_storage.flush()
+
     def get_community(self, cid, load=False, auto_load=True):
-        try:
-            return super(TrackerDispersy, self).get_community(cid, True, True)
-        except CommunityNotFoundException:
-            return TrackerCommunity.init_community(self, self.get_member(mid=cid), self._my_member)
+        community = self._communities.get(cid)
+        if community is None:
+            try:
+                community = super(TrackerDispersy, self).get_community(cid, True, True)
+            except CommunityNotFoundException:
+                community = TrackerCommunity.init_community(self, self.get_member(mid=cid), self._my_member)
+
+            snapshot = self._eviction.pop_snapshot(cid)
+            if snapshot:
+                snapshot.restore(community, time())
+
+        # DiscoveryCommunity is never unloaded
+        if not isinstance(community, DiscoveryCommunity):
+            self._eviction.touch(cid, time())
+        return community
+
+    def attach_community(self, community):
+        super(TrackerDispersy, self).attach_community(community)
+        # communities are also loaded without get_community, i.e. when reclassified after a
+        # dispersy-destroy-community
+        if not isinstance(community, DiscoveryCommunity):
+            self._eviction.touch(community.cid, time())
+
+    def detach_community(self, community):
+        super(TrackerDispersy, self).detach_community(community)
+        self._eviction.forget(community.cid)
 
     def _load_persistent_storage(self):
-        # load all destroyed communities
+        # load all destroyed communities, a shard only loads the communities that it owns.  all
+        # files are read since the number of shards may have changed
+        begin = time()
+        packets, duplicates = read_persistent_storage(
+            sorted(glob(os.path.join(self._working_directory, "persistent-storage*.data"))))
+        if isinstance(self._endpoint, ShardEndpoint):
+            packets = [pkt for pkt in packets
+                       if get_shard(pkt, self._endpoint.shard_count) == self._endpoint.shard]
+
+        # the replayed messages are already in the persistent storage
+        self._loading_persistent_storage = True
         try:
-            packets = [pkt.decode("HEX") for _, pkt in (line.split() for
-                                                        line in open(self._persistent_storage_filename, "r") if not
-                                                        line.startswith("#"))]
-        except IOError:
-            pass
-        else:
-            candidate = LoopbackCandidate()
-            for pkt in reversed(packets):
-                try:
-                    self.on_incoming_packets([(candidate, pkt)], cache=False, timestamp=time())
-                except:
-                    self._logger.exception("Error while loading from persistent-destroy-community.data")
+            accepted = replay_persistent_storage(self, packets)
+        finally:
+            self._loading_persistent_storage = False
+
+        msg("loaded %d/%d packets (%d duplicates) from persistent storage in %.2fs" %
+            (accepted, len(packets), duplicates, time() - begin))
 
     def unload_inactive_communities(self):
-        def is_active(community, now):
-            # check 1: DiscoveryCommunity is always active
-            if isinstance(community, DiscoveryCommunity):
-                return True
+        now = time()
+        count = len(self._communities)
+        unloaded = 0
+        for cid in self._eviction.evict(now):
+            community = self._communities.get(cid)
+            if community:
+                self._eviction.store_snapshot(cid, CommunitySnapshot(community, now))
+                community.unload_community()
+                unloaded += 1
+        print "#cleaned %d/%d communities" % (unloaded, count)
+
+    def get_statistics(self):
+        mapping = {TrackerCommunity: [0,0], TrackerHardKilledCommunity: [0,0], DiscoveryCommunity: [0,0]}
+        for community in self._communities.itervalues():
+            mapping[type(community)][0] += 1
+            mapping[type(community)][1] += len(list(community.dispersy_yield_verified_candidates()))
 
-            # check 2: does the community have any active candidates
-            if community.update_strikes(now) < 3:
-                return True
+        statistics = {"bandwidth": [self._statistics.total_up, self._statistics.total_down],
+                      "community": [mapping[TrackerCommunity][0], mapping[TrackerHardKilledCommunity][0], mapping[DiscoveryCommunity][0]],
+                      "candidate": [mapping[TrackerCommunity][1], mapping[TrackerHardKilledCommunity][1], mapping[DiscoveryCommunity][1]],
+                      "outgoing": dict(self._statistics.msg_statistics.outgoing_dict or {})}
 
-            return False
+        if isinstance(self._endpoint, ShardEndpoint):
+            statistics["shards"] = 1
+            statistics["forwarded"] = self._endpoint.forward_count
 
-        now = time()
-        inactive = [community for community in self._communities.itervalues() if not is_active(community, now)]
-        print "#cleaned %d/%d communities" % (len(inactive), len(self._communities))
-        for community in inactive:
-            community.unload_community()
+        return statistics
 
     def _report_statistics(self):
-        mapping = {TrackerCommunity: [0,0], TrackerHardKilledCommunity: [0,0], DiscoveryCommunity: [0,0]}
-        for community in self._communities.itervalues():
-            mapping[type(community)][0] += 1
-            mapping[type(community)][1] += len(list(community.dispersy_yield_verified_candidates())) 
+        if isinstance(self._endpoint, ShardEndpoint):
+            # the supervising process aggregates and prints the statistics of all shards
+            print STATISTICS_PREFIX + json.dumps(self.get_statistics())
+            sys.stdout.flush()
+        else:
+            print_statistics(self.get_statistics())
+
 
-        print "BANDWIDTH", self._statistics.total_up, self._statistics.total_down
-        print "COMMUNITY", mapping[TrackerCommunity][0], mapping[TrackerHardKilledCommunity][0], mapping[DiscoveryCommunity][0]
-        print "CANDIDATE2", mapping[TrackerCommunity][1], mapping[TrackerHardKilledCommunity][1], mapping[DiscoveryCommunity][1]
+class ShardSupervisor(object):
 
-        if self._statistics.msg_statistics.outgoing_dict:
-            for key, value in self._statistics.msg_statistics.outgoing_dict.iteritems():
-                print "OUTGOING", key, value
+    """
+    Starts and restarts the tracker worker processes and prints their aggregated statistics.
+    """
+
+    def __init__(self, options):
+        self._options = options
+        self._shard_count = options["shards"]
+        self._protocols = {}
+        self._reports = {}
+        self._stopping = False
+
+    def start(self):
+        for shard in xrange(self._shard_count):
+            self._spawn(shard)
+
+    def stop(self):
+        self._stopping = True
+        for protocol in self._protocols.values():
+            try:
+                protocol.transport.signalProcess("TERM")
+            except Exception, e:
+                msg("Got exception when stopping shard %d: %s" % (protocol.shard, e))
+
+    def _spawn(self, shard):
+        options = self._options
+        args = [sys.executable, "-u", "-c", "from twisted.scripts.twistd import run; run()",
+                "--nodaemon", "--pidfile=",
+                "tracker",
+                "--statedir", options["statedir"],
+                "--ip", options["ip"],
+                "--port", str(options["port"]),
+                "--crypto", options["crypto"],
+                "--logfile", "%s.%d" % (options["logfile"], shard),
+                "--shard", "%d/%d" % (shard, self._shard_count),
+                "--shard-port", str(options["shard-port"] or options["port"] + 1),
+                "--eventlog-size", str(options["eventlog-size"]),
+                "--eventlog-drop", str(options["eventlog-drop"])]
+        if options["max-communities"]:
+            args.extend(("--max-communities", str(options["max-communities"])))
+        if options["eventlog"]:
+            args.extend(("--eventlog", "%s.%d" % (options["eventlog"], shard)))
+        if options["silent"]:
+            args.append("--silent")
+
+        protocol = ShardProcessProtocol(shard, self._on_statistics, self._on_exit)
+        self._protocols[shard] = protocol
+        reactor.spawnProcess(protocol, sys.executable, args, env=os.environ)
+
+    def _on_statistics(self, shard, report):
+        self._reports[shard] = report
+        if len(self._reports) == len(self._protocols):
+            print_statistics(aggregate_statistics(self._reports.values()))
+            sys.stdout.flush()
+            self._reports.clear()
+
+    def _on_exit(self, shard, reason):
+        del self._protocols[shard]
+        self._reports.pop(shard, None)
+        if self._stopping:
+            if not self._protocols:
+                reactor.stop()
+        else:
+            msg("Shard %d ended (%s), restarting" % (shard, reason.value))
+            reactor.callLater(1.0, self._spawn, shard)
 
 
 class Options(usage.Options):
@@ -157,8 +328,19 @@ class Options(usage.Options):
         ["crypto"  , "c", "ECCrypto",     "The Crypto object type Dispersy is going to use"              , str],
         ["manhole" , "m", 0         ,     "Enable manhole telnet service listening at the specified port", int],
         ["logfile" , "l", "dispersy.log", "Use an alternate dispersy log file name",                       str],
+        ["shards"  , "n", 1         ,     "Number of worker processes sharing the port"                  , int],
+        ["shard"   , None, None     ,     "Run as worker K of N, given as K/N (used by --shards)"        , str],
+        ["shard-port", None, 0      ,     "First local UDP port used between workers (default: port + 1)", int],
+        ["max-communities", None, 0 ,     "Unload the least recently active communities beyond this number", int],
+        ["eventlog", "e", ""        ,     "Append the events to this binary log instead of stdout"       , str],
+        ["eventlog-size", None, 100000,   "Maximum number of buffered events"                             , int],
+        ["eventlog-drop", None, DROP_NEWEST, "Drop the 'newest' or the 'oldest' events when the buffer is full", unicode],
     ]
 
+    def postOptions(self):
+        if self["eventlog-drop"] not in (DROP_NEWEST, DROP_OLDEST):
+            raise usage.UsageError("--eventlog-drop must be '%s' or '%s'" % (DROP_NEWEST, DROP_OLDEST))
+
 
 class TrackerMultiService(MultiService):
 
@@ -207,13 +389,42 @@ class TrackerServiceMaker(object):
             tracker_service.addService(manhole)
             manhole.startService()
 
+        if options["shards"] > 1 and not options["shard"]:
+            supervisor = ShardSupervisor(options)
+
+            def signal_handler(sig, frame):
+                msg("Received signal '%s' in %s (stopping shards)" % (sig, frame))
+                supervisor.stop()
+            signal.signal(signal.SIGINT, signal_handler)
+            signal.signal(signal.SIGTERM, signal_handler)
+
+            reactor.exitCode = 0
+            reactor.callWhenRunning(supervisor.start)
+            return tracker_service
+
         def run():
             # setup
-            dispersy = TrackerDispersy(StandaloneEndpoint(options["port"],
-                                                          options["ip"]),
+            if options["shard"]:
+                shard, shard_count = [int(value) for value in options["shard"].split("/")]
+                endpoint = ShardEndpoint(options["port"], options["ip"], shard, shard_count,
+                                         options["shard-port"] or options["port"] + 1)
+            else:
+                endpoint = StandaloneEndpoint(options["port"], options["ip"])
+
+            if options["eventlog"]:
+                event_log = EventLog(open(options["eventlog"], "ab"), binary=True,
+                                     max_events=options["eventlog-size"], drop=options["eventlog-drop"])
+            elif options["silent"]:
+                event_log = None
+            else:
+                event_log = EventLog(sys.stdout, max_events=options["eventlog-size"], drop=options["eventlog-drop"])
+
+            dispersy = TrackerDispersy(endpoint,
                                        unicode(options["statedir"]),
                                        bool(options["silent"]),
-                                       crypto)
+                                       crypto,
+                                       event_log,
+                                       options["max-communities"])
             container[0] = dispersy
             manhole_namespace['dispersy'] = dispersy
 
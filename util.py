@@ -5,7 +5,10 @@ import sys
 import traceback
 import warnings
 from cProfile import Profile
+from itertools import count
+from operator import attrgetter, itemgetter
 from socket import inet_aton, error as socket_error
+from string import Formatter
 from thread import get_ident
 from threading import current_thread
 from time import time
@@ -15,6 +18,7 @@ from twisted.internet.task import LoopingCall
 from twisted.python import failure
 from twisted.python.threadable import isInIOThread
 
+from .meta import MetaObject
 from .statistics import _runtime_statistics
 
 
@@ -139,12 +143,27 @@ def attach_runtime_statistics(format_):
     Updated runtime information is available from Dispersy.statistics.runtime after calling
     Dispersy.statistics.update().  Statistics.runtime is a list (in no particular order) containing
     dictionaries with the keys: count, duration, average, and entry.
+
+    FORMAT_ is only formatted the first time a decorated function is called with a new key.  The key
+    is the tuple of values that FORMAT_ refers to, where a MetaObject.Implementation, such as a
+    Message.Implementation, is represented by its meta.  Hence the string representation of an
+    implementation used in FORMAT_ may only depend on its meta.
+
+    Only one in every _runtime_statistics.sample_interval calls is measured.
     """
     assert isinstance(format_, basestring), type(format_)
+    get_key = _compile_runtime_statistics_key(format_)
 
     def helper(func):
+        entries = {}
+        calls = count()
+
         @functools.wraps(func)
         def wrapper(*args, **kargs):
+            sample_interval = _runtime_statistics.sample_interval
+            if sample_interval > 1 and next(calls) % sample_interval:
+                return func(*args, **kargs)
+
             return_value = None
             start = time()
             try:
@@ -152,12 +171,71 @@ def attach_runtime_statistics(format_):
                 return return_value
             finally:
                 end = time()
-                entry = format_.format(function_name=func.__name__, return_value=return_value, *args, **kargs)
-                _runtime_statistics[entry].increment(end - start)
+                key = get_key(args, kargs, return_value)
+                try:
+                    entry = entries[key]
+                except KeyError:
+                    entry = entries[key] = format_.format(function_name=func.__name__, return_value=return_value, *args, **kargs)
+                except TypeError:
+                    # KEY is not hashable
+                    entry = format_.format(function_name=func.__name__, return_value=return_value, *args, **kargs)
+                _runtime_statistics[entry].increment(end - start, sample_interval)
         return wrapper
     return helper
 
 
+def _compile_runtime_statistics_key(format_):
+    """
+    Returns a function that returns the values that FORMAT_ refers to.
+
+    The returned function is called with the ARGS, KARGS, and RETURN_VALUE of a decorated function.
+    """
+    def get_meta(value):
+        return value.meta if isinstance(value, MetaObject.Implementation) else value
+
+    def compile_field(field_name):
+        first, rest = field_name._formatter_field_name_split()
+        steps = []
+        for is_attribute, key in rest:
+            if is_attribute and steps and isinstance(steps[-1], basestring):
+                steps[-1] += "." + key
+            else:
+                steps.append(key if is_attribute else (key,))
+
+        if steps:
+            getters = [attrgetter(step) if isinstance(step, basestring) else itemgetter(step[0]) for step in steps]
+            if len(getters) == 1:
+                get, = getters
+            else:
+                get = lambda value: reduce(lambda value, getter: getter(value), getters, value)
+        else:
+            # the value itself is formatted, use the meta when it is an implementation
+            get = get_meta
+
+        if first == "return_value":
+            return lambda args, kargs, return_value: get(return_value)
+        elif isinstance(first, (int, long)):
+            return lambda args, kargs, return_value: get(args[first])
+        else:
+            return lambda args, kargs, return_value: get(kargs[first])
+
+    fields = [compile_field(field_name)
+              for _, field_name, _, _ in Formatter().parse(format_)
+              if field_name is not None and field_name != "function_name"]
+
+    if not fields:
+        return lambda args, kargs, return_value: None
+
+    if len(fields) == 1:
+        return fields[0]
+
+    if len(fields) == 2:
+        first, second = fields
+        return lambda args, kargs, return_value: (first(args, kargs, return_value), second(args, kargs, return_value))
+
+    return lambda args, kargs, return_value: tuple([get_field(args, kargs, return_value) for get_field in fields])
+
+
 class deprecated(object):
 
     def __init__(self, msg=None):
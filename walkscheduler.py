@@ -0,0 +1,161 @@
+from heapq import heappush, heappop
+from itertools import count
+from time import time
+import logging
+
+from twisted.internet import reactor
+
+from .taskmanager import TaskManager
+
+
+# steps that are due within BATCH_WINDOW seconds of each other are taken during the same wakeup
+BATCH_WINDOW = 0.1
+
+# used to spread the first step of communities evenly over their interval
+GOLDEN_RATIO_FRACTION = 0.6180339887498949
+
+
+class WalkScheduler(TaskManager):
+
+    """
+    Takes the walker steps of all communities using a single timer.
+
+    All scheduled communities are kept in a heap ordered by the time their next step is due.  Steps
+    that are due at roughly the same time are taken during a single wakeup, resulting in their
+    introduction requests being handed to the endpoint in one burst.
+
+    When MAX_BYTES_PER_SECOND is given the outgoing bytes caused by the steps are limited using a
+    token bucket.  Steps that can not be taken because the bucket is empty keep their place in the
+    heap, hence the communities that waited longest will be the first to step when bandwidth becomes
+    available again.
+    """
+
+    def __init__(self, dispersy, max_bytes_per_second=None):
+        assert max_bytes_per_second is None or isinstance(max_bytes_per_second, (int, long, float)), type(max_bytes_per_second)
+        assert max_bytes_per_second is None or max_bytes_per_second > 0, max_bytes_per_second
+        super(WalkScheduler, self).__init__()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        self._dispersy = dispersy
+        self._max_bytes_per_second = max_bytes_per_second
+        self._tokens = max_bytes_per_second
+        self._tokens_timestamp = time()
+
+        # the heap contains (due, order, community) tuples.  _SCHEDULED contains community:(step,
+        # interval, order) pairs, a heap entry is stale when its order differs
+        self._heap = []
+        self._scheduled = {}
+        self._order = count()
+        self._phase = count()
+        self._timer = None
+
+        self.step_count = 0
+        self.delayed_count = 0
+
+    @property
+    def max_bytes_per_second(self):
+        return self._max_bytes_per_second
+
+    @max_bytes_per_second.setter
+    def max_bytes_per_second(self, max_bytes_per_second):
+        assert max_bytes_per_second is None or isinstance(max_bytes_per_second, (int, long, float)), type(max_bytes_per_second)
+        assert max_bytes_per_second is None or max_bytes_per_second > 0, max_bytes_per_second
+        self._max_bytes_per_second = max_bytes_per_second
+        self._tokens = max_bytes_per_second
+        self._tokens_timestamp = time()
+        self._schedule_timer()
+
+    def schedule(self, community, step, interval, delay=None):
+        """
+        Call STEP every INTERVAL seconds on behalf of COMMUNITY, replacing any step that was
+        previously scheduled for COMMUNITY.
+
+        The first step is taken after DELAY seconds.  When DELAY is None, the first steps of the
+        scheduled communities are spread evenly over INTERVAL.
+        """
+        assert callable(step), step
+        assert isinstance(interval, (int, long, float)), type(interval)
+        assert interval > 0, interval
+        assert delay is None or isinstance(delay, (int, long, float)), type(delay)
+        if delay is None:
+            delay = (next(self._phase) * GOLDEN_RATIO_FRACTION % 1.0) * interval
+
+        order = next(self._order)
+        self._scheduled[community] = (step, interval, order)
+        heappush(self._heap, (time() + delay, order, community))
+        self._schedule_timer()
+
+    def unschedule(self, community):
+        """
+        Stop taking steps on behalf of COMMUNITY.
+        """
+        if self._scheduled.pop(community, None):
+            self._schedule_timer()
+
+    def is_scheduled(self, community):
+        return community in self._scheduled
+
+    def stop(self):
+        self._heap = []
+        self._scheduled.clear()
+        self.cancel_all_pending_tasks()
+
+    def _pop_stale(self):
+        heap = self._heap
+        while heap and self._scheduled.get(heap[0][2], (None, None, None))[2] != heap[0][1]:
+            heappop(heap)
+
+    def _refill_tokens(self, now):
+        if self._max_bytes_per_second:
+            self._tokens = min(self._max_bytes_per_second,
+                               self._tokens + (now - self._tokens_timestamp) * self._max_bytes_per_second)
+            self._tokens_timestamp = now
+
+    def _schedule_timer(self):
+        self._pop_stale()
+        if not self._heap:
+            self.cancel_pending_task("step")
+            return
+
+        delay = max(0.0, self._heap[0][0] - time())
+        if self._max_bytes_per_second and self._tokens <= 0:
+            delay = max(delay, -self._tokens / self._max_bytes_per_second)
+
+        if self.is_pending_task_active("step"):
+            self._timer.reset(delay)
+        else:
+            self._timer = self.replace_task("step", reactor.callLater(delay, self._take_steps))
+
+    def _take_steps(self):
+        now = time()
+        self._refill_tokens(now)
+        statistics = self._dispersy.statistics
+        heap = self._heap
+
+        self._pop_stale()
+        while heap and heap[0][0] <= now + BATCH_WINDOW:
+            if self._max_bytes_per_second and self._tokens <= 0:
+                self.delayed_count += 1
+                break
+
+            due, order, community = heappop(heap)
+            step, interval, _ = self._scheduled[community]
+
+            total_up = statistics.total_up
+            try:
+                step()
+            except Exception:
+                self._logger.exception("%s step failed", community)
+            if self._max_bytes_per_second:
+                self._tokens -= statistics.total_up - total_up
+            self.step_count += 1
+
+            # STEP may have unscheduled or rescheduled COMMUNITY
+            if self._scheduled.get(community, (None, None, None))[2] == order:
+                # keep the phase unless we fell behind
+                due = due + interval if due + interval > now else now + interval
+                heappush(heap, (due, order, community))
+
+            self._pop_stale()
+
+        self._schedule_timer()